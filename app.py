@@ -7,27 +7,41 @@ import re
 # 设置 HuggingFace 镜像，解决国内连接问题
 os.environ['HF_ENDPOINT'] = 'https://hf-mirror.com'
 
-from llm_client import LLMClient
-from rag_engine import RAGEngine
-from history_utils import save_history_item, load_history, delete_history_item
+from llm_client import get_llm_client
+from rag_engine import RAGEngine, DEFAULT_CHUNK_SIZE, DEFAULT_CHUNK_OVERLAP
+from sharded_backend import DEFAULT_SHARD_CHUNKS, MAX_LOGICAL_NAME
+from history_utils import save_history_item, save_history_items, load_history, delete_history_item
+from config_store import get_config_store
+from prewarm import start_prewarm, get_prewarm_status
+from conversation_memory import ConversationMemory, make_llm_summarizer
+from chat_retrieval import CHAT_RETRIEVAL_K, ChatWorkingSet, build_chat_query
+from prompt_prefix import sort_context_docs, build_prefix_message
+from style_variants import PROMPT_STYLES, VariantRun
+from qq_prompt import QQ_OUTPUT_FORMATS, QQ_SECTIONS, QQ_SECTION_TITLES, stream_qq_prompt
+import metrics
+import profiling
 
 RAG_CONFIG_FILE = "rag_config.json"
+USER_CONFIG_FILE = "user_config.json"
+
+# 设置了 RAG_METRICS_PORT 时提供 Prometheus 指标端点（进程内只启动一次）
+metrics_port = metrics.start_http_server_from_env()
+
+# 每轮对话发送的历史消息（含检索片段）Token 预算，超出部分滚动压缩为摘要
+DEFAULT_HISTORY_TOKEN_BUDGET = 3000
+
+# 配置缓存在进程内存中，rerun 时不再重复读盘；内容变化时才写回
+rag_config_store = get_config_store(RAG_CONFIG_FILE)
+user_config_store = get_config_store(USER_CONFIG_FILE)
 
 def save_rag_config(config):
     try:
-        with open(RAG_CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(config, f)
+        rag_config_store.save(config)
     except Exception as e:
         print(f"保存配置失败: {e}")
 
 def load_rag_config():
-    if os.path.exists(RAG_CONFIG_FILE):
-        try:
-            with open(RAG_CONFIG_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except:
-            pass
-    return None
+    return rag_config_store.load()
 
 # 页面配置
 st.set_page_config(page_title="DeepSeek RAG 角色生成器", layout="wide")
@@ -39,6 +53,18 @@ if "gen_messages" not in st.session_state:
     st.session_state.gen_messages = []
 if "qq_dialogue_messages" not in st.session_state:
     st.session_state.qq_dialogue_messages = []
+if "gen_context" not in st.session_state:
+    st.session_state.gen_context = []
+if "gen_cache_usage" not in st.session_state:
+    st.session_state.gen_cache_usage = []
+# 各风格版本：{风格: {"messages": 对话, "cache_usage": [生成, 校验]}}，gen_messages 指向当前查看的版本
+if "gen_variants" not in st.session_state:
+    st.session_state.gen_variants = {}
+if "memories" not in st.session_state:
+    st.session_state.memories = {}
+# 自由对话的检索工作集：之前检索到的片段，追问时重新打分复用
+if "chat_working_set" not in st.session_state:
+    st.session_state.chat_working_set = ChatWorkingSet()
 if "qq_prompt_data" not in st.session_state:
     st.session_state.qq_prompt_data = {
         "character_info": "",
@@ -59,19 +85,50 @@ if "llm_client" not in st.session_state:
 if "vector_db_ready" not in st.session_state:
     st.session_state.vector_db_ready = False
 
-def init_rag(embedding_type, model_name, api_key=None, base_url=None):
+VECTOR_BACKENDS = {
+    "Chroma (默认)": "chroma",
+    "NumPy 内存映射 (轻量，启动快)": "numpy"
+}
+
+COMPRESSION_OPTIONS = {
+    "不压缩 (float32)": "float32",
+    "半精度 (float16，体积 1/2)": "float16",
+    "int8 标量量化 (体积约 1/4)": "int8",
+    "乘积量化 PQ + 精排": "pq"
+}
+
+LOCAL_INFERENCE_OPTIONS = {
+    "PyTorch": None,
+    "ONNX": "fp32",
+    "ONNX int8 量化": "int8"
+}
+
+def local_embedding_kwargs(config):
+    """从配置中取出本地 Embedding 服务的参数（未开启多进程服务时为空）"""
+    if config.get("embedding_type") != "local" or config.get("local_workers") is None:
+        return {}
+    return {
+        "local_workers": config["local_workers"],
+        "local_threads": config.get("local_threads"),
+        "local_onnx": config.get("local_onnx")
+    }
+
+def init_rag(embedding_type, model_name, api_key=None, base_url=None, backend="chroma", **local_kwargs):
     try:
         return RAGEngine(
             embedding_type=embedding_type, 
             model_name=model_name,
             api_key=api_key,
-            base_url=base_url
+            base_url=base_url,
+            backend=backend,
+            **local_kwargs
         )
     except Exception as e:
         st.error(f"初始化 RAG 引擎失败: {e}")
         return None
 
 # 尝试自动加载本地知识库配置
+# 在后台线程中加载 Embedding 模型和向量库，页面无需等待即可渲染
 if not st.session_state.rag_engine and os.path.exists("./chroma_db") and os.path.exists(RAG_CONFIG_FILE):
     config = load_rag_config()
     if config:
@@ -81,45 +138,138 @@ if not st.session_state.rag_engine and os.path.exists("./chroma_db") and os.path
         # 如果是 API 模式且没有保存 Key，尝试从用户配置读取（假设复用）
         if e_type == "api" and not api_key_to_use:
              # 这里需要临时加载一下 user config
-             if os.path.exists("user_config.json"):
-                 try:
-                     with open("user_config.json", "r", encoding="utf-8") as f:
-                         user_conf = json.load(f)
-                         api_key_to_use = user_conf.get("api_key")
-                 except:
-                     pass
+             api_key_to_use = (user_config_store.load() or {}).get("api_key")
 
         if e_type == "local" or (e_type == "api" and api_key_to_use):
-            with st.spinner("正在自动加载上次的知识库..."):
-                st.session_state.rag_engine = init_rag(
-                    embedding_type=e_type,
-                    model_name=config["model_name"],
-                    api_key=api_key_to_use,
-                    base_url=config.get("base_url")
-                )
-                if st.session_state.rag_engine:
-                    # 简单的验证一下是否真的有数据
-                    # 这里不进行深层检查，假设 chroma_db 存在即有效
-                    st.session_state.vector_db_ready = True
-                    # st.toast("已自动加载上次的知识库") # toast 在这里可能显示不出来，因为还没渲染页面
-
-USER_CONFIG_FILE = "user_config.json"
+            start_prewarm(
+                embedding_type=e_type,
+                model_name=config["model_name"],
+                api_key=api_key_to_use,
+                base_url=config.get("base_url"),
+                backend=config.get("vector_backend", "chroma"),
+                **local_embedding_kwargs(config)
+            )
+            status, engine, _ = get_prewarm_status()
+            if status == "ready":
+                st.session_state.rag_engine = engine
+                # 这里不进行深层检查，假设 chroma_db 存在即有效
+                st.session_state.vector_db_ready = True
+
+def render_prewarm_status():
+    """侧边栏显示后台加载进度，加载完成后刷新整个页面"""
+    status, _, detail = get_prewarm_status()
+    if status == "loading":
+        st.info(f"⏳ 正在后台加载上次的知识库...（{detail}）")
+        if not hasattr(st, "fragment"):
+            st.button("刷新加载状态", key="prewarm_refresh")
+    elif status == "ready" and not st.session_state.rag_engine:
+        st.rerun()
+    elif status == "failed" and not st.session_state.rag_engine:
+        st.warning(f"自动加载知识库失败: {detail}")
+
+# 新版 Streamlit 支持定时刷新局部组件，加载完成后自动切换到就绪状态
+if hasattr(st, "fragment"):
+    render_prewarm_status = st.fragment(run_every=1.0)(render_prewarm_status)
 
 def save_user_config(config):
     try:
-        with open(USER_CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(config, f)
+        user_config_store.save(config)
     except Exception as e:
         print(f"保存用户配置失败: {e}")
 
 def load_user_config():
-    if os.path.exists(USER_CONFIG_FILE):
-        try:
-            with open(USER_CONFIG_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except:
-            pass
-    return {}
+    return user_config_store.load() or {}
+
+def format_bytes(num_bytes):
+    """把字节数格式化为便于阅读的字符串"""
+    if num_bytes is None:
+        return "未知"
+    for unit in ["B", "KB", "MB", "GB"]:
+        if num_bytes < 1024 or unit == "GB":
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+def get_memory(name, model=None):
+    """每个对话（角色生成修改 / 自由对话 / QQ 对话）各自维护一份对话记忆"""
+    budget = st.session_state.get("history_token_budget", DEFAULT_HISTORY_TOKEN_BUDGET)
+    memory = st.session_state.memories.get(name)
+    if memory is None:
+        memory = ConversationMemory(max_history_tokens=budget)
+        st.session_state.memories[name] = memory
+    memory.max_history_tokens = budget
+    # LLM 客户端和模型可能在侧边栏中被更换，每次取最新的
+    memory.summarizer = make_llm_summarizer(st.session_state.llm_client, model) if st.session_state.llm_client else None
+    return memory
+
+
+def show_memory_report(report):
+    st.caption(
+        f"本轮发送约 {report['sent_tokens']} Token，相比完整重发节省 {report['saved_tokens']} Token"
+        f"（{report['dropped_messages']} 条旧消息已压缩为摘要，{report['deduped_chunks']} 个重复片段未重发）"
+    )
+
+
+def show_cache_usage(usages):
+    """显示各次调用的上下文缓存命中情况（提供商未返回 usage 时不显示）"""
+    usages = [u for u in usages if u]
+    if not usages:
+        return
+    parts = [f"{u['label']} 命中 {u['cached_tokens']}/{u['prompt_tokens']}" for u in usages]
+    st.caption("上下文缓存：" + "，".join(parts) + " Token")
+
+
+def render_diagnostics():
+    """侧边栏诊断面板：各阶段耗时汇总与最近的 LLM 调用"""
+    with st.expander("🩺 性能诊断"):
+        rows = metrics.summary()
+        if not rows:
+            st.caption("暂无数据，构建知识库或对话后再查看")
+            return
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+        llm_events = metrics.recent_events("llm_chat", limit=5)
+        if llm_events:
+            st.markdown("**最近的模型调用**")
+            for e in reversed(llm_events):
+                parts = [e.get("label", ""), f"总耗时 {e.get('duration_ms', 0):.0f} ms"]
+                if "ttft_ms" in e:
+                    parts.append(f"首 Token {e['ttft_ms']:.0f} ms")
+                if "tokens_per_s" in e:
+                    parts.append(f"{e['tokens_per_s']} Token/s")
+                if e.get("prompt_tokens"):
+                    parts.append(f"输入 {e['prompt_tokens']} / 输出 {e.get('completion_tokens', 0)}")
+                if e.get("error"):
+                    parts.append(f"失败: {e['error']}")
+                st.caption(" · ".join(parts))
+        if metrics.TRACE_FILE:
+            st.caption(f"完整跟踪记录: {metrics.TRACE_FILE}")
+        if metrics_port:
+            st.caption(f"Prometheus 端点: http://127.0.0.1:{metrics_port}/metrics")
+
+
+def profiling_enabled():
+    return profiling.env_enabled() or st.session_state.get("profiling_enabled", False)
+
+
+def render_profiling_panel():
+    """侧边栏剖析开关与最近一次剖析结果查看"""
+    with st.expander("🔬 性能剖析"):
+        if profiling.env_enabled():
+            st.caption(f"已通过环境变量 {profiling.PROFILE_ENV} 开启")
+        else:
+            st.checkbox("剖析后续操作 (cProfile + tracemalloc)", key="profiling_enabled", help="开启后构建知识库、生成角色、对话和知识库统计会变慢，结果保存在 profiles/ 目录")
+        runs = profiling.list_runs()
+        if not runs:
+            st.caption("暂无剖析记录")
+            return
+        run = st.selectbox("剖析记录", runs[:20], key="profile_run_select")
+        report = profiling.load_report(run)
+        st.caption(f"{report['action']} · 耗时 {report['elapsed_s']} 秒 · 内存峰值 {format_bytes(report['memory_peak_kb'] * 1024)}")
+        st.json(report["params"], expanded=False)
+        st.markdown("**最慢的函数（累计耗时）**")
+        st.dataframe(report["slowest_cumulative"][:15], hide_index=True, use_container_width=True)
+        st.markdown("**最大的内存分配**")
+        st.dataframe(report["top_allocations"][:15], hide_index=True, use_container_width=True)
+
 
 def update_qq_prompt_data():
     """更新QQ prompt数据"""
@@ -142,6 +292,7 @@ def main():
     # --- 侧边栏配置 ---
     with st.sidebar:
         st.header("⚙️ 设置")
+        render_prewarm_status()
         
         # API 配置
         default_provider_index = 0
@@ -156,7 +307,8 @@ def main():
         # 初始化 LLM Client
         if api_key:
             try:
-                st.session_state.llm_client = LLMClient(provider=api_provider, api_key=api_key)
+                # 复用进程内共享的客户端，避免每次 rerun 重建 HTTP 连接池
+                st.session_state.llm_client = get_llm_client(provider=api_provider, api_key=api_key)
                 models = st.session_state.llm_client.get_available_models()
                 
                 default_model_index = 0
@@ -165,6 +317,11 @@ def main():
                     default_model_index = models.index(saved_model)
                 
                 selected_model = st.selectbox("选择对话模型", models, index=default_model_index)
+                st.number_input(
+                    "对话历史 Token 预算", min_value=500, max_value=32000, step=500,
+                    value=DEFAULT_HISTORY_TOKEN_BUDGET, key="history_token_budget",
+                    help="超出预算的较早对话会被压缩成摘要，已发送过的检索片段不会重复发送"
+                )
                 st.success(f"已连接到 {api_provider}")
                 
                 # 保存配置（当连接成功时）
@@ -174,6 +331,16 @@ def main():
                         "api_key": api_key,
                         "model_name": selected_model
                     })
+
+                recent_usage = st.session_state.llm_client.recent_usage()
+                if recent_usage:
+                    with st.expander("📈 上下文缓存命中"):
+                        prompt_total = sum(u["prompt_tokens"] for u in recent_usage)
+                        cached_total = sum(u["cached_tokens"] for u in recent_usage)
+                        rate = cached_total / prompt_total if prompt_total else 0
+                        st.caption(f"最近 {len(recent_usage)} 次调用：输入 {prompt_total} Token，缓存命中 {cached_total} Token（{rate:.0%}）")
+                        for u in reversed(recent_usage[-10:]):
+                            st.text(f"{u['label']}: 命中 {u['cached_tokens']} / 输入 {u['prompt_tokens']}，输出 {u['completion_tokens']}")
                     
             except Exception as e:
                 st.error(f"连接失败: {e}")
@@ -197,6 +364,7 @@ def main():
         embedding_model_name = ""
         rag_api_key = None
         rag_base_url = None
+        local_kwargs = {}
         
         if rag_mode == "本地 (HuggingFace)":
             default_model = rag_config.get("model_name", "sentence-transformers/all-MiniLM-L6-v2")
@@ -205,6 +373,18 @@ def main():
                  
             embedding_model_name = st.text_input("模型名称", value=default_model)
             st.caption("提示：首次运行会自动下载模型。已配置国内镜像加速。")
+            with st.expander("⚡ 本地 Embedding 加速", expanded=False):
+                use_pool = st.checkbox("启用多进程 Embedding 服务", value=rag_config.get("local_workers") is not None, help="按片段长度动态分批，并在多个进程中并行计算，适合大文本入库。")
+                if use_pool:
+                    cpu_count = os.cpu_count() or 1
+                    # 保存的 0 表示在当前进程中计算，不能当成未设置
+                    local_kwargs["local_workers"] = st.number_input("工作进程数 (0 = 当前进程)", min_value=0, max_value=cpu_count, value=min(2, cpu_count) if rag_config.get("local_workers") is None else rag_config["local_workers"])
+                    threads = st.number_input("每进程线程数 (0 = 自动)", min_value=0, max_value=cpu_count, value=rag_config.get("local_threads") or 0)
+                    local_kwargs["local_threads"] = threads or None
+                    inference_labels = list(LOCAL_INFERENCE_OPTIONS.keys())
+                    saved_inference = rag_config.get("local_onnx")
+                    inference_index = list(LOCAL_INFERENCE_OPTIONS.values()).index(saved_inference) if saved_inference in LOCAL_INFERENCE_OPTIONS.values() else 0
+                    local_kwargs["local_onnx"] = LOCAL_INFERENCE_OPTIONS[st.selectbox("推理后端", inference_labels, index=inference_index, help="ONNX 需要安装 onnxruntime 且模型提供 ONNX 文件，不可用时自动回退到 PyTorch。")]
         else:
             # 尝试找到上次使用的模型 index
             model_options = [
@@ -232,86 +412,145 @@ def main():
             
             rag_base_url = "https://api.siliconflow.cn/v1"
 
+        backend_labels = list(VECTOR_BACKENDS.keys())
+        default_backend_index = list(VECTOR_BACKENDS.values()).index(rag_config.get("vector_backend", "chroma"))
+        backend_label = st.selectbox("向量存储后端", backend_labels, index=default_backend_index, help="NumPy 后端无需数据库进程，适合中小规模知识库；两种后端的知识库互相独立。")
+        vector_backend = VECTOR_BACKENDS[backend_label]
+
+        compression = None
+        if vector_backend == "numpy":
+            compression = COMPRESSION_OPTIONS[st.selectbox(
+                "向量压缩 (仅新建知识库时生效)",
+                list(COMPRESSION_OPTIONS.keys()),
+                help="压缩可大幅减少磁盘和内存占用；乘积量化会用半精度原向量对候选重新打分以保证召回。"
+            )]
+
         uploaded_files = st.file_uploader("上传大文本 (txt, pdf, docx)", accept_multiple_files=True)
         
         # 新增：网页 URL 输入
         st.markdown("或者")
         input_urls = st.text_area("输入网页链接 (每行一个)", height=100, help="支持直接读取网页小说章节内容")
-        is_crawl_mode = st.checkbox("这是一个目录页 (自动抓取页面内的章节链接)", value=False, help="勾选后，系统会尝试分析页面中的链接，并抓取所有章节内容。")
+        is_crawl_mode = st.checkbox("这是一个目录页 (自动抓取页面内的章节链接)", value=False, help="勾选后，系统会分析页面中的链接，跟随目录的“下一页”并抓取所有章节内容；章节分成多页时自动抓完。抓取中断后再次点击会从中断处继续。")
         
         kb_name = st.text_input("目标知识库名称 (仅限字母、数字、下划线)", value="default_kb", help="将文件存入指定的知识库分组中。注意：不支持中文，长度3-63字符。")
+
+        # 切分参数按知识库记录：向已有知识库追加时默认沿用它之前的设置
+        chunk_defaults = {"chunk_size": DEFAULT_CHUNK_SIZE, "chunk_overlap": DEFAULT_CHUNK_OVERLAP}
+        kb_exists = bool(st.session_state.rag_engine and kb_name.strip() in st.session_state.rag_engine.get_available_collections())
+        if kb_exists:
+            chunk_defaults = st.session_state.rag_engine.get_chunking(kb_name.strip())
+        col_chunk1, col_chunk2 = st.columns(2)
+        with col_chunk1:
+            chunk_size = st.number_input("片段长度", min_value=100, max_value=4000, step=50, value=chunk_defaults["chunk_size"], help="每个片段的最大字符数。可用 benchmarks/eval_retrieval.py 比较不同设置的召回率和 Token 消耗")
+        with col_chunk2:
+            chunk_overlap = st.number_input("片段重叠", min_value=0, max_value=1000, step=10, value=chunk_defaults["chunk_overlap"], help="相邻片段重叠的字符数，必须小于片段长度")
+        chunking = {"chunk_size": int(chunk_size), "chunk_overlap": int(chunk_overlap)}
+        build_dossiers = st.checkbox("入库后预生成主要角色档案", value=False, help="按出现频率找出主要角色，预先完成生成提示词时的多角度检索；生成时直接读取档案。知识库内容变化后档案自动失效，需要重新生成。")
+        # 分片只能在新建知识库时选择，已有知识库沿用创建时的设置
+        shard_chunks = None
+        if not kb_exists:
+            if st.checkbox("分片存储（超长连载）", value=False, help="按来源文件 / 分卷（“第X卷”）自动分配到多个分片，界面上仍是一个知识库；检索时并发查询各分片后合并。适合数百万片段的长篇系列，写入更快、单个索引的内存更小。"):
+                shard_chunks = int(st.number_input("每个分片最多片段数", min_value=1000, max_value=2000000, step=10000, value=DEFAULT_SHARD_CHUNKS))
         
         if st.button("构建/更新 知识库"):
             # 校验知识库名称
             if not re.match(r'^[a-zA-Z0-9][a-zA-Z0-9._-]{1,61}[a-zA-Z0-9]$', kb_name):
                  st.error("知识库名称格式错误！只能包含字母、数字、下划线、连字符和点，且长度在3-63之间，首尾必须是字母或数字。")
+            elif shard_chunks and len(kb_name) > MAX_LOGICAL_NAME:
+                st.error(f"分片知识库名称最长 {MAX_LOGICAL_NAME} 个字符")
+            elif chunking["chunk_overlap"] >= chunking["chunk_size"]:
+                st.error("片段重叠必须小于片段长度")
             elif not uploaded_files and not input_urls.strip():
                 st.error("请先上传文件或输入网页链接")
             else:
                 if rag_mode == "云端 API (SiliconFlow)" and not rag_api_key:
                     st.error("请提供 API Key")
                 else:
-                    with st.spinner("正在处理文档..."):
-                        # 确定参数
-                        e_type = "local" if rag_mode == "本地 (HuggingFace)" else "api"
+                    with profiling.profiled("kb_build", enabled=profiling_enabled(), params={
+                        "kb_name": kb_name, "files": [f.name for f in uploaded_files or []],
+                        "urls": len(input_urls.split()), "crawl": is_crawl_mode, "embedding": embedding_model_name,
+                        "mode": rag_mode, "backend": vector_backend, "compression": compression, **chunking, **local_kwargs
+                    }):
+                        with st.spinner("正在处理文档..."):
+                            # 确定参数
+                            e_type = "local" if rag_mode == "本地 (HuggingFace)" else "api"
                         
-                        # 初始化 RAG 引擎
-                        st.session_state.rag_engine = init_rag(
-                            embedding_type=e_type,
-                            model_name=embedding_model_name,
-                            api_key=rag_api_key,
-                            base_url=rag_base_url
-                        )
+                            # 初始化 RAG 引擎
+                            st.session_state.rag_engine = init_rag(
+                                embedding_type=e_type,
+                                model_name=embedding_model_name,
+                                api_key=rag_api_key,
+                                base_url=rag_base_url,
+                                backend=vector_backend,
+                                **local_kwargs
+                            )
                     
-                        if st.session_state.rag_engine:
-                            all_docs = []
+                            if st.session_state.rag_engine:
+                                all_docs = []
+                                # 使用用户指定的 collection name，如果为空则使用默认
+                                target_collection = kb_name.strip() if kb_name.strip() else "character_data"
                             
-                            # 1. 处理上传的文件
-                            if uploaded_files:
-                                temp_dir = tempfile.mkdtemp()
-                                file_paths = []
-                                for uploaded_file in uploaded_files:
-                                    file_path = os.path.join(temp_dir, uploaded_file.name)
-                                    with open(file_path, "wb") as f:
-                                        f.write(uploaded_file.getbuffer())
-                                    file_paths.append(file_path)
+                                # 1. 处理上传的文件
+                                if uploaded_files:
+                                    temp_dir = tempfile.mkdtemp()
+                                    file_paths = []
+                                    for uploaded_file in uploaded_files:
+                                        file_path = os.path.join(temp_dir, uploaded_file.name)
+                                        with open(file_path, "wb") as f:
+                                            f.write(uploaded_file.getbuffer())
+                                        file_paths.append(file_path)
                                 
-                                file_docs = st.session_state.rag_engine.load_documents(file_paths)
-                                if isinstance(file_docs, str):
-                                    st.error(f"文件处理错误: {file_docs}")
-                                else:
-                                    all_docs.extend(file_docs)
+                                    file_docs = st.session_state.rag_engine.load_documents(file_paths, chunking=chunking)
+                                    if isinstance(file_docs, str):
+                                        st.error(f"文件处理错误: {file_docs}")
+                                    else:
+                                        all_docs.extend(file_docs)
                                     
-                            # 2. 处理网页链接
-                            if input_urls.strip():
-                                url_list = [url.strip() for url in input_urls.split('\n') if url.strip()]
-                                if url_list:
-                                    web_docs = st.session_state.rag_engine.load_urls(url_list, fetch_links=is_crawl_mode)
-                                    if isinstance(web_docs, str):
-                                        st.error(f"网页处理错误: {web_docs}")
+                                # 2. 处理网页链接
+                                if input_urls.strip():
+                                    url_list = [url.strip() for url in input_urls.split('\n') if url.strip()]
+                                    if url_list:
+                                        web_docs = st.session_state.rag_engine.load_urls(url_list, fetch_links=is_crawl_mode, chunking=chunking, collection_name=target_collection)
+                                        if isinstance(web_docs, str):
+                                            st.error(f"网页处理错误: {web_docs}")
+                                        else:
+                                            all_docs.extend(web_docs)
+                                        crawl = st.session_state.rag_engine.last_crawl
+                                        if crawl:
+                                            st.caption(f"🌐 抓取 {crawl['pages']} 页，下载 {crawl['downloaded_bytes'] / 1024:.1f} KB，"
+                                                       f"{crawl['not_modified']} 页未修改，{crawl['reused']} 页已入库直接复用"
+                                                       + (f"，正文占整页文字 {crawl['content_chars'] / crawl['page_chars']:.0%}" if crawl['page_chars'] else "")
+                                                       + (f"，续抓复用 {crawl['resumed']} 页" if crawl['resumed'] else "")
+                                                       + (f"，{crawl['failed']} 页失败" if crawl['failed'] else ""))
+
+                                if not all_docs:
+                                    crawl = st.session_state.rag_engine.last_crawl
+                                    if crawl and crawl["reused"] and not uploaded_files:
+                                        st.info("所有网页都没有变化，知识库已是最新。")
                                     else:
-                                        all_docs.extend(web_docs)
-
-                            if not all_docs:
-                                st.warning("未能提取到任何有效内容。")
-                            else:
-                                # 构建向量库
-                                # 使用用户指定的 collection name，如果为空则使用默认
-                                target_collection = kb_name.strip() if kb_name.strip() else "character_data"
-                                msg = st.session_state.rag_engine.build_vector_store(all_docs, collection_name=target_collection)
-                                st.success(msg)
-                                st.session_state.vector_db_ready = True
+                                        st.warning("未能提取到任何有效内容。")
+                                else:
+                                    # 构建向量库
+                                    msg = st.session_state.rag_engine.build_vector_store(all_docs, collection_name=target_collection, compression=compression, chunking=chunking, shard_chunks=shard_chunks)
+                                    st.success(msg)
+                                    st.session_state.vector_db_ready = True
+                                    if build_dossiers:
+                                        with st.spinner("正在生成角色档案..."):
+                                            success, dossier_msg = st.session_state.rag_engine.build_dossiers(target_collection)
+                                        (st.success if success else st.warning)(dossier_msg)
                                 
-                                # 保存配置
-                                save_rag_config({
-                                    "embedding_type": e_type,
-                                    "model_name": embedding_model_name,
-                                    "base_url": rag_base_url,
-                                    "api_key": rag_api_key # 保存 Key
-                                })
+                                    # 保存配置
+                                    save_rag_config({
+                                        "embedding_type": e_type,
+                                        "model_name": embedding_model_name,
+                                        "base_url": rag_base_url,
+                                        "api_key": rag_api_key, # 保存 Key
+                                        "vector_backend": vector_backend,
+                                        **local_kwargs
+                                    })
                         
-                        # 清理临时文件
-                        # shutil.rmtree(temp_dir) # 可以在适当时候清理
+                            # 清理临时文件
+                            # shutil.rmtree(temp_dir) # 可以在适当时候清理
 
         # --- 知识库管理区域 ---
         st.divider()
@@ -333,35 +572,126 @@ def main():
                             st.rerun()
                         else:
                             st.error(msg)
+            pending_deletes = st.session_state.rag_engine.get_pending_deletes()
+            if pending_deletes:
+                st.caption(f"⏳ 正在后台删除: {', '.join(pending_deletes)}")
             
-            # 2. 清空所有
+            # 2. 导出 / 导入
+            with st.expander("📤 导出 / 导入知识库", expanded=False):
+                if available_kbs:
+                    kb_to_export = st.selectbox("选择要导出的知识库", available_kbs, key="export_kb_select")
+                    export_encoding = st.radio("向量精度", ["float16", "int8"], horizontal=True, key="export_encoding", help="int8 体积约为 float16 的一半，召回略有损失")
+                    if st.button("生成导出文件", key="export_kb_btn"):
+                        export_path = os.path.join(tempfile.mkdtemp(), f"{kb_to_export}.kbpack")
+                        with st.spinner("正在导出..."):
+                            success, msg = st.session_state.rag_engine.export_collection(kb_to_export, export_path, vector_encoding=export_encoding)
+                        if success:
+                            st.success(msg)
+                            with open(export_path, "rb") as f:
+                                st.download_button("⬇️ 下载 .kbpack 文件", f, file_name=os.path.basename(export_path), key="export_kb_download")
+                        else:
+                            st.error(msg)
+
+                st.caption("导入文件不包含 API Key；需要使用与导出时相同的 Embedding 模型。")
+                import_file = st.file_uploader("选择 .kbpack 文件", type=["kbpack"], key="import_kb_file")
+                import_name = st.text_input("导入为知识库 (留空则使用原名称)", key="import_kb_name")
+                if import_file and st.button("导入", key="import_kb_btn"):
+                    import_path = os.path.join(tempfile.mkdtemp(), import_file.name)
+                    with open(import_path, "wb") as f:
+                        f.write(import_file.getbuffer())
+                    with st.spinner("正在导入..."):
+                        success, msg = st.session_state.rag_engine.import_collection(import_path, collection_name=import_name.strip() or None, compression=compression)
+                    if success:
+                        st.success(msg)
+                        st.rerun()
+                    else:
+                        st.error(msg)
+
+            # 3. 角色档案
+            with st.expander("🧾 角色档案", expanded=False):
+                if available_kbs:
+                    st.caption("预先完成生成提示词时的多角度检索，生成时直接读取；知识库内容变化后档案自动失效，未建档的角色照常实时检索。")
+                    kb_for_dossier = st.selectbox("选择知识库", available_kbs, key="dossier_kb_select")
+                    dossier_names = st.text_input("额外指定角色 (可选，用逗号分隔)", key="dossier_names", help="自动识别只统计出现次数较多的人名，别名、外号等可以在这里补充")
+                    if st.button("生成 / 更新角色档案", key="dossier_build_btn"):
+                        names = [n for n in dossier_names.replace("，", ",").split(",") if n.strip()]
+                        progress_bar = st.progress(0.0)
+                        def update_dossier_progress(done, total, name):
+                            progress_bar.progress(done / total if total else 1.0, text=f"正在建档: {name}" if name else "完成")
+                        with st.spinner("正在生成角色档案..."):
+                            success, msg = st.session_state.rag_engine.build_dossiers(kb_for_dossier, names=names, progress=update_dossier_progress)
+                        (st.success if success else st.warning)(msg)
+                    dossiers = st.session_state.rag_engine.get_dossier_status(kb_for_dossier)
+                    if dossiers:
+                        st.text("\n".join(
+                            f"{'✅' if valid else '⌛'} {name}" + (f"（出现 {mentions} 次）" if mentions else "")
+                            for name, mentions, valid in dossiers
+                        ))
+                        if not all(valid for _, _, valid in dossiers):
+                            st.caption("⌛ 表示知识库在建档后有变化，档案已失效，生成时会实时检索。")
+
+            # 4. 回收磁盘空间
+            with st.expander("🧹 回收磁盘空间", expanded=False):
+                st.caption("删除知识库后，向量库目录中可能残留索引文件和数据库空闲页。回收在后台执行，排在正在进行的入库和删除之后。")
+                compact_status, compact_result = st.session_state.rag_engine.get_compaction_status()
+                if compact_status == "running":
+                    st.info("⏳ 正在后台回收磁盘空间...")
+                    st.button("刷新状态", key="compact_refresh")
+                else:
+                    if st.button("开始回收", key="compact_btn"):
+                        st.session_state.rag_engine.start_compaction()
+                        st.rerun()
+                    if compact_status == "done":
+                        st.success(f"上次回收释放了 {format_bytes(compact_result['freed'])}（{format_bytes(compact_result['before'])} → {format_bytes(compact_result['after'])}），耗时 {compact_result['seconds']:.1f} 秒")
+                        if compact_result["errors"]:
+                            st.warning("以下文件暂时无法删除，下次回收时重试：\n" + "\n".join(compact_result["errors"]))
+                    elif compact_status == "error":
+                        st.error(f"回收失败: {compact_result}")
+
+            # 5. 清空所有
             if st.button("⚠️ 清空所有知识库", type="primary"):
                 if st.session_state.rag_engine:
                     st.session_state.rag_engine.clear_database()
                     st.session_state.vector_db_ready = False
                     st.success("知识库已全部清空")
                     # 删除配置文件
-                    if os.path.exists(RAG_CONFIG_FILE):
-                        try:
-                            os.remove(RAG_CONFIG_FILE)
-                        except:
-                            pass
+                    try:
+                        rag_config_store.delete()
+                    except:
+                        pass
                     st.rerun()
 
         # 显示已有知识库内容
         if st.session_state.vector_db_ready and st.session_state.rag_engine:
             st.divider()
             with st.expander("📂 已收录文档列表", expanded=False):
-                summary = st.session_state.rag_engine.get_documents_summary()
+                with profiling.profiled("kb_summary", enabled=profiling_enabled(), params={"backend": st.session_state.rag_engine.backend.name}):
+                    summary = st.session_state.rag_engine.get_documents_summary()
                 if summary:
                     for kb, info in summary.items():
                         files = info['files']
                         count = info['count']
-                        st.markdown(f"**📦 {kb}** (共 {count} 个片段)")
+                        st.markdown(f"**📦 {kb}** (共 {count} 个片段，文本 {format_bytes(info.get('bytes'))})")
+                        if info.get("embedding_model") or info.get("last_ingest"):
+                            st.caption(f"模型: {info.get('embedding_model') or '未知'} · 最近入库: {info.get('last_ingest') or '未知'}")
+                        if info.get("chunking"):
+                            st.caption(f"切分: 长度 {info['chunking']['chunk_size']} / 重叠 {info['chunking']['chunk_overlap']}")
+                        if "disk_bytes" in info:
+                            st.caption(f"向量压缩: {info['compression']} · 磁盘占用: {format_bytes(info['disk_bytes'])}")
+                        if "shards" in info:
+                            st.caption(f"分片存储: {info['shards']} 个分片")
                         for f in files:
                             st.text(f"  └─ 📄 {f}")
+                    dedup = st.session_state.rag_engine.get_dedup_stats()
+                    if dedup and dedup["reused"]:
+                        st.caption(f"♻️ 跨知识库去重：{dedup['reused']} 个重复片段直接复用已有向量，省去了 Embedding 计算"
+                                   f"（片段缓存另占磁盘 {format_bytes(dedup['store_bytes'])}）")
                 else:
                     st.caption("暂无文件信息")
+
+        render_diagnostics()
+        render_profiling_panel()
+
     # --- 主界面 ---
     tab1, tab2, tab3, tab4 = st.tabs(["🎭 角色提示词生成", "💬 自由对话", "🤖 QQ角色生成", "📜 历史记录"])
 
@@ -400,7 +730,7 @@ def main():
         with col1:
             char_name = st.text_input("角色名称", placeholder="例如：孙悟空")
         with col2:
-            char_style = st.selectbox("提示词风格", ["详细设定版", "简短对话版", "JSON格式"])
+            char_styles = st.multiselect("提示词风格", PROMPT_STYLES, default=PROMPT_STYLES[:1], help="选择多个风格时只检索一次，各版本同时生成、并排显示")
         with col3:
             retrieve_k = st.number_input("检索片段数", min_value=1, max_value=100, value=15, help="增加此数值可以读取更多原文内容，但会消耗更多 Token")
 
@@ -409,142 +739,96 @@ def main():
         if st.button("生成角色提示词", disabled=not (st.session_state.vector_db_ready and st.session_state.llm_client)):
             if not char_name:
                 st.warning("请输入角色名称")
+            elif not char_styles:
+                st.warning("请至少选择一种提示词风格")
             else:
-                with st.spinner(f"正在多角度检索关于 {char_name} 的信息..."):
-                    # 1. RAG 多路检索 (Multi-Query Retrieval)
-                    # 定义不同的检索角度，以提取更丰富的信息
-                    queries = [
-                        f"关于角色 {char_name} 的外貌描写、性格特征、身世背景",
-                        f"{char_name} 的说话风格、口头禅、经典台词、语气",
-                        f"{char_name} 的重要经历、关键剧情、人际关系、对其他人的态度"
-                    ]
-                    if extra_req:
-                        queries.append(f"{char_name} {extra_req}")
-                    
-                    all_retrieved_docs = []
-                    seen_contents = set()
-                    
-                    # 执行多次检索
-                    for q in queries:
-                        docs = st.session_state.rag_engine.query(q, k=retrieve_k, collection_names=selected_kbs)
-                        for doc in docs:
-                            if doc.page_content not in seen_contents:
-                                seen_contents.add(doc.page_content)
-                                all_retrieved_docs.append(doc)
-                    
-                    # 截取用户指定的数量 (如果多路检索结果太多)
-                    # 这里的逻辑是：优先保留前面的结果（通常相关性更高），但因为我们是多路合并，
-                    # 简单的截断可能不够完美，但对于 RAG 来说，去重后的并集通常是最好的。
-                    # 如果数量实在太多超过 retrieve_k * 2，可以适当截断，防止 Token 爆炸
-                    if len(all_retrieved_docs) > retrieve_k:
-                         # 这里我们稍微放宽一点，允许比用户设定的多一点，因为是多路合并的
-                         all_retrieved_docs = all_retrieved_docs[:retrieve_k]
-
-                    context_text = "\n\n".join([doc.page_content for doc in all_retrieved_docs])
+                with profiling.profiled("character_generation", enabled=profiling_enabled(), params={
+                    "char_name": char_name, "styles": char_styles, "retrieve_k": retrieve_k,
+                    "kbs": selected_kbs, "model": selected_model, "extra_req": extra_req
+                }):
+                    with st.spinner(f"正在多角度检索关于 {char_name} 的信息..."):
+                        # 1. RAG 多路检索 (Multi-Query Retrieval)：外貌性格 + 语言风格 + 经历关系 + 额外要求，
+                        # 已建档的知识库直接读取预先计算的结果
+                        all_retrieved_docs, retrieval_info = st.session_state.rag_engine.retrieve_character(
+                            char_name, k=retrieve_k, collection_names=selected_kbs, extra_req=extra_req
+                        )
+
+                        # 排序后作为各风格版本的生成、校验、修改环节共用的缓存前缀
+                        context_chunks = sort_context_docs(all_retrieved_docs)
+                        prefix_message = build_prefix_message(context_chunks)
                     
-                    # 显示检索到的内容 (用于调试/确认)
-                    with st.expander(f"查看检索到的原文片段 (共 {len(all_retrieved_docs)} 个片段)"):
-                        st.info("已启用多角度混合检索（外貌性格 + 语言风格 + 经历关系 + 额外要求）")
-                        for i, doc in enumerate(all_retrieved_docs):
-                            st.markdown(f"**片段 {i+1}** (Source: {doc.metadata.get('source', 'unknown')}):")
-                            # 显示完整内容，不再截断
-                            st.text(doc.page_content)
-                            st.divider()
-
-                    # 2. 构建 Prompt (第一阶段：生成)
-                    gen_prompt = f"""你是一个专业的角色设定专家。请根据提供的原文片段，为角色【{char_name}】撰写一份高级的角色扮演 System Prompt。
-
-【任务要求】
-1. **Prompt结构**：请使用动态Prompt结构，包含以下模块：
-   - [角色详情]：姓名、年龄、身份等。
-   - [性格特质]：深层性格、行事逻辑、优缺点。
-   - [语言风格]：口癖、语气、常用词、句式特点。
-   - [经历背景]：关键身世、重要剧情节点。
-   - [人际关系]：与关键人物的关系及态度。
-2. **对话生成**：请生成一段包含 **5个来回** 的对话示例（User与{char_name}的互动）。对话内容需紧扣剧情逻辑，展现角色的语气和性格。
-3. **行文风格提取**：**必须**在所有输出的最后，单独列出一个章节叫“【提取的原文本行文风格】”，描述原文的描写手法、修辞风格和氛围感。
-
-【原文片段】
-{context_text}
-
-【用户额外要求】
-{extra_req}
-
-请直接输出结果。
-"""
+                        # 显示检索到的内容 (用于调试/确认)
+                        with st.expander(f"查看检索到的原文片段 (共 {len(all_retrieved_docs)} 个片段)"):
+                            st.info("已启用多角度混合检索（外貌性格 + 语言风格 + 经历关系 + 额外要求）")
+                            if retrieval_info["dossier"]:
+                                st.caption(f"🧾 使用角色档案: {', '.join(retrieval_info['dossier'])}"
+                                           + (f"；实时检索: {', '.join(retrieval_info['live'])}" if retrieval_info["live"] else ""))
+                            for i, doc in enumerate(all_retrieved_docs):
+                                st.markdown(f"**片段 {i+1}** (Source: {doc.metadata.get('source', 'unknown')}):")
+                                # 显示完整内容，不再截断
+                                st.text(doc.page_content)
+                                st.divider()
+
+                    # 2. 各风格版本并发执行“生成 → 剧情逻辑与人设校验”，每个版本流式显示在自己的一栏中
+                    run = VariantRun(st.session_state.llm_client, prefix_message, char_name, char_styles, extra_req, model=selected_model)
+                    with st.status(f"正在生成 {len(char_styles)} 个版本..." if len(char_styles) > 1 else "正在进行深度生成...", expanded=True) as status:
+                        columns = st.columns(len(char_styles))
+                        stage_placeholders, text_placeholders = {}, {}
+                        for column, style in zip(columns, char_styles):
+                            with column:
+                                st.markdown(f"**{style}**")
+                                stage_placeholders[style] = st.empty()
+                                stage_placeholders[style].caption("📝 等待生成...")
+                                text_placeholders[style] = st.empty()
+                        stage_labels = {"生成": "📝 正在生成初始角色设定与对话...", "校验": "⚖️ 正在进行剧情逻辑与人设校验...", "完成": "✅ 完成"}
+                        for style, stage, text in run.updates():
+                            if stage == "失败":
+                                stage_placeholders[style].error(text)
+                                continue
+                            stage_placeholders[style].caption(stage_labels[stage])
+                            text_placeholders[style].markdown(text if stage == "完成" else text + "▌")
+
+                        results = [(style, run.results[style]) for style in char_styles]
+                        succeeded = [(style, r) for style, r in results if not r["error"]]
+                        status.update(label="生成完成" if succeeded else "生成失败", state="complete" if succeeded else "error", expanded=not succeeded)
                     
-                    # 第一阶段调用
-                    first_stage_response = ""
-                    with st.status("正在进行深度生成...", expanded=True) as status:
-                        st.write("📝 正在生成初始角色设定与对话...")
-                        messages_gen = [{"role": "user", "content": gen_prompt}]
-                        stream_gen = st.session_state.llm_client.chat(messages_gen, model=selected_model, stream=True)
-                        
-                        gen_placeholder = st.empty()
-                        if isinstance(stream_gen, str):
-                            st.error(stream_gen)
-                            st.stop()
-                        
-                        for chunk in stream_gen:
-                            if chunk.choices[0].delta.content:
-                                content = chunk.choices[0].delta.content
-                                first_stage_response += content
-                                gen_placeholder.markdown(first_stage_response + "▌")
-                        gen_placeholder.markdown(first_stage_response)
-                        
-                        # 3. 构建 Prompt (第二阶段：判别与修正)
-                        st.write("⚖️ 正在进行剧情逻辑与人设校验...")
-                        judge_prompt = f"""你是一个剧情逻辑审核员。请评估以下生成的角色Prompt和对话是否符合原文的剧情逻辑和人设。
-
-【原文片段】
-{context_text}
-
-【待评估生成的设定】
-{first_stage_response}
-
-【审核要求】
-1. **判断标准**：重点判断是否符合“剧情逻辑”和“人设还原度”。**削弱逻辑判断**，不要过分纠结严密的现实逻辑，只要符合故事内部的剧情逻辑即可。
-2. **输出处理**：
-   - 如果内容合格，请直接输出原内容。
-   - 如果有偏差（如OOC、语气不对、剧情冲突），请修正并输出优化后的完整版本。
-3. **保留项**：确保输出的最后依然包含“【提取的原文本行文风格】”。
-
-请输出最终确定的版本。
-"""
-                        messages_judge = [{"role": "user", "content": judge_prompt}]
-                        stream_judge = st.session_state.llm_client.chat(messages_judge, model=selected_model, stream=True)
-                        
-                        final_response = ""
-                        # Clear previous placeholder to show final result cleanly
-                        gen_placeholder.empty() 
-                        final_placeholder = st.empty()
-                        
-                        if isinstance(stream_judge, str):
-                            st.error(stream_judge)
-                        else:
-                            for chunk in stream_judge:
-                                if chunk.choices[0].delta.content:
-                                    content = chunk.choices[0].delta.content
-                                    final_response += content
-                                    final_placeholder.markdown(final_response + "▌")
-                            final_placeholder.markdown(final_response)
-                        
-                        status.update(label="生成完成", state="complete", expanded=False)
-                        
-                        # 重置对话历史，存入最终结果
-                        st.session_state.gen_messages = [
-                            {"role": "user", "content": gen_prompt}, # 保存初始请求
-                            {"role": "assistant", "content": final_response}
-                        ]
+                    if succeeded:
+                        # 重置对话历史，存入各版本的最终结果
+                        st.session_state.gen_variants = {
+                            style: {
+                                "messages": [
+                                    r["initial_request"], # 保存初始请求
+                                    {"role": "assistant", "content": r["final"]}
+                                ],
+                                "cache_usage": r["usage"]
+                            }
+                            for style, r in succeeded
+                        }
+                        st.session_state.gen_style = succeeded[0][0]
+                        st.session_state.gen_char_name = char_name
+                        st.session_state.gen_messages = st.session_state.gen_variants[succeeded[0][0]]["messages"]
+                        st.session_state.gen_context = context_chunks
+                        st.session_state.gen_cache_usage = succeeded[0][1]["usage"]
+                        st.session_state.memories.pop("gen", None)
                         st.rerun()
 
+        # 多个风格版本时选择查看和继续修改哪一个
+        variants = st.session_state.gen_variants
+        if len(variants) > 1:
+            active_style = st.radio("当前版本", list(variants.keys()), horizontal=True, key="gen_style")
+            if st.session_state.gen_messages is not variants[active_style]["messages"]:
+                st.session_state.gen_messages = variants[active_style]["messages"]
+                st.session_state.gen_cache_usage = variants[active_style]["cache_usage"]
+                # 修改对话的摘要状态按版本区分
+                st.session_state.memories.pop("gen", None)
+
         # 显示生成历史和对话
         for msg in st.session_state.gen_messages:
             if msg["role"] == "system":
                 continue # 不显示系统指令
             if msg["role"] == "user":
                 # 隐藏初始的大段 Prompt，只显示后续的修改意见
-                if msg["content"].startswith("目标角色："):
+                if msg.get("initial"):
                     with st.expander("查看初始 Prompt 请求"):
                         st.text(msg["content"])
                 else:
@@ -553,12 +837,22 @@ def main():
             else:
                 with st.chat_message("assistant"):
                     st.markdown(msg["content"])
+        if len(st.session_state.gen_messages) == 2:
+            show_cache_usage(st.session_state.gen_cache_usage)
 
-        # 保存按钮
+        # 保存按钮：多个版本时一起保存（各版本的最新回复）
         if st.session_state.gen_messages and st.session_state.gen_messages[-1]["role"] == "assistant":
-            if st.button("💾 保存当前 Prompt 到历史记录"):
+            saved_name = st.session_state.get("gen_char_name") or char_name
+            if len(variants) > 1:
+                if st.button(f"💾 保存全部 {len(variants)} 个版本到历史记录"):
+                    save_history_items([
+                        (saved_name, next(m["content"] for m in reversed(v["messages"]) if m["role"] == "assistant"), style)
+                        for style, v in variants.items()
+                    ])
+                    st.success("已保存！")
+            elif st.button("💾 保存当前 Prompt 到历史记录"):
                 last_response = st.session_state.gen_messages[-1]["content"]
-                save_history_item(char_name, last_response)
+                save_history_item(saved_name, last_response, next(iter(variants), None))
                 st.success("已保存！")
 
         # 修改意见输入框
@@ -571,7 +865,11 @@ def main():
                     st.markdown(prompt)
 
                 with st.chat_message("assistant"):
-                    stream = st.session_state.llm_client.chat(st.session_state.gen_messages, model=selected_model, stream=True)
+                    memory = get_memory("gen", selected_model)
+                    # 与生成、校验阶段相同的前缀，修改对话同样可以命中缓存
+                    prefix = build_prefix_message(st.session_state.gen_context)["content"]
+                    messages_payload, memory_report = memory.build_messages(st.session_state.gen_messages, system_prompt=prefix)
+                    stream = st.session_state.llm_client.chat(messages_payload, model=selected_model, stream=True, label="修改")
                     if isinstance(stream, str):
                         st.error(stream)
                     else:
@@ -583,11 +881,20 @@ def main():
                                 full_response += content
                                 response_placeholder.markdown(full_response)
                         st.session_state.gen_messages.append({"role": "assistant", "content": full_response})
+                        show_memory_report(memory_report)
+                        show_cache_usage([stream.usage])
 
     # Tab 2: 自由对话
     with tab2:
         st.markdown("### 与模型对话 (可选 RAG)")
         enable_rag = st.checkbox("启用 RAG (引用知识库)", value=True, disabled=not st.session_state.vector_db_ready)
+        chat_kbs = []
+        if enable_rag and st.session_state.vector_db_ready and st.session_state.rag_engine:
+            available_kbs = st.session_state.rag_engine.get_available_collections()
+            # 默认检索全部知识库；已删除的知识库从选择中去掉
+            st.session_state.chat_kbs = [kb for kb in st.session_state.get("chat_kbs", available_kbs) if kb in available_kbs]
+            chat_kbs = st.multiselect("检索范围（知识库）", available_kbs, key="chat_kbs",
+                                      help="追问时优先复用本次对话中已检索到的片段，与问题不够相关时再重新检索")
         
         # 显示历史消息
         for msg in st.session_state.messages:
@@ -601,48 +908,62 @@ def main():
                 st.markdown(prompt)
 
             # 生成回复
-            with st.chat_message("assistant"):
-                if not st.session_state.llm_client:
-                    st.error("请先配置 API Key")
-                else:
-                    context_str = ""
-                    if enable_rag and st.session_state.vector_db_ready:
-                        with st.spinner("检索中..."):
-                            docs = st.session_state.rag_engine.query(prompt, k=3)
-                            context_str = "\n\n".join([doc.page_content for doc in docs])
+            with profiling.profiled("chat_turn", enabled=profiling_enabled(), params={
+                "model": selected_model if st.session_state.llm_client else None, "rag": enable_rag,
+                "kbs": chat_kbs, "history": len(st.session_state.messages)
+            }):
+                with st.chat_message("assistant"):
+                    if not st.session_state.llm_client:
+                        st.error("请先配置 API Key")
+                    else:
+                        use_rag = enable_rag and st.session_state.vector_db_ready and bool(chat_kbs)
+                        if use_rag:
+                            # 检索在后台进行，同时组装提示词（更新对话摘要）
+                            retrieval = st.session_state.chat_working_set.submit(
+                                st.session_state.rag_engine, build_chat_query(st.session_state.messages),
+                                k=CHAT_RETRIEVAL_K, collection_names=chat_kbs
+                            )
+                        elif enable_rag and st.session_state.vector_db_ready:
+                            st.caption("未选择知识库，本轮不检索")
+
+                        # 构建消息：超出预算的较早对话压缩为摘要
+                        if use_rag:
+                            system_msg = "你是一个助手。请基于对话中提供的【原文片段】回答用户的问题。"
+                        else:
+                            system_msg = "你是一个乐于助人的助手。"
+                        memory = get_memory("chat", selected_model)
+                        if use_rag:
+                            # 按所选知识库的片段长度为本轮片段预留 Token，片段到达后不必再次等待摘要
+                            reserve = CHAT_RETRIEVAL_K * max(st.session_state.rag_engine.get_chunking(kb)["chunk_size"] for kb in chat_kbs)
+                            memory.prepare(st.session_state.messages, system_prompt=system_msg, reserve_tokens=reserve)
+                            with st.spinner("检索中..."), metrics.span("chat_retrieval_wait"):
+                                docs, retrieval_info = retrieval.result()
+                            # 检索片段挂在本轮用户消息上，之后的轮次在预算内继续可见，重复片段不再重发
+                            st.session_state.messages[-1]["context"] = [doc.page_content for doc in docs]
                             with st.expander("参考上下文"):
-                                st.text(context_str)
-                    
-                    # 构建消息
-                    messages_payload = []
-                    # 如果有 RAG 上下文，插入到 System Prompt 或 User Prompt 中
-                    if context_str:
-                        system_msg = f"你是一个助手。请基于以下上下文回答用户的问题。\n\n上下文：\n{context_str}"
-                        messages_payload.append({"role": "system", "content": system_msg})
-                    
-                    # 添加历史记录 (简单处理，只取最近几轮以节省 token)
-                    for m in st.session_state.messages[-5:]:
-                        messages_payload.append(m)
-                    
-                    # 如果没有 RAG 且没有历史 system prompt，可以加一个默认的
-                    if not context_str and not any(m['role'] == 'system' for m in messages_payload):
-                         messages_payload.insert(0, {"role": "system", "content": "你是一个乐于助人的助手。"})
+                                if retrieval_info["reused"]:
+                                    st.caption(f"♻️ 复用本次对话已检索到的片段（工作集 {retrieval_info['working_set']} 个），{retrieval_info['ms']:.0f} ms")
+                                else:
+                                    st.caption(f"🔍 检索 {len(chat_kbs)} 个知识库，新增 {retrieval_info['new']} 个片段，{retrieval_info['ms']:.0f} ms")
+                                st.text("\n\n".join(st.session_state.messages[-1]["context"]))
+                        messages_payload, memory_report = memory.build_messages(st.session_state.messages, system_prompt=system_msg)
 
-                    # 调用 LLM
-                    response_placeholder = st.empty()
-                    full_response = ""
-                    stream = st.session_state.llm_client.chat(messages_payload, model=selected_model, stream=True)
+                        # 调用 LLM
+                        response_placeholder = st.empty()
+                        full_response = ""
+                        stream = st.session_state.llm_client.chat(messages_payload, model=selected_model, stream=True, label="自由对话")
                     
-                    if isinstance(stream, str):
-                        st.error(stream)
-                    else:
-                        for chunk in stream:
-                            if chunk.choices[0].delta.content:
-                                content = chunk.choices[0].delta.content
-                                full_response += content
-                                response_placeholder.markdown(full_response)
+                        if isinstance(stream, str):
+                            st.error(stream)
+                        else:
+                            for chunk in stream:
+                                if chunk.choices[0].delta.content:
+                                    content = chunk.choices[0].delta.content
+                                    full_response += content
+                                    response_placeholder.markdown(full_response)
                         
-                        st.session_state.messages.append({"role": "assistant", "content": full_response})
+                            st.session_state.messages.append({"role": "assistant", "content": full_response})
+                            show_memory_report(memory_report)
 
     # Tab 3: QQ角色生成
     with tab3:
@@ -674,11 +995,13 @@ def main():
                     full_response = ""
 
                     # 构建消息
-                    messages_payload = [{"role": "system", "content": "你是一个友好的AI助手，请与用户进行自然、流畅的对话。通过对话了解用户的喜好、性格特点，为后续生成QQ聊天角色设定做准备。"}]
-                    for m in st.session_state.qq_dialogue_messages[-10:]:  # 只保留最近10轮对话
-                        messages_payload.append(m)
+                    memory = get_memory("qq", selected_model)
+                    messages_payload, memory_report = memory.build_messages(
+                        st.session_state.qq_dialogue_messages,
+                        system_prompt="你是一个友好的AI助手，请与用户进行自然、流畅的对话。通过对话了解用户的喜好、性格特点，为后续生成QQ聊天角色设定做准备。"
+                    )
 
-                    stream = st.session_state.llm_client.chat(messages_payload, model=selected_model, stream=True)
+                    stream = st.session_state.llm_client.chat(messages_payload, model=selected_model, stream=True, label="QQ对话")
 
                     if isinstance(stream, str):
                         st.error(stream)
@@ -691,110 +1014,76 @@ def main():
 
                         response_placeholder.markdown(full_response)
                         st.session_state.qq_dialogue_messages.append({"role": "assistant", "content": full_response})
+                        show_memory_report(memory_report)
 
         # 第二步：生成QQ角色Prompt
         st.divider()
         st.subheader("🎯 第二步：生成QQ聊天Prompt")
 
+        qq_format = st.radio(
+            "输出格式",
+            list(QQ_OUTPUT_FORMATS),
+            format_func=lambda f: QQ_OUTPUT_FORMATS[f],
+            horizontal=True,
+            key="qq_output_format",
+            help="JSON 格式要求模型只输出一个 JSON 对象，解析更稳定；部分模型不支持时按普通请求发送"
+        )
+
         col_gen1, col_gen2 = st.columns([1, 1])
         with col_gen1:
             if st.button("📝 生成角色Prompt", disabled=not st.session_state.llm_client or not st.session_state.qq_dialogue_messages):
                 if not st.session_state.qq_dialogue_messages:
                     st.warning("请先进行一些对话来帮助AI了解角色特点")
                 else:
-                    with st.spinner("正在分析对话并生成角色设定..."):
-                        # 构建生成prompt
-                        dialogue_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in st.session_state.qq_dialogue_messages])
-
-                        gen_prompt = f"""基于以下对话内容，请为QQ聊天生成一个角色Prompt。
-
-【对话记录】
-{dialogue_text}
-
-请生成一个完整的QQ聊天角色Prompt，包含以下部分：
-
-1. 【人设基本信息】：角色的姓名、年龄、性别、职业等基本信息
-2. 【人物背景】：角色的身世背景、经历、性格特点等
-3. 【聊天对话要求】：角色的说话风格、语气、常用表情、聊天习惯等
-4. 【对话示例】：请提供5个具体的对话示例，格式如下：
-   用户：消息内容
-   角色：回复内容
-
-请确保对话示例贴合角色的性格和说话风格。
-"""
-
-                        messages_gen = [{"role": "user", "content": gen_prompt}]
-                        response = st.session_state.llm_client.chat(messages_gen, model=selected_model, stream=False)
-
-                        if isinstance(response, str):
-                            st.error(response)
+                    dialogue_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in st.session_state.qq_dialogue_messages])
+
+                    # 每个部分一接收完整就显示出来，不等整个回复结束
+                    status = st.empty()
+                    section_slots = {field: st.empty() for field, _ in QQ_SECTIONS}
+                    raw_slot = st.empty()
+                    status.info("正在分析对话并生成角色设定...")
+                    result = None
+                    for event, payload in stream_qq_prompt(st.session_state.llm_client, dialogue_text, model=selected_model, output_format=qq_format):
+                        if event == "text":
+                            field, text = payload
+                            receiving = f"正在接收【{QQ_SECTION_TITLES[field]}】" if field else "正在接收"
+                            raw_slot.caption(f"{receiving}…（已接收 {len(text)} 字）")
+                        elif event == "section":
+                            field, value = payload
+                            shown = "\n".join(f"用户：{ex['user']}  \n角色：{ex['character']}" for ex in value) if field == "dialogue_examples" else value
+                            section_slots[field].success(f"**{QQ_SECTION_TITLES[field]}**\n\n{shown}")
+                        elif event == "retry":
+                            status.info("以下部分缺失或格式不符，正在单独补充生成：" + "、".join(QQ_SECTION_TITLES[f] for f in payload))
                         else:
-                            full_response = response.choices[0].message.content
-
-                            # 解析生成的prompt
-                            try:
-                                # 简单的文本解析
-                                lines = full_response.split('\n')
-                                character_info = ""
-                                background = ""
-                                chat_requirements = ""
-                                examples = []
-
-                                current_section = ""
-                                example_lines = []
-
-                                for line in lines:
-                                    line = line.strip()
-                                    if line.startswith("【人设基本信息】"):
-                                        current_section = "character_info"
-                                        character_info = line.replace("【人设基本信息】", "").strip()
-                                    elif line.startswith("【人物背景】"):
-                                        current_section = "background"
-                                        background = line.replace("【人物背景】", "").strip()
-                                    elif line.startswith("【聊天对话要求】"):
-                                        current_section = "chat_requirements"
-                                        chat_requirements = line.replace("【聊天对话要求】", "").strip()
-                                    elif line.startswith("【对话示例】"):
-                                        current_section = "examples"
-                                    elif current_section == "character_info" and not line.startswith("【"):
-                                        character_info += "\n" + line
-                                    elif current_section == "background" and not line.startswith("【"):
-                                        background += "\n" + line
-                                    elif current_section == "chat_requirements" and not line.startswith("【"):
-                                        chat_requirements += "\n" + line
-                                    elif current_section == "examples":
-                                        if "：" in line:
-                                            parts = line.split("：", 1)
-                                            if len(parts) == 2:
-                                                role = parts[0].strip()
-                                                content = parts[1].strip()
-                                                if role == "用户" or role == "角色":
-                                                    example_lines.append({"role": "user" if role == "用户" else "character", "content": content})
-                                                if len(example_lines) >= 2:
-                                                    examples.append({
-                                                        "user": example_lines[-2]["content"] if example_lines[-2]["role"] == "user" else "",
-                                                        "character": example_lines[-1]["content"] if example_lines[-1]["role"] == "character" else ""
-                                                    })
-                                                    example_lines = []
-
-                                # 更新session state
-                                st.session_state.qq_prompt_data = {
-                                    "character_info": character_info.strip(),
-                                    "background": background.strip(),
-                                    "chat_requirements": chat_requirements.strip(),
-                                    "dialogue_examples": examples[:5] if examples else st.session_state.qq_prompt_data["dialogue_examples"]
-                                }
-
-                                st.success("角色Prompt生成完成！")
-                                st.rerun()
-
-                            except Exception as e:
-                                st.error(f"解析生成结果失败: {e}")
-                                st.text_area("生成的完整内容", full_response, height=300)
+                            result = payload
+                    raw_slot.empty()
+
+                    data = result["data"]
+                    if not data:
+                        status.empty()
+                        errors = [e for e in result["errors"] if e]
+                        st.error(errors[-1] if errors else "未能从生成结果中解析出任何部分")
+                        if any(result["raw"]):
+                            st.text_area("生成的完整内容", "\n\n".join(r for r in result["raw"] if r), height=300)
+                    else:
+                        # 仍然缺失的部分保留原来的内容
+                        st.session_state.qq_prompt_data = {
+                            field: data.get(field, st.session_state.qq_prompt_data[field]) for field, _ in QQ_SECTIONS
+                        }
+                        if result["missing"]:
+                            st.session_state.qq_gen_warning = "以下部分多次生成仍不完整，已保留原来的内容：" + "、".join(QQ_SECTION_TITLES[f] for f in result["missing"])
+                        st.session_state.qq_gen_notice = f"角色Prompt生成完成！（共请求 {result['requests']} 次）"
+                        st.rerun()
+
+            if "qq_gen_notice" in st.session_state:
+                st.success(st.session_state.pop("qq_gen_notice"))
+            if "qq_gen_warning" in st.session_state:
+                st.warning(st.session_state.pop("qq_gen_warning"))
 
         with col_gen2:
             if st.button("🗑️ 清空对话", disabled=not st.session_state.qq_dialogue_messages):
                 st.session_state.qq_dialogue_messages = []
+                st.session_state.memories.pop("qq", None)
                 st.success("对话已清空")
                 st.rerun()
 
@@ -840,7 +1129,7 @@ def main():
 """
 
                     messages_adjust = [{"role": "user", "content": adjust_prompt}]
-                    response = st.session_state.llm_client.chat(messages_adjust, model=selected_model, stream=False)
+                    response = st.session_state.llm_client.chat(messages_adjust, model=selected_model, stream=False, label="QQ调整")
 
                     if isinstance(response, str):
                         st.error(response)
@@ -882,7 +1171,7 @@ def main():
             st.info("暂无历史记录。")
         else:
             for i, item in enumerate(history):
-                with st.expander(f"{item['timestamp']} - {item['char_name']}"):
+                with st.expander(f"{item['timestamp']} - {item['char_name']}" + (f"（{item['style']}）" if item.get("style") else "")):
                     st.code(item['content'], language="markdown")
                     if st.button("删除", key=f"del_{i}"):
                         delete_history_item(i)
@@ -0,0 +1,81 @@
+"""
+比较 Chroma 与 NumPy 内存映射后端的入库速度和检索延迟。
+
+用法:
+    python benchmarks/bench_backends.py --sizes 10000 100000 1000000 --dim 384
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_backends import create_backend
+
+
+def random_vectors(n, dim, seed):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def bench_backend(backend_name, size, dim, num_queries, batch_size):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        backend = create_backend(backend_name, tmp_dir)
+        vectors = random_vectors(size, dim, seed=0)
+
+        start = time.perf_counter()
+        for i in range(0, size, batch_size):
+            j = min(i + batch_size, size)
+            ids = [f"id-{n}" for n in range(i, j)]
+            texts = [f"片段 {n}" for n in range(i, j)]
+            metadatas = [{"source": "bench.txt"} for _ in range(i, j)]
+            backend.add("bench_kb", ids, vectors[i:j], texts, metadatas)
+        ingest_seconds = time.perf_counter() - start
+
+        # 重新打开，模拟应用冷启动
+        del backend
+        start = time.perf_counter()
+        backend = create_backend(backend_name, tmp_dir)
+        backend.count("bench_kb")
+        open_seconds = time.perf_counter() - start
+
+        queries = random_vectors(num_queries, dim, seed=1)
+        latencies = []
+        for q in queries:
+            start = time.perf_counter()
+            backend.search("bench_kb", q, 15)
+            latencies.append(time.perf_counter() - start)
+        latencies = np.asarray(latencies) * 1000
+
+        return {
+            "backend": backend_name,
+            "size": size,
+            "ingest_vectors_per_sec": size / ingest_seconds,
+            "open_ms": open_seconds * 1000,
+            "query_p50_ms": float(np.percentile(latencies, 50)),
+            "query_p95_ms": float(np.percentile(latencies, 95)),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量后端基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--backends", nargs="+", default=["numpy", "chroma"])
+    args = parser.parse_args()
+
+    print(f"{'后端':<8}{'向量数':>10}{'入库(条/秒)':>14}{'打开(ms)':>10}{'P50(ms)':>10}{'P95(ms)':>10}")
+    for size in args.sizes:
+        for name in args.backends:
+            r = bench_backend(name, size, args.dim, args.queries, args.batch_size)
+            print(f"{r['backend']:<8}{r['size']:>10}{r['ingest_vectors_per_sec']:>14.0f}{r['open_ms']:>10.1f}{r['query_p50_ms']:>10.2f}{r['query_p95_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
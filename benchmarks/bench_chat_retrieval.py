@@ -0,0 +1,207 @@
+"""
+自由对话检索测试：模拟多轮对话（先问某个角色，再用不带名字的短句追问，中间有重问），
+对比原来的做法（每轮只用本轮问题实时检索）与结合上下文的查询 + 会话工作集。
+
+  - 每轮检索延迟 p50 / p95（--embed-delay 模拟 API Embedding 的往返延迟）
+  - 复用工作集的轮次，以及复用时的结果与同一查询实时检索的重合度
+  - 工作集大小不超过上限
+  - 新片段加入工作集时取入库时的向量，对话过程中不再调用 embed_documents
+  - 并发：检索与组装提示词（摘要更新，用桩函数模拟模型延迟）并发时本轮的准备耗时，对照先检索再组装
+
+语料由 synthetic_corpus.py 生成，分成两个知识库。HashEmbedder 只看字面重叠，
+测不出结合上下文的查询在语义上是否更准，这里只测延迟与复用的一致性。
+
+用法:
+    python benchmarks/bench_chat_retrieval.py --backend numpy --chars 400000
+    python benchmarks/bench_chat_retrieval.py --backend chroma --embed-delay 0.05
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from chat_retrieval import CHAT_RETRIEVAL_K, ChatWorkingSet, build_chat_query
+from conversation_memory import ConversationMemory
+from fake_embedder import HashEmbedder
+from rag_engine import RAGEngine
+from synthetic_corpus import generate_corpus
+
+# 短片段让事实句在片段中占主要部分，HashEmbedder 的命中率才有区分度
+CHUNKING = {"chunk_size": 200, "chunk_overlap": 20}
+# 复用时允许与实时检索的结果有出入（近似重问），HashEmbedder 的分数很接近，差别会被放大
+MIN_REUSE_OVERLAP = 0.75
+# 后几轮是不带角色名的追问，其中有原样重问和只改了标点的重问
+TURNS = [
+    "{name}的外貌是什么样的？",
+    "他的口头禅呢？",
+    "能再详细说说吗？",
+    "{name}的外貌是什么样的？",
+    "他有过什么经历？",
+    "他的人际关系如何？",
+    "{name}的外貌是什么样的",
+]
+
+
+class DelayedEmbedder(HashEmbedder):
+    """每次调用额外等待 delay 秒，模拟 API Embedding；documents 为 embed_documents 计算过的片段数"""
+
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.documents = 0
+
+    def embed_documents(self, texts):
+        self.documents += len(texts)
+        time.sleep(self.delay)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        time.sleep(self.delay)
+        return super().embed_query(text)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else float("nan")
+
+
+def conversations(facts):
+    """每个角色一段对话：[用户问题]"""
+    names = list(dict.fromkeys(fact["character"] for fact in facts))
+    return [[template.format(name=name) for template in TURNS] for name in names]
+
+
+def run_baseline(engine, dialogs, k, collections):
+    latencies = []
+    for dialog in dialogs:
+        for question in dialog:
+            start = time.perf_counter()
+            engine.query(question, k=k, collection_names=collections)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_working_set(engine, dialogs, k, collections):
+    latencies, overlaps, sizes = {True: [], False: []}, [], []
+    working_set = ChatWorkingSet()
+    for dialog in dialogs:
+        # 每段对话是一个新会话
+        working_set.reset()
+        history = []
+        for question in dialog:
+            history.append({"role": "user", "content": question})
+            query = build_chat_query(history)
+            start = time.perf_counter()
+            docs, info = working_set.retrieve(engine, query, k, collections)
+            latencies[info["reused"]].append(time.perf_counter() - start)
+            if info["reused"]:
+                fresh = {d.page_content for d in engine.query(query, k=k, collection_names=collections)}
+                overlaps.append(len(fresh & {d.page_content for d in docs}) / k)
+            # 用户阅读回复、输入下一个问题期间新片段加入工作集
+            working_set.wait()
+            sizes.append(len(working_set))
+            history.append({"role": "assistant", "content": "好的。"})
+    return latencies, overlaps, max(sizes), working_set.max_size
+
+
+def check_overlap_with_assembly(engine, collections, summary_delay):
+    """先检索再组装 vs 检索与组装并发，返回两种方式的平均准备耗时（秒）"""
+    def summarizer(previous, messages):
+        time.sleep(summary_delay)
+        return (previous + " " + messages[-1]["content"]).strip()[-200:]
+
+    history = []
+    for i in range(12):
+        history.append({"role": "user", "content": f"第{i}个问题，" + "青云山" * 40})
+        history.append({"role": "assistant", "content": "回答" * 80})
+    history.append({"role": "user", "content": "他后来呢？"})
+
+    # 与界面相同：按各知识库的片段长度为本轮片段预留 Token
+    reserve = CHAT_RETRIEVAL_K * max(engine.get_chunking(c)["chunk_size"] for c in collections)
+    results = {}
+    for mode in ["sequential", "concurrent"]:
+        total = 0.0
+        for _ in range(5):
+            memory = ConversationMemory(max_history_tokens=800, summarizer=summarizer, min_summary_messages=1)
+            working_set = ChatWorkingSet()
+            start = time.perf_counter()
+            if mode == "sequential":
+                docs, _ = working_set.retrieve(engine, build_chat_query(history), CHAT_RETRIEVAL_K, collections)
+            else:
+                future = working_set.submit(engine, build_chat_query(history), CHAT_RETRIEVAL_K, collections)
+                memory.prepare(history, reserve_tokens=reserve)
+                docs, _ = future.result()
+            memory.build_messages(history[:-1] + [dict(history[-1], context=[d.page_content for d in docs])])
+            total += time.perf_counter() - start
+        results[mode] = total / 5
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="自由对话检索：结合上下文的查询与会话工作集")
+    parser.add_argument("--backend", default="numpy", choices=["numpy", "chroma"])
+    parser.add_argument("--chars", type=int, default=400000, help="合成语料的总字数")
+    parser.add_argument("--k", type=int, default=CHAT_RETRIEVAL_K)
+    parser.add_argument("--embed-delay", type=float, default=0.0, help="模拟 API Embedding 每次调用的延迟（秒）")
+    parser.add_argument("--summary-delay", type=float, default=0.3, help="模拟更新对话摘要的模型调用延迟（秒）")
+    args = parser.parse_args()
+
+    failures = []
+    tmp = tempfile.mkdtemp(prefix="rag_chat_")
+    try:
+        embedder = DelayedEmbedder(args.embed_delay)
+        engine = RAGEngine(persist_directory=tmp, model_name="hash", backend=args.backend, embeddings=embedder)
+        chapters, facts = generate_corpus(total_chars=args.chars, seed=49)
+        half = len(chapters) // 2
+        collections = ["novel_a", "novel_b"]
+        for name, part in zip(collections, [chapters[:half], chapters[half:]]):
+            docs = engine._splitter(CHUNKING).create_documents(part, metadatas=[{"source": f"{name}.txt"} for _ in part])
+            msg = engine.build_vector_store(docs, collection_name=name, chunking=CHUNKING)
+            if not msg.startswith("成功"):
+                raise RuntimeError(msg)
+        dialogs = conversations(facts)
+        turns = sum(len(d) for d in dialogs)
+
+        base_lat = run_baseline(engine, dialogs, args.k, collections)
+        ingested = embedder.documents
+        ws_lat, overlaps, max_size, limit = run_working_set(engine, dialogs, args.k, collections)
+        reembedded = embedder.documents - ingested
+        reused = len(overlaps)
+
+        print(f"{args.backend} 后端，{args.chars} 字语料分为 {len(collections)} 个知识库，"
+              f"{len(dialogs)} 段对话共 {turns} 轮，k={args.k}，Embedding 延迟 {args.embed_delay * 1000:.0f} ms")
+        print(f"原做法（每轮只用本轮问题实时检索）: p50 {percentile(base_lat, 0.5):.2f} ms / p95 {percentile(base_lat, 0.95):.2f} ms")
+        print(f"结合上下文 + 工作集: 实时检索的轮次 p50 {percentile(ws_lat[False], 0.5):.2f} ms / p95 {percentile(ws_lat[False], 0.95):.2f} ms，"
+              f"复用的轮次 p50 {percentile(ws_lat[True], 0.5):.2f} ms；{reused}/{turns} 轮复用工作集"
+              + (f"（与实时检索结果重合 {sum(overlaps) / len(overlaps):.0%}）" if overlaps else "")
+              + f"，工作集最多 {max_size} 个片段，重新 Embedding {reembedded} 个片段")
+        if not reused:
+            failures.append("重问时没有复用工作集")
+        elif sum(overlaps) / len(overlaps) < MIN_REUSE_OVERLAP:
+            failures.append(f"复用工作集的结果与实时检索差别太大: 重合 {sum(overlaps) / len(overlaps):.0%}")
+        if reembedded:
+            failures.append(f"工作集对入库时已算过向量的 {reembedded} 个片段重新调用了 Embedding")
+        if max_size > limit:
+            failures.append(f"工作集超过上限: {max_size} > {limit}")
+
+        overlap = check_overlap_with_assembly(engine, collections, args.summary_delay)
+        print(f"本轮准备耗时（检索 + 组装提示词，摘要更新 {args.summary_delay * 1000:.0f} ms）: "
+              f"先检索再组装 {overlap['sequential'] * 1000:.1f} ms，并发 {overlap['concurrent'] * 1000:.1f} ms")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+后台删除与磁盘空间回收测试：
+  - 删除大知识库：delete_collection 调用本身的耗时（应立即返回）与后台删除完成的耗时，
+    对照直接在后端上同步删除同样大小的知识库
+  - 删除后知识库立即从列表中消失；后台删除期间其他知识库照常检索；同名知识库可以立即重建
+  - 回收磁盘空间：报告释放的字节数，回收后剩余知识库的片段数和检索结果不变
+  - 待删除记录在进程退出后保留：子进程中重新打开引擎会继续删除
+
+用法:
+    python benchmarks/bench_compaction.py --backend chroma --chunks 20000
+    python benchmarks/bench_compaction.py --backend numpy --chunks 50000
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_embedder import HashEmbedder
+from kb_maintenance import dir_size
+from rag_engine import RAGEngine
+
+POOL = "天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏闰余成岁律吕调阳云腾致雨露结为霜金生丽水玉出昆冈剑号巨阙珠称夜光"
+
+
+def make_engine(tmp, backend):
+    return RAGEngine(persist_directory=tmp, model_name="hash", backend=backend, embeddings=HashEmbedder())
+
+
+def build(engine, collection, count, seed):
+    rng = random.Random(seed)
+    texts = [f"{collection}-{i} " + "".join(rng.choice(POOL) for _ in range(300)) for i in range(count)]
+    docs = engine.text_splitter.create_documents(texts, metadatas=[{"source": f"{collection}.txt"} for _ in texts])
+    msg = engine.build_vector_store(docs, collection_name=collection)
+    if not msg.startswith("成功"):
+        raise RuntimeError(msg)
+    return texts
+
+
+def snapshot(engine, collection, queries):
+    return [[d.page_content for d in engine.query(q, k=5, collection_names=[collection])] for q in queries]
+
+
+def _resume_deletes(tmp, backend):
+    engine = make_engine(tmp, backend)
+    for name in list(engine.maintenance.pending()):
+        engine.maintenance.wait(name)
+    sys.exit(1 if engine.get_pending_deletes() else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="后台删除知识库与磁盘空间回收")
+    parser.add_argument("--backend", default="chroma", choices=["numpy", "chroma"])
+    parser.add_argument("--chunks", type=int, default=20000, help="被删除的大知识库的片段数")
+    args = parser.parse_args()
+
+    failures = []
+    tmp = tempfile.mkdtemp(prefix="rag_compact_")
+    try:
+        engine = make_engine(tmp, args.backend)
+        keep_texts = build(engine, "kb_keep", 2000, 0)
+        build(engine, "kb_big", args.chunks, 1)
+        build(engine, "kb_sync", args.chunks, 2)
+        queries = random.Random(3).sample(keep_texts, 20)
+        keep_before = snapshot(engine, "kb_keep", queries)
+        size_full = dir_size(tmp)
+
+        # 对照：原先的做法，在后端上同步删除（含释放引用）
+        start = time.perf_counter()
+        engine.writer.call(engine.backend.delete_collection, "kb_sync")
+        engine.chunk_store.release_collection("kb_sync")
+        engine.chunk_store.purge_orphans()
+        engine.stats.remove("kb_sync")
+        sync_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        success, msg = engine.delete_collection("kb_big")
+        call_s = time.perf_counter() - start
+        if not success:
+            failures.append(msg)
+        if "kb_big" in engine.get_available_collections():
+            failures.append("删除后知识库仍在列表中")
+        # 后台删除期间检索其他知识库
+        start = time.perf_counter()
+        if snapshot(engine, "kb_keep", queries[:5]) != keep_before[:5]:
+            failures.append("后台删除期间其他知识库的检索结果变化")
+        query_during_s = time.perf_counter() - start
+        engine.maintenance.wait("kb_big")
+        done_s = time.perf_counter() - start + call_s
+        if engine.get_pending_deletes():
+            failures.append(f"后台删除没有完成: {engine.get_pending_deletes()}")
+
+        print(f"{args.backend} 后端，删除 {args.chunks} 个片段的知识库")
+        print(f"同步删除（原做法）: {sync_s * 1000:.1f} ms")
+        print(f"delete_collection 返回: {call_s * 1000:.1f} ms，后台删除完成: {done_s * 1000:.1f} ms，"
+              f"期间 5 次检索 {query_during_s * 1000:.1f} ms")
+
+        # 同名重建
+        build(engine, "kb_big", 500, 4)
+        if engine.backend.count("kb_big") != 500 or engine.stats.get("kb_big")["count"] != 500:
+            failures.append(f"同名重建后片段数不对: {engine.backend.count('kb_big')}")
+        engine.delete_collection("kb_big", wait=True)
+
+        size_deleted = dir_size(tmp)
+        engine.start_compaction()
+        while engine.get_compaction_status()[0] == "running":
+            time.sleep(0.05)
+        status, report = engine.get_compaction_status()
+        if status != "done":
+            failures.append(f"回收失败: {report}")
+        else:
+            print(f"目录大小: 建库后 {size_full / 1e6:.1f} MB，删除后 {size_deleted / 1e6:.1f} MB，"
+                  f"回收后 {report['after'] / 1e6:.1f} MB（释放 {report['freed'] / 1e6:.1f} MB，{report['seconds']:.2f} 秒，"
+                  f"删除 {len(report['removed'])} 项，{len(report['errors'])} 项失败）")
+            if report["freed"] <= 0:
+                failures.append("回收没有释放空间")
+        if engine.backend.count("kb_keep") != len(keep_texts) or snapshot(engine, "kb_keep", queries) != keep_before:
+            failures.append("回收后剩余知识库的片段数或检索结果变化")
+        build(engine, "kb_after", 500, 5)
+        if engine.backend.count("kb_after") != 500:
+            failures.append("回收后无法继续入库")
+
+        # 进程退出前没删完：记录待删除但不安排删除，由子进程继续
+        engine.maintenance.mark_deleting("kb_after")
+        proc = multiprocessing.get_context("spawn").Process(target=_resume_deletes, args=(tmp, args.backend))
+        proc.start()
+        proc.join()
+        engine.maintenance.finish_delete("kb_after")
+        if proc.exitcode != 0:
+            failures.append("重新打开引擎后没有继续删除")
+        elif "kb_after" in engine.backend.list_collections():
+            failures.append("子进程报告删除完成，但知识库仍然存在")
+        else:
+            print("重新打开引擎后继续删除: 完成")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+正文提取测试：用保存的 HTML 样例（benchmarks/fixtures/html，由 make_html_fixtures.py 生成），
+对比整页文字（原先 BeautifulSoup get_text 的做法）与 ContentExtractor 提取的正文：
+  - 切分后的片段数（即 Embedding 调用量）减少了多少
+  - 每页提取耗时（lxml 与标准库 html.parser 两种解析器）
+  - 正文首尾句是否保留、导航 / 广告 / 评论 / 模板文字是否去掉
+
+同一站点的前几页还在学习模板（LEARN_AFTER），逐行重复的模板文字从学会之后才会去掉，
+所以“应当去掉”的检查只针对学习完成后的页面，前几页的残留单独报告。
+整页文字的基准需要 beautifulsoup4。
+
+用法:
+    python benchmarks/bench_content_extraction.py --repeat 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from content_extractor import LEARN_AFTER, ContentExtractor, _get_lxml
+from rag_engine import make_text_splitter
+
+FIXTURE_DIR = os.path.join(BENCH_DIR, "fixtures", "html")
+
+
+def load_fixtures():
+    with open(os.path.join(FIXTURE_DIR, "expected.json"), encoding="utf-8") as f:
+        expected = json.load(f)
+    sites = {}
+    for name in sorted(expected, key=lambda n: (n.split("/")[0], int(n.split("/")[1].split(".")[0]))):
+        with open(os.path.join(FIXTURE_DIR, name), encoding="utf-8") as f:
+            sites.setdefault(name.split("/")[0], []).append((name, f.read(), expected[name]))
+    return sites
+
+
+def full_page_text(html):
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html, "html.parser").get_text()
+
+
+def run_site(site, pages, backend, repeat):
+    """返回 (正文列表, 每页平均毫秒, 方法计数, 失败列表, 学习期残留数)"""
+    url = "http://{}.example/{}"
+    texts, methods, failures, leaked = [], {}, [], 0
+    extractor = ContentExtractor(backend=backend)
+    start = time.perf_counter()
+    for i, (name, html, expected) in enumerate(pages):
+        page = extractor.extract(html, url=url.format(site, name))
+        texts.append(page.text)
+        methods[page.method] = methods.get(page.method, 0) + 1
+        missing = [s for s in expected["keep"] if s not in page.text]
+        if missing:
+            failures.append(f"{name} 缺少正文: {missing[0]}")
+        present = [s for s in expected["drop"] if s in page.text]
+        if present and i >= LEARN_AFTER - 1:
+            failures.append(f"{name} 没有去掉: {present[0]}")
+        elif present:
+            leaked += len(present)
+    elapsed = time.perf_counter() - start
+
+    # 计时：已学会模板之后的稳定状态，每页重复 repeat 次
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for name, html, _expected in pages:
+            extractor.extract(html, url=url.format(site, name))
+    steady = (time.perf_counter() - start) / (repeat * len(pages)) * 1000 if repeat else elapsed / len(pages) * 1000
+    return texts, steady, methods, failures, leaked
+
+
+def main():
+    parser = argparse.ArgumentParser(description="正文提取：片段数减少比例与每页耗时")
+    parser.add_argument("--repeat", type=int, default=20, help="计时时每个页面重复提取的次数")
+    args = parser.parse_args()
+
+    sites = load_fixtures()
+    splitter = make_text_splitter()
+    backends = ["lxml", "html.parser"] if _get_lxml() else ["html.parser"]
+    if len(backends) == 1:
+        print("未安装 lxml，只测试标准库解析器")
+
+    full_page_text("<p>预热</p>")  # 首次导入 bs4 的耗时不计入
+    width = 18
+    header = ["站点", "页数", "整页片段", "正文片段", "减少", "整页 ms/页"] + [f"{b} ms/页" for b in backends] + ["方法"]
+    print("".join(h.ljust(width) for h in header))
+    failures = []
+    totals = {"full": 0, "content": 0}
+    for site, pages in sites.items():
+        start = time.perf_counter()
+        full_texts = [full_page_text(html) for _name, html, _e in pages]
+        full_ms = (time.perf_counter() - start) / len(pages) * 1000
+        full_chunks = sum(len(splitter.split_text(t)) for t in full_texts)
+
+        timings, reference = [], None
+        for backend in backends:
+            texts, ms, methods, site_failures, leaked = run_site(site, pages, backend, args.repeat)
+            timings.append(f"{ms:.2f}")
+            failures.extend(f"[{backend}] {f}" for f in site_failures)
+            if reference is None:
+                reference = (texts, methods, leaked)
+            elif texts != reference[0]:
+                failures.append(f"{site}: {backend} 与 {backends[0]} 提取结果不一致")
+        texts, methods, leaked = reference
+        content_chunks = sum(len(splitter.split_text(t)) for t in texts)
+        totals["full"] += full_chunks
+        totals["content"] += content_chunks
+        reduction = 1 - content_chunks / full_chunks if full_chunks else 0
+        method_text = ",".join(f"{m}:{n}" for m, n in sorted(methods.items()))
+        if leaked:
+            method_text += f" 学习期残留{leaked}"
+        row = [site, len(pages), full_chunks, content_chunks, f"{reduction:.0%}", f"{full_ms:.2f}"] + timings + [method_text]
+        print("".join(str(c).ljust(width) for c in row))
+
+    reduction = 1 - totals["content"] / totals["full"] if totals["full"] else 0
+    print(f"合计: 整页 {totals['full']} 个片段 -> 正文 {totals['content']} 个片段，减少 {reduction:.0%}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+抓取队列测试：在本地启动一个模拟小说站点，检查目录分页、章节分页的跟随、URL 去重和断点续抓。
+
+站点结构：
+  - 目录分为多页（/book/index.html, /book/index_2.html ...），页底有“上一页 / 下一页 / 首页”，
+    每页顶部重复列出“最新章节”，章节链接带统计参数和 #锚点（规范化后应当去重）
+  - 每章拆成若干页（/book/12.html, /book/12_2.html ...），页内有“下一页”，
+    最后一页的“下一页”指向下一章（不应当被当作本章的分页），另有“上一章 / 下一章 / 返回目录”
+
+测试流程：完整抓取一次作为基准；另用一个空目录抓取，在第 N 个请求时模拟进程中断，
+再用同样的链接重新抓取，检查续抓后得到的文档与基准一致，且中断前抓过的页面没有重新请求。
+
+用法:
+    python benchmarks/bench_crawl_frontier.py --chapters 1000 --interrupt-at 1500
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag_engine import RAGEngine
+from fake_embedder import HashEmbedder
+from synthetic_corpus import generate_corpus
+
+TOC_PAGE_SIZE = 50
+LATEST = 5
+
+
+class SplitSite:
+    def __init__(self, chapters, max_parts, seed=0):
+        rng = random.Random(seed)
+        # 每章拆成 1..max_parts 页
+        self.parts = []
+        for text in chapters:
+            count = rng.randint(1, max_parts)
+            size = len(text) // count + 1
+            self.parts.append([text[i * size:(i + 1) * size] for i in range(count)])
+        self.lock = threading.Lock()
+        self.requests = {}
+
+    @property
+    def total_pages(self):
+        return sum(len(p) for p in self.parts)
+
+    def toc_pages(self):
+        return (len(self.parts) + TOC_PAGE_SIZE - 1) // TOC_PAGE_SIZE
+
+    def _toc_url(self, page):
+        return "/book/index.html" if page == 1 else f"/book/index_{page}.html"
+
+    def _part_url(self, chapter, part):
+        return f"/book/{chapter}.html" if part == 1 else f"/book/{chapter}_{part}.html"
+
+    def toc_html(self, page):
+        total = len(self.parts)
+        latest = "".join(f'<a href="/book/{i}.html">第{i + 1}章 最新</a>' for i in range(max(0, total - LATEST), total))
+        start = (page - 1) * TOC_PAGE_SIZE
+        items = "".join(
+            f'<li><a href="{i}.html?utm_source=toc#top">第{i + 1}章 标题{i + 1}</a></li>'
+            for i in range(start, min(total, start + TOC_PAGE_SIZE))
+        )
+        nav = '<a href="/">首页</a>'
+        if page > 1:
+            nav += f'<a href="{self._toc_url(page - 1)}">上一页</a>'
+        if page < self.toc_pages():
+            nav += f'<a href="{self._toc_url(page + 1)}">下一页 &gt;</a>'
+        return f"<html><head><title>目录 {page}</title></head><body><div>最新章节{latest}</div><ul>{items}</ul>{nav}</body></html>"
+
+    def part_html(self, chapter, part):
+        parts = self.parts[chapter]
+        nav = '<a href="/book/index.html">返回目录</a>'
+        if chapter > 0:
+            nav += f'<a href="/book/{chapter - 1}.html">上一章</a>'
+        if part < len(parts):
+            nav += f'<a href="{self._part_url(chapter, part + 1)}">下一页</a>'
+        elif chapter + 1 < len(self.parts):
+            # 很多站点在章节最后一页用“下一页”指向下一章
+            nav += f'<a href="/book/{chapter + 1}.html">下一页</a>'
+        if chapter + 1 < len(self.parts):
+            nav += f'<a href="/book/{chapter + 1}.html">下一章</a>'
+        body = "".join(f"<p>{p}</p>" for p in parts[part - 1].split("\n\n") if p)
+        return f"<html><head><title>第{chapter + 1}章 ({part})</title></head><body>{body}{nav}</body></html>"
+
+    def route(self, path):
+        path = path.split("?", 1)[0]
+        if path == "/book/index.html":
+            return self.toc_html(1)
+        name = path.rsplit("/", 1)[-1]
+        if name.startswith("index_"):
+            page = int(name[len("index_"):-len(".html")])
+            return self.toc_html(page) if page <= self.toc_pages() else None
+        if path.startswith("/book/") and name.endswith(".html"):
+            stem = name[:-len(".html")]
+            chapter, _, part = stem.partition("_")
+            chapter, part = int(chapter), int(part or 1)
+            if chapter < len(self.parts) and part <= len(self.parts[chapter]):
+                return self.part_html(chapter, part)
+        return None
+
+
+def start_site(site):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # 头部和正文分两次写出，不关 Nagle 的话每个请求都会多等一个延迟 ACK（约 40ms）
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            html = site.route(self.path)
+            with site.lock:
+                site.requests[self.path] = site.requests.get(self.path, 0) + 1
+            body = html.encode("utf-8") if html else b"not found"
+            self.send_response(200 if html else 404)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/book/index.html"
+
+
+class SimulatedCrash(BaseException):
+    """不是 Exception 的子类，像 KeyboardInterrupt 一样穿过所有 except Exception"""
+
+
+def make_engine(path):
+    return RAGEngine(persist_directory=path, model_name="hash", backend="numpy", embeddings=HashEmbedder())
+
+
+def run_crawl(engine, url):
+    start = time.perf_counter()
+    docs = engine.load_urls([url], fetch_links=True)
+    if isinstance(docs, str):
+        raise RuntimeError(docs)
+    return docs, time.perf_counter() - start
+
+
+def _page_position(url):
+    chapter, _, part = url.rsplit("/", 1)[-1][:-len(".html")].partition("_")
+    return int(chapter), int(part or 1)
+
+
+def page_texts(docs):
+    # 逐个比较 (来源页面, 正文)，顺序也必须一致
+    return [(d.metadata["source"], d.page_content) for d in docs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="抓取队列：目录分页、章节分页与断点续抓")
+    parser.add_argument("--chapters", type=int, default=1000)
+    parser.add_argument("--chapter-chars", type=int, default=3000)
+    parser.add_argument("--max-parts", type=int, default=5)
+    parser.add_argument("--interrupt-at", type=int, default=1500, help="第 N 个请求时模拟进程中断")
+    args = parser.parse_args()
+
+    chapters, _ = generate_corpus(total_chars=args.chapters * args.chapter_chars, chapter_chars=args.chapter_chars, seed=5)
+    site = SplitSite(chapters, args.max_parts)
+    server, url = start_site(site)
+    expected_pages = site.total_pages + site.toc_pages()
+    print(f"模拟站点: {len(chapters)} 章，拆成 {site.total_pages} 个章节页，{site.toc_pages()} 个目录页")
+
+    failures = []
+    dirs = [tempfile.mkdtemp(prefix="rag_crawl_ref_"), tempfile.mkdtemp(prefix="rag_crawl_resume_")]
+    try:
+        reference = make_engine(dirs[0])
+        ref_docs, ref_seconds = run_crawl(reference, url)
+        ref_stats = dict(reference.last_crawl)
+        ref_requests = sum(site.requests.values())
+        sources = {d.metadata["source"] for d in ref_docs}
+        print(f"完整抓取: {ref_stats['pages']} 个页面，{len(ref_docs)} 个片段，{ref_seconds:.1f} 秒")
+        if ref_stats["pages"] != expected_pages:
+            failures.append(f"抓取了 {ref_stats['pages']} 个页面，站点共有 {expected_pages} 个")
+        if len(sources) != site.total_pages:
+            failures.append(f"正文来自 {len(sources)} 个页面，预期 {site.total_pages} 个章节页")
+        order = [_page_position(d.metadata["source"]) for d in ref_docs]
+        if order != sorted(order):
+            failures.append("文档没有按章节和分页顺序排列")
+        duplicated = [p for p, n in site.requests.items() if n > 1]
+        if duplicated:
+            failures.append(f"{len(duplicated)} 个页面被重复请求，例如 {duplicated[0]}")
+
+        # 断点续抓：第 N 个请求时中断
+        site.requests.clear()
+        engine = make_engine(dirs[1])
+        real_fetch = engine.http_cache.fetch
+        calls = [0]
+
+        def crashing_fetch(page_url, **kwargs):
+            calls[0] += 1
+            if calls[0] == args.interrupt_at:
+                raise SimulatedCrash()
+            return real_fetch(page_url, **kwargs)
+
+        engine.http_cache.fetch = crashing_fetch
+        try:
+            run_crawl(engine, url)
+            failures.append("模拟中断没有生效（--interrupt-at 大于页面总数？）")
+        except SimulatedCrash:
+            print(f"第 {args.interrupt_at} 个请求时中断")
+        before_crash = sum(site.requests.values())
+
+        engine = make_engine(dirs[1])
+        resumed_docs, resumed_seconds = run_crawl(engine, url)
+        stats = engine.last_crawl
+        after_crash = sum(site.requests.values()) - before_crash
+        print(f"续抓: 复用 {stats['resumed']} 个已完成页面，新请求 {after_crash} 个，{resumed_seconds:.1f} 秒")
+        print(f"两次合计请求 {before_crash + after_crash} 个，完整抓取为 {ref_requests} 个")
+
+        if page_texts(resumed_docs) != page_texts(ref_docs):
+            failures.append("续抓得到的文档与完整抓取不一致")
+        if before_crash + after_crash > ref_requests:
+            failures.append("续抓重新请求了中断前已完成的页面")
+
+        # 抓取完成后再抓一次应当从头开始（由 HTTP 缓存负责复用）
+        site.requests.clear()
+        again, _ = run_crawl(engine, url)
+        if engine.last_crawl["resumed"] or len(again) != len(ref_docs):
+            failures.append("抓取完成后再次抓取没有从头开始")
+    finally:
+        server.shutdown()
+        for d in dirs:
+            shutil.rmtree(d, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+角色档案测试：在合成语料上建库并预生成角色档案，检查：
+  - 自动识别出的主要角色与语料中埋入的角色一致
+  - 读取档案得到的片段与实时多路检索完全相同（多个检索片段数 k，含多知识库混合检索）
+  - 读取档案与实时检索的耗时
+  - 知识库追加内容后档案失效、退回实时检索，结果仍与实时检索相同；未建档的角色同样实时检索
+
+用法:
+    python benchmarks/bench_dossier.py --chars 400000 --backend numpy
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from character_dossier import CHARACTER_ASPECTS
+from fake_embedder import HashEmbedder
+from rag_engine import RAGEngine
+from synthetic_corpus import generate_corpus
+
+K_VALUES = [5, 15, 40]
+
+
+def live_retrieval(engine, name, k, collections, extra_req=None):
+    """原先 app 中的做法：每个角度调用一次 query，按内容去重后取前 k 个"""
+    queries = [template.format(name=name) for _, template in CHARACTER_ASPECTS]
+    if extra_req:
+        queries.append(f"{name} {extra_req}")
+    docs, seen = [], set()
+    for query in queries:
+        for doc in engine.query(query, k=k, collection_names=collections):
+            if doc.page_content not in seen:
+                seen.add(doc.page_content)
+                docs.append(doc)
+    return docs[:k]
+
+
+def same(a, b):
+    return [(d.page_content, d.metadata) for d in a] == [(d.page_content, d.metadata) for d in b]
+
+
+def split(engine, chapters, source):
+    return engine.text_splitter.create_documents(chapters, metadatas=[{"source": source} for _ in chapters])
+
+
+def timed_ms(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="角色档案：识别主要角色、与实时检索一致、读取耗时与失效")
+    parser.add_argument("--chars", type=int, default=400000, help="合成语料字数")
+    parser.add_argument("--backend", default="numpy", choices=["numpy", "chroma"])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    failures = []
+    tmp = tempfile.mkdtemp(prefix="rag_dossier_")
+    try:
+        engine = RAGEngine(persist_directory=tmp, model_name="hash", backend=args.backend, embeddings=HashEmbedder())
+        chapters, facts = generate_corpus(total_chars=args.chars, seed=21)
+        other_chapters, _ = generate_corpus(total_chars=args.chars // 4, seed=22)
+        engine.build_vector_store(split(engine, chapters, "novel.txt"), collection_name="novel")
+        engine.build_vector_store(split(engine, other_chapters, "side.txt"), collection_name="side")
+        expected = sorted({f["character"] for f in facts})
+
+        start = time.perf_counter()
+        success, msg = engine.build_dossiers("novel")
+        print(f"{msg}（{time.perf_counter() - start:.2f} 秒）")
+        if not success:
+            failures.append(msg)
+        found = sorted(name for name, _, _ in engine.get_dossier_status("novel"))
+        if found != expected:
+            failures.append(f"识别出的角色 {found} 与语料中的角色 {expected} 不一致")
+
+        width = 16
+        print("".join(h.ljust(width) for h in ["知识库", "k", "档案 ms", "实时 ms", "一致"]))
+        for collections in (["novel"], ["novel", "side"]):
+            for k in K_VALUES:
+                matched = 0
+                for name in expected:
+                    docs, info = engine.retrieve_character(name, k=k, collection_names=collections)
+                    if info["dossier"] != ["novel"]:
+                        failures.append(f"{name} k={k} {collections}: 没有使用档案 {info}")
+                    matched += same(docs, live_retrieval(engine, name, k, collections))
+                if matched != len(expected):
+                    failures.append(f"{collections} k={k}: {len(expected) - matched} 个角色的档案结果与实时检索不同")
+                name = expected[0]
+                dossier_ms = timed_ms(lambda: engine.retrieve_character(name, k=k, collection_names=collections), args.repeat)
+                live_ms = timed_ms(lambda: live_retrieval(engine, name, k, collections), args.repeat)
+                print("".join(str(c).ljust(width) for c in ["+".join(collections), k, f"{dossier_ms:.2f}", f"{live_ms:.2f}", f"{matched}/{len(expected)}"]))
+
+        docs, info = engine.retrieve_character(expected[0], k=15, collection_names=["novel"], extra_req="战斗经历")
+        if not same(docs, live_retrieval(engine, expected[0], 15, ["novel"], extra_req="战斗经历")):
+            failures.append("带额外要求时档案结果与实时检索不同")
+
+        docs, info = engine.retrieve_character("不存在的人", k=15, collection_names=["novel"])
+        if info["dossier"] or not same(docs, live_retrieval(engine, "不存在的人", 15, ["novel"])):
+            failures.append(f"未建档角色没有退回实时检索: {info}")
+
+        # 追加内容后档案失效
+        more, _ = generate_corpus(total_chars=args.chars // 4, seed=23)
+        engine.build_vector_store(split(engine, more, "more.txt"), collection_name="novel")
+        stale = [name for name, _, valid in engine.get_dossier_status("novel") if not valid]
+        docs, info = engine.retrieve_character(expected[0], k=15, collection_names=["novel"])
+        if info["dossier"] or len(stale) != len(expected):
+            failures.append(f"追加内容后档案没有失效: {info}")
+        if not same(docs, live_retrieval(engine, expected[0], 15, ["novel"])):
+            failures.append("档案失效后的结果与实时检索不同")
+        print(f"追加内容后 {len(stale)}/{len(expected)} 个档案失效，退回实时检索")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+本地 Embedding 服务吞吐量测试：报告不同工作进程数下的 片段/秒。
+
+用法:
+    python benchmarks/bench_embedding_pool.py --workers 0 1 2 4 --chunks 2000
+    python benchmarks/bench_embedding_pool.py --onnx int8
+默认使用体积很小的 paraphrase-MiniLM-L3-v2，首次运行会下载模型。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("HF_ENDPOINT", "https://hf-mirror.com")
+
+from embedding_pool import LocalEmbeddingPool
+
+SENTENCES = [
+    "他握紧了手中的长剑，目光越过人群，落在远处那座被雾气笼罩的山峰上。",
+    "“你终于来了。”她轻声说道，语气里听不出是欣喜还是责备。",
+    "夜色渐深，客栈里只剩下掌柜拨弄算盘的声音。",
+    "少年低头看着掌心的伤口，血已经止住了，却还隐隐作痛。",
+]
+
+
+def make_chunks(n, seed=0):
+    """长度在 50~800 字之间的随机片段，模拟切分后的小说文本"""
+    rng = random.Random(seed)
+    chunks = []
+    for _ in range(n):
+        target = rng.randint(50, 800)
+        parts = []
+        while sum(len(p) for p in parts) < target:
+            parts.append(rng.choice(SENTENCES))
+        chunks.append("".join(parts)[:target])
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 Embedding 服务吞吐量测试")
+    parser.add_argument("--model", default="sentence-transformers/paraphrase-MiniLM-L3-v2")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4])
+    parser.add_argument("--threads", type=int, default=None, help="每进程线程数，默认按核数平均分配")
+    parser.add_argument("--onnx", choices=["fp32", "int8"], default=None)
+    parser.add_argument("--chunks", type=int, default=2000)
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.chunks)
+    print(f"模型: {args.model}  片段数: {len(chunks)}  CPU 核数: {os.cpu_count()}")
+    print(f"{'进程数':<8}{'线程/进程':>10}{'启动(秒)':>10}{'片段/秒':>10}")
+    for workers in args.workers:
+        start = time.perf_counter()
+        pool = LocalEmbeddingPool(args.model, num_workers=workers, threads_per_worker=args.threads, onnx=args.onnx)
+        startup = time.perf_counter() - start
+
+        pool.embed_documents(chunks[:64])  # 预热
+        start = time.perf_counter()
+        pool.embed_documents(chunks)
+        elapsed = time.perf_counter() - start
+        print(f"{workers:<8}{str(pool.threads_per_worker or '默认'):>10}{startup:>10.1f}{len(chunks) / elapsed:>10.1f}")
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
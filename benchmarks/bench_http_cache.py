@@ -0,0 +1,223 @@
+"""
+网页抓取缓存测试：在本地启动一个模拟连载小说站点，对同一个知识库连续抓取多轮，
+检查条件请求 (304)、页面复用和更新章节的增量入库，并报告每轮的下载字节数、复用页数和耗时。
+
+站点的章节分三种响应方式，覆盖常见服务器行为：
+  - etag：返回 ETag，支持 If-None-Match
+  - last_modified：返回 Last-Modified，支持 If-Modified-Since
+  - plain：不返回校验头，每次都是完整 200（HTML 注释里带访问计数，正文不变）
+
+各轮之间：
+  1. 首次抓取，全部入库
+  2. 站点不变，应当全部复用、不下载正文（plain 章节除外）
+  3. 修改最后几章、新增一章，应当只重新入库这些章节，并删除被修改章节的旧片段
+
+用法:
+    python benchmarks/bench_http_cache.py --chapters 200 --backend chroma
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag_engine import RAGEngine
+from fake_embedder import HashEmbedder
+from synthetic_corpus import generate_corpus
+
+VALIDATOR_MODES = ["etag", "last_modified", "plain"]
+
+
+class NovelSite:
+    """章节内容和版本号；修改章节时版本号加一，ETag / Last-Modified 随之变化"""
+
+    def __init__(self, chapters):
+        self.lock = threading.Lock()
+        self.chapters = list(chapters)
+        self.versions = [1] * len(chapters)
+        self.modified_at = [time.time() - 86400] * len(chapters)
+        self.hits = 0
+        self.responses = {200: 0, 304: 0}
+        self.body_bytes = 0
+
+    def update(self, index, text):
+        with self.lock:
+            self.chapters[index] = text
+            self.versions[index] += 1
+            self.modified_at[index] = time.time()
+
+    def append(self, text):
+        with self.lock:
+            self.chapters.append(text)
+            self.versions.append(1)
+            self.modified_at.append(time.time())
+
+    def reset_counters(self):
+        with self.lock:
+            self.responses = {200: 0, 304: 0}
+            self.body_bytes = 0
+
+    def index_html(self):
+        links = "".join(f'<li><a href="/chapter/{i}">第{i + 1}章 连载</a></li>' for i in range(len(self.chapters)))
+        return f"<html><head><title>目录</title></head><body><ul>{links}</ul></body></html>"
+
+    def chapter_html(self, index):
+        with self.lock:
+            self.hits += 1
+            text = self.chapters[index]
+            hits = self.hits
+        paragraphs = "".join(f"<p>{p}</p>" for p in text.split("\n\n"))
+        # 访问计数只出现在注释里：HTML 每次都不同，但提取出的正文不变
+        return f"<html><head><title>第{index + 1}章</title></head><body><!-- views {hits} -->{paragraphs}</body></html>"
+
+
+def _make_handler(site):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # 头部和正文分两次写出，不关 Nagle 的话每个请求都会多等一个延迟 ACK（约 40ms）
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body=b"", headers=None):
+            self.send_response(status)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            if body:
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.end_headers()
+            if body:
+                self.wfile.write(body)
+            with site.lock:
+                site.responses[status] = site.responses.get(status, 0) + 1
+                site.body_bytes += len(body)
+
+        def do_GET(self):
+            if self.path in ("/", "/index"):
+                return self._send(200, site.index_html().encode("utf-8"))
+            if not self.path.startswith("/chapter/"):
+                return self._send(404)
+            index = int(self.path.rsplit("/", 1)[1])
+            if index >= len(site.chapters):
+                return self._send(404)
+
+            mode = VALIDATOR_MODES[index % len(VALIDATOR_MODES)]
+            headers = {}
+            if mode == "etag":
+                headers["ETag"] = f'"c{index}-v{site.versions[index]}"'
+                if self.headers.get("If-None-Match") == headers["ETag"]:
+                    return self._send(304, headers=headers)
+            elif mode == "last_modified":
+                headers["Last-Modified"] = formatdate(site.modified_at[index], usegmt=True)
+                if self.headers.get("If-Modified-Since") == headers["Last-Modified"]:
+                    return self._send(304, headers=headers)
+            self._send(200, site.chapter_html(index).encode("utf-8"), headers)
+
+    return Handler
+
+
+def start_site(chapters):
+    site = NovelSite(chapters)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(site))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, site, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def crawl(engine, site, url, collection):
+    site.reset_counters()
+    start = time.perf_counter()
+    docs = engine.load_urls([url + "/index"], fetch_links=True, collection_name=collection)
+    if isinstance(docs, str):
+        raise RuntimeError(docs)
+    pages = len({d.metadata["source"] for d in docs})
+    if docs:
+        engine.build_vector_store(docs, collection_name=collection)
+    elapsed = time.perf_counter() - start
+    return dict(engine.last_crawl, ingested_pages=pages, chunks=len(docs), seconds=round(elapsed, 2),
+                server_200=site.responses.get(200, 0), server_304=site.responses.get(304, 0), server_bytes=site.body_bytes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="网页抓取缓存测试")
+    parser.add_argument("--chapters", type=int, default=120)
+    parser.add_argument("--chapter-chars", type=int, default=3000)
+    parser.add_argument("--changed", type=int, default=3, help="第 3 轮修改的章节数（从最后一章往前）")
+    parser.add_argument("--backend", default="chroma")
+    args = parser.parse_args()
+
+    chapters, _ = generate_corpus(total_chars=args.chapters * args.chapter_chars, chapter_chars=args.chapter_chars, seed=3)
+    server, site, url = start_site(chapters)
+    tmp_dir = tempfile.mkdtemp(prefix="rag_http_cache_")
+    collection = "web_novel"
+    failures = []
+    try:
+        engine = RAGEngine(persist_directory=tmp_dir, model_name="hash", backend=args.backend, embeddings=HashEmbedder())
+        rounds = [("首次抓取", crawl(engine, site, url, collection))]
+        count_after_first = engine.backend.count(collection)
+
+        rounds.append(("站点未变", crawl(engine, site, url, collection)))
+
+        changed = list(range(len(chapters) - args.changed, len(chapters)))
+        for i in changed:
+            site.update(i, chapters[i].replace("。", "！", 5) + f"\n\n（作者修订第 {i + 1} 章）")
+        extra, _ = generate_corpus(total_chars=args.chapter_chars, chapter_chars=args.chapter_chars, seed=99)
+        site.append(extra[0])
+        rounds.append((f"改 {args.changed} 章 + 新增 1 章", crawl(engine, site, url, collection)))
+
+        # 重新入库后，各章节的片段应当与只抓取最新版本建出的知识库一致
+        fresh_dir = tempfile.mkdtemp(prefix="rag_http_cache_ref_")
+        try:
+            reference = RAGEngine(persist_directory=fresh_dir, model_name="hash", backend=args.backend, embeddings=HashEmbedder())
+            crawl(reference, site, url, collection)
+            expected_count = reference.backend.count(collection)
+            expected_texts = sorted(t for page in reference.backend.iter_texts(collection) for t in page)
+        finally:
+            shutil.rmtree(fresh_dir, ignore_errors=True)
+        final_count = engine.backend.count(collection)
+        final_texts = sorted(t for page in engine.backend.iter_texts(collection) for t in page)
+        # 回收空间（numpy 后端重写去掉标记删除的行）后内容不变
+        engine.start_compaction().result()
+        compacted_texts = sorted(t for page in engine.backend.iter_texts(collection) for t in page)
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    columns = ["pages", "new", "modified", "not_modified", "reused", "ingested_pages", "chunks",
+               "downloaded_bytes", "server_200", "server_304", "seconds"]
+    print(f"\n{len(site.chapters)} 章，每章约 {args.chapter_chars} 字，后端: {args.backend}")
+    print(f"{'':<16}" + "".join(f"{c:>18}" for c in columns))
+    for name, row in rounds:
+        print(f"{name:<16}" + "".join(f"{row[c]:>18}" for c in columns))
+
+    first, unchanged, updated = (row for _, row in rounds)
+    plain_pages = sum(1 for i in range(len(chapters)) if VALIDATOR_MODES[i % 3] == "plain")
+    if unchanged["reused"] != unchanged["pages"] - unchanged["toc_pages"] or unchanged["chunks"]:
+        failures.append("站点未变时仍有页面被重新入库")
+    if unchanged["server_304"] != len(chapters) - plain_pages:
+        failures.append(f"条件请求未生效: 304 次数 {unchanged['server_304']}，预期 {len(chapters) - plain_pages}")
+    if updated["ingested_pages"] != args.changed + 1:
+        failures.append(f"更新后重新入库 {updated['ingested_pages']} 页，预期 {args.changed + 1}")
+    if final_count != expected_count or final_texts != expected_texts:
+        failures.append(f"更新后片段数 {final_count}，与重新建库的 {expected_count} 不一致（旧片段未删除）")
+    if compacted_texts != final_texts:
+        failures.append(f"回收空间后片段变化: {len(final_texts)} -> {len(compacted_texts)}")
+    saved = 1 - unchanged["downloaded_bytes"] / max(1, first["downloaded_bytes"])
+    print(f"\n第 2 轮下载量减少 {saved:.0%}，首次入库 {count_after_first} 个片段，更新后 {final_count} 个（重新建库为 {expected_count} 个）")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
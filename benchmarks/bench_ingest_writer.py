@@ -0,0 +1,231 @@
+"""
+入库写入服务压力测试：多个生产者同时向同一个向量库目录入库，检索线程同时不断查询。
+
+  - 线程：每个生产者各自创建 RAGEngine（模拟多个会话），按 --page 个片段一次反复调用 build_vector_store
+    （小的值模拟逐章抓取，大的值模拟上传整本 TXT）；
+    多数生产者各写一个知识库，另有两个生产者写同一个知识库（检索线程也在查询这个知识库）。记录总吞吐、写入线程的合并情况（每次写入合并了多少个请求）、
+    入库期间与空闲时的检索延迟
+  - 合并：写入线程忙时提交的请求应合并写入（暂时占住写入锁，让请求排队）
+  - 进程：几个子进程同时向同一目录的不同知识库入库（各自有写入线程，靠文件锁互斥）
+  - 完整性：每个知识库的片段数、片段 id 集合、统计目录、内容寻址存储的引用与预期一致；
+    用新打开的后端实例重新读取，抽样检索每个片段自己的向量能排在第一位
+
+用法:
+    python benchmarks/bench_ingest_writer.py --backend numpy --producers 6 --chunks 3000
+    python benchmarks/bench_ingest_writer.py --backend chroma --producers 4 --chunks 1500
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from chunk_store import chunk_hash
+from fake_embedder import HashEmbedder
+from rag_engine import RAGEngine
+from vector_backends import create_backend
+
+# 建基础知识库时每次 build_vector_store 的片段数
+PAGE_CHUNKS = 60
+POOL = "天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏闰余成岁律吕调阳云腾致雨露结为霜金生丽水玉出昆冈剑号巨阙珠称夜光"
+
+
+def make_texts(tag, count, seed):
+    rng = random.Random(seed)
+    return [f"{tag}-{i} " + "".join(rng.choice(POOL) for _ in range(rng.randint(200, 600))) for i in range(count)]
+
+
+def make_engine(tmp, backend):
+    return RAGEngine(persist_directory=tmp, model_name="hash", backend=backend, embeddings=HashEmbedder())
+
+
+def ingest(engine, collection, texts, source, page_chunks=PAGE_CHUNKS):
+    """每次入库 page_chunks 个片段，返回失败信息列表"""
+    errors = []
+    for i in range(0, len(texts), page_chunks):
+        page = texts[i:i + page_chunks]
+        docs = engine.text_splitter.create_documents(page, metadatas=[{"source": f"{source}_{i // page_chunks}.txt"} for _ in page])
+        msg = engine.build_vector_store(docs, collection_name=collection)
+        if not msg.startswith("成功"):
+            errors.append(msg)
+    return errors
+
+
+def _process_producer(tmp, backend, collection, count, seed):
+    engine = make_engine(tmp, backend)
+    errors = ingest(engine, collection, make_texts(collection, count, seed), collection)
+    if errors:
+        raise RuntimeError(errors[0])
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else float("nan")
+
+
+def reader_loop(engine, collections, stop, latencies, errors):
+    rng = random.Random(1)
+    while not stop.is_set():
+        query = "".join(rng.choice(POOL) for _ in range(30))
+        start = time.perf_counter()
+        try:
+            engine.query_with_scores(query, k=10, collection_names=collections)
+        except Exception as e:
+            errors.append(str(e))
+        latencies.append(time.perf_counter() - start)
+
+
+def check_coalescing(engine, failures, requests=10):
+    """占住写入锁时提交的请求，除了写入线程已取出的第一个，其余应合并为一次写入"""
+    writer = engine.writer
+    embedder = HashEmbedder()
+    texts = make_texts("coalesce", requests, 7)
+    before = dict(writer.stats)
+    with writer.lock:
+        futures = [writer.submit("kb_coalesce", [chunk_hash("hash", t)], [embedder.embed_query(t)], [t], [{"source": "coalesce.txt"}])
+                   for t in texts]
+        time.sleep(0.2)
+    for future in futures:
+        future.result()
+    writes = writer.stats["writes"] - before["writes"]
+    print(f"合并: 写入锁被占用期间的 {requests} 个请求写了 {writes} 次")
+    if writes > 2:
+        failures.append(f"排队的写入请求没有合并: {requests} 个请求写了 {writes} 次")
+    engine.stats.record_batch("kb_coalesce", texts, [{"source": "coalesce.txt"}] * len(texts), "hash")
+    engine.chunk_store.add_refs("kb_coalesce", [chunk_hash("hash", t) for t in texts])
+    return texts
+
+
+def check_integrity(tmp, backend_name, expected, failures):
+    """expected: {知识库: [正文]}"""
+    engine = make_engine(tmp, backend_name)
+    fresh = create_backend(backend_name, tmp)
+    embedder = HashEmbedder()
+    for collection, texts in expected.items():
+        hashes = {chunk_hash("hash", t) for t in texts}
+        ids = set()
+        for batch_ids, _, _, _ in engine.backend.iter_batches(collection):
+            ids.update(batch_ids)
+        if ids != hashes:
+            failures.append(f"{collection}: 片段 id 与预期不符（缺 {len(hashes - ids)} 个，多 {len(ids - hashes)} 个）")
+        if fresh.count(collection) != len(hashes):
+            failures.append(f"{collection}: 重新打开后片段数 {fresh.count(collection)} != {len(hashes)}")
+        entry = engine.stats.get(collection) or {}
+        if entry.get("count") != len(hashes):
+            failures.append(f"{collection}: 统计目录片段数 {entry.get('count')} != {len(hashes)}")
+        refs = len(engine.chunk_store.filter_new(collection, list(hashes)))
+        if refs:
+            failures.append(f"{collection}: {refs} 个片段没有登记引用")
+        sample = random.Random(0).sample(texts, min(20, len(texts)))
+        missed = sum(fresh.search(collection, embedder.embed_query(t), 1)[0][0] != t for t in sample)
+        # Chroma 的 HNSW 是近似检索，允许个别片段没有排在第一位
+        if missed > (0 if backend_name == "numpy" else len(sample) // 10):
+            failures.append(f"{collection}: 抽样 {len(sample)} 个片段中 {missed} 个检索不到自己")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入库写入服务：并发入库的吞吐、检索延迟与数据完整性")
+    parser.add_argument("--backend", default="numpy", choices=["numpy", "chroma"])
+    parser.add_argument("--producers", type=int, default=6, help="线程生产者数（其中两个写同一个知识库）")
+    parser.add_argument("--processes", type=int, default=2, help="同时入库的子进程数")
+    parser.add_argument("--chunks", type=int, default=3000, help="每个生产者的片段数")
+    parser.add_argument("--page", type=int, default=1000, help="生产者每次 build_vector_store 的片段数")
+    parser.add_argument("--readers", type=int, default=2)
+    args = parser.parse_args()
+
+    failures = []
+    tmp = tempfile.mkdtemp(prefix="rag_writer_")
+    try:
+        base_engine = make_engine(tmp, args.backend)
+        base_texts = make_texts("base", args.chunks, 0)
+        shared_texts = make_texts("shared", PAGE_CHUNKS, 0)
+        ingest(base_engine, "kb_base", base_texts, "base")
+        ingest(base_engine, "kb_shared", shared_texts, "shared")
+        # 检索线程同时查询一个不再写入的知识库和一个正在写入的知识库
+        expected = {"kb_base": base_texts, "kb_shared": list(shared_texts)}
+        searched = ["kb_base", "kb_shared"]
+
+        # 空闲时的检索延迟
+        idle = []
+        stop = threading.Event()
+        timer = threading.Timer(2.0, stop.set)
+        timer.start()
+        reader_loop(base_engine, searched, stop, idle, failures)
+
+        jobs = []
+        for p in range(args.producers):
+            collection = "kb_shared" if p >= args.producers - 2 else f"kb_{p}"
+            texts = make_texts(f"p{p}", args.chunks, p + 1)
+            expected.setdefault(collection, []).extend(texts)
+            jobs.append((collection, texts, f"p{p}"))
+
+        writer = base_engine.writer
+        before = dict(writer.stats)
+        stop = threading.Event()
+        busy, read_errors = [], []
+        readers = [threading.Thread(target=reader_loop, args=(make_engine(tmp, args.backend), searched, stop, busy, read_errors))
+                   for _ in range(args.readers)]
+        errors = []
+        producers = [threading.Thread(target=lambda job=job: errors.extend(ingest(make_engine(tmp, args.backend), *job, page_chunks=args.page)))
+                     for job in jobs]
+        start = time.perf_counter()
+        for t in readers + producers:
+            t.start()
+        for t in producers:
+            t.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for t in readers:
+            t.join()
+        failures.extend(errors + read_errors)
+
+        requests = writer.stats["requests"] - before["requests"]
+        writes = writer.stats["writes"] - before["writes"]
+        rows = writer.stats["rows"] - before["rows"]
+        total = args.producers * args.chunks
+        print(f"{args.backend} 后端，{args.producers} 个生产者 × {args.chunks} 个片段（每次入库 {args.page} 个），{args.readers} 个检索线程，{os.cpu_count()} 个 CPU")
+        print(f"线程入库: {total} 个片段 {elapsed:.2f} 秒（{total / elapsed:.0f} 片段/秒），"
+              f"{requests} 个写入请求合并为 {writes} 次写入（平均 {rows / max(writes, 1):.0f} 个片段/次）")
+        print(f"检索延迟: 空闲 p50 {percentile(idle, 0.5):.2f} ms / p95 {percentile(idle, 0.95):.2f} ms，"
+              f"入库期间 p50 {percentile(busy, 0.5):.2f} ms / p95 {percentile(busy, 0.95):.2f} ms（{len(busy)} 次）")
+        expected["kb_coalesce"] = check_coalescing(base_engine, failures)
+
+        if args.processes:
+            ctx = multiprocessing.get_context("spawn")
+            procs = []
+            for p in range(args.processes):
+                collection = f"kb_proc{p}"
+                expected[collection] = make_texts(collection, args.chunks, 100 + p)
+                procs.append(ctx.Process(target=_process_producer, args=(tmp, args.backend, collection, args.chunks, 100 + p)))
+            start = time.perf_counter()
+            for proc in procs:
+                proc.start()
+            for proc in procs:
+                proc.join()
+                if proc.exitcode != 0:
+                    failures.append(f"子进程入库失败（退出码 {proc.exitcode}）")
+            print(f"进程入库: {args.processes} 个进程 × {args.chunks} 个片段 {time.perf_counter() - start:.2f} 秒")
+
+        check_integrity(tmp, args.backend, expected, failures)
+        print(f"完整性: 检查了 {len(expected)} 个知识库")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
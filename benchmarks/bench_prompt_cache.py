@@ -0,0 +1,90 @@
+"""
+对比旧的 Prompt 组装方式与前缀稳定的组装方式在上下文缓存上的命中率。
+模拟一次完整的角色生成流程：生成 → 校验 → 两轮修改，请求发往本地桩服务（openai_stub.py），
+由桩服务按公共前缀计算缓存命中并通过 usage 返回，最终读取 LLMClient 记录的 usage。
+
+用法:
+    python benchmarks/bench_prompt_cache.py --chunks 15 --chunk-chars 800
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_client import get_llm_client
+from prompt_prefix import build_prefix_message
+from openai_stub import start_stub
+
+TASK = "请为角色【{name}】撰写一份高级的角色扮演 System Prompt，包含角色详情、性格特质、语言风格、经历背景、人际关系，并给出5个来回的对话示例。"
+JUDGE = "请评估上面生成的角色Prompt和对话是否符合原文的剧情逻辑和人设，如有偏差请修正并输出完整版本。"
+FEEDBACKS = ["语气再冷淡一些。", "补充与师父之间的关系。"]
+
+
+def make_chunks(count, chars, seed=0):
+    rng = random.Random(seed)
+    pool = "天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏闰余成岁律吕调阳云腾致雨露结为霜"
+    return ["".join(rng.choice(pool) for _ in range(chars)) for _ in range(count)]
+
+
+def legacy_flow(client, chunks, name):
+    """旧方式：任务说明在前、原文在中间；校验阶段换一种写法重新附上原文；修改时重发全部历史"""
+    context = "\n\n".join(chunks)
+    gen_prompt = f"你是一个专业的角色设定专家。{TASK.format(name=name)}\n\n【原文片段】\n{context}\n\n请直接输出结果。"
+    draft = client.chat([{"role": "user", "content": gen_prompt}], stream=False, label="生成").choices[0].message.content
+    judge_prompt = f"你是一个剧情逻辑审核员。\n\n【原文片段】\n{context}\n\n【待评估生成的设定】\n{draft}\n\n{JUDGE}"
+    final = client.chat([{"role": "user", "content": judge_prompt}], stream=False, label="校验").choices[0].message.content
+    history = [{"role": "user", "content": gen_prompt}, {"role": "assistant", "content": final}]
+    for feedback in FEEDBACKS:
+        history.append({"role": "user", "content": feedback})
+        reply = client.chat(history, stream=False, label="修改").choices[0].message.content
+        history.append({"role": "assistant", "content": reply})
+
+
+def prefix_flow(client, chunks, name):
+    """新方式：共享 system 前缀（角色说明 + 排序后的原文），各阶段只在后面追加消息"""
+    prefix = build_prefix_message(sorted(chunks))
+    messages = [prefix, {"role": "user", "content": TASK.format(name=name)}]
+    draft = client.chat(messages, stream=False, label="生成").choices[0].message.content
+    judge = messages + [{"role": "assistant", "content": draft}, {"role": "user", "content": JUDGE}]
+    final = client.chat(judge, stream=False, label="校验").choices[0].message.content
+    history = messages + [{"role": "assistant", "content": final}]
+    for feedback in FEEDBACKS:
+        history.append({"role": "user", "content": feedback})
+        reply = client.chat(history, stream=False, label="修改").choices[0].message.content
+        history.append({"role": "assistant", "content": reply})
+
+
+def run(flow, server, url, chunks, characters):
+    server.state.reset()
+    client = get_llm_client(provider="deepseek", api_key="stub", base_url=url)
+    client.usage_log.clear()
+    for name in characters:
+        flow(client, chunks, name)
+    return client.recent_usage()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt 前缀缓存命中对比")
+    parser.add_argument("--chunks", type=int, default=15)
+    parser.add_argument("--chunk-chars", type=int, default=800)
+    parser.add_argument("--reply-chars", type=int, default=1500)
+    args = parser.parse_args()
+
+    server, url = start_stub(reply_chars=args.reply_chars)
+    chunks = make_chunks(args.chunks, args.chunk_chars)
+    # 同一知识库、同一组检索片段上为两个角色各生成一次
+    characters = ["萧炎", "药尘"]
+
+    print(f"{'方式':<8}{'调用':>6}{'输入 Token':>12}{'缓存命中':>12}{'命中率':>8}")
+    for label, flow in [("旧方式", legacy_flow), ("稳定前缀", prefix_flow)]:
+        usage = run(flow, server, url, chunks, characters)
+        prompt_total = sum(u["prompt_tokens"] for u in usage)
+        cached_total = sum(u["cached_tokens"] for u in usage)
+        print(f"{label:<8}{len(usage):>6}{prompt_total:>12}{cached_total:>12}{cached_total / prompt_total:>8.0%}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+QQ 角色 Prompt 流式生成测试：请求发往本地桩服务（openai_stub.py），回复按请求内容构造。
+
+  - 延迟：原来的做法（非流式，整个回复结束后才解析）与流式增量解析的第一个部分出现的时间、全部完成的时间
+  - 解析一致性：同一段回复按随机位置切成数据块增量解析，结果与整段解析相同；标题带序号、加粗、# 也能识别
+  - 补充请求：回复缺少某部分、或 JSON 格式下某字段不合格时，只补充请求缺失的部分，已完成的部分不再生成
+  - JSON 格式：请求带 response_format，字段在整个对象结束之前就逐个解析出来
+
+用法:
+    python benchmarks/bench_qq_prompt.py --chunk-delay-ms 20
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_client import get_llm_client
+from openai_stub import start_stub
+from qq_prompt import (QQ_EXAMPLE_COUNT, QQ_SECTION_TITLES, QQ_SECTIONS, JsonSectionParser, SectionParser,
+                       render_sections, stream_qq_prompt, validate_section)
+
+DIALOGUE = "user: 我想要一个活泼的猫娘角色\nassistant: 好的，她叫什么名字？\nuser: 叫小铃，喜欢吃鱼"
+
+DATA = {
+    "character_info": "姓名：小铃\n年龄：17岁\n性别：女\n职业：高中生兼咖啡店店员",
+    "background": "小铃出生在海边小镇，从小和猫一起长大，" + "性格开朗、好奇心强，偶尔有点小迷糊。" * 12,
+    "chat_requirements": "说话轻快，句尾常带“喵~”，喜欢用颜文字，" + "遇到不懂的问题会老实承认并撒个娇。" * 12,
+    "dialogue_examples": [
+        {"user": f"第{i}个问题：今天吃什么？", "character": f"当然是吃鱼喵~（第{i}次回答）" + "(=^･ω･^=)" * 3}
+        for i in range(1, QQ_EXAMPLE_COUNT + 1)
+    ],
+}
+
+# 模型常见的几种标题写法
+HEADER_STYLES = [
+    "【{title}】",
+    "{n}. 【{title}】：",
+    "**【{title}】**",
+    "### {n}、【{title}】",
+]
+
+
+def text_reply(fields, header_style="【{title}】"):
+    blocks = ["好的，以下是根据对话生成的角色Prompt：\n"]
+    for n, (field, title) in enumerate(QQ_SECTIONS, 1):
+        if field not in fields:
+            continue
+        header = header_style.format(n=n, title=title)
+        body = render_sections({field: DATA[field]}).split("\n", 1)[1]
+        if field == "dialogue_examples":
+            body = "\n".join(("   " if i % 2 else "") + line for i, line in enumerate(body.split("\n")))
+        blocks.append(f"{header}\n{body}")
+    return "\n\n".join(blocks)
+
+
+def requested_fields(prompt):
+    """从请求中读出要求生成的部分（补充请求只列出缺失的部分）"""
+    if "JSON" in prompt:
+        return [field for field, _ in QQ_SECTIONS if f'- "{field}"' in prompt]
+    return [field for field, title in QQ_SECTIONS if f". 【{title}】：" in prompt]
+
+
+class Replier:
+    """按请求内容构造回复；drop: 第一次请求中要省略的字段；broken: 第一次请求中给出不合格值的字段"""
+
+    def __init__(self, drop=(), broken=()):
+        self.drop = set(drop)
+        self.broken = set(broken)
+        self.requests = []
+
+    def __call__(self, request):
+        prompt = request["messages"][-1]["content"]
+        fields = requested_fields(prompt) or [field for field, _ in QQ_SECTIONS]
+        first = not self.requests
+        self.requests.append({"fields": fields, "json": request.get("response_format") == {"type": "json_object"}})
+        if first:
+            fields = [f for f in fields if f not in self.drop]
+        if "JSON" in prompt:
+            obj = {f: ([] if f == "dialogue_examples" else "") if first and f in self.broken else DATA[f] for f in fields}
+            return "```json\n" + json.dumps(obj, ensure_ascii=False, indent=2) + "\n```"
+        return text_reply(fields)
+
+
+def run_stream(client, output_format="text"):
+    """返回 (第一个部分出现的时间, 完成时间, 结果, 各部分出现时已接收的字数)"""
+    start = time.perf_counter()
+    first_section, received, at_section = None, 0, []
+    result = None
+    for event, payload in stream_qq_prompt(client, DIALOGUE, model="stub", output_format=output_format):
+        if event == "text":
+            received = len(payload[1])
+        elif event == "section":
+            if first_section is None:
+                first_section = time.perf_counter() - start
+            at_section.append(received)
+        elif event == "done":
+            result = payload
+    return first_section, time.perf_counter() - start, result, at_section
+
+
+def incremental_parse(parser, text, rng):
+    sections = []
+    pos = 0
+    while pos < len(text):
+        step = rng.randint(1, 12)
+        sections.extend(parser.feed(text[pos:pos + step]))
+        pos += step
+    return sections + parser.finish()
+
+
+def check_parsers(failures, trials):
+    rng = random.Random(50)
+    for style in HEADER_STYLES:
+        text = text_reply(DATA, style)
+        whole = SectionParser()
+        expected = whole.feed(text) + whole.finish()
+        parsed = {f: validate_section(f, v) for f, v in expected}
+        if parsed != DATA:
+            failures.append(f"标题写法 {style!r} 解析结果与原数据不同: {sorted(parsed)}")
+        for _ in range(trials):
+            if incremental_parse(SectionParser(), text, rng) != expected:
+                failures.append(f"标题写法 {style!r} 按随机数据块增量解析的结果与整段解析不同")
+                break
+
+    text = "```json\n" + json.dumps(DATA, ensure_ascii=False, indent=2) + "\n```"
+    for _ in range(trials):
+        if dict(incremental_parse(JsonSectionParser(), text, rng)) != DATA:
+            failures.append("JSON 按随机数据块增量解析的结果与 json.loads 不同")
+            break
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QQ 角色 Prompt：流式增量解析与补充请求")
+    parser.add_argument("--first-token-ms", type=float, default=500)
+    parser.add_argument("--chunk-delay-ms", type=float, default=20)
+    parser.add_argument("--trials", type=int, default=200, help="随机切分数据块的次数")
+    args = parser.parse_args()
+
+    failures = []
+    replier = Replier()
+    server, url = start_stub(first_token_ms=args.first_token_ms, chunk_delay_ms=args.chunk_delay_ms, reply=replier)
+    try:
+        client = get_llm_client(provider="deepseek", api_key="stub", base_url=url)
+        full_text = text_reply(DATA)
+
+        # 原来的做法：非流式请求，整个回复到达后才解析
+        start = time.perf_counter()
+        response = client.chat([{"role": "user", "content": "预热"}], model="stub", stream=False, label="QQ生成")
+        blocking = time.perf_counter() - start
+        if isinstance(response, str) or response.choices[0].message.content != full_text:
+            failures.append(f"非流式请求失败: {response if isinstance(response, str) else '回复内容不同'}")
+
+        first, total, result, at_section = run_stream(client)
+        print(f"回复 {len(full_text)} 字，首 Token {args.first_token_ms:.0f} ms，数据块间隔 {args.chunk_delay_ms:.0f} ms")
+        print(f"原做法（非流式）: {blocking * 1000:.0f} ms 后才显示任何部分")
+        print(f"流式增量解析: 第一个部分 {first * 1000:.0f} ms，全部完成 {total * 1000:.0f} ms；"
+              f"各部分出现时已接收 {at_section} 字")
+        if result["data"] != DATA or result["requests"] != 1:
+            failures.append(f"流式生成结果不完整: {sorted(result['data'])}，请求 {result['requests']} 次")
+        if first is None or first > blocking / 2:
+            failures.append(f"第一个部分出现得太晚: {first} s（非流式 {blocking:.2f} s）")
+
+        check_parsers(failures, args.trials)
+
+        # 补充请求：文本格式缺少两部分，JSON 格式缺少一个字段、另一个字段不合格
+        server.state.chunk_delay_ms = 0
+        server.state.first_token_ms = 0
+        cases = [
+            ("text", Replier(drop=["background", "dialogue_examples"])),
+            ("json", Replier(drop=["chat_requirements"], broken=["dialogue_examples"])),
+        ]
+        for output_format, case in cases:
+            server.state.reply = case
+            _, _, result, at_section = run_stream(client, output_format)
+            fields = [r["fields"] for r in case.requests]
+            print(f"{output_format} 格式补充请求: 各次请求的部分 {[[QQ_SECTION_TITLES[f] for f in r] for r in fields]}")
+            expected_retry = sorted(case.drop | case.broken)
+            if result["data"] != DATA or result["missing"]:
+                failures.append(f"{output_format}: 补充请求后仍缺少 {result['missing']}")
+            if len(fields) != 2 or sorted(fields[1]) != expected_retry:
+                failures.append(f"{output_format}: 补充请求没有只请求缺失的部分: {fields}")
+            if output_format == "json":
+                if not all(r["json"] for r in case.requests):
+                    failures.append("JSON 格式的请求没有带 response_format")
+                # 每个字段在对象结束前解析出来：第一次请求的字段不是在最后一个数据块才全部出现
+                first_raw = len(result["raw"][0])
+                if not at_section or at_section[0] >= first_raw:
+                    failures.append(f"JSON 字段没有增量解析: 出现时已接收 {at_section}，全文 {first_raw} 字")
+    finally:
+        server.shutdown()
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+测量每次 Streamlit rerun 时侧边栏的固定开销：
+旧方式每次新建 LLMClient（含新的 HTTP 连接池）并重新读取两个配置文件，
+新方式复用进程级客户端注册表和内存配置缓存。
+
+用法:
+    python benchmarks/bench_rerun_overhead.py --reruns 200
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config_store import get_config_store
+from llm_client import LLMClient, get_llm_client
+
+
+def old_rerun(user_path, rag_path):
+    with open(user_path, "r", encoding="utf-8") as f:
+        user_config = json.load(f)
+    with open(rag_path, "r", encoding="utf-8") as f:
+        json.load(f)
+    client = LLMClient(provider=user_config["api_provider"], api_key=user_config["api_key"])
+    client.get_available_models()
+
+
+def new_rerun(user_path, rag_path):
+    user_config = get_config_store(user_path).load()
+    get_config_store(rag_path).load()
+    client = get_llm_client(provider=user_config["api_provider"], api_key=user_config["api_key"])
+    client.get_available_models()
+
+
+def measure(fn, reruns, *args):
+    start = time.perf_counter()
+    for _ in range(reruns):
+        fn(*args)
+    return (time.perf_counter() - start) / reruns * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="rerun 固定开销基准测试")
+    parser.add_argument("--reruns", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        user_path = os.path.join(tmp_dir, "user_config.json")
+        rag_path = os.path.join(tmp_dir, "rag_config.json")
+        with open(user_path, "w", encoding="utf-8") as f:
+            json.dump({"api_provider": "deepseek", "api_key": "sk-bench", "model_name": "deepseek-chat"}, f)
+        with open(rag_path, "w", encoding="utf-8") as f:
+            json.dump({"embedding_type": "local", "model_name": "sentence-transformers/all-MiniLM-L6-v2"}, f)
+
+        old_ms = measure(old_rerun, args.reruns, user_path, rag_path)
+        new_ms = measure(new_rerun, args.reruns, user_path, rag_path)
+
+    print(f"旧方式: {old_ms:.3f} ms/rerun（每次新建客户端，之后的对话需要重新建立 TLS 连接）")
+    print(f"新方式: {new_ms:.3f} ms/rerun（复用客户端和连接池）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+分片知识库测试：同一批向量按不同的分片数写入，比较写入速度和检索延迟，并检查结果与不分片时一致。
+
+  - 后端层：随机单位向量按“来源文件 + 分卷”分组写入（每卷的片段落在同一个分片），
+    分片数 1 / 2 / 4 / 8，记录写入吞吐、检索 p50 / p95，检索结果与 1 个分片时逐条比较
+  - 引擎层：用 HashEmbedder 对合成语料（带“第X卷”分卷标题的 TXT）建一个分片知识库和一个普通知识库，
+    检查分卷分配到了多个分片、检索结果与普通知识库相同、统计目录的片段数与各分片合计一致
+
+NumPy 后端是精确检索，结果应完全相同；Chroma 的 HNSW 是近似检索，报告相对精确检索的召回率。
+检索延迟与 CPU 核数有关：单核机器上并发查询分片只增加调度开销，多核时各分片同时查询。
+
+用法:
+    python benchmarks/bench_shards.py --backend numpy --chunks 200000
+    python benchmarks/bench_shards.py --backend chroma --chunks 50000
+"""
+import argparse
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_embedder import HashEmbedder
+from sharded_backend import ShardedBackend
+from synthetic_corpus import generate_corpus
+from vector_backends import create_backend
+
+SHARD_COUNTS = [1, 2, 4, 8]
+BATCH = 5000
+
+
+def make_data(chunks, dim, volumes, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((chunks, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    per_volume = math.ceil(chunks / volumes)
+    metadatas = [{"source": f"/tmp/upload/series_{i // (per_volume * 4)}.txt", "volume": f"第{i // per_volume}卷"} for i in range(chunks)]
+    texts = [f"片段 {i}" for i in range(chunks)]
+    ids = [f"id{i}" for i in range(chunks)]
+    queries = rng.standard_normal((50, dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return ids, vectors, texts, metadatas, queries
+
+
+def run_backend(backend_name, shard_count, data, k, tmp):
+    ids, vectors, texts, metadatas, queries = data
+    backend = ShardedBackend(create_backend(backend_name, os.path.join(tmp, f"{backend_name}_{shard_count}")))
+    backend.create_sharded("series", max_chunks=math.ceil(len(ids) / shard_count))
+    start = time.perf_counter()
+    for i in range(0, len(ids), BATCH):
+        backend.add("series", ids[i:i + BATCH], vectors[i:i + BATCH], texts[i:i + BATCH], metadatas[i:i + BATCH])
+    ingest_s = time.perf_counter() - start
+
+    backend.search("series", queries[0], k)  # 预热（打开内存映射、加载索引）
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hits = backend.search("series", query, k)
+        latencies.append(time.perf_counter() - start)
+        results.append([text for text, _, _ in hits])
+    latencies.sort()
+    return {
+        "shards": len(backend.shard_names("series")),
+        "count": backend.count("series"),
+        "ingest_per_s": len(ids) / ingest_s,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "results": results
+    }
+
+
+def check_engine(backend_name, tmp, failures):
+    """引擎层：分卷 TXT 建分片知识库，检索结果与普通知识库相同"""
+    from rag_engine import RAGEngine
+    chapters, facts = generate_corpus(total_chars=240000, seed=46)
+    path = os.path.join(tmp, "series.txt")
+    volume_size = len(chapters) // 4 + 1
+    with open(path, "w", encoding="utf-8") as f:
+        for v in range(4):
+            f.write(f"第{v + 1}卷 卷{v + 1}\n\n" + "\n\n".join(chapters[v * volume_size:(v + 1) * volume_size]) + "\n\n")
+
+    engine = RAGEngine(persist_directory=os.path.join(tmp, "engine"), model_name="hash", backend=backend_name, embeddings=HashEmbedder())
+    docs = engine.load_documents([path])
+    volumes = sorted({d.metadata.get("volume") for d in docs if d.metadata.get("volume")})
+    engine.build_vector_store(docs, collection_name="plain")
+    engine.build_vector_store(docs, collection_name="series", shard_chunks=len(docs) // 4)
+    shards = engine.backend.shard_names("series")
+    if len(volumes) != 4 or len(shards) < 3:
+        failures.append(f"分卷 {volumes} 没有分配到多个分片: {shards}")
+    if "series" not in engine.get_available_collections() or any(s in engine.get_available_collections() for s in shards):
+        failures.append(f"知识库列表应只显示逻辑名称: {engine.get_available_collections()}")
+    summary = engine.get_documents_summary()["series"]
+    if summary["count"] != len(docs) or summary.get("shards") != len(shards):
+        failures.append(f"统计目录与分片不一致: {summary['count']} / {len(docs)} 个片段，{summary.get('shards')} 个分片")
+
+    same = 0
+    queries = [f"{f['character']} 的外貌" for f in facts[:20]]
+    for query in queries:
+        plain = [(d.page_content, s) for d, s in engine.query_with_scores(query, k=10, collection_names=["plain"])]
+        sharded = [(d.page_content, s) for d, s in engine.query_with_scores(query, k=10, collection_names=["series"])]
+        same += [t for t, _ in plain] == [t for t, _ in sharded]
+    print(f"引擎层: {len(docs)} 个片段、{len(volumes)} 卷分到 {len(shards)} 个分片，{same}/{len(queries)} 个查询结果与普通知识库相同")
+    if backend_name == "numpy" and same != len(queries):
+        failures.append("分片知识库的检索结果与普通知识库不同")
+    # 删除默认在后台进行，这里等待完成后再检查分片是否都已删除
+    ok, msg = engine.delete_collection("series", wait=True)
+    if not ok or any(s in engine.backend.base.list_collections() for s in shards):
+        failures.append(f"删除分片知识库后仍有分片残留: {msg}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分片知识库：写入速度、检索延迟与分片数的关系")
+    parser.add_argument("--backend", default="numpy", choices=["numpy", "chroma"])
+    parser.add_argument("--chunks", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--volumes", type=int, default=32)
+    parser.add_argument("--k", type=int, default=15)
+    args = parser.parse_args()
+
+    failures = []
+    tmp = tempfile.mkdtemp(prefix="rag_shards_")
+    try:
+        data = make_data(args.chunks, args.dim, args.volumes)
+        width = 14
+        print(f"{args.backend} 后端，{args.chunks} 个片段，{args.volumes} 卷，k={args.k}，{os.cpu_count()} 个 CPU")
+        print("".join(h.ljust(width) for h in ["分片数", "写入 片段/秒", "检索 p50 ms", "检索 p95 ms", "召回率"]))
+        _, vectors, texts, _, queries = data
+        exact = [[texts[i] for i in np.argsort(-(vectors @ q))[:args.k]] for q in queries]
+        baseline = None
+        for shard_count in SHARD_COUNTS:
+            r = run_backend(args.backend, shard_count, data, args.k, tmp)
+            if baseline is None:
+                baseline = r["results"]
+            recall = sum(len(set(a) & set(b)) for a, b in zip(r["results"], exact)) / sum(len(b) for b in exact)
+            print("".join(str(c).ljust(width) for c in [r["shards"], f"{r['ingest_per_s']:.0f}", f"{r['p50_ms']:.2f}", f"{r['p95_ms']:.2f}", f"{recall:.1%}"]))
+            if r["count"] != args.chunks:
+                failures.append(f"{shard_count} 个分片: 片段数 {r['count']} != {args.chunks}")
+            if args.backend == "numpy" and r["results"] != baseline:
+                failures.append(f"{shard_count} 个分片: 检索结果与单分片不同")
+            if shard_count > 1 and r["shards"] < 2:
+                failures.append(f"要求 {shard_count} 个分片，实际只有 {r['shards']} 个")
+        check_engine(args.backend, tmp, failures)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+跟踪冷启动耗时，防止重量级依赖重新回到模块顶层导入：
+在全新的解释器中分别计时导入各模块，并列出 -X importtime 统计中最慢的依赖。
+
+用法:
+    python benchmarks/bench_startup.py --runs 5 --top 10
+    python benchmarks/bench_startup.py --with-engine   # 额外计时 RAGEngine 初始化（需要已下载模型）
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["llm_client", "history_utils", "rag_engine", "prewarm"]
+
+
+def time_import(module, runs):
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+        samples.append(float(out.stdout.strip().splitlines()[-1]) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def slowest_imports(module, top):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # 格式: "import time:  self [us] | cumulative | imported package"
+        _, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def time_engine():
+    code = (
+        "import time; t = time.perf_counter(); from rag_engine import RAGEngine; "
+        "RAGEngine(persist_directory='./.bench_startup_db', backend='numpy'); print(time.perf_counter() - t)"
+    )
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1]) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="冷启动基准测试")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--with-engine", action="store_true")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    results = {"imports_ms": {}}
+    for module in MODULES:
+        ms = time_import(module, args.runs)
+        results["imports_ms"][module] = ms
+        print(f"import {module:<14}{ms:>10.1f} ms (中位数)")
+
+    print(f"\nimport rag_engine 最慢的 {args.top} 个依赖（累计耗时）:")
+    results["slowest"] = []
+    for cumulative_us, name in slowest_imports("rag_engine", args.top):
+        results["slowest"].append({"module": name, "cumulative_ms": cumulative_us / 1000})
+        print(f"  {cumulative_us / 1000:>8.1f} ms  {name}")
+
+    if args.with_engine:
+        results["engine_init_ms"] = time_engine()
+        print(f"\nRAGEngine 初始化（含模型加载）: {results['engine_init_ms']:.0f} ms")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
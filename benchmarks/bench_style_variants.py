@@ -0,0 +1,87 @@
+"""
+多风格版本并发生成测试：请求发往本地桩服务（openai_stub.py，可配置首 Token 延迟和流式间隔），
+比较三种方式的端到端耗时：
+  single       只生成一个风格（生成 → 校验）
+  sequential   逐个生成全部风格（原先每次切换风格重新生成的做法，不含重复检索）
+  concurrent   VariantRun 并发生成全部风格
+并检查并发生成的每个版本都完成了两个阶段、界面更新按刷新间隔合并，以及各版本共用的前缀命中了上下文缓存。
+
+用法:
+    python benchmarks/bench_style_variants.py --first-token-ms 800 --chunk-delay-ms 20
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_client import get_llm_client
+from openai_stub import start_stub
+from prompt_prefix import build_prefix_message
+from style_variants import PROMPT_STYLES, VariantRun
+
+
+def make_chunks(count, chars, seed=0):
+    rng = random.Random(seed)
+    pool = "天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏闰余成岁律吕调阳云腾致雨露结为霜"
+    return ["".join(rng.choice(pool) for _ in range(chars)) for _ in range(count)]
+
+
+def run(client, prefix, styles, max_workers):
+    variant_run = VariantRun(client, prefix, "林萧", styles, model="stub", max_workers=max_workers)
+    start = time.perf_counter()
+    updates = sum(1 for _ in variant_run.updates())
+    return time.perf_counter() - start, variant_run.results, updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多风格版本：并发与逐个生成的端到端耗时")
+    parser.add_argument("--first-token-ms", type=float, default=800)
+    parser.add_argument("--chunk-delay-ms", type=float, default=20)
+    parser.add_argument("--reply-chars", type=int, default=1200)
+    parser.add_argument("--chunks", type=int, default=15)
+    args = parser.parse_args()
+
+    server, url = start_stub(reply_chars=args.reply_chars, first_token_ms=args.first_token_ms, chunk_delay_ms=args.chunk_delay_ms)
+    failures = []
+    try:
+        client = get_llm_client(provider="deepseek", api_key="stub", base_url=url)
+        prefix = build_prefix_message(make_chunks(args.chunks, 800))
+        run(client, prefix, PROMPT_STYLES[:1], 1)  # 预热连接
+
+        single, _, _ = run(client, prefix, PROMPT_STYLES[:1], 1)
+        sequential, _, _ = run(client, prefix, PROMPT_STYLES, 1)
+        server.state.reset()
+        concurrent, results, updates = run(client, prefix, PROMPT_STYLES, len(PROMPT_STYLES))
+
+        print(f"single      {single:.2f}s")
+        print(f"sequential  {sequential:.2f}s  ({sequential / single:.2f}x)")
+        print(f"concurrent  {concurrent:.2f}s  ({concurrent / single:.2f}x)，界面更新 {updates} 次")
+
+        for style in PROMPT_STYLES:
+            result = results.get(style)
+            if not result or result["error"] or not result["draft"] or not result["final"]:
+                failures.append(f"{style}: 没有完成两个阶段 {result and result['error']}")
+        # 流式数据块数远多于刷新次数：每 0.1 秒最多刷新一次（每个版本一条）
+        chunks = 2 * len(PROMPT_STYLES) * (args.reply_chars // 20)
+        if updates >= chunks:
+            failures.append(f"界面更新 {updates} 次，没有按刷新间隔合并（{chunks} 个数据块）")
+        cached = [r["usage"][1]["cached_tokens"] for r in results.values() if r["usage"][1]]
+        if len(cached) != len(PROMPT_STYLES) or min(cached) < len(prefix["content"]) // 2:
+            failures.append(f"校验阶段没有命中共用前缀的缓存: {cached}")
+        if concurrent > single * 1.5:
+            failures.append(f"并发生成 {len(PROMPT_STYLES)} 个版本耗时为单个版本的 {concurrent / single:.2f} 倍")
+    finally:
+        server.shutdown()
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+TXT 加载测试：生成大体积的 UTF-8 与 GB18030（\\r\\n 换行，模拟 Windows 下保存的小说）文件，
+对比三种方式的耗时和进程峰值内存：
+  old     原先的整文件读取（依次尝试 utf-8 / gb18030 / gbk，与 TextLoader 的读法相同，再整体切分）
+  list    load_txt_documents：流式解码切分，片段收集成列表返回（load_documents 的用法）
+  stream  iter_txt_documents：逐个消费片段、不保留，内存与文件大小无关
+并检查：
+  - 流式切分出的片段与整文件切分完全相同（内容和顺序）
+  - 随机生成的小文件（LF / CRLF / 混合换行，段落长短不一）在很小的 SEGMENT_CHARS / BLOCK_BYTES 下，
+    流式切分与整文件 split_text 完全相同、字节偏移正确（段边界很多，能覆盖各种截断位置）
+  - 每个片段的 byte_start / byte_end 从原文件中截取解码后与片段正文完全相同
+
+每种方式在单独的子进程中运行，峰值内存互不影响（需要 resource 模块，Windows 上不报告内存）。
+
+用法:
+    python benchmarks/bench_txt_loader.py --mb 100
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+FILES = [("utf-8", "\n"), ("gb18030", "\r\n")]
+MODES = ["old", "list", "stream"]
+
+
+def write_novel(path, megabytes, encoding, newline):
+    """重复写入合成语料直到达到指定大小（按编码后的字节数）"""
+    from synthetic_corpus import generate_corpus
+    chapters, _ = generate_corpus(total_chars=400000, seed=3)
+    target = megabytes * 1024 * 1024
+    written = 0
+    with open(path, "w", encoding=encoding, newline=newline) as f:
+        round_no = 0
+        while written < target:
+            for chapter in chapters:
+                text = chapter.replace("第", f"第{round_no}卷 第", 1) + "\n\n"
+                f.write(text)
+                written += len(text.encode(encoding))
+                if written >= target:
+                    break
+            round_no += 1
+
+
+def _peak_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def worker(mode, path, digests_path):
+    from rag_engine import make_text_splitter
+    splitter = make_text_splitter()
+    baseline_mb = _peak_mb()
+    start = time.perf_counter()
+    digests = []
+    if mode == "old":
+        from langchain_core.documents import Document
+        text, used = None, None
+        for enc in ["utf-8", "gb18030", "gbk"]:
+            try:
+                with open(path, encoding=enc) as f:
+                    text = f.read()
+                used = enc
+                break
+            except UnicodeDecodeError:
+                continue
+        docs = splitter.split_documents([Document(page_content=text, metadata={"source": path})])
+        del text
+    elif mode == "list":
+        from txt_loader import load_txt_documents
+        docs, used = load_txt_documents(path, splitter)
+    else:
+        from txt_loader import iter_txt_documents
+        docs, used = [], None
+        for doc in iter_txt_documents(path, splitter):
+            digests.append(_digest(doc.page_content))
+    seconds = time.perf_counter() - start
+    peak = _peak_mb()
+
+    offset_errors = 0
+    if mode == "list":
+        with open(path, "rb") as f:
+            data = f.read()
+        for doc in docs:
+            raw = data[doc.metadata["byte_start"]:doc.metadata["byte_end"]].decode(used)
+            if raw.replace("\r\n", "\n") != doc.page_content:
+                offset_errors += 1
+    with open(digests_path, "w") as f:
+        f.write("\n".join(digests or [_digest(d.page_content) for d in docs]))
+    print(json.dumps({"seconds": seconds, "peak_mb": peak, "baseline_mb": baseline_mb, "chunks": len(digests or docs),
+                      "encoding": used, "offset_errors": offset_errors}))
+
+
+def random_text(rng, chars):
+    """长短不一的段落，段落之间随机用单个换行、空行、多个空行或行尾带空格的换行分隔"""
+    pool = "天地玄黄宇宙洪荒ab 。！？"
+    separators = ["\n", "\n\n", "\n\n\n", "  \n", "\r\n", "\r\n\r\n", " "]
+    parts = []
+    while sum(len(p) for p in parts) < chars:
+        parts.append("".join(rng.choice(pool) for _ in range(rng.choice([3, 20, 80, 300, 1200]))))
+        parts.append(rng.choice(separators))
+    return "".join(parts)
+
+
+def check_random_files(tmp, count, failures):
+    """小段、小块下流式切分与整文件切分逐个比较，返回不一致的文件数"""
+    import txt_loader
+    from rag_engine import make_text_splitter
+    saved = txt_loader.SEGMENT_CHARS, txt_loader.BLOCK_BYTES
+    mismatched = []
+    try:
+        for seed in range(count):
+            rng = random.Random(seed)
+            txt_loader.SEGMENT_CHARS = rng.choice([500, 2000, 5000])
+            txt_loader.BLOCK_BYTES = rng.choice([1000, 4096, 20000])
+            newline = rng.choice(["LF", "CRLF", "mixed"])
+            text = random_text(rng, rng.choice([5000, 30000, 60000]))
+            if newline == "LF":
+                text = text.replace("\r\n", "\n")
+            elif newline == "CRLF":
+                text = text.replace("\r\n", "\n").replace("\n", "\r\n")
+            encoding = rng.choice(["utf-8", "gb18030"])
+            splitter = make_text_splitter({"chunk_size": rng.choice([200, 800]), "chunk_overlap": rng.choice([0, 30, 100])})
+            path = os.path.join(tmp, f"random_{seed}.txt")
+            with open(path, "wb") as f:
+                f.write(text.encode(encoding))
+            expected = splitter.split_text(text.replace("\r\n", "\n").replace("\r", "\n"))
+            docs = list(txt_loader.iter_txt_documents(path, splitter, encoding))
+            with open(path, "rb") as f:
+                data = f.read()
+            offsets_ok = all(
+                data[d.metadata["byte_start"]:d.metadata["byte_end"]].decode(encoding).replace("\r\n", "\n") == d.page_content
+                for d in docs
+            )
+            if [d.page_content for d in docs] != expected or not offsets_ok:
+                mismatched.append(f"#{seed} {newline} {encoding}")
+            os.remove(path)
+    finally:
+        txt_loader.SEGMENT_CHARS, txt_loader.BLOCK_BYTES = saved
+    print(f"随机小文件: {count - len(mismatched)}/{count} 个与整文件切分完全相同")
+    if mismatched:
+        failures.append(f"{len(mismatched)} 个随机文件的流式切分与整文件切分不同: {', '.join(mismatched[:5])}")
+
+
+def run_worker(mode, path, digests_path):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", mode, "--file", path, "--digests", digests_path],
+                         capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TXT 流式加载：耗时、峰值内存与字节偏移")
+    parser.add_argument("--mb", type=int, default=100, help="生成的文件大小 (MB)")
+    parser.add_argument("--random-files", type=int, default=80, help="随机小文件的数量")
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--file", help=argparse.SUPPRESS)
+    parser.add_argument("--digests", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.worker, args.file, args.digests)
+        return
+
+    failures = []
+    tmp = tempfile.mkdtemp(prefix="rag_txt_")
+    try:
+        check_random_files(tmp, args.random_files, failures)
+        width = 16
+        print("".join(h.ljust(width) for h in ["文件", "方式", "编码", "片段", "秒", "峰值内存 MB"]))
+        for encoding, newline in FILES:
+            path = os.path.join(tmp, f"novel_{encoding}.txt")
+            write_novel(path, args.mb, encoding, newline)
+            label = f"{encoding} {'CRLF' if newline == chr(13) + chr(10) else 'LF'}"
+            results = {}
+            for mode in MODES:
+                results[mode] = run_worker(mode, path, os.path.join(tmp, f"{encoding}_{mode}.txt"))
+                r = results[mode]
+                peak = f"{r['peak_mb']:.0f} (+{r['peak_mb'] - r['baseline_mb']:.0f})" if r["peak_mb"] else "-"
+                print("".join(str(c).ljust(width) for c in [label, mode, r["encoding"] or "-", r["chunks"], f"{r['seconds']:.1f}", peak]))
+
+            if results["list"]["encoding"] != encoding:
+                failures.append(f"{label}: 判断的编码为 {results['list']['encoding']}")
+            if results["list"]["offset_errors"]:
+                failures.append(f"{label}: {results['list']['offset_errors']} 个片段的字节偏移与正文不符")
+            digests = {}
+            for mode in MODES:
+                with open(os.path.join(tmp, f"{encoding}_{mode}.txt")) as f:
+                    digests[mode] = f.read().split()
+            for mode in ["list", "stream"]:
+                if digests[mode] != digests["old"]:
+                    same = sum(1 for a, b in zip(digests[mode], digests["old"]) if a == b)
+                    failures.append(f"{label}: {mode} 与整文件切分不一致（{same}/{len(digests['old'])} 个片段相同）")
+            os.remove(path)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+检索质量与延迟评测：在多组切分参数下分别建库，用带标注的查询集计算
+recall@k、MRR、检索结果的上下文 Token 数和查询延迟，用于选择 chunk_size / chunk_overlap / k。
+
+默认使用合成语料（synthetic_corpus.py 埋入的角色事实即标准答案）和 HashEmbedder；
+也可以用真实小说和自己标注的查询集：
+    {"queries": [{"query": "孙悟空的口头禅", "gold": ["俺老孙来也"]}, ...]}
+gold 为应当被检索到的原文短语，片段包含其中任意一个即视为命中。
+
+用法:
+    python benchmarks/eval_retrieval.py --configs 300:30 500:50 800:100 1200:150 --k 5 10 15
+    python benchmarks/eval_retrieval.py --corpus 西游记.txt --queries labels.json --model BAAI/bge-small-zh-v1.5
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation_memory import count_tokens
+from rag_engine import RAGEngine, make_text_splitter
+from fake_embedder import HashEmbedder
+from synthetic_corpus import generate_corpus, make_queries
+
+
+def parse_config(text):
+    size, overlap = text.split(":")
+    return {"chunk_size": int(size), "chunk_overlap": int(overlap)}
+
+
+def load_labeled_set(args):
+    if args.corpus:
+        with open(args.corpus, "r", encoding=args.encoding) as f:
+            texts = [f.read()]
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = json.load(f)["queries"]
+        return texts, [{"query": q["query"], "gold": q["gold"]} for q in queries]
+    chapters, facts = generate_corpus(total_chars=args.chars, num_characters=args.characters, seed=args.seed)
+    return chapters, [{"query": q["query"], "gold": [q["key"]]} for q in make_queries(facts)]
+
+
+def make_embeddings(model_name):
+    if model_name == "hash":
+        return HashEmbedder()
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=model_name)
+
+
+def first_hit_rank(docs, gold):
+    for rank, doc in enumerate(docs, start=1):
+        if any(g in doc.page_content for g in gold):
+            return rank
+    return None
+
+
+def evaluate(engine, texts, queries, chunking, ks, collection):
+    splitter = make_text_splitter(chunking)
+    docs = splitter.create_documents(texts, metadatas=[{"source": f"part_{i}"} for i in range(len(texts))])
+    start = time.perf_counter()
+    engine.build_vector_store(docs, collection_name=collection, chunking=chunking)
+    build_s = time.perf_counter() - start
+
+    max_k = max(ks)
+    ranks = []
+    latencies = []
+    context_tokens = {k: [] for k in ks}
+    for q in queries:
+        start = time.perf_counter()
+        results = engine.query(q["query"], k=max_k, collection_names=[collection])
+        latencies.append(time.perf_counter() - start)
+        ranks.append(first_hit_rank(results, q["gold"]))
+        for k in ks:
+            context_tokens[k].append(sum(count_tokens(d.page_content) for d in results[:k]))
+
+    latencies.sort()
+    row = {
+        **chunking,
+        "chunks": len(docs),
+        "build_s": round(build_s, 2),
+        "mrr": round(statistics.mean(1 / r if r else 0 for r in ranks), 3),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 2)
+    }
+    for k in ks:
+        row[f"recall@{k}"] = round(sum(1 for r in ranks if r and r <= k) / len(ranks), 3)
+        row[f"tokens@{k}"] = round(statistics.mean(context_tokens[k]))
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="切分参数与 k 的检索评测")
+    parser.add_argument("--configs", nargs="+", default=["300:30", "500:50", "800:100", "1200:150"], help="chunk_size:chunk_overlap")
+    parser.add_argument("--k", nargs="+", type=int, default=[5, 10, 15])
+    parser.add_argument("--backend", default="numpy")
+    parser.add_argument("--model", default="hash", help="hash 使用 HashEmbedder，其余为 HuggingFace 模型名")
+    parser.add_argument("--corpus", help="真实语料 txt，需配合 --queries")
+    parser.add_argument("--queries", help="标注查询集 JSON")
+    parser.add_argument("--encoding", default="utf-8")
+    parser.add_argument("--chars", type=int, default=300000, help="合成语料字数")
+    parser.add_argument("--characters", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+    if args.corpus and not args.queries:
+        parser.error("--corpus 需要同时提供 --queries")
+
+    texts, queries = load_labeled_set(args)
+    embeddings = make_embeddings(args.model)
+    tmp_dir = tempfile.mkdtemp(prefix="rag_eval_")
+    rows = []
+    try:
+        engine = RAGEngine(persist_directory=tmp_dir, model_name=args.model, backend=args.backend, embeddings=embeddings)
+        for i, text in enumerate(args.configs):
+            chunking = parse_config(text)
+            rows.append(evaluate(engine, texts, queries, chunking, args.k, f"eval_{i}"))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    columns = ["chunk_size", "chunk_overlap", "chunks"] + [f"recall@{k}" for k in args.k] + ["mrr"] + [f"tokens@{k}" for k in args.k] + ["p50_ms", "p95_ms"]
+    print(f"\n{len(queries)} 个查询，Embedding: {args.model}，后端: {args.backend}")
+    print("".join(f"{c:>12}" for c in columns))
+    for row in rows:
+        print("".join(f"{row[c]:>12}" for c in columns))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"model": args.model, "queries": len(queries), "results": rows}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
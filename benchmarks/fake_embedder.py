@@ -0,0 +1,56 @@
+"""
+确定性的哈希 Embedding：把文本的字符一元、二元组哈希到固定维度并归一化。
+不需要下载模型、不需要 API，同样的文本总是得到同样的向量；
+字面重叠越多的文本余弦相似度越高，足以用来测量检索流程的速度和粗略的召回。
+
+实现 langchain Embeddings 的 embed_documents / embed_query 接口，
+可以通过 RAGEngine(embeddings=HashEmbedder()) 注入。
+"""
+import hashlib
+
+import numpy as np
+
+DEFAULT_DIM = 384
+# 哈希桶缓存的上限，防止超大语料把内存撑满
+CACHE_LIMIT = 500000
+
+
+def _bucket(token, dim):
+    digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+    value = int.from_bytes(digest, "little")
+    # 最低位决定符号，减少哈希冲突带来的系统性偏差
+    return (value >> 1) % dim, 1.0 if value & 1 else -1.0
+
+
+class HashEmbedder:
+    def __init__(self, dim=DEFAULT_DIM):
+        self.dim = dim
+        self._cache = {}
+
+    def _features(self, text):
+        text = "".join(text.split())
+        for ch in text:
+            yield ch, 0.5
+        for i in range(len(text) - 1):
+            yield text[i:i + 2], 1.0
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token, weight in self._features(text):
+            bucket = self._cache.get(token)
+            if bucket is None:
+                bucket = _bucket(token, self.dim)
+                if len(self._cache) < CACHE_LIMIT:
+                    self._cache[token] = bucket
+            index, sign = bucket
+            vector[index] += sign * weight
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def embed_documents(self, texts):
+        return [self._embed(t).tolist() for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text).tolist()
@@ -0,0 +1,121 @@
+"""
+生成正文提取测试用的 HTML 样例（benchmarks/fixtures/html/<站点>/<n>.html）。
+四种常见的小说站点模板，各带不同的干扰内容：
+  - biquge：div#content + <br> 正文，页头导航、面包屑、上一章/下一章、“记住本站地址”模板文字
+  - qidian：div.read-content 里的 <p> 正文，侧栏推荐作品、带标点的读者评论区
+  - inline_ads：正文容器内夹着广告块和“本章未完，请点击下一页继续阅读”
+  - table：老式表格布局，没有任何 class/id 提示，导航和正文都在 <td> 里
+expected.json 记录每页应当保留（正文首尾句）和应当去掉的文字，供 bench_content_extraction.py 检查。
+
+已生成的样例随仓库提交；修改模板后重新运行:
+    python benchmarks/make_html_fixtures.py
+"""
+import html
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_corpus import PLACES, generate_corpus
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "html")
+PAGES_PER_SITE = 5
+
+NAV = ["首页", "玄幻小说", "修真小说", "都市小说", "历史小说", "网游小说", "科幻小说", "排行榜", "完本小说", "我的书架"]
+RECOMMENDED = ["万古神帝", "剑来", "诡秘之主", "凡人修仙传", "大奉打更人", "雪中悍刀行", "斗破苍穹", "遮天"]
+COMMENTS = ["作者更新太慢了，每天就一章，什么时候能加更啊？", "这一章写得真好，主角终于要突破了！",
+            "前面的伏笔在这里回收了，佩服作者。", "催更催更，今天能不能再来一章？", "有没有人知道下一卷什么时候开始？"]
+
+
+def _paragraphs(chapter):
+    body = chapter.split("\n\n", 1)[1]
+    return [p for p in body.split("\n\n") if p.strip()]
+
+
+def _links(items, href="/list/{i}.html"):
+    return "".join(f'<a href="{href.format(i=i)}">{html.escape(t)}</a>' for i, t in enumerate(items))
+
+
+def biquge(index, title, paragraphs):
+    content = "<br /><br />".join("&nbsp;&nbsp;&nbsp;&nbsp;" + html.escape(p) for p in paragraphs)
+    page = f"""<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title}_测试小说_笔趣阁</title>
+<script>var ad = "<div>广告</div>"; document.write(ad);</script><style>#content{{font-size:18px}}</style></head>
+<body><div id="wrapper"><div class="header"><div class="nav">{_links(NAV)}</div></div>
+<div class="content_read"><div class="box_con"><div class="con_top"><a href="/">笔趣阁</a> &gt; <a href="/book/1/">测试小说</a> &gt; {title}</div>
+<div class="bookname"><h1>{title}</h1><div class="bottem1"><a href="/book/1/{index - 1}.html">上一章</a> &larr; <a href="/book/1/">章节目录</a> &rarr; <a href="/book/1/{index + 1}.html">下一章</a> <a href="/shelf">加入书签</a></div></div>
+<div id="content">{content}<br /><br />天才一秒记住本站地址：www.biquge.test。笔趣阁手机版阅读网址：m.biquge.test</div>
+<div class="bottem2"><a href="/book/1/{index - 1}.html">上一章</a> &larr; <a href="/book/1/">章节目录</a> &rarr; <a href="/book/1/{index + 1}.html">下一章</a></div>
+</div></div><div class="footer"><p>本站所有小说为转载作品，所有章节均由网友上传，转载至本站只是为了宣传，让更多读者欣赏。</p><p>Copyright © 2024 笔趣阁 All Rights Reserved.</p></div></div></body></html>"""
+    return page, ["天才一秒记住本站地址", "本站所有小说为转载作品", "加入书签", "玄幻小说"]
+
+
+def qidian(index, title, paragraphs):
+    content = "".join(f"<p>　　{html.escape(p)}</p>" for p in paragraphs)
+    comments = "".join(f'<div class="comment-item"><span class="user"><a href="/u/{i}">读者{i}</a></span><p>{html.escape(c)}</p></div>'
+                       for i, c in enumerate(COMMENTS))
+    page = f"""<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title}_测试小说在线阅读</title></head>
+<body><div class="wrap"><div class="top-bar">{_links(NAV)}</div>
+<div class="read-main-wrap"><div class="main-text-wrap"><div class="text-head"><h3 class="j_chapterName">{title}</h3>
+<div class="text-info"><a href="/author/9">作者：测试作者</a><span>本章字数：{sum(len(p) for p in paragraphs)}</span><span>更新时间：2024-05-0{index % 9 + 1} 12:00</span></div></div>
+<div class="read-content j_readContent">{content}</div></div>
+<div class="chapter-control"><a href="/chapter/{index - 1}">上一章</a><a href="/catalog">目录</a><a href="/chapter/{index + 1}">下一章</a></div>
+<div class="comment-wrap"><h4>本章说</h4>{comments}</div></div>
+<div class="side-bar"><h4>同类作品推荐</h4><ul>{"".join(f'<li><a href="/book/{i}">{t}</a><span>{random.Random(i).randint(10, 900)}万字</span></li>' for i, t in enumerate(RECOMMENDED))}</ul></div>
+</div></body></html>"""
+    return page, [COMMENTS[0], COMMENTS[3], "同类作品推荐", RECOMMENDED[2], "本章字数"]
+
+
+def inline_ads(index, title, paragraphs):
+    half = len(paragraphs) // 2
+    first = "".join(f"<p>{html.escape(p)}</p>" for p in paragraphs[:half])
+    second = "".join(f"<p>{html.escape(p)}</p>" for p in paragraphs[half:])
+    page = f"""<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title} - 测试小说 - 小说网</title></head>
+<body><header><nav>{_links(NAV)}</nav></header>
+<div class="container"><div class="chapter"><h1>{title}</h1><div class="txt" id="chaptercontent">{first}
+<div class="ads"><a href="https://ad.test/1">【广告】限时免费领取VIP会员</a><a href="https://ad.test/2">热门手游推荐</a></div>
+{second}<p>本章未完，请点击下一页继续阅读</p><p><a href="/c/{index}_2.html">下一页</a></p></div></div>
+<div class="hot-books"><h3>热门小说</h3>{_links(RECOMMENDED, "/b/{i}")}</div></div>
+<footer>小说网 版权所有 沪ICP备00000000号</footer></body></html>"""
+    return page, ["限时免费领取VIP会员", "本章未完，请点击下一页继续阅读", "版权所有", RECOMMENDED[0]]
+
+
+def table(index, title, paragraphs):
+    content = "<br>".join(html.escape(p) for p in paragraphs)
+    page = f"""<html><head><meta http-equiv="Content-Type" content="text/html; charset=utf-8"><title>{title}</title></head>
+<body><table width="900" align="center"><tr><td>{" | ".join(f'<a href="/s/{i}">{t}</a>' for i, t in enumerate(NAV))}</td></tr>
+<tr><td align="center"><b>{title}</b><br><a href="/index.html">返回书目</a> <a href="/{index + 1}.html">下一章</a></td></tr>
+<tr><td>{content}</td></tr>
+<tr><td align="center"><a href="/{index - 1}.html">上一章</a> | <a href="/index.html">返回书目</a> | <a href="/{index + 1}.html">下一章</a></td></tr>
+<tr><td>{"，".join(PLACES)}都在本站连载，欢迎收藏本站。</td></tr></table></body></html>"""
+    return page, ["欢迎收藏本站", "返回书目", "排行榜"]
+
+
+SITES = {"biquge": biquge, "qidian": qidian, "inline_ads": inline_ads, "table": table}
+
+
+def main():
+    chapters, _ = generate_corpus(total_chars=PAGES_PER_SITE * len(SITES) * 2000, chapter_chars=2000, seed=11)
+    expected = {}
+    for s, (site, template) in enumerate(SITES.items()):
+        os.makedirs(os.path.join(FIXTURE_DIR, site), exist_ok=True)
+        for n in range(PAGES_PER_SITE):
+            chapter = chapters[s * PAGES_PER_SITE + n]
+            title = chapter.split("\n", 1)[0]
+            paragraphs = _paragraphs(chapter)
+            page, noise = template(n + 1, title, paragraphs)
+            name = f"{site}/{n + 1}.html"
+            with open(os.path.join(FIXTURE_DIR, name), "w", encoding="utf-8") as f:
+                f.write(page)
+            expected[name] = {
+                "keep": [paragraphs[0][:30], paragraphs[-1][-30:]],
+                "drop": noise
+            }
+    with open(os.path.join(FIXTURE_DIR, "expected.json"), "w", encoding="utf-8") as f:
+        json.dump(expected, f, ensure_ascii=False, indent=2)
+    print(f"已生成 {len(expected)} 个样例页面: {FIXTURE_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+本地 OpenAI 兼容接口桩，用于离线测试和基准测试：
+
+- /chat/completions：流式与非流式，像 DeepSeek 一样按公共前缀模拟上下文缓存，
+  在 usage 中返回命中 Token 数（1 个字符按 1 个 Token 计，缓存以 64 Token 为单位命中）
+- /embeddings：用 HashEmbedder 计算确定性向量
+- 可配置首 Token 延迟、流式数据块间隔、Embedding 延迟，以及每 N 个请求返回一次 429
+
+单独运行：
+    python benchmarks/openai_stub.py --port 8765 --first-token-ms 300 --rate-limit-every 10
+然后用 get_llm_client(provider="deepseek", api_key="stub", base_url="http://127.0.0.1:8765")，
+或 RAGEngine(embedding_type="api", api_key="stub", base_url="http://127.0.0.1:8765") 访问。
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fake_embedder import HashEmbedder
+
+CACHE_UNIT = 64
+STREAM_CHUNK_CHARS = 20
+
+
+def _serialize(messages):
+    return "".join(f"<{m['role']}>{m['content']}" for m in messages)
+
+
+def _common_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class StubState:
+    """
+    reply_chars: 每次回复的字符数
+    first_token_ms: 收到对话请求到返回第一个数据块的延迟
+    chunk_delay_ms: 流式数据块之间的间隔（每块 20 个字符）
+    embed_ms: 每次 Embedding 请求的延迟
+    rate_limit_every: 每 N 个请求返回一次 429，0 表示不注入
+    reply: 可选，固定的回复文本，或 reply(request) -> 回复文本；不提供时回复 reply_chars 个字符的占位文本
+    """
+
+    def __init__(self, reply_chars=200, first_token_ms=0, chunk_delay_ms=0, embed_ms=0, rate_limit_every=0, dim=384,
+                 reply=None):
+        self.reply_chars = reply_chars
+        self.reply = reply
+        self.first_token_ms = first_token_ms
+        self.chunk_delay_ms = chunk_delay_ms
+        self.embed_ms = embed_ms
+        self.rate_limit_every = rate_limit_every
+        self.embedder = HashEmbedder(dim)
+        self.lock = threading.Lock()
+        self.prompts = []
+        self.requests = 0
+        self.rate_limited = 0
+
+    def reset(self):
+        with self.lock:
+            self.prompts = []
+            self.requests = 0
+            self.rate_limited = 0
+
+    def should_rate_limit(self):
+        with self.lock:
+            self.requests += 1
+            if self.rate_limit_every and self.requests % self.rate_limit_every == 0:
+                self.rate_limited += 1
+                return True
+            return False
+
+    def usage_for(self, prompt, completion_tokens):
+        with self.lock:
+            hit = max((_common_prefix(prompt, p) for p in self.prompts), default=0)
+            self.prompts.append(prompt)
+        hit = hit // CACHE_UNIT * CACHE_UNIT
+        return {
+            "prompt_tokens": len(prompt),
+            "completion_tokens": completion_tokens,
+            "total_tokens": len(prompt) + completion_tokens,
+            "prompt_cache_hit_tokens": hit,
+            "prompt_cache_miss_tokens": len(prompt) - hit,
+            "prompt_tokens_details": {"cached_tokens": hit}
+        }
+
+
+def _make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, payload, status=200):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if status == 429:
+                self.send_header("Retry-After", "0")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            path = self.path.rstrip("/")
+            if path.endswith("/reset"):
+                state.reset()
+                return self._send_json({"ok": True})
+            if path.endswith("/chat/completions") or path.endswith("/embeddings"):
+                if state.should_rate_limit():
+                    return self._send_json({"error": {
+                        "message": "Rate limit reached (stub)", "type": "rate_limit_error", "code": 429
+                    }}, status=429)
+                if path.endswith("/embeddings"):
+                    return self._embeddings(request)
+                return self._chat(request)
+            return self._send_json({"error": {"message": "not found"}}, status=404)
+
+        def _embeddings(self, request):
+            inputs = request.get("input", [])
+            if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                inputs = [inputs]
+            # OpenAIEmbeddings 可能先用 tiktoken 切成 Token id 列表再发送，这里按字符串处理
+            texts = [t if isinstance(t, str) else " ".join(map(str, t)) for t in inputs]
+            if state.embed_ms:
+                time.sleep(state.embed_ms / 1000)
+            vectors = state.embedder.embed_documents(texts)
+            tokens = sum(len(t) for t in texts)
+            return self._send_json({
+                "object": "list",
+                "model": request.get("model", "stub"),
+                "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+            })
+
+        def _chat(self, request):
+            if callable(state.reply):
+                reply = state.reply(request)
+            elif state.reply is not None:
+                reply = state.reply
+            else:
+                reply = ("模拟回复。" * state.reply_chars)[:state.reply_chars]
+            usage = state.usage_for(_serialize(request.get("messages", [])), len(reply))
+            base = {"id": "stub", "created": int(time.time()), "model": request.get("model", "stub")}
+            if state.first_token_ms:
+                time.sleep(state.first_token_ms / 1000)
+
+            if not request.get("stream"):
+                if state.chunk_delay_ms:
+                    time.sleep(state.chunk_delay_ms / 1000 * (len(reply) // STREAM_CHUNK_CHARS))
+                return self._send_json(dict(base, object="chat.completion", usage=usage, choices=[{
+                    "index": 0, "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": reply}
+                }]))
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+
+            def send(payload):
+                self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            for i in range(0, len(reply), STREAM_CHUNK_CHARS):
+                if i and state.chunk_delay_ms:
+                    time.sleep(state.chunk_delay_ms / 1000)
+                send(dict(base, object="chat.completion.chunk", choices=[{
+                    "index": 0, "finish_reason": None,
+                    "delta": {"role": "assistant", "content": reply[i:i + STREAM_CHUNK_CHARS]}
+                }]))
+            send(dict(base, object="chat.completion.chunk", choices=[{"index": 0, "finish_reason": "stop", "delta": {}}]))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                send(dict(base, object="chat.completion.chunk", choices=[], usage=usage))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+
+def start_stub(port=0, **options):
+    """在后台线程启动桩服务，返回 (server, base_url)；server.state 为 StubState，可调整参数或重置"""
+    state = StubState(**options)
+    server = ThreadingHTTPServer(("127.0.0.1", port), _make_handler(state))
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容接口桩")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--reply-chars", type=int, default=200)
+    parser.add_argument("--first-token-ms", type=float, default=0)
+    parser.add_argument("--chunk-delay-ms", type=float, default=0)
+    parser.add_argument("--embed-ms", type=float, default=0)
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="每 N 个请求返回一次 429，0 表示不注入")
+    args = parser.parse_args()
+    server, url = start_stub(
+        args.port,
+        reply_chars=args.reply_chars,
+        first_token_ms=args.first_token_ms,
+        chunk_delay_ms=args.chunk_delay_ms,
+        embed_ms=args.embed_ms,
+        rate_limit_every=args.rate_limit_every
+    )
+    print(f"桩服务已启动: {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
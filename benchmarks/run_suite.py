@@ -0,0 +1,322 @@
+"""
+离线基准测试套件：不需要 API Key，也不需要下载模型。
+
+- Embedding 使用确定性的 HashEmbedder（fake_embedder.py），或经本地桩服务的 API 模式
+- 对话模型使用本地 OpenAI 兼容桩服务（openai_stub.py），可配置延迟
+- 语料由 synthetic_corpus.py 生成
+
+测量：
+    ingest        入库吞吐（切分 + Embedding + 写入），按向量后端
+    query_size    单知识库检索延迟 vs 知识库大小
+    query_count   多知识库检索延迟 vs 同时检索的知识库数量
+    api_ingest    API Embedding 模式入库（含 429 注入，需要 langchain_community）
+    generation    端到端角色生成延迟：多路检索 + 生成 + 校验（流式）
+
+结果写入 benchmarks/results/<commit>.json，可用 --compare 与另一次结果对比。
+
+用法:
+    python benchmarks/run_suite.py --quick
+    python benchmarks/run_suite.py --compare benchmarks/results/abc1234.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from fake_embedder import HashEmbedder
+from openai_stub import start_stub
+from synthetic_corpus import generate_corpus, make_queries
+
+MODEL_NAME = "hash-embedder-384"
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+
+def available_backends():
+    from vector_backends import BACKENDS
+    backends = []
+    for name in BACKENDS:
+        if name == "chroma":
+            try:
+                import chromadb  # noqa: F401
+            except ImportError:
+                continue
+        backends.append(name)
+    return backends
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 2),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 2),
+        "mean_ms": round(statistics.mean(samples) * 1000, 2)
+    }
+
+
+def make_engine(tmp_dir, backend, **kwargs):
+    from rag_engine import RAGEngine
+    kwargs.setdefault("embeddings", HashEmbedder())
+    return RAGEngine(persist_directory=os.path.join(tmp_dir, backend), model_name=MODEL_NAME, backend=backend, **kwargs)
+
+
+def split_corpus(engine, chapters, source="synthetic.txt"):
+    return engine.text_splitter.create_documents(chapters, metadatas=[{"source": source} for _ in chapters])
+
+
+def bench_ingest(tmp_dir, backends, chars):
+    chapters, _ = generate_corpus(total_chars=chars, seed=1)
+    results = {}
+    for backend in backends:
+        engine = make_engine(tmp_dir, backend)
+        start = time.perf_counter()
+        docs = split_corpus(engine, chapters)
+        split_s = time.perf_counter() - start
+        start = time.perf_counter()
+        msg = engine.build_vector_store(docs, collection_name="ingest_bench")
+        build_s = time.perf_counter() - start
+        results[backend] = {
+            "chars": chars,
+            "chunks": len(docs),
+            "split_s": round(split_s, 3),
+            "build_s": round(build_s, 3),
+            "chunks_per_s": round(len(docs) / build_s, 1),
+            "message": msg
+        }
+        print(f"[ingest] {backend}: {len(docs)} 片段，切分 {split_s:.2f}s，入库 {build_s:.2f}s ({len(docs) / build_s:.0f} 片段/s)")
+    return results
+
+
+def bench_query_size(tmp_dir, backends, sizes, queries):
+    results = {}
+    for backend in backends:
+        engine = make_engine(tmp_dir, backend)
+        results[backend] = []
+        built = 0
+        seed = 100
+        for size in sizes:
+            # 在同一个知识库上逐步追加到目标大小
+            while built < size:
+                chapters, _ = generate_corpus(total_chars=200000, seed=seed)
+                seed += 1
+                docs = split_corpus(engine, chapters, source=f"part_{seed}.txt")[:size - built]
+                engine.build_vector_store(docs, collection_name="size_bench")
+                built = engine.backend.count("size_bench")
+            engine.query("预热", k=15, collection_names=["size_bench"])
+            samples = []
+            for q in queries:
+                start = time.perf_counter()
+                engine.query(q["query"], k=15, collection_names=["size_bench"])
+                samples.append(time.perf_counter() - start)
+            row = dict(size=built, **percentiles(samples))
+            results[backend].append(row)
+            print(f"[query_size] {backend}: {built} 片段 p50 {row['p50_ms']}ms p95 {row['p95_ms']}ms")
+    return results
+
+
+def bench_query_count(tmp_dir, backends, counts, chunks_per_collection, queries):
+    results = {}
+    for backend in backends:
+        engine = make_engine(tmp_dir, backend)
+        names = []
+        for i in range(max(counts)):
+            chapters, _ = generate_corpus(total_chars=chunks_per_collection * 800, seed=200 + i)
+            name = f"count_bench_{i}"
+            engine.build_vector_store(split_corpus(engine, chapters)[:chunks_per_collection], collection_name=name)
+            names.append(name)
+        results[backend] = []
+        for count in counts:
+            selected = names[:count]
+            engine.query("预热", k=15, collection_names=selected)
+            samples = []
+            for q in queries:
+                start = time.perf_counter()
+                engine.query(q["query"], k=15, collection_names=selected)
+                samples.append(time.perf_counter() - start)
+            row = dict(collections=count, **percentiles(samples))
+            results[backend].append(row)
+            print(f"[query_count] {backend}: {count} 个知识库 p50 {row['p50_ms']}ms p95 {row['p95_ms']}ms")
+    return results
+
+
+def bench_api_ingest(tmp_dir, server, url, chunks, rate_limit_every):
+    try:
+        import langchain_community.embeddings  # noqa: F401
+    except ImportError:
+        print("[api_ingest] 跳过：未安装 langchain_community")
+        return {"skipped": "langchain_community 未安装"}
+    server.state.reset()
+    server.state.rate_limit_every = rate_limit_every
+    try:
+        engine = make_engine(tmp_dir, "numpy", embeddings=None, embedding_type="api", api_key="stub", base_url=url)
+        chapters, _ = generate_corpus(total_chars=chunks * 800, seed=300)
+        docs = split_corpus(engine, chapters)[:chunks]
+        start = time.perf_counter()
+        msg = engine.build_vector_store(docs, collection_name="api_bench")
+        elapsed = time.perf_counter() - start
+    finally:
+        server.state.rate_limit_every = 0
+    result = {
+        "chunks": len(docs),
+        "build_s": round(elapsed, 3),
+        "chunks_per_s": round(len(docs) / elapsed, 1),
+        "stored": engine.backend.count("api_bench"),
+        "requests": server.state.requests,
+        "rate_limited": server.state.rate_limited,
+        "message": msg
+    }
+    print(f"[api_ingest] {len(docs)} 片段，{elapsed:.2f}s，429 次数 {result['rate_limited']}，实际入库 {result['stored']}")
+    return result
+
+
+def bench_generation(tmp_dir, backend, url, runs):
+    """模拟 app 中的角色生成：多路检索 → 生成（流式）→ 校验（流式）"""
+    from llm_client import get_llm_client
+    from prompt_prefix import build_prefix_message, sort_context_docs
+
+    engine = make_engine(tmp_dir, backend)
+    chapters, facts = generate_corpus(total_chars=400000, seed=400)
+    engine.build_vector_store(split_corpus(engine, chapters), collection_name="gen_bench")
+    client = get_llm_client(provider="deepseek", api_key="stub", base_url=url)
+    characters = sorted({f["character"] for f in facts})
+
+    rows = []
+    for i in range(runs):
+        name = characters[i % len(characters)]
+        start = time.perf_counter()
+        docs, _ = engine.retrieve_character(name, k=15, collection_names=["gen_bench"])
+        retrieval_s = time.perf_counter() - start
+
+        messages = [build_prefix_message(sort_context_docs(docs)), {"role": "user", "content": f"请为角色【{name}】撰写角色扮演 System Prompt。"}]
+        gen = client.chat(messages, label="生成")
+        draft = "".join(c.choices[0].delta.content or "" for c in gen)
+        judge = client.chat(messages + [{"role": "assistant", "content": draft}, {"role": "user", "content": "请校验并输出最终版本。"}], label="校验")
+        "".join(c.choices[0].delta.content or "" for c in judge)
+        total_s = time.perf_counter() - start
+        rows.append({
+            "retrieval_s": retrieval_s,
+            "gen_ttft_s": gen.ttft or 0,
+            "judge_ttft_s": judge.ttft or 0,
+            "total_s": total_s,
+            "cached_tokens": (judge.usage or {}).get("cached_tokens", 0)
+        })
+
+    result = {key: percentiles([r[key] for r in rows]) for key in ["retrieval_s", "gen_ttft_s", "judge_ttft_s", "total_s"]}
+    result["runs"] = runs
+    result["judge_cached_tokens"] = rows[-1]["cached_tokens"]
+    print(f"[generation] 检索 p50 {result['retrieval_s']['p50_ms']}ms，生成首 Token p50 {result['gen_ttft_s']['p50_ms']}ms，总耗时 p50 {result['total_s']['p50_ms']}ms")
+    return result
+
+
+def git_info():
+    def run(*args):
+        try:
+            return subprocess.check_output(["git", *args], cwd=REPO_DIR, stderr=subprocess.DEVNULL).decode().strip()
+        except Exception:
+            return ""
+    return {"commit": run("rev-parse", "--short", "HEAD") or "unknown", "dirty": bool(run("status", "--porcelain", "--untracked-files=no"))}
+
+
+def flatten(data, prefix=""):
+    items = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            items.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(data, list):
+        for i, value in enumerate(data):
+            items.update(flatten(value, f"{prefix}{i}."))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        items[prefix.rstrip(".")] = data
+    return items
+
+
+def compare(current, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = flatten(baseline["results"])
+    new = flatten(current["results"])
+    print(f"\n与 {baseline['git']['commit']} 对比（新/旧）：")
+    for key in sorted(set(old) & set(new)):
+        if not key.endswith(("_ms", "_s", "_per_s")) or not old[key]:
+            continue
+        ratio = new[key] / old[key]
+        flag = "  ⚠️" if (ratio > 1.2 and not key.endswith("_per_s")) or (ratio < 0.8 and key.endswith("_per_s")) else ""
+        print(f"  {key:<55}{old[key]:>12.2f}{new[key]:>12.2f}{ratio:>8.2f}x{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线基准测试套件")
+    parser.add_argument("--quick", action="store_true", help="小规模快速运行")
+    parser.add_argument("--only", nargs="*", choices=["ingest", "query_size", "query_count", "api_ingest", "generation"])
+    parser.add_argument("--backends", nargs="*", help="默认为已安装的全部后端")
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--chunk-delay-ms", type=float, default=5)
+    parser.add_argument("--out", help="结果文件路径，默认 benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help="与之前的结果文件对比")
+    args = parser.parse_args()
+
+    quick = args.quick
+    config = {
+        "ingest_chars": 300000 if quick else 2000000,
+        "sizes": [500, 2000] if quick else [1000, 5000, 20000],
+        "counts": [1, 2, 4] if quick else [1, 2, 4, 8],
+        "chunks_per_collection": 300 if quick else 2000,
+        "api_chunks": 40 if quick else 200,
+        "rate_limit_every": 7,
+        "generation_runs": 3 if quick else 10,
+        "first_token_ms": args.first_token_ms,
+        "chunk_delay_ms": args.chunk_delay_ms
+    }
+    selected = set(args.only or ["ingest", "query_size", "query_count", "api_ingest", "generation"])
+    backends = args.backends or available_backends()
+    _, facts = generate_corpus(seed=0)
+    queries = make_queries(facts)[:20]
+
+    server, url = start_stub(reply_chars=800, first_token_ms=config["first_token_ms"], chunk_delay_ms=config["chunk_delay_ms"])
+    tmp_dir = tempfile.mkdtemp(prefix="rag_bench_")
+    results = {}
+    try:
+        if "ingest" in selected:
+            results["ingest"] = bench_ingest(tmp_dir, backends, config["ingest_chars"])
+        if "query_size" in selected:
+            results["query_size"] = bench_query_size(tmp_dir, backends, config["sizes"], queries)
+        if "query_count" in selected:
+            results["query_count"] = bench_query_count(tmp_dir, backends, config["counts"], config["chunks_per_collection"], queries)
+        if "api_ingest" in selected:
+            results["api_ingest"] = bench_api_ingest(tmp_dir, server, url, config["api_chunks"], config["rate_limit_every"])
+        if "generation" in selected:
+            results["generation"] = bench_generation(tmp_dir, backends[0], url, config["generation_runs"])
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    report = {
+        "git": git_info(),
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": config,
+        "results": results
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"{report['git']['commit']}{'-dirty' if report['git']['dirty'] else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入 {out}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+合成中文小说语料：按随机种子确定性地生成章节正文，并在其中埋入各角色的“事实句”
+（外貌、口头禅、经历、人际关系），同时返回这些事实作为检索评测的标准答案。
+
+用法:
+    python benchmarks/synthetic_corpus.py --chars 2000000 --out /tmp/novel.txt --encoding gb18030
+"""
+import argparse
+import random
+
+SURNAMES = "林萧苏叶秦陆沈顾韩楚白温江柳慕容"
+GIVEN = "炎尘雪辰夜清羽风寒月霜青云逸晨瑶婉宁墨玄烟离"
+PLACES = ["青云山", "落霞城", "天剑宗", "幽冥谷", "万妖林", "紫霄殿", "东海之滨", "北境雪原", "藏经阁", "断魂崖"]
+OBJECTS = ["古剑", "玉佩", "丹炉", "残卷", "铜镜", "长笛", "灵石", "符箓", "酒壶", "油灯"]
+WEATHER = ["细雨", "大雪", "狂风", "浓雾", "烈日", "月色", "晨光", "暮色"]
+FILLER = [
+    "{place}上空{weather}弥漫，远处传来阵阵钟声。",
+    "众人沉默片刻，各自思量着{place}的传闻。",
+    "{weather}之中，一盏{obj}静静地放在石桌上。",
+    "据说{place}深处藏着一件{obj}，百年来无人得见。",
+    "山风吹过，卷起满地落叶，{weather}渐渐散去。",
+    "客栈里人声鼎沸，说书人正讲到{place}的往事。",
+    "那{obj}上刻着模糊的纹路，似乎是某种古老的阵法。",
+    "夜深了，{place}方向亮起点点火光。"
+]
+
+APPEARANCE = ["眉心有一道淡金色的火焰印记", "左手缺了一根小指", "常年穿一件洗得发白的青衫", "一双眼睛是罕见的琥珀色",
+              "鬓角早早生出几缕白发", "腰间总挂着一只朱红色的酒葫芦", "右颊有一道浅浅的剑痕", "身形瘦削却站得笔直"]
+CATCHPHRASE = ["天塌下来也得先吃饭", "三十年河东，三十年河西", "规矩是死的，人是活的", "这笔账我记下了",
+               "不急，好戏还在后头", "我只信手里的剑", "走一步看一步罢了", "输了就再来一次"]
+EVENTS = ["十二岁那年在{place}被逐出家门", "曾独自在{place}闭关三年", "为了一件{obj}与师门决裂",
+          "在{place}一战中失去了全部修为", "幼时被一位老乞丐收养，学会了辨认药草", "曾在{place}救下一整座城的百姓"]
+RELATIONS = ["视{other}为此生唯一的知己", "与{other}有杀父之仇", "暗中倾慕{other}多年",
+             "是{other}同父异母的兄长", "拜{other}为师却屡次顶撞", "与{other}立下十年之约"]
+
+ASPECTS = {
+    "appearance": "外貌描写",
+    "catchphrase": "口头禅、经典台词",
+    "event": "重要经历",
+    "relation": "人际关系"
+}
+
+
+def make_characters(count, rng):
+    names = set()
+    while len(names) < count:
+        names.add(rng.choice(SURNAMES) + "".join(rng.sample(GIVEN, rng.choice([1, 2]))))
+    return sorted(names)
+
+
+def _fill(template, rng, **extra):
+    return template.format(place=rng.choice(PLACES), weather=rng.choice(WEATHER), obj=rng.choice(OBJECTS), **extra)
+
+
+def generate_corpus(total_chars=200000, num_characters=8, seed=42, chapter_chars=4000):
+    """
+    返回 (chapters, facts)
+    chapters: [章节正文]，每章以“第N章”开头
+    facts: [{"character", "aspect", "text", "key"}]，key 是事实句中独有的短语，用于判断检索命中
+    """
+    rng = random.Random(seed)
+    characters = make_characters(num_characters, rng)
+    facts = []
+    for name in characters:
+        other = rng.choice([c for c in characters if c != name])
+        details = {
+            "appearance": rng.choice(APPEARANCE),
+            "catchphrase": rng.choice(CATCHPHRASE),
+            "event": _fill(rng.choice(EVENTS), rng),
+            "relation": rng.choice(RELATIONS).format(other=other)
+        }
+        # 事实句带有方面相关的字眼（外貌、口头禅、经历、关系），
+        # 这样字面匹配的 HashEmbedder 也能检索到，评测结果才有区分度
+        texts = {
+            "appearance": f"说起{name}的外貌，{name}{details['appearance']}，旁人一眼便能认出。",
+            "catchphrase": f"{name}的口头禅是：“{details['catchphrase']}。”",
+            "event": f"{name}的经历颇为传奇：{details['event']}。",
+            "relation": f"论人际关系，{name}{details['relation']}，这件事在江湖上流传甚广。"
+        }
+        for aspect, text in texts.items():
+            facts.append({"character": name, "aspect": aspect, "text": text, "key": details[aspect]})
+
+    # 事实句均匀分布在全书中，其余内容为随机填充
+    num_chapters = max(1, total_chars // chapter_chars)
+    placements = {}
+    for fact in facts:
+        placements.setdefault(rng.randrange(num_chapters), []).append(fact["text"])
+
+    chapters = []
+    for index in range(num_chapters):
+        sentences = []
+        length = 0
+        pending = list(placements.get(index, []))
+        while length < chapter_chars:
+            if pending and rng.random() < 0.05:
+                sentence = pending.pop()
+            else:
+                speaker = rng.choice(characters)
+                sentence = _fill(rng.choice(FILLER), rng)
+                if rng.random() < 0.3:
+                    sentence = f"{speaker}望着{rng.choice(PLACES)}，" + sentence
+            sentences.append(sentence)
+            length += len(sentence)
+        sentences.extend(pending)
+        paragraphs = ["".join(sentences[i:i + 6]) for i in range(0, len(sentences), 6)]
+        chapters.append(f"第{index + 1}章 {rng.choice(PLACES)}\n\n" + "\n\n".join(paragraphs))
+    return chapters, facts
+
+
+def make_queries(facts):
+    """为每条事实生成一个“角色 + 方面”的查询，key 为应当检索到的短语"""
+    return [
+        {"query": f"{fact['character']} 的{ASPECTS[fact['aspect']]}", "character": fact["character"],
+         "aspect": fact["aspect"], "key": fact["key"]}
+        for fact in facts
+    ]
+
+
+def write_corpus(path, chapters, encoding="utf-8"):
+    with open(path, "w", encoding=encoding) as f:
+        f.write("\n\n".join(chapters))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成中文小说语料")
+    parser.add_argument("--chars", type=int, default=200000)
+    parser.add_argument("--characters", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--encoding", default="utf-8")
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+    chapters, facts = generate_corpus(args.chars, args.characters, args.seed)
+    write_corpus(args.out, chapters, args.encoding)
+    print(f"已生成 {len(chapters)} 章、{sum(len(c) for c in chapters)} 字，埋入 {len(facts)} 条角色事实: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
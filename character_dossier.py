@@ -0,0 +1,235 @@
+"""
+角色档案：入库后预先找出知识库中的主要角色，按生成提示词时的几个检索角度
+（外貌性格、说话风格、经历关系）各自检索并保存排好序的片段。
+
+生成提示词时直接读取档案，不必每次都做多路检索；档案记录知识库的版本号和 Embedding 模型，
+知识库内容变化后自动失效，未建档的角色或过期的档案退回实时检索。
+
+主要角色按出现频率判断：安装了 jieba 时用其词性标注中的人名（nr），
+否则按常见姓氏 + 一到两个字统计候选：人名后面常跟“说、道、笑、望”之类的字，前面的字则各不相同，
+据此排除“青云山”中的“云山”、“东海之滨”中的“东海”这类词，再合并“林萧 / 林萧然”这类前缀重叠的候选。
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+DOSSIER_FILE = "character_dossiers.sqlite3"
+
+# 生成提示词时的检索角度；修改措辞后旧档案自动失效
+CHARACTER_ASPECTS = [
+    ("profile", "关于角色 {name} 的外貌描写、性格特征、身世背景"),
+    ("speech", "{name} 的说话风格、口头禅、经典台词、语气"),
+    ("story", "{name} 的重要经历、关键剧情、人际关系、对其他人的态度"),
+]
+# 每个角度保存的片段数；生成时的检索片段数不超过它才能直接使用档案
+DOSSIER_DEPTH = 40
+# 自动建档的角色数上限，以及至少出现多少次才算主要角色
+MAX_CHARACTERS = 20
+MIN_MENTIONS = 10
+# 统计角色时最多读取的片段数（均匀抽样），大知识库不必全部扫描
+SCAN_CHUNKS = 3000
+
+SURNAMES = set(
+    "赵钱孙李周吴郑王冯陈褚卫蒋沈韩杨朱秦尤许何吕施张孔曹严华金魏陶姜戚谢邹喻柏窦章云苏潘葛范彭郎鲁韦昌马苗凤"
+    "花方俞任袁柳鲍史唐费廉岑薛雷贺倪汤滕殷罗毕郝邬安常乐于傅皮齐康伍余元顾孟黄和穆萧尹姚邵汪祁毛狄米贝明"
+    "臧计伏成戴宋庞熊纪舒屈项祝董梁杜阮蓝闵席季贾路江童颜郭梅盛林钟徐邱骆高夏蔡田樊胡凌霍虞万柯管卢莫房解"
+    "丁邓洪包石崔吉龚程邢裴陆荣翁荀甄曲封储靳段焦巴谷车侯全班仰秋仲伊宫宁仇甘厉戎祖武符刘景詹龙叶幸司黎薄"
+    "白蒲邰从鄂索赖卓蔺屠蒙池乔阴胥苍双闻党翟谭贡劳姬申冉郦雍桑桂濮牛寿通边燕冀尚温庄晏柴瞿阎慕连习艾鱼容"
+    "向古易慎戈廖庾终居衡步都耿满弘匡国文寇广禄东欧沃利蔚越隆师巩聂晁勾敖融冷辛阚那简饶空曾沙养鞠须丰巢关"
+    "蒯相查后荆红游竺权逯盖桓公楚"
+)
+COMPOUND_SURNAMES = {"欧阳", "司马", "上官", "诸葛", "东方", "慕容", "令狐", "独孤", "南宫", "公孙", "皇甫", "轩辕",
+                     "司徒", "夏侯", "西门", "宇文", "长孙", "端木", "尉迟", "百里", "呼延", "澹台", "拓跋", "赫连"}
+# 不会出现在人名中（姓氏之后）的常用字，用来排除“林中”“王的”之类的候选
+NON_NAME_CHARS = set("的了着过是在说道和与也就都不又把被对向从给让叫问笑看听想见这那个们里上下中来去到有没么吗呢吧啊"
+                     "一二三四五六七八九十百千万年月日时前后左右大小多少里外今当每各此其所之而以于则且并")
+# 常跟在人名后面的字（动作、神态；“的”地名后面也常见，不算）
+NAME_FOLLOWERS = set("说道笑问答望看听想点摇叹喊叫怒冷淡轻低沉皱却也便正微心手眼脸和与对向")
+# 后面跟着这些字的比例不到 FOLLOWER_RATIO，或前面总是同一个字（超过 BOUND_RATIO）的候选不是人名
+FOLLOWER_RATIO = 0.1
+BOUND_RATIO = 0.5
+# 以姓氏字开头的常用词
+NOT_NAMES = {"方向", "方法", "方面", "方才", "高兴", "高手", "白色", "明白", "文字", "马上", "王朝", "黄金", "金子",
+             "江湖", "东西", "东方", "安静", "安全", "常常", "平常", "于是", "成为", "成功", "宁愿", "通过", "万分",
+             "连忙", "向前", "古代", "易容", "国家", "关系", "关于", "相信", "相同", "全部", "全身", "石头", "龙王",
+             "花园", "云层", "雷电", "叶子", "林中", "公子", "公主"}
+
+_HAN = re.compile(r"[一-鿿]+")
+
+
+def _get_jieba_posseg():
+    try:
+        import jieba
+        import jieba.posseg as pseg
+        jieba.setLogLevel(60)
+        return pseg
+    except ImportError:
+        return None
+
+
+def _count_candidates(texts):
+    """
+    按姓氏统计候选人名：单姓 + 1~2 字，复姓 + 1~2 字。
+    返回 {候选: [出现次数, 后面跟着 NAME_FOLLOWERS 的次数, {前一个字: 次数}]}，句首的前一个字记为 None
+    """
+    counts = {}
+    for text in texts:
+        for run in _HAN.findall(text):
+            for i, ch in enumerate(run):
+                if run[i:i + 2] in COMPOUND_SURNAMES:
+                    lengths = (3, 4)
+                elif ch in SURNAMES:
+                    lengths = (2, 3)
+                else:
+                    continue
+                for length in lengths:
+                    if i + length > len(run):
+                        break
+                    candidate = run[i:i + length]
+                    if NON_NAME_CHARS.intersection(candidate[1:]):
+                        break
+                    stat = counts.get(candidate)
+                    if stat is None:
+                        stat = counts[candidate] = [0, 0, {}]
+                    stat[0] += 1
+                    if run[i + length:i + length + 1] in NAME_FOLLOWERS:
+                        stat[1] += 1
+                    before = run[i - 1] if i else None
+                    stat[2][before] = stat[2].get(before, 0) + 1
+    return counts
+
+
+def _looks_like_name(stat):
+    total, followed, before = stat
+    bound = max((n for ch, n in before.items() if ch is not None), default=0)
+    return followed >= FOLLOWER_RATIO * total and bound <= BOUND_RATIO * total
+
+
+def _merge_overlaps(counts, min_mentions):
+    """
+    “林萧然”几乎总是完整出现时保留三字名、去掉“林萧”；否则三字候选只是名字后面跟了别的字，去掉。
+    “萧然”这类被更长的名字包含的候选同样去掉。
+    """
+    names = {c: stat[0] for c, stat in counts.items()
+             if stat[0] >= min_mentions and c not in NOT_NAMES and _looks_like_name(stat)}
+    for name in sorted(names, key=len, reverse=True):
+        if name not in names:
+            continue
+        prefix = name[:-1]
+        if prefix in names and len(prefix) >= 2:
+            if names[name] >= 0.6 * names[prefix]:
+                del names[prefix]
+            else:
+                del names[name]
+    for name in sorted(names, key=len):
+        if any(name != other and name in other and names[other] >= 0.6 * names[name] for other in names):
+            del names[name]
+    return names
+
+
+def find_main_characters(texts, limit=MAX_CHARACTERS, min_mentions=MIN_MENTIONS):
+    """按出现次数找出主要角色，返回 [(名字, 次数)]，次数从高到低"""
+    pseg = _get_jieba_posseg()
+    if pseg is not None:
+        counts = {}
+        for text in texts:
+            for word, flag in pseg.cut(text):
+                if flag == "nr" and 2 <= len(word) <= 4 and word not in NOT_NAMES:
+                    counts[word] = counts.get(word, 0) + 1
+        names = {w: n for w, n in counts.items() if n >= min_mentions}
+    else:
+        names = _merge_overlaps(_count_candidates(texts), min_mentions)
+    return sorted(names.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+def aspects_signature():
+    """检索角度的措辞签名，措辞变化后旧档案作废"""
+    return zlib.crc32(json.dumps(CHARACTER_ASPECTS, ensure_ascii=False).encode("utf-8"))
+
+
+class DossierStore:
+    """
+    角色档案的持久化存储（SQLite），每个 (知识库, 角色) 一行。
+    data 为 zlib 压缩的 JSON：{"chunks": [[正文, metadata]], "aspects": {角度: [[片段序号, 分数]]}}，
+    各角度共用的片段只存一份。
+    """
+
+    def __init__(self, persist_directory):
+        os.makedirs(persist_directory, exist_ok=True)
+        self.path = os.path.join(persist_directory, DOSSIER_FILE)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS dossiers (
+                collection TEXT NOT NULL,
+                name TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                model TEXT NOT NULL,
+                signature INTEGER NOT NULL,
+                depth INTEGER NOT NULL,
+                mentions INTEGER,
+                built_at REAL NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (collection, name)
+            );
+        """)
+        self._conn.commit()
+
+    def put(self, collection_name, name, version, model, aspects, mentions=None):
+        """aspects: {角度: [(正文, metadata, 分数)]}，按分数从高到低"""
+        chunks, index, packed = [], {}, {}
+        for key, hits in aspects.items():
+            packed[key] = []
+            for text, meta, score in hits:
+                if text not in index:
+                    index[text] = len(chunks)
+                    chunks.append([text, meta])
+                packed[key].append([index[text], score])
+        data = zlib.compress(json.dumps({"chunks": chunks, "aspects": packed}, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dossiers (collection, name, version, model, signature, depth, mentions, built_at, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (collection_name, name, version, model, aspects_signature(), DOSSIER_DEPTH, mentions, time.time(), data)
+            )
+            self._conn.commit()
+
+    def get(self, collection_name, name, version, model):
+        """
+        读取与当前知识库版本、Embedding 模型和检索角度一致的档案，返回 {角度: [(正文, metadata, 分数)]} 与保存深度；
+        没有或已过期时返回 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, model, signature, depth, data FROM dossiers WHERE collection = ? AND name = ?",
+                (collection_name, name)
+            ).fetchone()
+        if not row or row[0] != version or row[1] != model or row[2] != aspects_signature():
+            return None
+        payload = json.loads(zlib.decompress(row[4]).decode("utf-8"))
+        chunks = payload["chunks"]
+        aspects = {key: [(chunks[i][0], chunks[i][1], score) for i, score in hits] for key, hits in payload["aspects"].items()}
+        return aspects, row[3]
+
+    def list(self, collection_name):
+        """[(角色, 出现次数, 版本号, 建档时间)]"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT name, mentions, version, built_at FROM dossiers WHERE collection = ? "
+                "ORDER BY COALESCE(mentions, 0) DESC, name", (collection_name,)
+            ).fetchall()
+
+    def forget_collection(self, collection_name):
+        with self._lock:
+            self._conn.execute("DELETE FROM dossiers WHERE collection = ?", (collection_name,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM dossiers")
+            self._conn.commit()
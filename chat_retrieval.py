@@ -0,0 +1,180 @@
+"""
+自由对话的检索：按用户选择的知识库检索，并在会话内维护一个片段“工作集”，追问时尽量复用。
+
+- 查询结合上下文：追问往往很短、不带主语（“那他后来呢？”），追问连同上一个问题、
+  以及最近 FOLLOWUP_TURNS 轮内最后一个完整的问题一起检索
+- 工作集：实时检索到的片段连同向量保存在会话中（向量在本轮返回后从片段缓存 chunk_store 中取出，
+  入库时已经算过，不再调用 Embedding；缓存中没有的旧片段才重新计算）。
+  本轮查询与之前某次实时检索的查询足够接近（余弦相似度不低于 REUSE_QUERY_SIMILARITY，
+  例如重问、换个标点或语气词），且那次检索到的片段仍都在工作集中时，不再检索知识库，
+  而是用本轮查询向量给工作集重新打分、取前 k 个；否则实时检索，新片段加入工作集，
+  超出上限时淘汰与本轮查询最不相关的片段。知识库选择或内容（统计目录版本号）变化时清空工作集
+- 检索在线程池中进行（submit 返回 Future），调用方同时组装提示词，需要片段时再等待结果
+
+每轮检索的耗时、是否复用记录在 metrics 的 chat_retrieval 事件中。
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+from chunk_store import chunk_hash
+
+CHAT_RETRIEVAL_K = 3
+# 工作集最多保留的片段数
+MAX_WORKING_SET = 30
+# 很短、或以代词 / 承接词开头的问题视为追问，带上之前的问题一起检索
+FOLLOWUP_MAX_CHARS = 8
+FOLLOWUP_PREFIXES = ("他", "她", "它", "那", "这", "还", "再", "能再", "然后", "后来", "继续", "为什么")
+FOLLOWUP_TURNS = 4
+REUSE_QUERY_SIMILARITY = 0.95
+# 记住最近多少次实时检索的查询向量
+MAX_SEARCHED_QUERIES = 20
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-retrieval")
+
+
+def is_followup(question):
+    return len(question) < FOLLOWUP_MAX_CHARS or question.startswith(FOLLOWUP_PREFIXES)
+
+
+def build_chat_query(history):
+    """
+    history 的最后一条为本轮用户消息；返回用于检索的查询文本。
+    追问时查询由三部分组成：最近一个完整的问题（通常带有主语）、上一个问题、本轮问题
+    """
+    questions = [m["content"].strip() for m in history if m["role"] == "user"]
+    if not questions:
+        return ""
+    current = questions[-1]
+    if not is_followup(current):
+        return current
+    earlier = questions[-1 - FOLLOWUP_TURNS:-1]
+    anchor = next((q for q in reversed(earlier) if not is_followup(q)), None)
+    parts = [anchor, earlier[-1] if earlier else None, current]
+    return "\n".join(dict.fromkeys(p for p in parts if p))
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+class ChatWorkingSet:
+    """一个对话会话的检索工作集，保存在 session_state 中"""
+
+    def __init__(self, max_size=MAX_WORKING_SET):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.key = None
+        self.texts = []
+        self.metadatas = []
+        self.vectors = None
+        # 最近几次实时检索的查询向量及其检索到的片段
+        self.searched = None
+        self.searched_hits = []
+        self._pending = None
+
+    def __len__(self):
+        return len(self.texts)
+
+    def submit(self, engine, query, k=CHAT_RETRIEVAL_K, collection_names=None):
+        """在线程池中检索，返回 Future，结果同 retrieve"""
+        return _executor.submit(self.retrieve, engine, query, k, collection_names)
+
+    def retrieve(self, engine, query, k=CHAT_RETRIEVAL_K, collection_names=None):
+        """
+        返回 (Document 列表, 本轮信息)
+        本轮信息: {"reused": 是否复用工作集, "new": 新加入的片段数, "working_set": 工作集大小, "ms": 耗时}
+        """
+        from langchain_core.documents import Document
+        collection_names = list(collection_names or ["character_data"])
+        start = time.perf_counter()
+        with self._lock, metrics.span("chat_retrieval", k=k, collections=len(collection_names)) as span:
+            key = (engine.embedding_model_name, tuple((c, engine.stats.version(c)) for c in collection_names))
+            if key != self.key:
+                self.reset()
+                self.key = key
+
+            with metrics.span("embed_query", chars=len(query)):
+                query_vector = _normalize(engine.embeddings.embed_query(query))
+
+            reused = False
+            if self.searched is not None:
+                similarity = self.searched @ query_vector
+                nearest = int(np.argmax(similarity))
+                reused = bool(similarity[nearest] >= REUSE_QUERY_SIMILARITY
+                              and len(self.searched_hits[nearest]) >= k and self.searched_hits[nearest] <= set(self.texts))
+            fresh = []
+            if reused:
+                scores = self.vectors @ query_vector
+                order = np.argsort(-scores, kind="stable")[:k]
+                results = [(self.texts[i], self.metadatas[i]) for i in order]
+                self._evict(scores)
+            else:
+                hits = engine.search_vector(query_vector, k, collection_names)
+                results = [(text, meta) for text, meta, _ in hits]
+                known = set(self.texts)
+                fresh = [(text, meta) for text, meta in results if text not in known]
+                # 新片段的向量在本轮返回之后再取（下一轮检索前完成），不增加本轮的等待
+                self._pending = _executor.submit(self._add_chunks, engine, key, query_vector, fresh, {text for text, _ in results})
+
+            span["reused"] = reused
+            span["new"] = len(fresh)
+            span["working_set"] = len(self.texts) + len(fresh)
+        docs = [Document(page_content=text, metadata=meta) for text, meta in results]
+        info = {"reused": reused, "new": len(fresh), "working_set": len(self.texts) + len(fresh),
+                "ms": (time.perf_counter() - start) * 1000}
+        return docs, info
+
+    def wait(self):
+        """等待上一轮的新片段加入工作集"""
+        pending = self._pending
+        if pending is not None:
+            pending.result()
+
+    def _add_chunks(self, engine, key, query_vector, fresh, hit_texts):
+        """把实时检索到的新片段及其向量加入工作集，记录这次检索的查询"""
+        with self._lock:
+            if key != self.key:
+                return
+            try:
+                if fresh:
+                    vectors = _normalize(self._chunk_vectors(engine, [text for text, _ in fresh]))
+                    self.texts.extend(text for text, _ in fresh)
+                    self.metadatas.extend(meta for _, meta in fresh)
+                    self.vectors = vectors if self.vectors is None else np.concatenate([self.vectors, vectors])
+            except Exception as e:
+                print(f"获取工作集片段向量失败: {e}")
+                return
+            searched = query_vector[None, :] if self.searched is None else np.vstack([self.searched, query_vector])
+            self.searched = searched[-MAX_SEARCHED_QUERIES:]
+            self.searched_hits = (self.searched_hits + [hit_texts])[-MAX_SEARCHED_QUERIES:]
+            if self.texts:
+                self._evict(self.vectors @ query_vector)
+
+    @staticmethod
+    def _chunk_vectors(engine, texts):
+        """取片段入库时的向量；片段缓存建立之前入库的片段不在缓存中，只对这些片段调用 Embedding"""
+        hashes = [chunk_hash(engine.embedding_model_name, text) for text in texts]
+        stored = engine.chunk_store.get_vectors(hashes)
+        missing = [text for h, text in zip(hashes, texts) if h not in stored]
+        if missing:
+            stored.update(zip((chunk_hash(engine.embedding_model_name, t) for t in missing),
+                              engine.embeddings.embed_documents(missing)))
+        return [stored[h] for h in hashes]
+
+    def _evict(self, scores):
+        """超出上限时淘汰与本轮查询最不相关的片段"""
+        if len(self.texts) <= self.max_size:
+            return
+        keep = np.sort(np.argsort(-scores, kind="stable")[:self.max_size])
+        self.texts = [self.texts[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+        self.vectors = self.vectors[keep]
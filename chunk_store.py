@@ -0,0 +1,132 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+CHUNK_STORE_FILE = "chunk_store.sqlite3"
+
+
+def chunk_hash(model_name, text):
+    """片段的内容地址：同一 Embedding 模型下相同正文得到相同哈希"""
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class ChunkStore:
+    """
+    内容寻址的片段/向量缓存：相同片段只计算一次 Embedding，其他知识库入库时直接取用这里的向量；
+    各知识库通过引用计数共享，删除知识库时释放引用，无人引用的片段随之删除。
+    向量后端仍各自保存自己的向量和正文，这里是额外的一份，省下的是 Embedding 调用而不是磁盘空间。
+    """
+
+    def __init__(self, persist_directory):
+        os.makedirs(persist_directory, exist_ok=True)
+        self.path = os.path.join(persist_directory, CHUNK_STORE_FILE)
+        self._lock = threading.Lock()
+        # Streamlit 每次 rerun 可能在不同线程执行，连接由锁保护；
+        # 多个应用进程同时入库时等待对方的写事务，而不是立即报 database is locked
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                hash TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS refs (
+                hash TEXT NOT NULL,
+                collection TEXT NOT NULL,
+                PRIMARY KEY (hash, collection)
+            );
+            CREATE INDEX IF NOT EXISTS refs_collection ON refs (collection);
+        """)
+        self._conn.commit()
+
+    def _select_in(self, sql, keys, extra=()):
+        # SQLite 单条语句的参数个数有上限，分段查询
+        rows = []
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            placeholders = ",".join("?" * len(part))
+            rows.extend(self._conn.execute(sql.format(placeholders), tuple(extra) + tuple(part)).fetchall())
+        return rows
+
+    def filter_new(self, collection_name, hashes):
+        """返回尚未被该知识库引用的哈希（保持顺序，批内重复只保留一次）"""
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            rows = self._select_in("SELECT hash FROM refs WHERE collection = ? AND hash IN ({})", unique, (collection_name,))
+        existing = {r[0] for r in rows}
+        return [h for h in unique if h not in existing]
+
+    def get_vectors(self, hashes):
+        """返回 {hash: float32 向量}，只包含已存储的片段"""
+        with self._lock:
+            rows = self._select_in("SELECT hash, vector FROM chunks WHERE hash IN ({})", list(hashes))
+        return {h: np.frombuffer(blob, dtype=np.float32) for h, blob in rows}
+
+    def put(self, hashes, texts, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO chunks (hash, text, dim, vector) VALUES (?, ?, ?, ?)",
+                [(h, t, int(v.shape[0]), v.tobytes()) for h, t, v in zip(hashes, texts, vectors)]
+            )
+            self._conn.commit()
+
+    def add_refs(self, collection_name, hashes):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO refs (hash, collection) VALUES (?, ?)",
+                [(h, collection_name) for h in hashes]
+            )
+            self._conn.commit()
+
+    def release(self, collection_name, hashes):
+        """释放知识库对部分片段的引用（例如网页更新后删掉的旧片段）；不再被引用的片段由 purge_orphans 删除"""
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM refs WHERE collection = ? AND hash = ?",
+                [(collection_name, h) for h in hashes]
+            )
+            self._conn.commit()
+
+    def release_collection(self, collection_name):
+        """释放知识库的全部引用，返回释放的引用数；不再被引用的片段由 purge_orphans 删除"""
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM refs WHERE collection = ?", (collection_name,))
+            self._conn.commit()
+            return cur.rowcount
+
+    def purge_orphans(self):
+        """删除不再被任何知识库引用的片段（要扫描整张表，删除大知识库后在后台执行），返回删除的片段数"""
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM chunks WHERE hash NOT IN (SELECT hash FROM refs)")
+            self._conn.commit()
+            return cur.rowcount
+
+    def vacuum(self):
+        """把删除片段后空出的页面还给文件系统"""
+        with self._lock:
+            self._conn.execute("VACUUM")
+            # WAL 模式下 VACUUM 先写入 -wal 文件，检查点后截断
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM refs")
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.commit()
+
+    def dedup_stats(self):
+        """
+        去重统计：refs 为各知识库引用总数，unique 为缓存的片段数，
+        reused 为直接取用缓存向量、没有重新 Embedding 的片段数，store_bytes 为缓存本身占用的磁盘空间
+        """
+        with self._lock:
+            unique = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            refs = self._conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        store_bytes = sum(os.path.getsize(self.path + suffix) for suffix in ["", "-wal"] if os.path.exists(self.path + suffix))
+        return {"refs": refs, "unique": unique, "reused": max(refs - unique, 0), "store_bytes": store_bytes}
@@ -0,0 +1,69 @@
+import copy
+import json
+import os
+import threading
+
+# 进程级缓存：同一路径只对应一个 JsonConfigStore
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+class JsonConfigStore:
+    """
+    带内存缓存的 JSON 配置文件：读取时只做一次 stat 检查文件是否被外部修改，
+    写入时内容没有变化就不落盘。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = None
+        self._mtime = None
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self):
+        """返回配置副本；文件不存在或损坏时返回 None"""
+        with self._lock:
+            mtime = self._file_mtime()
+            if mtime != self._mtime:
+                self._data = None
+                if mtime is not None:
+                    try:
+                        with open(self.path, "r", encoding="utf-8") as f:
+                            self._data = json.load(f)
+                    except Exception as e:
+                        print(f"读取配置 {self.path} 失败: {e}")
+                self._mtime = mtime
+            return copy.deepcopy(self._data)
+
+    def save(self, config):
+        """配置有变化时才写入文件，返回是否实际写入"""
+        with self._lock:
+            if config == self._data and self._mtime == self._file_mtime():
+                return False
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(config, f)
+            self._data = copy.deepcopy(config)
+            self._mtime = self._file_mtime()
+            return True
+
+    def delete(self):
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._data = None
+            self._mtime = None
+
+
+def get_config_store(path):
+    with _STORES_LOCK:
+        store = _STORES.get(path)
+        if store is None:
+            store = JsonConfigStore(path)
+            _STORES[path] = store
+        return store
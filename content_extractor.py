@@ -0,0 +1,453 @@
+"""
+网页正文提取：切分之前去掉导航、广告、评论区和推荐列表，只保留章节正文。
+
+一次流式解析同时完成三件事：收集链接（供抓取队列使用）、统计每个容器元素的文字量 / 标点 / 链接密度、
+记录文本片段的位置。正文容器按文字密度打分（参考 Readability：段落给所在容器和上一级容器加分，
+链接密度高、class/id 像导航或评论的容器降权），然后只取该容器内、去掉链接列表后的文字。
+
+同一站点的章节页通常共用一个模板，提取器会按站点学习：
+  - 同一个容器路径连续多次胜出后记为该站点的正文选择器，之后直接使用，不再依赖打分；
+  - 多个页面正文中反复出现的行（“本章未完，请点击下一页继续阅读”之类）记为模板文字，之后自动去掉。
+学到的结果保存在 site_templates.json。
+
+解析后端：安装了 lxml 时使用其 C 实现的 HTML 解析器（parser target 接口），否则使用标准库 html.parser。
+"""
+import re
+import threading
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+
+from config_store import get_config_store
+
+SITE_TEMPLATES_FILE = "site_templates.json"
+
+# 内容完全忽略的元素
+SKIP_TAGS = {"script", "style", "noscript", "iframe", "textarea", "select", "button", "svg", "template", "object"}
+# 可以作为正文容器的元素
+CONTAINER_TAGS = {"body", "div", "article", "section", "main", "td", "dd", "center", "blockquote", "pre",
+                  "nav", "header", "footer", "aside", "ul", "ol", "form", "table"}
+# 结束时产生换行的元素
+BREAK_TAGS = CONTAINER_TAGS | {"p", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "dt", "br", "hr"}
+VOID_TAGS = {"br", "hr", "img", "meta", "link", "input", "area", "base", "col", "embed", "source", "track", "wbr", "param"}
+
+PUNCTUATION = "，。！？；：…“”、,.!?;"
+POSITIVE_HINT = re.compile(r"content|article|chapter|read|text|txt|main|zw", re.I)
+NEGATIVE_HINT = re.compile(r"comment|footer|nav|menu|sidebar|recommend|tuijian|rank|hot|share|banner|pinglun|login|"
+                           r"copyright|crumb|advert|guanggao|(^|[\s_-])ads?([\s_-]|$)", re.I)
+
+# 段落至少多少字才参与打分
+MIN_PARAGRAPH_CHARS = 5
+# 同一容器路径胜出多少次后记为站点选择器
+LEARN_AFTER = 3
+# 每个站点用前多少页统计重复行
+LINE_LEARN_PAGES = 20
+# 行在多大比例的页面中出现才算模板文字
+BOILERPLATE_RATIO = 0.6
+BOILERPLATE_MAX_CHARS = 80
+# 选出的正文太短时（例如目录页）退回整页文字
+MIN_CONTENT_CHARS = 50
+
+_SPACES = re.compile(r"[ \t\r\n\f\v 　]+")
+_DIGITS = re.compile(r"\d+")
+_SELECTOR = re.compile(r"^([a-z0-9]+)?(#[\w-]+)?((?:\.[\w-]+)*)$", re.I)
+
+
+class _Container:
+    __slots__ = ("tag", "id", "classes", "path", "seg_start", "seg_end", "chars", "link_chars", "punct", "score", "hint")
+
+    def __init__(self, tag, element_id, classes, path, seg_start, chars, link_chars, punct):
+        self.tag = tag
+        self.id = element_id
+        self.classes = classes
+        self.path = path
+        self.seg_start = seg_start
+        self.seg_end = seg_start
+        # 打开时的全局计数，关闭时换算成子树内的数量
+        self.chars = chars
+        self.link_chars = link_chars
+        self.punct = punct
+        self.score = 0.0
+        hint_text = f"{element_id} {' '.join(classes)}"
+        self.hint = 1.0
+        if POSITIVE_HINT.search(hint_text):
+            self.hint *= 1.5
+        if NEGATIVE_HINT.search(hint_text):
+            self.hint *= 0.3
+
+    @property
+    def link_density(self):
+        return self.link_chars / self.chars if self.chars else 0.0
+
+    def matches(self, selector):
+        tag, element_id, classes = selector
+        return ((not tag or tag == self.tag) and (not element_id or element_id == self.id)
+                and all(c in self.classes for c in classes))
+
+
+class _PageHandler:
+    """
+    解析回调（lxml parser target 与 html.parser 共用）：维护元素栈，
+    记录文本片段、链接和每个容器的统计。
+    """
+
+    def __init__(self):
+        self.stack = []  # [(tag, container 或 None, path)]
+        self.segments = []  # 文本片段，"\n" 表示换行
+        self.in_link = []  # 每个片段是否为链接文字
+        self.containers = []
+        self.links = []
+        self.title = ""
+        self.chars = 0
+        self.link_chars = 0
+        self.punct = 0
+        self._skip = 0
+        self._link = None  # [href, 文字片段]
+        self._in_title = False
+        self._run_chars = 0
+        self._run_punct = 0
+
+    def _nearest_containers(self):
+        found = []
+        for _, container, _ in reversed(self.stack):
+            if container is not None:
+                found.append(container)
+                if len(found) == 2:
+                    break
+        return found
+
+    def _flush_run(self):
+        # 一段连续的非链接文字（以换行或块级元素为界）算一个段落，给所在容器加分、上一级加一半
+        if self._run_chars >= MIN_PARAGRAPH_CHARS:
+            score = 1 + self._run_punct + min(self._run_chars / 100, 3)
+            nearest = self._nearest_containers()
+            if nearest:
+                nearest[0].score += score
+            if len(nearest) > 1:
+                nearest[1].score += score / 2
+        self._run_chars = 0
+        self._run_punct = 0
+
+    def _break(self):
+        self._flush_run()
+        if self.segments and self.segments[-1] != "\n":
+            self.segments.append("\n")
+            self.in_link.append(False)
+
+    def start(self, tag, attrs):
+        tag = tag.lower() if isinstance(tag, str) else ""
+        if tag in VOID_TAGS:
+            if tag in ("br", "hr") and not self._skip:
+                self._break()
+            return
+        if self._skip or tag in SKIP_TAGS:
+            self._skip += 1
+            self.stack.append((tag, None, None))
+            return
+        if tag == "title":
+            self._in_title = True
+        elif tag == "a":
+            self._link = [attrs.get("href"), []]
+        if tag in BREAK_TAGS:
+            self._break()
+
+        parent_path = self.stack[-1][2] if self.stack else ""
+        element_id = attrs.get("id") or ""
+        classes = tuple(sorted((attrs.get("class") or "").split()))
+        # 路径里的数字统一掉（chapter-123 之类），同一模板的页面得到相同的路径
+        step = tag + (f"#{element_id}" if element_id else "") + "".join("." + c for c in classes)
+        path = f"{parent_path}>{_DIGITS.sub('0', step)}" if parent_path else _DIGITS.sub("0", step)
+        container = None
+        if tag in CONTAINER_TAGS:
+            container = _Container(tag, element_id, classes, path, len(self.segments), self.chars, self.link_chars, self.punct)
+        self.stack.append((tag, container, path))
+
+    def end(self, tag):
+        tag = tag.lower() if isinstance(tag, str) else ""
+        if tag in VOID_TAGS:
+            return
+        # 容错：关闭标签找不到对应的开始标签时忽略；中间未闭合的元素一并关闭
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == tag:
+                break
+        else:
+            return
+        while len(self.stack) > i:
+            self._close(self.stack.pop())
+
+    def _close(self, frame):
+        tag, container, _ = frame
+        if self._skip:
+            self._skip -= 1
+            return
+        if tag == "title":
+            self._in_title = False
+        elif tag == "a" and self._link is not None:
+            href, parts = self._link
+            if href:
+                self.links.append((href, "".join(parts).strip()))
+            self._link = None
+        if tag in BREAK_TAGS:
+            self._break()
+        if container is not None:
+            container.seg_end = len(self.segments)
+            container.chars = self.chars - container.chars
+            container.link_chars = self.link_chars - container.link_chars
+            container.punct = self.punct - container.punct
+            self.containers.append(container)
+
+    def data(self, text):
+        if self._skip:
+            return
+        if self._in_title:
+            self.title += text
+            return
+        text = _SPACES.sub(" ", text)
+        stripped = text.strip()
+        if not stripped:
+            return
+        length = len(stripped)
+        punct = sum(stripped.count(p) for p in PUNCTUATION)
+        self.chars += length
+        self.punct += punct
+        if self._link is not None:
+            self._link[1].append(stripped)
+            self.link_chars += length
+        else:
+            self._run_chars += length
+            self._run_punct += punct
+        # 保留两端的空白，英文单词之间不会粘连；换行处的空白最后统一去掉
+        self.segments.append(text)
+        self.in_link.append(self._link is not None)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        while self.stack:
+            self._close(self.stack.pop())
+        self._flush_run()
+        return self
+
+
+class _StdlibParser(HTMLParser):
+    def __init__(self, handler):
+        super().__init__(convert_charrefs=True)
+        self.handler = handler
+
+    def handle_starttag(self, tag, attrs):
+        self.handler.start(tag, dict((k, v or "") for k, v in attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handler.start(tag, dict((k, v or "") for k, v in attrs))
+        self.handler.end(tag)
+
+    def handle_endtag(self, tag):
+        self.handler.end(tag)
+
+    def handle_data(self, data):
+        self.handler.data(data)
+
+
+_lxml_etree = None
+
+
+def _get_lxml():
+    global _lxml_etree
+    if _lxml_etree is None:
+        try:
+            from lxml import etree
+            _lxml_etree = etree
+        except Exception:
+            _lxml_etree = False
+    return _lxml_etree
+
+
+def parser_backend():
+    return "lxml" if _get_lxml() else "html.parser"
+
+
+def parse_html(html, backend=None):
+    """
+    解析页面，返回 _PageHandler（文本片段、链接、容器统计）
+    backend: None 自动选择，"lxml" / "html.parser" 指定后端（基准测试用）
+    """
+    etree = _get_lxml() if backend in (None, "lxml") else None
+    if etree:
+        handler = _PageHandler()
+        try:
+            parser = etree.HTMLParser(target=handler, remove_comments=True, recover=True)
+            parser.feed(html)
+            return parser.close()
+        except Exception:
+            # 个别页面 lxml 无法处理（例如字符串里带编码声明），退回标准库
+            pass
+    handler = _PageHandler()
+    parser = _StdlibParser(handler)
+    parser.feed(html)
+    parser.close()
+    return handler.close()
+
+
+def parse_selector(selector):
+    """解析简单选择器 tag#id.class（不支持后代、属性等组合），返回 (tag, id, classes)"""
+    match = _SELECTOR.match((selector or "").strip())
+    if not selector or not match:
+        raise ValueError(f"不支持的正文选择器: {selector}")
+    tag, element_id, classes = match.groups()
+    return (tag or "").lower(), (element_id or "")[1:], tuple(c for c in (classes or "").split(".") if c)
+
+
+class ExtractedPage:
+    """
+    text: 正文（按段落换行）；title: 页面标题；links: [(href, 链接文字)]，未规范化
+    method: selector (配置的选择器) / learned (站点学到的选择器) / density (打分) / fallback (整页文字)
+    page_chars: 整页可见文字数，用来估算正文提取去掉了多少内容
+    """
+
+    def __init__(self, text, title, links, method, path, page_chars):
+        self.text = text
+        self.title = title
+        self.links = links
+        self.method = method
+        self.path = path
+        self.page_chars = page_chars
+
+
+class _SiteProfile:
+    def __init__(self, saved=None):
+        saved = saved or {}
+        self.selector = saved.get("selector")
+        self.boilerplate = set(saved.get("boilerplate", []))
+        self.votes = {}
+        self.pages = 0
+        self.line_pages = 0
+        self.line_counts = {}
+
+    def to_json(self):
+        return {"selector": self.selector, "boilerplate": sorted(self.boilerplate)}
+
+
+class ContentExtractor:
+    """
+    按站点学习模板的正文提取器。profile_path 为 None 时只在内存中学习。
+    """
+
+    def __init__(self, profile_path=None, learn_after=LEARN_AFTER, backend=None):
+        self.learn_after = learn_after
+        self.backend = backend
+        self._store = get_config_store(profile_path) if profile_path else None
+        self._lock = threading.Lock()
+        saved = (self._store.load() if self._store else None) or {}
+        self._profiles = {host: _SiteProfile(data) for host, data in saved.items()}
+
+    def _profile(self, url):
+        host = (urlparse(url).hostname or "") if url else ""
+        profile = self._profiles.get(host)
+        if profile is None:
+            profile = self._profiles[host] = _SiteProfile()
+        return profile
+
+    def _save(self):
+        if self._store:
+            self._store.save({host: p.to_json() for host, p in self._profiles.items() if p.selector or p.boilerplate})
+
+    def extract(self, html, url=None, selector=None, learn=True):
+        """
+        selector: 站点配置的正文选择器（tag#id.class），优先于学到的和打分选出的容器
+        learn: 是否用这个页面学习站点模板（目录页等非正文页面应传 False）
+        """
+        page = parse_html(html, self.backend)
+        title = page.title.strip()
+        page_chars = page.chars
+        with self._lock:
+            profile = self._profile(url)
+
+        chosen, method = None, "density"
+        if selector:
+            wanted = parse_selector(selector)
+            chosen = next((c for c in page.containers if c.matches(wanted)), None)
+            method = "selector"
+        if chosen is None and profile.selector:
+            chosen = next((c for c in page.containers if c.path == profile.selector and c.chars >= MIN_CONTENT_CHARS), None)
+            method = "learned"
+        if chosen is None:
+            method = "density"
+            candidates = [c for c in page.containers if c.score > 0]
+            if candidates:
+                chosen = max(candidates, key=lambda c: c.score * c.hint * (1 - c.link_density))
+                if chosen.chars - chosen.link_chars < MIN_CONTENT_CHARS:
+                    chosen = None
+
+        if chosen is None:
+            text = _join_segments(page, 0, len(page.segments), [], include_links=True)
+            return ExtractedPage(text, title, page.links, "fallback", None, page_chars)
+
+        # 正文容器内部的链接列表（推荐阅读、章节导航等）整块去掉
+        excluded = [(c.seg_start, c.seg_end) for c in page.containers
+                    if c is not chosen and chosen.seg_start <= c.seg_start and c.seg_end <= chosen.seg_end
+                    and c.chars and c.link_density > 0.5]
+        text = _join_segments(page, chosen.seg_start, chosen.seg_end, excluded)
+        if learn:
+            text = self._learn(profile, chosen.path if method == "density" else None, text)
+        elif profile.boilerplate:
+            text = _strip_lines(text, profile.boilerplate)
+        return ExtractedPage(text, title, page.links, method, chosen.path, page_chars)
+
+    def _learn(self, profile, path, text):
+        """记录容器路径的投票和正文中的行，返回去掉模板文字后的正文"""
+        lines = text.split("\n")
+        changed = False
+        with self._lock:
+            profile.pages += 1
+            if path:
+                profile.votes[path] = profile.votes.get(path, 0) + 1
+                if profile.selector is None and profile.votes[path] >= self.learn_after \
+                        and profile.votes[path] >= 0.8 * sum(profile.votes.values()):
+                    profile.selector = path
+                    changed = True
+            if profile.line_pages < LINE_LEARN_PAGES:
+                profile.line_pages += 1
+                for line in set(lines):
+                    if 4 <= len(line) <= BOILERPLATE_MAX_CHARS:
+                        profile.line_counts[line] = profile.line_counts.get(line, 0) + 1
+                if profile.line_pages >= self.learn_after:
+                    threshold = max(self.learn_after, BOILERPLATE_RATIO * profile.line_pages)
+                    repeated = {line for line, n in profile.line_counts.items() if n >= threshold}
+                    if not repeated <= profile.boilerplate:
+                        profile.boilerplate |= repeated
+                        changed = True
+                if profile.line_pages == LINE_LEARN_PAGES:
+                    profile.line_counts = {}
+            boilerplate = profile.boilerplate
+            if changed:
+                self._save()
+        return _strip_lines(text, boilerplate)
+
+
+def _strip_lines(text, boilerplate):
+    if not boilerplate:
+        return text
+    return "\n".join(line for line in text.split("\n") if line not in boilerplate)
+
+
+def _join_segments(page, start, end, excluded, include_links=False):
+    parts = []
+    skip_until = -1
+    excluded = sorted(excluded)
+    j = 0
+    for i in range(start, end):
+        while j < len(excluded) and excluded[j][0] <= i:
+            skip_until = max(skip_until, excluded[j][1])
+            j += 1
+        if i < skip_until:
+            continue
+        segment = page.segments[i]
+        if page.in_link[i] and not include_links:
+            continue
+        if segment == "\n":
+            if parts and parts[-1] != "\n":
+                parts.append("\n")
+        else:
+            parts.append(segment)
+    lines = "".join(parts).split("\n")
+    return "\n".join(line.strip() for line in lines if line.strip())
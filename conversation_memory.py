@@ -0,0 +1,164 @@
+"""
+对话记忆管理：按 Token 预算裁剪历史、把较早的轮次滚动压缩成摘要、
+并对已经在本次请求中出现过的检索片段去重，减少每轮重复发送的 Token。
+
+历史消息格式与 session_state 中保存的一致：{"role", "content"}，
+用户消息可以额外带 "context": [检索片段, ...]，发送时渲染为【原文片段】块。
+"""
+import hashlib
+
+_encoder = None
+
+
+def count_tokens(text):
+    """估算 Token 数：优先使用 tiktoken (cl100k_base)，未安装时按字符粗略估算"""
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoder = False
+    if _encoder:
+        return len(_encoder.encode(text, disallowed_special=()))
+    # 中文大约 1 字 1 Token，其余字符大约 4 个 1 Token
+    cjk = sum(1 for ch in text if "一" <= ch <= "鿿")
+    return cjk + (len(text) - cjk) // 4
+
+
+def count_message_tokens(messages):
+    # 每条消息另有约 4 个 Token 的格式开销
+    return sum(count_tokens(m["content"]) + 4 for m in messages)
+
+
+def _chunk_key(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def render_context(chunks):
+    return "【原文片段】\n" + "\n\n".join(chunks)
+
+
+def render_message(msg, skip_chunks=None):
+    """把带 context 的消息渲染成发送给模型的文本；skip_chunks 中的片段不再重复发送"""
+    chunks = msg.get("context") or []
+    if skip_chunks:
+        chunks = [c for c in chunks if _chunk_key(c) not in skip_chunks]
+    if not chunks:
+        return {"role": msg["role"], "content": msg["content"]}
+    return {"role": msg["role"], "content": render_context(chunks) + "\n\n" + msg["content"]}
+
+
+class ConversationMemory:
+    """
+    max_history_tokens: 历史消息（含其检索片段）的 Token 预算
+    summarizer: 可选，签名 summarizer(旧摘要, [被移出窗口的消息]) -> 新摘要；
+                不提供时超出预算的旧消息直接丢弃
+    """
+
+    def __init__(self, max_history_tokens=3000, summarizer=None, min_summary_messages=2):
+        self.max_history_tokens = max_history_tokens
+        self.summarizer = summarizer
+        # 至少积累这么多条移出窗口的消息才更新一次摘要，避免每轮都多一次模型调用
+        self.min_summary_messages = min_summary_messages
+        self.summary = ""
+        self.summarized_upto = 0
+        self.history_len = 0
+
+    def reset(self):
+        self.summary = ""
+        self.summarized_upto = 0
+        self.history_len = 0
+
+    def _update_summary(self, history, window_start):
+        if len(history) < self.history_len:
+            # 历史被清空或重新生成过
+            self.reset()
+        self.history_len = len(history)
+        # 窗口比上次大（例如本轮片段比预留的少）时已摘要的消息会同时出现在窗口中，摘要保留
+        dropped = history[self.summarized_upto:window_start]
+        if not dropped or len(dropped) < self.min_summary_messages or not self.summarizer:
+            return
+        # 摘要只压缩对话本身，检索片段不进入摘要
+        plain = [{"role": m["role"], "content": m["content"]} for m in dropped]
+        try:
+            self.summary = self.summarizer(self.summary, plain)
+            self.summarized_upto = window_start
+        except Exception as e:
+            print(f"更新对话摘要失败，本轮直接截断旧消息: {e}")
+
+    def prepare(self, history, system_prompt=None, reserve_tokens=0):
+        """
+        检索进行时先按当前历史更新摘要（可能需要调用模型）。
+        reserve_tokens 为本轮检索片段预留的 Token 数：片段到达后再调用 build_messages 时，
+        只要片段不超过预留，窗口就不会比这次更小，不会再次等待摘要
+        """
+        self.build_messages(history, system_prompt=system_prompt, reserve_tokens=reserve_tokens)
+
+    def build_messages(self, history, system_prompt=None, reserve_tokens=0):
+        """
+        构建本轮要发送的消息列表，返回 (messages, report)。
+        history 的最后一条应为本轮用户消息，它和上一条回复总会被保留。
+        reserve_tokens: 从预算中预留的 Token 数（见 prepare）
+        """
+        # 从最新的消息往前放，直到超出预算；
+        # 同一片段只保留在最新出现的那条消息里，较早消息中的重复片段不再发送
+        rendered = []
+        sent_chunks = set()
+        used = reserve_tokens
+        deduped = 0
+        window_start = len(history)
+        for i in range(len(history) - 1, -1, -1):
+            msg = render_message(history[i], skip_chunks=sent_chunks)
+            tokens = count_message_tokens([msg])
+            if len(rendered) >= 2 and used + tokens > self.max_history_tokens:
+                break
+            chunks = history[i].get("context") or []
+            deduped += sum(1 for c in chunks if _chunk_key(c) in sent_chunks)
+            sent_chunks.update(_chunk_key(c) for c in chunks)
+            rendered.insert(0, msg)
+            used += tokens
+            window_start = i
+
+        self._update_summary(history, window_start)
+
+        messages = []
+        system_text = system_prompt or ""
+        if self.summary and window_start > 0:
+            system_text += f"\n\n【之前对话的摘要】\n{self.summary}"
+        if system_text:
+            messages.append({"role": "system", "content": system_text.strip()})
+        messages.extend(rendered)
+
+        # 对照：不做任何压缩、完整重发全部历史和片段需要的 Token
+        naive = ([{"role": "system", "content": system_prompt}] if system_prompt else []) + [render_message(m) for m in history]
+        naive_tokens = count_message_tokens(naive)
+        sent_tokens = count_message_tokens(messages)
+        report = {
+            "sent_tokens": sent_tokens,
+            "naive_tokens": naive_tokens,
+            "saved_tokens": max(naive_tokens - sent_tokens, 0),
+            "dropped_messages": window_start,
+            "deduped_chunks": deduped
+        }
+        return messages, report
+
+
+def make_llm_summarizer(llm_client, model=None):
+    """用对话模型生成滚动摘要"""
+    def summarize(previous_summary, messages):
+        dialogue = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        prompt = f"""请把下面的对话压缩成一段简洁的摘要，保留用户的要求、已经确定的设定和尚未解决的问题，不超过300字。
+
+【已有摘要】
+{previous_summary or "（无）"}
+
+【新增对话】
+{dialogue}
+
+只输出更新后的摘要。"""
+        response = llm_client.chat([{"role": "user", "content": prompt}], model=model, temperature=0.3, stream=False, label="摘要")
+        if isinstance(response, str):
+            raise RuntimeError(response)
+        return response.choices[0].message.content.strip()
+    return summarize
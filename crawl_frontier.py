@@ -0,0 +1,409 @@
+"""
+网页抓取队列（frontier）：URL 规范化与去重、目录分页和章节分页的跟随规则、按站点配置的链接规则，
+以及断点续抓。
+
+每次抓取（按种子 URL 区分）对应一个 SQLite 状态文件，记录所有见过的 URL（磁盘上的去重集合）
+和每个页面的状态；每抓完一个页面就提交一次，进程中断后用同样的种子再次抓取会从中断处继续。
+抓取全部完成后状态被标记为已结束，下一次抓取重新开始（未变化的页面由 HTTP 缓存负责跳过）。
+
+按站点的规则写在 crawl_rules.json 中，键为域名（也匹配子域名），值覆盖 DEFAULT_RULES 中的项，例如：
+    {"www.example.com": {"chapter_pattern": "/book/\\\\d+/\\\\d+\\\\.html$", "max_depth": 20, "content_selector": "div#content"}}
+"""
+import hashlib
+import json
+import os
+import posixpath
+import re
+import sqlite3
+import threading
+from urllib.parse import parse_qsl, quote, unquote, urlencode, urljoin, urlparse, urlunparse
+
+from config_store import get_config_store
+from content_extractor import parse_selector
+
+CRAWL_DIR = "crawls"
+CRAWL_RULES_FILE = "crawl_rules.json"
+
+DEFAULT_RULES = {
+    # 目录分页最多跟随的层数（种子目录页为第 0 层）
+    "max_depth": 50,
+    # 单次抓取最多收录的页面数（含目录页和章节分页）
+    "max_pages": 5000,
+    # 单章最多跟随的分页数
+    "max_parts": 20,
+    # 章节链接的 URL 正则；为空时按链接文字长度判断
+    "chapter_pattern": None,
+    # 目录分页 URL 正则；为空时只看链接文字是否为“下一页”
+    "toc_pattern": None,
+    # 章节分页 URL 正则；为空时要求分页文件名为“章节文件名_序号”（如 123.html -> 123_2.html）
+    "part_pattern": None,
+    # 命中则不抓取的 URL 正则
+    "exclude_pattern": None,
+    # 章节链接文字的长度范围（与原先 2 < len(text) < 50 的规则一致）
+    "link_text_min": 3,
+    "link_text_max": 49,
+    "next_page_texts": ["下一页", "下页", "下一頁", "nextpage"],
+    "nav_texts": ["上一页", "上页", "上一章", "下一章", "目录", "返回目录", "章节目录", "首页", "返回首页",
+                  "返回书页", "书架", "加入书架", "加入书签", "投推荐票", "推荐本书"],
+    "same_domain": True,
+    # 章节页的正文容器（tag#id.class，如 "div#content"）；为空时由 content_extractor 按文字密度判断并按站点学习
+    "content_selector": None
+}
+
+# 不影响页面内容的统计参数，规范化时去掉
+TRACKING_PARAM_PREFIXES = ("utm_", "spm", "from", "ref", "_t")
+
+_TEXT_NOISE = re.compile(r"[\s>»→›<«←‹\[\]【】()（）.。:：|]+")
+
+
+def normalize_url(url, base=None):
+    """
+    规范化 URL 用于去重：补全相对路径、协议和域名转小写、去掉默认端口、片段 (#...) 和统计参数，
+    解析 . / .. 路径并统一百分号编码，查询参数排序。不是 http(s) 链接时返回 None。
+    """
+    if base:
+        url = urljoin(base, url.strip())
+    parts = urlparse(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https") or not parts.hostname:
+        return None
+    host = parts.hostname.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        return None
+    netloc = host if port is None or (scheme, port) in (("http", 80), ("https", 443)) else f"{host}:{port}"
+
+    path = parts.path or "/"
+    trailing = path.endswith("/")
+    path = posixpath.normpath(re.sub(r"/{2,}", "/", path))
+    if path == ".":
+        path = "/"
+    if trailing and not path.endswith("/"):
+        path += "/"
+    path = quote(unquote(path), safe="/:@!$&'()*+,;=-._~")
+
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not k.lower().startswith(TRACKING_PARAM_PREFIXES)]
+    return urlunparse((scheme, netloc, path, "", urlencode(sorted(query)), ""))
+
+
+def clean_link_text(text):
+    return _TEXT_NOISE.sub("", text or "").lower()
+
+
+def extract_links(raw_links, base_url):
+    """
+    raw_links: 解析页面得到的 [(href, 链接文字)]（见 content_extractor.ExtractedPage.links）
+    返回 [(规范化 URL, 链接文字)]，保持页面顺序。
+    同一 URL 出现多次时全部保留：文字可能不同（如“2”和“下一页”），出现位置也影响章节排序。
+    """
+    links = []
+    for href, text in raw_links:
+        href = (href or "").strip()
+        if not href or href.startswith("javascript") or href.startswith("#"):
+            continue
+        url = normalize_url(href, base_url)
+        if url:
+            links.append((url, text.strip()))
+    return links
+
+
+def _url_stem(url):
+    name = posixpath.basename(urlparse(url).path.rstrip("/"))
+    return name.split(".", 1)[0]
+
+
+class SiteRules:
+    """按站点合并 DEFAULT_RULES 与 crawl_rules.json 中的配置，并编译正则"""
+
+    def __init__(self, rules_file=CRAWL_RULES_FILE):
+        self._store = get_config_store(rules_file)
+        self._cache = {}
+
+    def for_url(self, url):
+        host = urlparse(url).hostname or ""
+        if host not in self._cache:
+            rules = dict(DEFAULT_RULES)
+            for domain, overrides in (self._store.load() or {}).items():
+                if host == domain or host.endswith("." + domain):
+                    rules.update(overrides)
+            for key in ("chapter_pattern", "toc_pattern", "part_pattern", "exclude_pattern"):
+                rules[key] = re.compile(rules[key]) if rules.get(key) else None
+            rules["next_page_texts"] = {clean_link_text(t) for t in rules["next_page_texts"]}
+            rules["nav_texts"] = {clean_link_text(t) for t in rules["nav_texts"]}
+            if rules.get("content_selector"):
+                parse_selector(rules["content_selector"])
+            self._cache[host] = rules
+        return self._cache[host]
+
+
+class FrontierItem:
+    """
+    队列中的一个页面。
+    kind: toc (目录页) / chapter (章节页，包括章节的后续分页)
+    seq: 发现顺序，同一章的分页共用章节的 seq；part: 章节内的分页序号，从 0 开始
+    chapter: 分页所属章节的 URL
+    """
+
+    def __init__(self, url, kind, depth, seq, part=0, chapter=None):
+        self.url = url
+        self.kind = kind
+        self.depth = depth
+        self.seq = seq
+        self.part = part
+        self.chapter = chapter or url
+
+    @property
+    def order(self):
+        return (self.seq, self.part)
+
+
+class CrawlFrontier:
+    """
+    一次抓取的持久化队列。用 open() 创建：同样的种子上次没有抓完就继续，否则重新开始。
+    调用方循环 pop() 取页面，抓取后 add_links() 登记页面上的链接，再 mark_done() / mark_failed()。
+    """
+
+    def __init__(self, path, rules=None):
+        self.path = path
+        self.rules = rules or SiteRules()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS items (
+                url TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                depth INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                part INTEGER NOT NULL,
+                chapter TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                content INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS items_status ON items (status);
+            CREATE TABLE IF NOT EXISTS links (
+                url TEXT PRIMARY KEY,
+                body_hash TEXT NOT NULL,
+                links TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self._conn.commit()
+        row = self._conn.execute("SELECT COALESCE(MAX(seq), -1), COUNT(*) FROM items").fetchone()
+        self._next_seq = row[0] + 1
+        self._size = row[1]
+
+    @classmethod
+    def open(cls, crawl_dir, seeds, kind="toc", rules=None):
+        """
+        打开种子对应的抓取状态。seeds 中无法识别的链接会被忽略。
+        返回的 frontier.resumed 为 True 表示在继续一次未完成的抓取。
+        """
+        os.makedirs(crawl_dir, exist_ok=True)
+        seeds = [u for u in (normalize_url(s) for s in seeds) if u]
+        crawl_id = hashlib.sha1(json.dumps([kind, seeds]).encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(crawl_dir, f"{crawl_id}.sqlite3")
+
+        frontier = cls(path, rules)
+        state = frontier._get_meta("state")
+        if state == "finished":
+            frontier._reset()
+            state = None
+        frontier.resumed = state == "running"
+        if frontier.resumed:
+            # 上次失败的页面重新排队
+            with frontier._lock:
+                frontier._conn.execute("UPDATE items SET status = 'pending', error = NULL WHERE status = 'failed'")
+                frontier._conn.commit()
+        else:
+            for url in seeds:
+                frontier._insert(FrontierItem(url, kind, 0, frontier._take_seq()))
+            frontier._set_meta("seeds", json.dumps(seeds))
+            frontier._set_meta("state", "running")
+        return frontier
+
+    def _get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+            self._conn.commit()
+
+    def _reset(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM items")
+            self._conn.execute("DELETE FROM meta")
+            self._conn.commit()
+            self._next_seq = 0
+            self._size = 0
+
+    def _take_seq(self):
+        seq = self._next_seq
+        self._next_seq += 1
+        return seq
+
+    def _insert(self, item):
+        """URL 没见过时加入队列，返回是否加入"""
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO items (url, kind, depth, seq, part, chapter) VALUES (?, ?, ?, ?, ?, ?)",
+                (item.url, item.kind, item.depth, item.seq, item.part, item.chapter)
+            )
+            self._conn.commit()
+            self._size += cur.rowcount
+            return cur.rowcount > 0
+
+    def _row_to_item(self, row):
+        return FrontierItem(row[0], row[1], row[2], row[3], row[4], row[5])
+
+    def seen(self, url):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM items WHERE url = ?", (url,)).fetchone() is not None
+
+    def size(self):
+        """见过的 URL 数（包括已抓取、待抓取和失败的）"""
+        return self._size
+
+    def pop(self):
+        """下一个待抓取的页面；目录页优先，尽早拿到完整的章节列表。没有时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, kind, depth, seq, part, chapter FROM items WHERE status = 'pending' "
+                "ORDER BY kind != 'toc', seq, part LIMIT 1"
+            ).fetchone()
+        return self._row_to_item(row) if row else None
+
+    def completed(self):
+        """已抓取完成且有正文的页面（断点续抓时用本地缓存重建它们的文档）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url, kind, depth, seq, part, chapter FROM items WHERE status = 'done' AND content = 1 ORDER BY seq, part"
+            ).fetchall()
+        return [self._row_to_item(r) for r in rows]
+
+    def mark_done(self, item, content=True):
+        """content: 页面本身是否有正文要入库（目录页为 False）"""
+        with self._lock:
+            self._conn.execute("UPDATE items SET status = 'done', content = ? WHERE url = ?", (int(content), item.url))
+            self._conn.commit()
+
+    def mark_failed(self, item, error):
+        with self._lock:
+            self._conn.execute("UPDATE items SET status = 'failed', error = ? WHERE url = ?", (str(error)[:500], item.url))
+            self._conn.commit()
+
+    def finish(self):
+        """所有页面处理完毕；下次用同样的种子抓取时重新开始"""
+        self._set_meta("state", "finished")
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall()
+        return dict(rows)
+
+    def cached_links(self, url, body_hash):
+        """同一份正文之前解析出的链接；正文变了或没解析过返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT body_hash, links FROM links WHERE url = ?", (url,)).fetchone()
+        if row and row[0] == body_hash:
+            return [tuple(link) for link in json.loads(row[1])]
+        return None
+
+    def save_links(self, url, body_hash, links):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO links (url, body_hash, links) VALUES (?, ?, ?)",
+                (url, body_hash, json.dumps(links, ensure_ascii=False))
+            )
+            self._conn.commit()
+
+    def _is_candidate(self, item, url, rules):
+        if rules["exclude_pattern"] and rules["exclude_pattern"].search(url):
+            return False
+        if rules["same_domain"] and urlparse(url).netloc != urlparse(item.url).netloc:
+            return False
+        return url != item.url
+
+    def _is_part(self, item, url, rules):
+        if rules["part_pattern"]:
+            return bool(rules["part_pattern"].search(url))
+        stem = _url_stem(item.chapter)
+        return bool(stem) and re.fullmatch(re.escape(stem) + r"[_-]\d+", _url_stem(url)) is not None
+
+    def add_links(self, item, links):
+        """
+        按规则把页面上的链接分类入队：
+          目录页上：文字为“下一页”的链接是目录分页（受 max_depth 限制），其余符合条件的是章节；
+          章节页上：只跟随“下一页”，且 URL 看起来是同一章的后续分页（受 max_parts 限制）。
+        目录页总是先于章节抓取，同一章节在目录中出现多次时以最后一次出现的位置为准。
+        返回 {"toc", "chapters", "parts": 新入队的数量, "matched": 符合规则的链接数（含已见过的）}
+        """
+        rules = self.rules.for_url(item.url)
+        found = {"toc": 0, "chapters": 0, "parts": 0, "matched": 0}
+        for url, text in links:
+            if not self._is_candidate(item, url, rules):
+                continue
+            label = clean_link_text(text)
+            is_next = label in rules["next_page_texts"]
+
+            if item.kind == "toc":
+                if is_next or (rules["toc_pattern"] and rules["toc_pattern"].search(url)):
+                    key = "toc"
+                    if item.depth >= rules["max_depth"]:
+                        continue
+                    new_item = FrontierItem(url, "toc", item.depth + 1, self._next_seq)
+                else:
+                    if label in rules["nav_texts"]:
+                        continue
+                    if rules["chapter_pattern"]:
+                        if not rules["chapter_pattern"].search(url):
+                            continue
+                    elif not rules["link_text_min"] <= len(text) <= rules["link_text_max"]:
+                        continue
+                    key = "chapters"
+                    new_item = FrontierItem(url, "chapter", item.depth + 1, self._next_seq)
+            elif is_next and self._is_part(item, url, rules):
+                if item.part + 1 >= rules["max_parts"]:
+                    continue
+                key = "parts"
+                new_item = FrontierItem(url, "chapter", item.depth, item.seq, item.part + 1, item.chapter)
+            else:
+                continue
+
+            found["matched"] += 1
+            if key == "chapters" and self._move(new_item):
+                self._take_seq()
+                continue
+            if self._size >= rules["max_pages"]:
+                continue
+            if self._insert(new_item):
+                found[key] += 1
+                if key != "parts":
+                    self._take_seq()
+        return found
+
+    def _move(self, item):
+        """
+        已在队列中、尚未抓取的章节再次出现在目录里时，按最后一次出现的位置排序：
+        目录页顶部常有“最新章节”，第一次出现的位置并不是它在目录中的真实顺序。
+        """
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE items SET seq = ? WHERE url = ? AND kind = 'chapter' AND part = 0 AND status = 'pending'",
+                (item.seq, item.url)
+            )
+            self._conn.commit()
+            return cur.rowcount > 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
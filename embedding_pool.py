@@ -0,0 +1,163 @@
+"""
+本地 Embedding 多进程服务：把片段按长度分桶组成动态批次，分发到多个工作进程并行计算。
+实现 langchain Embeddings 的 embed_documents / embed_query 接口，可直接替换 HuggingFaceEmbeddings。
+"""
+import os
+import platform
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+# 一个批次内 (片段数 × 最长片段字符数) 的上限：同一批次按最长片段补齐，
+# 长度相近的片段放在一起可以减少补齐浪费
+DEFAULT_MAX_BATCH_CHARS = 64 * 800
+DEFAULT_MAX_BATCH_SIZE = 64
+
+# sentence-transformers 导出的 ONNX 量化模型文件名，按 CPU 指令集区分；
+# AVX2 版本几乎所有 x86 CPU 都能运行，检测到 AVX-512 时才用更快的版本
+ONNX_INT8_FILES = {
+    "arm64": "onnx/model_qint8_arm64.onnx",
+    "avx2": "onnx/model_quint8_avx2.onnx",
+    "avx512": "onnx/model_qint8_avx512.onnx",
+    "avx512_vnni": "onnx/model_qint8_avx512_vnni.onnx",
+}
+
+# 工作进程内的模型（每个进程加载一次）
+_worker_model = None
+
+
+def onnx_int8_file():
+    """按当前 CPU 选择量化模型文件：ARM 用 arm64 版本；x86 只在 Linux 上能从 /proc/cpuinfo 确认支持 AVX-512 时才用对应版本"""
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return ONNX_INT8_FILES["arm64"]
+    flags = set()
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    flags = set(line.split(":", 1)[1].split())
+                    break
+    except OSError:
+        pass
+    if "avx512_vnni" in flags:
+        return ONNX_INT8_FILES["avx512_vnni"]
+    if "avx512f" in flags:
+        return ONNX_INT8_FILES["avx512"]
+    return ONNX_INT8_FILES["avx2"]
+
+
+def _load_model(model_name, threads, onnx):
+    if threads:
+        # 必须在导入 torch / onnxruntime 之前设置
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+    from sentence_transformers import SentenceTransformer
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+
+    if onnx:
+        model_kwargs = {"file_name": onnx_int8_file()} if onnx == "int8" else None
+        try:
+            return SentenceTransformer(model_name, backend="onnx", model_kwargs=model_kwargs)
+        except Exception as e:
+            # 旧版 sentence-transformers 不支持 backend 参数，或模型没有提供 ONNX 文件
+            print(f"ONNX 推理不可用，改用 PyTorch: {e}")
+    return SentenceTransformer(model_name)
+
+
+def _init_worker(model_name, threads, onnx):
+    global _worker_model
+    _worker_model = _load_model(model_name, threads, onnx)
+
+
+def _encode(texts):
+    return _worker_model.encode(texts, batch_size=len(texts), convert_to_numpy=True, show_progress_bar=False).astype(np.float32)
+
+
+def _warm_up(_):
+    return _worker_model is not None
+
+
+def make_batches(texts, max_batch_chars=DEFAULT_MAX_BATCH_CHARS, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+    """
+    按长度排序后切分批次，返回原始下标列表的列表。
+    批次大小随片段长度动态变化：短片段一批多放，长片段一批少放。
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    batches = []
+    current = []
+    for i in order:
+        longest = max(len(texts[i]), 1)
+        if current and (len(current) >= max_batch_size or (len(current) + 1) * longest > max_batch_chars):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+class LocalEmbeddingPool:
+    """
+    num_workers: 工作进程数，0 表示在当前进程中计算（仍然使用长度分桶）
+    threads_per_worker: 每个进程的推理线程数，None 时按 CPU 核数平均分配（当前进程模式下保持默认）
+    onnx: None 使用 PyTorch；"fp32" 使用 ONNX；"int8" 使用 ONNX 量化模型
+    """
+
+    def __init__(self, model_name, num_workers=2, threads_per_worker=None, onnx=None,
+                 max_batch_chars=DEFAULT_MAX_BATCH_CHARS, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+        self.model_name = model_name
+        self.num_workers = num_workers
+        self.onnx = onnx
+        self.max_batch_chars = max_batch_chars
+        self.max_batch_size = max_batch_size
+        if threads_per_worker is None and num_workers > 0:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // max(num_workers, 1))
+        self.threads_per_worker = threads_per_worker
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._local_model = None
+        if num_workers > 0:
+            # spawn：Windows 的默认方式，也避免 fork 已初始化的 torch 线程池
+            self._executor = ProcessPoolExecutor(
+                max_workers=num_workers,
+                mp_context=get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(model_name, threads_per_worker, onnx)
+            )
+            # 提前让每个进程加载好模型，第一次入库时不用再等
+            list(self._executor.map(_warm_up, range(num_workers)))
+        else:
+            self._local_model = _load_model(model_name, threads_per_worker, onnx)
+
+    def _encode_batches(self, texts, batches):
+        if self._executor is not None:
+            futures = [self._executor.submit(_encode, [texts[i] for i in batch]) for batch in batches]
+            return [f.result() for f in futures]
+        with self._lock:
+            return [
+                self._local_model.encode([texts[i] for i in batch], batch_size=len(batch), convert_to_numpy=True, show_progress_bar=False)
+                for batch in batches
+            ]
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        texts = [t.replace("\n", " ") for t in texts]
+        batches = make_batches(texts, self.max_batch_chars, self.max_batch_size)
+        results = [None] * len(texts)
+        for batch, vectors in zip(batches, self._encode_batches(texts, batches)):
+            for i, vector in zip(batch, vectors):
+                results[i] = vector.tolist()
+        return results
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -14,14 +14,27 @@ def load_history():
         print(f"Error loading history: {e}")
         return []
 
-def save_history_item(char_name, prompt_content):
+def save_history_item(char_name, prompt_content, style=None):
+    save_history_items([(char_name, prompt_content, style)])
+
+def save_history_items(items):
+    """
+    一次写入多条记录（同一角色的多个风格版本），共用同一个时间戳
+    items: [(角色名, Prompt 内容, 风格)]，风格可以为 None
+    """
     history = load_history()
-    item = {
-        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "char_name": char_name,
-        "content": prompt_content
-    }
-    history.insert(0, item) # 最新在最前
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    new_items = []
+    for char_name, prompt_content, style in items:
+        item = {
+            "timestamp": timestamp,
+            "char_name": char_name,
+            "content": prompt_content
+        }
+        if style:
+            item["style"] = style
+        new_items.append(item)
+    history[0:0] = new_items # 最新在最前
     with open(HISTORY_FILE, "w", encoding="utf-8") as f:
         json.dump(history, f, ensure_ascii=False, indent=2)
 
@@ -0,0 +1,186 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+HTTP_CACHE_FILE = "http_cache.sqlite3"
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+REQUEST_TIMEOUT = 10
+
+
+def content_digest(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+
+class CachedPage:
+    """
+    一次抓取的结果。
+    status: new (首次抓取) / modified (内容有变化) / not_modified (304 或正文与缓存相同)
+    text_hash: 上次从这份正文提取出的文本的哈希，尚未提取过时为 None
+    downloaded: 本次实际下载的正文字节数（304 为 0）
+    """
+
+    def __init__(self, url, body, encoding, status, text_hash, downloaded, body_hash=None):
+        self.url = url
+        self.body = body
+        self.encoding = encoding
+        self.status = status
+        self.text_hash = text_hash
+        self.downloaded = downloaded
+        self.body_hash = body_hash or content_digest(body)
+
+    @property
+    def not_modified(self):
+        return self.status == "not_modified"
+
+    @property
+    def text(self):
+        return self.body.decode(self.encoding or "utf-8", errors="replace")
+
+
+class HttpCache:
+    """
+    爬虫的持久化 HTTP 缓存：正文 zlib 压缩后连同 ETag / Last-Modified 存入 SQLite，
+    再次抓取时发送条件请求（If-None-Match / If-Modified-Since），服务器返回 304 时直接用缓存。
+    同时记录每个页面已入库到哪些知识库、入库时的文本哈希，未变化的页面可以整页跳过。
+    """
+
+    def __init__(self, persist_directory):
+        os.makedirs(persist_directory, exist_ok=True)
+        self.path = os.path.join(persist_directory, HTTP_CACHE_FILE)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                encoding TEXT,
+                body BLOB NOT NULL,
+                body_hash TEXT NOT NULL,
+                text_hash TEXT,
+                fetched_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS ingested (
+                url TEXT NOT NULL,
+                collection TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                PRIMARY KEY (url, collection)
+            );
+            CREATE INDEX IF NOT EXISTS ingested_collection ON ingested (collection);
+        """)
+        self._conn.commit()
+        self._session = None
+
+    def _get_session(self):
+        # 复用连接（keep-alive），抓取同一站点的大量章节时省去重复握手
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+            self._session.headers["User-Agent"] = USER_AGENT
+        return self._session
+
+    def _get_row(self, url):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT etag, last_modified, encoding, body, body_hash, text_hash FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+
+    def fetch(self, url, timeout=REQUEST_TIMEOUT):
+        """抓取页面，有缓存时发送条件请求；网络错误照常抛出"""
+        row = self._get_row(url)
+        headers = {}
+        if row:
+            etag, last_modified = row[0], row[1]
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        response = self._get_session().get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and row:
+            with self._lock:
+                self._conn.execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), url))
+                self._conn.commit()
+            return CachedPage(url, zlib.decompress(row[3]), row[2], "not_modified", row[5], 0, row[4])
+        response.raise_for_status()
+
+        body = response.content
+        body_hash = content_digest(body)
+        if row and row[4] == body_hash:
+            # 服务器不支持条件请求，但正文没变：沿用之前检测的编码和提取结果
+            encoding, text_hash, status = row[2], row[5], "not_modified"
+        else:
+            # 与原先的做法一致，按内容推断编码（很多小说站点的声明编码不可靠）
+            encoding = response.apparent_encoding or response.encoding or "utf-8"
+            text_hash = None
+            status = "modified" if row else "new"
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url, etag, last_modified, encoding, body, body_hash, text_hash, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, response.headers.get("ETag"), response.headers.get("Last-Modified"), encoding,
+                 zlib.compress(body), body_hash, text_hash, time.time())
+            )
+            self._conn.commit()
+        return CachedPage(url, body, encoding, status, text_hash, len(body), body_hash)
+
+    def cached(self, url):
+        """只读本地缓存，不发请求（断点续抓时重建已完成的页面）；没有缓存返回 None"""
+        row = self._get_row(url)
+        if not row:
+            return None
+        return CachedPage(url, zlib.decompress(row[3]), row[2], "not_modified", row[5], 0, row[4])
+
+    def set_text_hash(self, url, text_hash):
+        """记录从当前缓存正文提取出的文本哈希，下次 304 时无需重新提取就能判断是否已入库"""
+        with self._lock:
+            self._conn.execute("UPDATE pages SET text_hash = ? WHERE url = ?", (text_hash, url))
+            self._conn.commit()
+
+    def is_ingested(self, url, collection_name, text_hash):
+        return bool(text_hash) and self.ingested_hash(url, collection_name) == text_hash
+
+    def ingested_hash(self, url, collection_name):
+        """页面上次入库时的文本哈希，未入库过返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text_hash FROM ingested WHERE url = ? AND collection = ?", (url, collection_name)
+            ).fetchone()
+        return row[0] if row else None
+
+    def mark_ingested(self, collection_name, page_hashes):
+        """page_hashes: {url: text_hash}，页面切分出的片段全部写入知识库后调用"""
+        if not page_hashes:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ingested (url, collection, text_hash) VALUES (?, ?, ?)",
+                [(url, collection_name, h) for url, h in page_hashes.items()]
+            )
+            self._conn.commit()
+
+    def forget_collection(self, collection_name):
+        """删除知识库时调用，之后重新抓取会把页面重新入库"""
+        with self._lock:
+            self._conn.execute("DELETE FROM ingested WHERE collection = ?", (collection_name,))
+            self._conn.commit()
+
+    def clear_ingested(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM ingested")
+            self._conn.commit()
+
+    def stats(self):
+        """缓存的页面数和压缩后的正文字节数"""
+        with self._lock:
+            pages, stored = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM pages"
+            ).fetchone()
+        return {"pages": pages, "stored_bytes": stored}
@@ -0,0 +1,202 @@
+"""
+入库写入服务：同一个向量库目录的所有写入都交给一个写入线程串行执行。
+
+多个会话同时建不同的知识库时，各自的入库流程只负责切分和 Embedding，
+算好的片段提交给写入线程后继续处理下一批；写入线程把排队中的请求按知识库合并成大批次写入，
+一次写入期间持有向量库目录下的文件锁，多个应用进程同时写同一目录时也不会交错。
+检索不经过写入线程，也不等文件锁。
+"""
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+import metrics
+
+WRITE_LOCK_FILE = "ingest.lock"
+# 合并后单次写入的最大片段数
+MAX_WRITE_ROWS = 20000
+
+
+class FileLock:
+    """跨进程的独占文件锁（Windows 用 msvcrt，其他系统用 fcntl），同一进程内的线程由 threading.Lock 互斥"""
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._fd = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+            if os.name == "nt":
+                import msvcrt
+                while True:
+                    try:
+                        # LK_LOCK 最多重试 10 秒，超时后继续等待
+                        msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+            else:
+                import fcntl
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except Exception:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if os.name == "nt":
+                import msvcrt
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+            self._thread_lock.release()
+
+
+class _Write:
+    def __init__(self, collection_name, ids, vectors, texts, metadatas, compression):
+        self.collection_name = collection_name
+        self.ids = list(ids)
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self.texts = list(texts)
+        self.metadatas = list(metadatas)
+        self.compression = compression
+        self.future = Future()
+
+
+class _Call:
+    def __init__(self, fn):
+        self.fn = fn
+        self.future = Future()
+
+
+class IngestWriter:
+    """
+    用法：
+        future = writer.submit(collection_name, ids, vectors, texts, metadatas)  # 立即返回
+        future.result()  # 等待写入完成，写入失败时抛出异常
+        writer.call(backend.delete_collection, name)  # 删除等操作排在已提交的写入之后执行
+        writer.call_async(engine._compact)  # 同上，不等待，返回 Future
+    """
+
+    def __init__(self, backend, lock_path):
+        self.backend = backend
+        self.lock = FileLock(lock_path)
+        self.stats = {"requests": 0, "writes": 0, "rows": 0}
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, collection_name, ids, vectors, texts, metadatas, compression=None):
+        """提交一批片段，返回 Future（结果为 None）"""
+        item = _Write(collection_name, ids, vectors, texts, metadatas, compression)
+        self._queue.put(item)
+        return item.future
+
+    def write(self, collection_name, ids, vectors, texts, metadatas, compression=None):
+        """提交并等待写入完成"""
+        return self.submit(collection_name, ids, vectors, texts, metadatas, compression).result()
+
+    def call(self, fn, *args, **kwargs):
+        """在写入线程中、持有文件锁执行 fn，排在此前提交的写入之后；返回 fn 的结果"""
+        if threading.current_thread() is self._thread:
+            return fn(*args, **kwargs)
+        return self.call_async(fn, *args, **kwargs).result()
+
+    def call_async(self, fn, *args, **kwargs):
+        """同 call，但立即返回 Future"""
+        item = _Call(lambda: fn(*args, **kwargs))
+        self._queue.put(item)
+        return item.future
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            # 写入期间排队的请求一次取出合并，不额外等待
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self.lock:
+                    for group in self._group(items):
+                        if isinstance(group, _Call):
+                            self._apply_call(group)
+                        else:
+                            self._apply_writes(group)
+            except Exception as e:
+                # 例如文件锁无法打开：本轮还没完成的请求全部失败，写入线程继续服务
+                print(f"写入线程出错: {e}")
+                for item in items:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+
+    def _group(self, items):
+        """
+        同一知识库（压缩方式相同）的请求合并为一组，单组不超过 MAX_WRITE_ROWS 个片段；
+        不同知识库互不影响，各自保持提交顺序；删除等操作是分界，不与前后的写入交换顺序。
+        """
+        groups = {}
+        for item in items + [None]:
+            if isinstance(item, _Write):
+                key = (item.collection_name, item.compression)
+                group = groups.setdefault(key, [[]])
+                if group[-1] and sum(len(w.ids) for w in group[-1]) + len(item.ids) > MAX_WRITE_ROWS:
+                    group.append([])
+                group[-1].append(item)
+                continue
+            for group in groups.values():
+                yield from group
+            groups = {}
+            if item is not None:
+                yield item
+
+    def _apply_call(self, item):
+        try:
+            item.future.set_result(item.fn())
+        except Exception as e:
+            item.future.set_exception(e)
+
+    def _apply_writes(self, group):
+        first = group[0]
+        rows = sum(len(item.ids) for item in group)
+        try:
+            with metrics.span("writer_flush", collection=first.collection_name, requests=len(group), rows=rows):
+                self.backend.add(
+                    first.collection_name,
+                    [i for item in group for i in item.ids],
+                    np.concatenate([item.vectors for item in group]) if len(group) > 1 else first.vectors,
+                    [t for item in group for t in item.texts],
+                    [m for item in group for m in item.metadatas],
+                    compression=first.compression
+                )
+        except Exception as e:
+            if len(group) == 1:
+                first.future.set_exception(e)
+                return
+            # 合并写入失败时逐个重试，只让出错的请求失败
+            print(f"合并写入 {first.collection_name} 失败，逐批重试: {e}")
+            for item in group:
+                self._apply_writes([item])
+            return
+        self.stats["requests"] += len(group)
+        self.stats["writes"] += 1
+        self.stats["rows"] += rows
+        for item in group:
+            item.future.set_result(None)
@@ -0,0 +1,197 @@
+"""
+知识库导出/导入（.kbpack 单文件格式）。
+
+文件布局：
+    MAGIC | 各数据段（64 字节对齐）| 头部 JSON | 头部长度 (uint64) | MAGIC
+
+数据段均为连续数组，导入时直接内存映射分批写入，不需要重新 Embedding：
+    vectors       float16 (n, dim) 或 int8 (n, dim)
+    scales        float32 (n, 1)，仅 int8
+    text_offsets  int64 (n + 1)，第 i 个片段为 text_blob[offsets[i]:offsets[i+1]]
+    text_blob     所有片段正文的 UTF-8 字节
+    records       zlib 压缩的 JSON Lines，每行 [id, metadata]
+
+头部记录 Embedding 模型身份（类型、模型名、Base URL），不包含 API Key。
+"""
+import json
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+MAGIC = b"KBPACK01"
+ALIGNMENT = 64
+ARCHIVE_BATCH_SIZE = 5000
+VECTOR_ENCODINGS = ["float16", "int8"]
+
+
+class _SectionWriter:
+    """每个数据段先写到临时文件，导出结束后再依次拼接到归档中"""
+
+    def __init__(self, tmp_dir, name, dtype):
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.path = os.path.join(tmp_dir, name)
+        self.file = open(self.path, "wb")
+        self.rows = 0
+        self.width = None
+
+    def write(self, array):
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        if array.ndim == 2:
+            self.width = array.shape[1]
+        self.rows += len(array)
+        self.file.write(array.tobytes())
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def shape(self):
+        return [self.rows, self.width] if self.width is not None else [self.rows]
+
+
+def export_collection(backend, collection_name, path, embedding_info, vector_encoding="float16"):
+    """
+    把知识库导出为 .kbpack 文件，返回导出的片段数
+    embedding_info: {"type", "model_name", "base_url"}，导入时用于校验模型一致
+    """
+    if vector_encoding not in VECTOR_ENCODINGS:
+        raise ValueError(f"不支持的向量编码: {vector_encoding}")
+
+    tmp_dir = tempfile.mkdtemp(prefix="kbpack_")
+    try:
+        vectors = _SectionWriter(tmp_dir, "vectors", vector_encoding)
+        scales = _SectionWriter(tmp_dir, "scales", "float32") if vector_encoding == "int8" else None
+        offsets = _SectionWriter(tmp_dir, "text_offsets", "int64")
+        texts = _SectionWriter(tmp_dir, "text_blob", "uint8")
+        records = _SectionWriter(tmp_dir, "records", "uint8")
+        compressor = zlib.compressobj(level=6)
+
+        text_pos = 0
+        offsets.write(np.zeros(1, dtype=np.int64))
+        for ids, batch_vectors, batch_texts, batch_metas in backend.iter_batches(collection_name, ARCHIVE_BATCH_SIZE):
+            if vector_encoding == "int8":
+                batch_scales = np.abs(batch_vectors).max(axis=1, keepdims=True) / 127.0
+                batch_scales[batch_scales == 0] = 1.0
+                vectors.write(np.clip(np.rint(batch_vectors / batch_scales), -127, 127))
+                scales.write(batch_scales)
+            else:
+                vectors.write(batch_vectors)
+
+            encoded = [t.encode("utf-8") for t in batch_texts]
+            lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+            offsets.write(text_pos + np.cumsum(lengths))
+            text_pos += int(lengths.sum())
+            texts.file.write(b"".join(encoded))
+            texts.rows += int(lengths.sum())
+
+            lines = "".join(json.dumps([i, m], ensure_ascii=False) + "\n" for i, m in zip(ids, batch_metas))
+            records.file.write(compressor.compress(lines.encode("utf-8")))
+        records.file.write(compressor.flush())
+
+        sections = [s for s in [vectors, scales, offsets, texts, records] if s is not None]
+        for s in sections:
+            s.close()
+        records.rows = os.path.getsize(records.path)
+
+        header = {
+            "format": 1,
+            "collection": collection_name,
+            "embedding": embedding_info,
+            "count": vectors.rows,
+            "dim": vectors.width,
+            "vector_encoding": vector_encoding,
+            "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "sections": {}
+        }
+        with open(path, "wb") as out:
+            out.write(MAGIC)
+            for s in sections:
+                out.write(b"\0" * (-out.tell() % ALIGNMENT))
+                header["sections"][s.name] = {
+                    "offset": out.tell(),
+                    "dtype": s.dtype.str,
+                    "shape": s.shape
+                }
+                with open(s.path, "rb") as f:
+                    shutil.copyfileobj(f, out, length=16 * 1024 * 1024)
+            header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+            out.write(header_bytes)
+            out.write(struct.pack("<Q", len(header_bytes)))
+            out.write(MAGIC)
+        return header["count"]
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("不是有效的知识库归档文件")
+        f.seek(-(8 + len(MAGIC)), os.SEEK_END)
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("知识库归档文件不完整")
+        f.seek(-(header_len + 8 + len(MAGIC)), os.SEEK_END)
+        return json.loads(f.read(header_len).decode("utf-8"))
+
+
+def _open_section(path, header, name):
+    info = header["sections"][name]
+    return np.memmap(path, dtype=np.dtype(info["dtype"]), mode="r", offset=info["offset"], shape=tuple(info["shape"]))
+
+
+def iter_archive_batches(path, header=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """内存映射归档文件，逐批返回 (ids, float32 向量, texts, metadatas)"""
+    header = header or read_header(path)
+    n = header["count"]
+    if n == 0:
+        return
+    vectors = _open_section(path, header, "vectors")
+    scales = _open_section(path, header, "scales") if header["vector_encoding"] == "int8" else None
+    offsets = _open_section(path, header, "text_offsets")
+    texts = _open_section(path, header, "text_blob")
+
+    # metadata 体积小，流式解压后按行读取
+    records_info = header["sections"]["records"]
+    decompressor = zlib.decompressobj()
+    with open(path, "rb") as f:
+        f.seek(records_info["offset"])
+        remaining = records_info["shape"][0]
+        lines = []
+        partial = b""
+
+        def next_records(count):
+            nonlocal lines, partial, remaining
+            while len(lines) < count:
+                chunk = f.read(min(remaining, 4 * 1024 * 1024))
+                if not chunk:
+                    data = partial + decompressor.flush()
+                    partial = b""
+                    lines.extend(l for l in data.split(b"\n") if l)
+                    if len(lines) < count:
+                        raise ValueError("知识库归档文件损坏：metadata 条数不足")
+                    break
+                remaining -= len(chunk)
+                parts = (partial + decompressor.decompress(chunk)).split(b"\n")
+                partial = parts.pop()
+                lines.extend(parts)
+            batch, lines = lines[:count], lines[count:]
+            return [json.loads(l.decode("utf-8")) for l in batch]
+
+        for i in range(0, n, batch_size):
+            j = min(i + batch_size, n)
+            batch_vectors = np.asarray(vectors[i:j], dtype=np.float32)
+            if scales is not None:
+                batch_vectors = batch_vectors * scales[i:j]
+            blob = bytes(texts[offsets[i]:offsets[j]])
+            starts = offsets[i:j] - offsets[i]
+            ends = offsets[i + 1:j + 1] - offsets[i]
+            batch_texts = [blob[a:b].decode("utf-8") for a, b in zip(starts, ends)]
+            records = next_records(j - i)
+            yield [r[0] for r in records], batch_vectors, batch_texts, [r[1] for r in records]
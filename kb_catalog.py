@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+from ingest_writer import FileLock
+
+CATALOG_FILE = "kb_stats.json"
+
+
+class StatsCatalog:
+    """
+    知识库统计目录：记录每个知识库的片段数、来源文件、文本字节数、Embedding 模型和最近入库时间。
+    在入库/删除时增量维护，管理面板只需读取这个小文件，不必把整个知识库拉进内存。
+    version 在知识库内容每次变化时加一，预先计算的结果（如角色档案）据此判断是否过期。
+    多个应用进程共用同一目录时，修改在文件锁内“重新读取 → 修改 → 写回”，读取前发现文件变化也会重新加载。
+    """
+
+    def __init__(self, persist_directory):
+        self.path = os.path.join(persist_directory, CATALOG_FILE)
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(self.path + ".lock")
+        self._stat = None
+        self._data = self._load()
+
+    def _file_stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _refresh(self):
+        """其他进程写过目录文件时重新加载（调用方持有 _lock）"""
+        if self._file_stat() != self._stat:
+            self._data = self._load()
+
+    def _load(self):
+        self._stat = self._file_stat()
+        if self._stat is None:
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"读取统计目录失败，将重新统计: {e}")
+            return {}
+
+    def _save(self):
+        # 先写临时文件再替换，避免写到一半崩溃留下损坏的目录
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        self._stat = self._file_stat()
+
+    def get(self, collection_name):
+        with self._lock:
+            self._refresh()
+            entry = self._data.get(collection_name)
+            return dict(entry) if entry else None
+
+    def names(self):
+        with self._lock:
+            self._refresh()
+            return list(self._data.keys())
+
+    def record_ingest(self, collection_name, documents, embedding_model, chunking=None):
+        """入库成功后累加统计"""
+        self.record_batch(
+            collection_name,
+            [doc.page_content for doc in documents],
+            [doc.metadata for doc in documents],
+            embedding_model,
+            chunking
+        )
+
+    def record_batch(self, collection_name, texts, metadatas, embedding_model, chunking=None):
+        """
+        按文本和 metadata 累加统计（批量导入等不构造 Document 的场景）
+        chunking: {"chunk_size", "chunk_overlap"}，记录该知识库使用的切分参数
+        """
+        if not texts:
+            return
+        with self._lock, self._file_lock:
+            self._refresh()
+            entry = self._data.setdefault(collection_name, {
+                "count": 0,
+                "sources": {},
+                "bytes": 0,
+                "embedding_model": embedding_model,
+                "last_ingest": None
+            })
+            for text, meta in zip(texts, metadatas):
+                source = os.path.basename(meta.get("source", "")) if meta else ""
+                if source:
+                    entry["sources"][source] = entry["sources"].get(source, 0) + 1
+                entry["count"] += 1
+                if entry.get("bytes") is not None:
+                    entry["bytes"] += len(text.encode("utf-8"))
+            entry["embedding_model"] = embedding_model
+            if chunking:
+                entry["chunking"] = dict(chunking)
+            entry["last_ingest"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            entry["version"] = entry.get("version", 0) + 1
+            self._save()
+
+    def set_entry(self, collection_name, entry):
+        """用一次完整扫描的结果覆盖统计（用于目录缺失或与实际片段数不一致时）"""
+        with self._lock, self._file_lock:
+            self._refresh()
+            previous = self._data.get(collection_name) or {}
+            self._data[collection_name] = dict(entry, version=previous.get("version", 0) + 1)
+            self._save()
+
+    def touch(self, collection_name):
+        """片段被删除等不经过 record_batch 的内容变化，只更新版本号"""
+        with self._lock, self._file_lock:
+            self._refresh()
+            entry = self._data.get(collection_name)
+            if entry is not None:
+                entry["version"] = entry.get("version", 0) + 1
+                self._save()
+
+    def version(self, collection_name):
+        """知识库内容的版本号；不在目录中的知识库返回 None"""
+        with self._lock:
+            self._refresh()
+            entry = self._data.get(collection_name)
+            return entry.get("version", 0) if entry else None
+
+    def remove(self, collection_name):
+        with self._lock, self._file_lock:
+            self._refresh()
+            if self._data.pop(collection_name, None) is not None:
+                self._save()
+
+    def clear(self):
+        with self._lock, self._file_lock:
+            self._refresh()
+            self._data = {}
+            self._save()
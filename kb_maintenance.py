@@ -0,0 +1,84 @@
+"""
+知识库后台维护：删除知识库时立即从列表中移除，向量数据在写入线程中删除；
+空间回收（删除孤立的段目录、收缩预分配容量、VACUUM）也在写入线程中排队执行，完成后报告释放的字节数。
+
+待删除的知识库记录在 pending_deletes.json 中，删到一半退出应用的，下次启动时继续删除。
+"""
+import json
+import os
+import threading
+
+PENDING_DELETES_FILE = "pending_deletes.json"
+
+
+def dir_size(path):
+    """目录下所有文件的字节数（遍历过程中被删除的文件忽略）"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class Maintenance:
+    """后台维护任务的状态：待删除的知识库（持久化）和最近一次空间回收"""
+
+    def __init__(self, persist_directory):
+        self.path = os.path.join(persist_directory, PENDING_DELETES_FILE)
+        self._lock = threading.Lock()
+        self._pending = self._load()
+        self._futures = {}
+        self.compaction = None
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"读取待删除知识库列表失败: {e}")
+            return []
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._pending, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def pending(self):
+        """正在后台删除的知识库"""
+        with self._lock:
+            return list(self._pending)
+
+    def mark_deleting(self, collection_name):
+        with self._lock:
+            if collection_name not in self._pending:
+                self._pending.append(collection_name)
+                self._save()
+
+    def track(self, collection_name, future):
+        with self._lock:
+            self._futures[collection_name] = future
+
+    def untracked(self):
+        """记录为待删除、但本进程还没有安排删除的知识库（上次退出时没删完）"""
+        with self._lock:
+            return [name for name in self._pending if name not in self._futures]
+
+    def finish_delete(self, collection_name):
+        with self._lock:
+            if collection_name in self._pending:
+                self._pending.remove(collection_name)
+                self._save()
+
+    def wait(self, collection_name):
+        """等待该知识库的后台删除完成（用同名重建知识库前调用）"""
+        with self._lock:
+            future = self._futures.get(collection_name)
+        if future is not None:
+            future.exception()
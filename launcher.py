@@ -56,6 +56,13 @@ def main():
     print("如果浏览器没有反应，请手动访问: http://localhost:8501")
     print("===================================================\n")
 
+    # 后台预热：与 Streamlit 同时启动，提前导入重量级依赖并加载上次的 Embedding 模型，
+    # 让应用里的首次加载命中磁盘缓存。预热失败不影响应用启动。
+    try:
+        subprocess.Popen([sys.executable, "prewarm.py"])
+    except Exception as e:
+        print(f"[提示] 后台预热未启动: {e}")
+
     # 启动 Streamlit
     # 使用 sys.executable 确保使用当前的 Python 解释器
     cmd = [sys.executable, "-m", "streamlit", "run", "app.py"]
@@ -1,22 +1,134 @@
 import os
-from openai import OpenAI
+import hashlib
+import threading
+import time
+from collections import deque
+
+import metrics
+
+# 进程级客户端注册表：Streamlit 每次 rerun 都会重新执行侧边栏，
+# 复用同一个 LLMClient（及其 HTTP 连接池）可以避免每轮对话重新握手
+_CLIENT_REGISTRY = {}
+_REGISTRY_LOCK = threading.Lock()
+
+# 每个客户端保留最近多少次调用的 usage 记录
+USAGE_LOG_SIZE = 100
+
+def _resolve_api_key(provider, api_key):
+    if api_key:
+        return api_key
+    if provider == "deepseek":
+        return os.getenv("DEEPSEEK_API_KEY")
+    if provider == "siliconflow":
+        return os.getenv("SILICONFLOW_API_KEY")
+    return None
+
+def get_llm_client(provider="deepseek", api_key=None, base_url=None):
+    """
+    按 (provider, API Key 哈希, Base URL) 获取共享的 LLMClient，同一进程内只创建一次
+    """
+    api_key = _resolve_api_key(provider, api_key)
+    key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest() if api_key else ""
+    registry_key = (provider, key_hash, base_url)
+    with _REGISTRY_LOCK:
+        client = _CLIENT_REGISTRY.get(registry_key)
+        if client is None:
+            client = LLMClient(provider=provider, api_key=api_key, base_url=base_url)
+            _CLIENT_REGISTRY[registry_key] = client
+        return client
+
+def parse_usage(usage):
+    """
+    统一各提供商的 usage 字段，返回 dict；usage 为空时返回 None。
+    DeepSeek 返回 prompt_cache_hit_tokens / prompt_cache_miss_tokens，
+    OpenAI 兼容接口（如硅基流动）返回 prompt_tokens_details.cached_tokens。
+    """
+    if usage is None:
+        return None
+    if not isinstance(usage, dict):
+        usage = usage.model_dump() if hasattr(usage, "model_dump") else dict(usage.__dict__)
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    cached = usage.get("prompt_cache_hit_tokens")
+    if cached is None:
+        details = usage.get("prompt_tokens_details") or {}
+        cached = details.get("cached_tokens") or 0
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": usage.get("completion_tokens") or 0,
+        "cached_tokens": cached,
+        "miss_tokens": usage.get("prompt_cache_miss_tokens", prompt_tokens - cached)
+    }
+
+
+class UsageStream:
+    """
+    包装流式响应：只产出带 choices 的数据块，并在流结束时记录最后一个数据块里的 usage，
+    同时统计首 Token 延迟 (TTFT) 和输出速度。
+    usage 为 parse_usage() 的结果再加上调用名称 label，可以直接交给界面显示
+    """
+
+    def __init__(self, stream, on_usage, started=None, label="chat", model=None):
+        self._stream = stream
+        self._on_usage = on_usage
+        self._started = started or time.perf_counter()
+        self._label = label
+        self._model = model
+        self.usage = None
+        self.ttft = None
+
+    def __iter__(self):
+        first = None
+        content_chunks = 0
+        error = None
+        try:
+            for chunk in self._stream:
+                if getattr(chunk, "usage", None):
+                    self.usage = dict(parse_usage(chunk.usage), label=self._label)
+                if chunk.choices:
+                    if chunk.choices[0].delta.content:
+                        content_chunks += 1
+                        if first is None:
+                            first = time.perf_counter()
+                            self.ttft = first - self._started
+                    yield chunk
+        except Exception as e:
+            error = str(e)[:200]
+            raise
+        finally:
+            end = time.perf_counter()
+            fields = dict(self.usage or {}, label=self._label, model=self._model, stream=True)
+            # 提供商没有返回 usage 时，用内容数据块数近似输出 Token 数
+            completion = (self.usage or {}).get("completion_tokens") or content_chunks
+            if first is not None:
+                fields["ttft_ms"] = round((first - self._started) * 1000, 1)
+                metrics.observe("llm_ttft", first - self._started)
+                if end > first:
+                    fields["tokens_per_s"] = round(completion / (end - first), 1)
+            if error:
+                fields["error"] = error
+            metrics.record("llm_chat", end - self._started, **fields)
+        if self.usage:
+            self._on_usage(self.usage)
+
 
 class LLMClient:
-    def __init__(self, provider="deepseek", api_key=None):
+    def __init__(self, provider="deepseek", api_key=None, base_url=None):
         self.provider = provider
         self.api_key = api_key
         self.client = None
         self.model_name = ""
+        # 可覆盖提供商默认地址（例如指向本地的兼容接口）
+        self.base_url_override = base_url
+        self.usage_log = deque(maxlen=USAGE_LOG_SIZE)
+        self._usage_lock = threading.Lock()
+        # 提供商不接受 stream_options 时不再附带
+        self._stream_usage_supported = True
         
         self._setup_client()
 
     def _setup_client(self):
-        if not self.api_key:
-            # 尝试从环境变量获取
-            if self.provider == "deepseek":
-                self.api_key = os.getenv("DEEPSEEK_API_KEY")
-            elif self.provider == "siliconflow":
-                self.api_key = os.getenv("SILICONFLOW_API_KEY")
+        # 未提供时尝试从环境变量获取
+        self.api_key = _resolve_api_key(self.provider, self.api_key)
         
         if not self.api_key:
             raise ValueError(f"未提供 {self.provider} 的 API Key")
@@ -30,24 +142,71 @@ class LLMClient:
             self.model_name = "deepseek-ai/DeepSeek-V3" 
         else:
             raise ValueError("不支持的提供商")
+        if self.base_url_override:
+            self.base_url = self.base_url_override
 
+        # openai 包导入较慢（约 1 秒），推迟到第一次创建客户端时
+        from openai import OpenAI
         self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
 
-    def chat(self, messages, model=None, temperature=0.7, stream=True):
+    def _record_usage(self, label, model, usage):
+        record = dict(usage, label=label, model=model, time=time.time())
+        with self._usage_lock:
+            self.usage_log.append(record)
+
+    def recent_usage(self):
+        with self._usage_lock:
+            return list(self.usage_log)
+
+    def chat(self, messages, model=None, temperature=0.7, stream=True, label="chat", json_mode=False):
         """
         发送对话请求
+        label: 记录 usage（含上下文缓存命中 Token）时使用的调用名称
+        json_mode: 要求模型只输出一个 JSON 对象（response_format=json_object）；提供商不支持时按普通请求发送
         """
         use_model = model if model else self.model_name
+        started = time.perf_counter()
         
         try:
-            response = self.client.chat.completions.create(
-                model=use_model,
-                messages=messages,
-                temperature=temperature,
-                stream=stream
-            )
+            kwargs = {}
+            if stream and self._stream_usage_supported:
+                # 让流式响应在最后一个数据块中返回 usage
+                kwargs["stream_options"] = {"include_usage": True}
+            if json_mode:
+                kwargs["response_format"] = {"type": "json_object"}
+            try:
+                response = self.client.chat.completions.create(
+                    model=use_model,
+                    messages=messages,
+                    temperature=temperature,
+                    stream=stream,
+                    **kwargs
+                )
+            except Exception as e:
+                unsupported = [key for key in kwargs if key in str(e)]
+                if not unsupported:
+                    raise
+                if "stream_options" in unsupported:
+                    self._stream_usage_supported = False
+                for key in unsupported:
+                    kwargs.pop(key)
+                response = self.client.chat.completions.create(
+                    model=use_model,
+                    messages=messages,
+                    temperature=temperature,
+                    stream=stream,
+                    **kwargs
+                )
+            on_usage = lambda usage: self._record_usage(label, use_model, usage)
+            if stream:
+                return UsageStream(response, on_usage, started=started, label=label, model=use_model)
+            usage = parse_usage(getattr(response, "usage", None))
+            metrics.record("llm_chat", time.perf_counter() - started, label=label, model=use_model, stream=False, **(usage or {}))
+            if usage:
+                on_usage(usage)
             return response
         except Exception as e:
+            metrics.record("llm_chat", time.perf_counter() - started, label=label, model=use_model, error=str(e)[:200])
             return f"Error: {str(e)}"
 
     def get_available_models(self):
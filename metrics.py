@@ -0,0 +1,240 @@
+"""
+轻量的性能埋点：计时区间 (span) + 事件记录。
+
+- 每个事件追加写入 JSONL 跟踪文件（环境变量 RAG_METRICS_TRACE 指定路径，设为空字符串关闭），
+  超过 TRACE_MAX_BYTES 时改名为 .1 备份（只保留一份）后重新开始
+- 进程内按名称聚合，供侧边栏诊断面板展示
+- 可渲染 Prometheus 文本格式；设置 RAG_METRICS_PORT 后在该端口提供 /metrics
+
+只依赖标准库，rag_engine / llm_client 可以放心导入。
+"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+TRACE_FILE = os.environ.get("RAG_METRICS_TRACE", "metrics_trace.jsonl")
+# 跟踪文件的大小上限（环境变量 RAG_METRICS_TRACE_MAX_MB 调整）
+TRACE_MAX_BYTES = int(float(os.environ.get("RAG_METRICS_TRACE_MAX_MB", "20")) * 1024 * 1024)
+METRICS_PORT_ENV = "RAG_METRICS_PORT"
+
+# 每个名称保留最近多少次耗时用于计算分位数
+SAMPLES_PER_NAME = 500
+RECENT_EVENTS = 200
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+
+class MetricsRegistry:
+    def __init__(self, trace_file=TRACE_FILE, trace_max_bytes=TRACE_MAX_BYTES):
+        self.trace_file = trace_file
+        self.trace_max_bytes = trace_max_bytes
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=SAMPLES_PER_NAME))
+        self._counts = defaultdict(int)
+        self._errors = defaultdict(int)
+        self._duration_sum = defaultdict(float)
+        self._duration_count = defaultdict(int)
+        self._buckets = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+        self._field_sums = defaultdict(float)
+        self._recent = deque(maxlen=RECENT_EVENTS)
+
+    def record(self, name, duration=None, **fields):
+        """记录一个事件；duration 单位为秒，数值字段会被累加导出为计数器"""
+        event = {"ts": datetime.now().isoformat(timespec="milliseconds"), "name": name}
+        if duration is not None:
+            event["duration_ms"] = round(duration * 1000, 3)
+        event.update(fields)
+
+        with self._lock:
+            self._counts[name] += 1
+            if fields.get("error"):
+                self._errors[name] += 1
+            if duration is not None:
+                self._observe(name, duration)
+            for key, value in fields.items():
+                # 速率、延迟类字段累加没有意义，只累计数量类字段
+                if key.endswith(("_ms", "_per_s")):
+                    continue
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self._field_sums[(name, key)] += value
+            self._recent.append(event)
+            if self.trace_file:
+                try:
+                    with open(self.trace_file, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+                        full = f.tell() > self.trace_max_bytes
+                    if full:
+                        os.replace(self.trace_file, self.trace_file + ".1")
+                except OSError as e:
+                    print(f"写入性能跟踪文件失败: {e}")
+        return event
+
+    def _observe(self, name, seconds):
+        self._samples[name].append(seconds)
+        self._duration_sum[name] += seconds
+        self._duration_count[name] += 1
+        buckets = self._buckets[name]
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+
+    def observe(self, name, seconds):
+        """只计入耗时分布（例如首 Token 延迟），不单独写跟踪记录"""
+        with self._lock:
+            self._observe(name, seconds)
+
+    @contextmanager
+    def span(self, name, **fields):
+        """计时区间；with 块内可以往 yield 出的 dict 里补充字段"""
+        start = time.perf_counter()
+        try:
+            yield fields
+        except Exception as e:
+            fields["error"] = str(e)[:200]
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, **fields)
+
+    def summary(self):
+        """按名称汇总：次数、失败次数、平均 / P50 / P95 耗时 (ms)"""
+        with self._lock:
+            rows = []
+            for name in sorted(set(self._counts) | set(self._samples)):
+                samples = sorted(self._samples.get(name, ()))
+                row = {"name": name, "count": self._counts.get(name) or len(samples), "errors": self._errors.get(name, 0)}
+                if samples:
+                    row["avg_ms"] = round(sum(samples) / len(samples) * 1000, 1)
+                    row["p50_ms"] = round(samples[len(samples) // 2] * 1000, 1)
+                    row["p95_ms"] = round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1)
+                rows.append(row)
+            return rows
+
+    def recent(self, name=None, limit=20):
+        with self._lock:
+            events = [e for e in self._recent if name is None or e["name"] == name]
+        return events[-limit:]
+
+    def render_prometheus(self):
+        lines = [
+            "# HELP rag_span_duration_seconds 各阶段耗时",
+            "# TYPE rag_span_duration_seconds histogram"
+        ]
+        with self._lock:
+            for name in sorted(self._buckets):
+                for bound, count in zip(DURATION_BUCKETS, self._buckets[name]):
+                    lines.append(f'rag_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+                total = self._duration_count[name]
+                lines.append(f'rag_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {total}')
+                lines.append(f'rag_span_duration_seconds_sum{{span="{name}"}} {self._duration_sum[name]}')
+                lines.append(f'rag_span_duration_seconds_count{{span="{name}"}} {total}')
+            lines += ["# HELP rag_events_total 事件次数", "# TYPE rag_events_total counter"]
+            for name in sorted(self._counts):
+                lines.append(f'rag_events_total{{span="{name}"}} {self._counts[name]}')
+            # 同一指标的样本要连续输出，放在各自的 HELP / TYPE 之后
+            lines += ["# HELP rag_event_errors_total 出错的事件次数", "# TYPE rag_event_errors_total counter"]
+            for name in sorted(self._counts):
+                lines.append(f'rag_event_errors_total{{span="{name}"}} {self._errors[name]}')
+            lines += ["# HELP rag_event_field_sum 事件数值字段累计（Token 数、片段数等）", "# TYPE rag_event_field_sum counter"]
+            for (name, key), value in sorted(self._field_sums.items()):
+                lines.append(f'rag_event_field_sum{{span="{name}",field="{key}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_registry():
+    return _registry
+
+
+def record(name, duration=None, **fields):
+    return _registry.record(name, duration, **fields)
+
+
+def span(name, **fields):
+    return _registry.span(name, **fields)
+
+
+def observe(name, seconds):
+    _registry.observe(name, seconds)
+
+
+def timed(name, describe=None):
+    """
+    装饰器形式的 span；describe(result) 返回要补充到事件里的字段
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _registry.span(name) as fields:
+                result = fn(*args, **kwargs)
+                if describe:
+                    fields.update(describe(result))
+                return result
+        return wrapper
+    return decorator
+
+
+def summary():
+    return _registry.summary()
+
+
+def recent_events(name=None, limit=20):
+    return _registry.recent(name, limit)
+
+
+def render_prometheus():
+    return _registry.render_prometheus()
+
+
+def _make_handler():
+    # 指标端点默认不启用，http.server 在启动时才导入，不拖慢应用启动
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return MetricsHandler
+
+
+def start_http_server(port, host="127.0.0.1"):
+    """在后台线程提供 Prometheus /metrics 端点，重复调用只启动一次，返回实际端口"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            from http.server import ThreadingHTTPServer
+            _server = ThreadingHTTPServer((host, port), _make_handler())
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+            print(f"Prometheus 指标端点: http://{host}:{_server.server_address[1]}/metrics")
+        return _server.server_address[1]
+
+
+def start_http_server_from_env():
+    """设置了 RAG_METRICS_PORT 时启动端点，返回端口；否则返回 None"""
+    port = os.environ.get(METRICS_PORT_ENV)
+    if not port:
+        return None
+    try:
+        return start_http_server(int(port))
+    except (OSError, ValueError) as e:
+        print(f"启动指标端点失败: {e}")
+        return None
@@ -0,0 +1,109 @@
+"""
+后台预热：在后台线程中初始化 RAGEngine（加载 Embedding 模型、打开向量库），
+页面可以立即渲染，知识库就绪后再启用相关功能。
+
+也可以作为脚本运行（launcher.py 会在启动 Streamlit 的同时调用），
+提前下载/读取上次使用的本地 Embedding 模型并导入重量级依赖，
+让应用进程中的首次加载命中磁盘缓存。
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+RAG_CONFIG_FILE = "rag_config.json"
+
+_lock = threading.Lock()
+_state = {
+    "key": None,
+    "thread": None,
+    "engine": None,
+    "error": None,
+    "started": None,
+    "elapsed": None
+}
+
+
+def _engine_key(kwargs):
+    # 其中包含 API Key，只保存在进程内存中用于比较
+    return tuple(sorted((k, str(v)) for k, v in kwargs.items()))
+
+
+def _load_engine(key, kwargs):
+    from rag_engine import RAGEngine
+    start = time.perf_counter()
+    try:
+        engine = RAGEngine(**kwargs)
+        error = None
+    except Exception as e:
+        engine = None
+        error = str(e)
+    with _lock:
+        # 期间参数被更换过则丢弃这次结果
+        if _state["key"] == key:
+            _state["engine"] = engine
+            _state["error"] = error
+            _state["elapsed"] = time.perf_counter() - start
+
+
+def start_prewarm(**engine_kwargs):
+    """
+    在后台线程中构建 RAGEngine；相同参数只会启动一次，可以在每次 rerun 时调用
+    """
+    key = _engine_key(engine_kwargs)
+    with _lock:
+        if _state["key"] == key:
+            return
+        _state.update({
+            "key": key,
+            "engine": None,
+            "error": None,
+            "started": time.perf_counter(),
+            "elapsed": None
+        })
+        thread = threading.Thread(target=_load_engine, args=(key, engine_kwargs), name="rag-prewarm", daemon=True)
+        _state["thread"] = thread
+    thread.start()
+
+
+def get_prewarm_status():
+    """返回 (状态, engine, 说明)，状态为 idle / loading / ready / failed"""
+    with _lock:
+        if _state["key"] is None:
+            return "idle", None, ""
+        if _state["engine"] is not None:
+            return "ready", _state["engine"], f"耗时 {_state['elapsed']:.1f} 秒"
+        if _state["error"] is not None:
+            return "failed", None, _state["error"]
+        waited = time.perf_counter() - _state["started"]
+        return "loading", None, f"已等待 {waited:.0f} 秒"
+
+
+def warm_caches(config_path=RAG_CONFIG_FILE):
+    """
+    脚本模式：导入重量级依赖并加载上次使用的本地模型，然后退出。
+    只为预热磁盘和 HuggingFace 缓存，不会打开向量库（避免与应用进程争用数据库文件）。
+    """
+    if not os.path.exists(config_path):
+        return
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    start = time.perf_counter()
+    import langchain_community.document_loaders  # noqa: F401
+    if config.get("vector_backend", "chroma") == "chroma":
+        import chromadb  # noqa: F401
+    if config.get("embedding_type") == "local":
+        os.environ.setdefault("HF_ENDPOINT", "https://hf-mirror.com")
+        from langchain_huggingface import HuggingFaceEmbeddings
+        HuggingFaceEmbeddings(model_name=config["model_name"])
+    print(f"[预热] 依赖与模型缓存预热完成，耗时 {time.perf_counter() - start:.1f} 秒")
+
+
+if __name__ == "__main__":
+    try:
+        warm_caches()
+    except Exception as e:
+        print(f"[预热] 跳过: {e}")
+        sys.exit(0)
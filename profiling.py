@@ -0,0 +1,167 @@
+"""
+按需性能剖析：用 cProfile + tracemalloc 包住一次操作（构建知识库、生成角色、对话等），
+结果连同本次参数保存到 profiles/ 目录，便于复现“构建知识库好慢”之类的问题。
+
+开启方式：环境变量 RAG_PROFILE=1，或侧边栏中的开关。
+注意 cProfile 只统计当前线程；本地 Embedding 工作进程、后台预热线程里的耗时不在其中。
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+PROFILE_ENV = "RAG_PROFILE"
+PROFILE_DIR = "profiles"
+REPORT_FILE = "report.json"
+TOP_N = 30
+# tracemalloc 保存的调用栈深度，越深越准确但开销越大
+TRACEMALLOC_FRAMES = 5
+
+# 同一进程同时只能有一个 cProfile 在运行（Python 3.12 起会直接报错）
+_active_lock = threading.Lock()
+
+
+def env_enabled():
+    return os.environ.get(PROFILE_ENV, "").lower() in ("1", "true", "yes")
+
+
+def _top_functions(profiler, sort_key, limit):
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    stats.sort_stats(sort_key)
+    rows = []
+    for func in stats.fcn_list[:limit]:
+        cc, ncalls, tottime, cumtime, _ = stats.stats[func]
+        filename, line, name = func
+        rows.append({
+            "function": f"{name} ({os.path.basename(filename)}:{line})",
+            "calls": ncalls,
+            "tottime_s": round(tottime, 4),
+            "cumtime_s": round(cumtime, 4)
+        })
+    return rows
+
+
+def _top_allocations(snapshot, limit):
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")
+    ])
+    rows = []
+    for stat in snapshot.statistics("lineno")[:limit]:
+        frame = stat.traceback[0]
+        rows.append({
+            "location": f"{frame.filename}:{frame.lineno}",
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count
+        })
+    return rows
+
+
+@contextmanager
+def profiled(action, enabled=True, params=None, profile_dir=PROFILE_DIR):
+    """
+    剖析 with 块内的代码。enabled 为 False、或已有剖析在进行时直接执行，不做任何记录。
+    with 块结束后（包括异常和 st.rerun 抛出的控制流异常）写出：
+        profiles/<时间>_<action>/profile.prof   pstats 格式，可用 snakeviz 等工具查看
+        profiles/<时间>_<action>/report.json    参数、耗时、最慢函数、最大内存分配
+    """
+    if not enabled or not _active_lock.acquire(blocking=False):
+        yield None
+        return
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    elif hasattr(tracemalloc, "reset_peak"):
+        # Python 3.9+：已经在追踪时只统计本次操作的峰值
+        tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    error = None
+    profiler.enable()
+    try:
+        yield profiler
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+        try:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            _save_run(action, params or {}, profiler, snapshot, elapsed, current, peak, error, profile_dir)
+        except Exception as e:
+            print(f"保存性能剖析结果失败: {e}")
+        finally:
+            _active_lock.release()
+
+
+def _save_run(action, params, profiler, snapshot, elapsed, current, peak, error, profile_dir):
+    safe_action = re.sub(r"[^0-9A-Za-z_-]", "_", action)
+    run_dir = os.path.join(profile_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{safe_action}")
+    os.makedirs(run_dir, exist_ok=True)
+    profiler.dump_stats(os.path.join(run_dir, "profile.prof"))
+    report = {
+        "action": action,
+        "params": params,
+        "started": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "elapsed_s": round(elapsed, 3),
+        "memory_current_kb": round(current / 1024, 1),
+        "memory_peak_kb": round(peak / 1024, 1),
+        "error": error,
+        "slowest_cumulative": _top_functions(profiler, "cumulative", TOP_N),
+        "slowest_self": _top_functions(profiler, "tottime", TOP_N),
+        "top_allocations": _top_allocations(snapshot, TOP_N)
+    }
+    with open(os.path.join(run_dir, REPORT_FILE), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    print(f"[剖析] {action} 耗时 {elapsed:.2f} 秒，结果已保存到 {run_dir}")
+    return run_dir
+
+
+def list_runs(profile_dir=PROFILE_DIR):
+    """按时间倒序返回各次剖析的目录名"""
+    if not os.path.isdir(profile_dir):
+        return []
+    runs = [d for d in os.listdir(profile_dir) if os.path.exists(os.path.join(profile_dir, d, REPORT_FILE))]
+    return sorted(runs, reverse=True)
+
+
+def load_report(run_name, profile_dir=PROFILE_DIR):
+    with open(os.path.join(profile_dir, run_name, REPORT_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    # 命令行查看最近一次剖析
+    import argparse
+
+    parser = argparse.ArgumentParser(description="查看 profiles/ 中的性能剖析结果")
+    parser.add_argument("run", nargs="?", help="剖析目录名，默认最近一次")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = list_runs()
+    if not runs:
+        print("暂无剖析记录")
+    else:
+        report = load_report(args.run or runs[0])
+        print(f"{report['action']}  耗时 {report['elapsed_s']} 秒  内存峰值 {report['memory_peak_kb']} KB")
+        print(f"参数: {json.dumps(report['params'], ensure_ascii=False)}")
+        print("\n最慢的函数（累计耗时）")
+        for row in report["slowest_cumulative"][:args.top]:
+            print(f"{row['cumtime_s']:>10.3f}s {row['tottime_s']:>10.3f}s {row['calls']:>8}  {row['function']}")
+        print("\n最大的内存分配")
+        for row in report["top_allocations"][:args.top]:
+            print(f"{row['size_kb']:>10.1f} KB {row['count']:>8}  {row['location']}")
@@ -0,0 +1,30 @@
+"""
+前缀稳定的 Prompt 组装。
+
+DeepSeek / 硅基流动会缓存请求的公共前缀，命中部分按折扣计费且首字更快。
+因此角色生成、剧情校验和后续修改三个环节共用同一条 system 消息：
+固定的角色说明 + 排序后的原文片段；各环节不同的任务说明都放在其后的消息中。
+"""
+from conversation_memory import render_context
+
+CHARACTER_EXPERT_ROLE = """你是一个专业的角色设定专家，同时负责审核角色设定是否符合原著的剧情逻辑和人设。
+下面提供的原文片段是本次所有任务的唯一依据。"""
+
+
+def sort_context_docs(docs):
+    """
+    按来源分组，同一来源内按片段在原文中的位置（TXT 的 byte_start）排序，返回片段正文列表。
+    多路检索的合并顺序每次可能不同，排序后同一组片段总能得到完全相同的前缀，且保持原著的先后顺序；
+    没有位置信息的片段（如网页）保持检索顺序。
+    """
+    def key(item):
+        index, doc = item
+        position = doc.metadata.get("byte_start", doc.metadata.get("start_index"))
+        return (str(doc.metadata.get("source", "")), -1 if position is None else position, index)
+
+    return [doc.page_content for _, doc in sorted(enumerate(docs), key=key)]
+
+
+def build_prefix_message(context_chunks, role=CHARACTER_EXPERT_ROLE):
+    """共享前缀：固定角色说明 + 原文片段"""
+    return {"role": "system", "content": role + "\n\n" + render_context(context_chunks)}
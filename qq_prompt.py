@@ -0,0 +1,303 @@
+"""
+QQ 聊天角色 Prompt 的生成与解析：流式生成，边接收边按部分解析，每个部分一结束就校验并填入对应字段。
+
+- 文本格式：模型按【人设基本信息】【人物背景】【聊天对话要求】【对话示例】分段输出，
+  SectionParser 只处理已完整接收的行，遇到下一个标题（或输出结束）时上一部分完成；
+  标题前的序号、Markdown 加粗 / 标题符号都可以识别
+- JSON 格式：模型只输出一个 JSON 对象（请求时带 response_format=json_object），
+  JsonSectionParser 每当一个顶层字段的值完整接收就解析出来，不等整个对象结束
+- 每个部分按 QQ_SCHEMA 校验（文本非空，对话示例至少一组完整的“用户 / 角色”），
+  缺失或不合格的部分单独补充请求，已生成的部分作为上下文保留，不整体重来
+"""
+import json
+import re
+
+import metrics
+
+# (字段, 标题)，也是输出和解析的顺序
+QQ_SECTIONS = [
+    ("character_info", "人设基本信息"),
+    ("background", "人物背景"),
+    ("chat_requirements", "聊天对话要求"),
+    ("dialogue_examples", "对话示例"),
+]
+QQ_SECTION_TITLES = dict(QQ_SECTIONS)
+QQ_OUTPUT_FORMATS = {"text": "分段文本", "json": "JSON"}
+QQ_EXAMPLE_COUNT = 5
+# 缺失部分最多补充请求几轮
+MAX_SECTION_RETRIES = 2
+
+# JSON 格式的字段说明，同时用于提示词和校验
+QQ_SCHEMA = {
+    "character_info": (str, "角色的姓名、年龄、性别、职业等基本信息"),
+    "background": (str, "角色的身世背景、经历、性格特点等"),
+    "chat_requirements": (str, "角色的说话风格、语气、常用表情、聊天习惯等"),
+    "dialogue_examples": (list, f"{QQ_EXAMPLE_COUNT} 个对话示例，每项为 {{\"user\": 用户的消息, \"character\": 角色的回复}}"),
+}
+
+_HEADER_RE = re.compile(
+    r"^\s*(?:#+\s*)?(?:\d+\s*[.、．)]\s*)?(?:\*\*)?\s*【(" + "|".join(QQ_SECTION_TITLES.values()) + r")】\s*(?:\*\*)?\s*[:：]?\s*(.*)$"
+)
+_TITLE_FIELDS = {title: field for field, title in QQ_SECTIONS}
+_EXAMPLE_RE = re.compile(r"^\s*(?:[-*]\s*|\d+\s*[.、．)]\s*)?(?:\*\*)?([^：:*]{1,12}?)(?:\*\*)?\s*[:：]\s*(.*)$")
+_KEY_RE = re.compile(r'\s*,?\s*("(?:[^"\\]|\\.)*")\s*:\s*')
+
+
+def build_qq_prompt(dialogue_text, fields=None, output_format="text", done=None):
+    """
+    生成（或补充生成）QQ 角色 Prompt 的请求。
+    fields: 要生成的字段，None 表示全部；done: 已生成的 {字段: 值}，补充请求时作为上下文
+    """
+    fields = [f for f, _ in QQ_SECTIONS if fields is None or f in fields]
+    prompt = f"""基于以下对话内容，请为QQ聊天生成一个角色Prompt。
+
+【对话记录】
+{dialogue_text}
+"""
+    if done:
+        prompt += "\n以下部分已经生成，请保持一致，不要重复输出：\n\n" + render_sections(done) + "\n"
+
+    if output_format == "json":
+        keys = "\n".join(f'   - "{f}": {"数组" if QQ_SCHEMA[f][0] is list else "字符串"}，{QQ_SCHEMA[f][1]}' for f in fields)
+        prompt += f"""
+请只输出一个 JSON 对象，不要输出 JSON 以外的任何文字，包含以下字段：
+{keys}
+
+请确保对话示例贴合角色的性格和说话风格。
+"""
+        return prompt
+
+    parts = {
+        "character_info": "【人设基本信息】：角色的姓名、年龄、性别、职业等基本信息",
+        "background": "【人物背景】：角色的身世背景、经历、性格特点等",
+        "chat_requirements": "【聊天对话要求】：角色的说话风格、语气、常用表情、聊天习惯等",
+        "dialogue_examples": f"""【对话示例】：请提供{QQ_EXAMPLE_COUNT}个具体的对话示例，格式如下：
+   用户：消息内容
+   角色：回复内容""",
+    }
+    listing = "\n".join(f"{i}. {parts[f]}" for i, f in enumerate(fields, 1))
+    what = "一个完整的QQ聊天角色Prompt" if len(fields) == len(QQ_SECTIONS) else "QQ聊天角色Prompt中缺少的部分"
+    prompt += f"""
+请生成{what}，包含以下部分（每部分以标题单独起一行）：
+
+{listing}
+
+请确保对话示例贴合角色的性格和说话风格。
+"""
+    return prompt
+
+
+def render_sections(data):
+    """把 {字段: 值} 渲染成分段文本（与文本格式的输出相同）"""
+    blocks = []
+    for field, title in QQ_SECTIONS:
+        if field not in data:
+            continue
+        value = data[field]
+        if field == "dialogue_examples":
+            value = "\n".join(f"用户：{ex['user']}\n角色：{ex['character']}" for ex in value)
+        blocks.append(f"【{title}】\n{value}")
+    return "\n\n".join(blocks)
+
+
+def parse_examples(text):
+    """从“用户：… / 角色：…”交替的行中提取对话示例；角色一方也可以写成角色名"""
+    examples = []
+    user = None
+    for line in text.split("\n"):
+        m = _EXAMPLE_RE.match(line)
+        if not m:
+            continue
+        label, content = m.group(1).strip(), m.group(2).strip()
+        if label == "用户":
+            user = content
+        elif user is not None:
+            examples.append({"user": user, "character": content})
+            user = None
+    return examples
+
+
+def validate_section(field, value):
+    """按 QQ_SCHEMA 校验并规范化一个部分的值；不合格时返回 None"""
+    if field not in QQ_SCHEMA:
+        return None
+    if field == "dialogue_examples":
+        if isinstance(value, str):
+            value = parse_examples(value)
+        if not isinstance(value, list):
+            return None
+        examples = []
+        for item in value:
+            if not isinstance(item, dict):
+                continue
+            user = str(item.get("user") or "").strip()
+            character = str(item.get("character") or "").strip()
+            if user and character:
+                examples.append({"user": user, "character": character})
+        return examples[:QQ_EXAMPLE_COUNT] or None
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        value = "\n".join(value)
+    if isinstance(value, dict):
+        value = "\n".join(f"{k}：{v}" for k, v in value.items())
+    if not isinstance(value, str) or not value.strip():
+        return None
+    return value.strip()
+
+
+class SectionParser:
+    """
+    文本格式的增量解析：
+        for delta in stream:
+            for field, text in parser.feed(delta): ...  # 已完成的部分（未校验的原文）
+        parser.finish()  # 输出结束，最后一部分完成
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self.field = None
+        self._lines = []
+
+    def feed(self, delta):
+        self._pending += delta
+        *lines, self._pending = self._pending.split("\n")
+        completed = []
+        for line in lines:
+            completed.extend(self._line(line))
+        return completed
+
+    def finish(self):
+        completed = self._line(self._pending) if self._pending else []
+        self._pending = ""
+        return completed + self._close()
+
+    def partial(self):
+        """(正在接收的字段, 已接收的内容)，还没有遇到标题时字段为 None"""
+        text = "\n".join(line.strip() for line in self._lines + [self._pending]).strip()
+        return self.field, text
+
+    def _line(self, line):
+        m = _HEADER_RE.match(line)
+        if m:
+            completed = self._close()
+            self.field = _TITLE_FIELDS[m.group(1)]
+            self._lines = [m.group(2)] if m.group(2).strip() else []
+            return completed
+        if self.field is not None:
+            self._lines.append(line)
+        return []
+
+    def _close(self):
+        if self.field is None:
+            return []
+        completed = [(self.field, "\n".join(line.strip() for line in self._lines).strip())]
+        self.field = None
+        self._lines = []
+        return completed
+
+
+class JsonSectionParser:
+    """JSON 格式的增量解析：顶层对象的每个字段的值完整接收后立即产出 (键, 值)，接口同 SectionParser"""
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = None
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, delta):
+        self._buffer += delta
+        return self._scan()
+
+    def finish(self):
+        return self._scan()
+
+    def partial(self):
+        return None, ""
+
+    def _scan(self):
+        completed = []
+        if self._pos is None:
+            # 模型可能在对象前加了 ```json 之类的包裹
+            start = self._buffer.find("{")
+            if start < 0:
+                return completed
+            self._pos = start + 1
+        while True:
+            m = _KEY_RE.match(self._buffer, self._pos)
+            if not m:
+                break
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, m.end())
+            except ValueError:
+                # 值还没有接收完整
+                break
+            # 数字可能被截断在缓冲区末尾，等后面的字符到达再确认
+            if end == len(self._buffer) and not isinstance(value, (str, list, dict)):
+                break
+            completed.append((json.loads(m.group(1)), value))
+            self._pos = end
+        return completed
+
+
+def make_parser(output_format):
+    return JsonSectionParser() if output_format == "json" else SectionParser()
+
+
+def stream_qq_prompt(client, dialogue_text, model=None, output_format="text", max_retries=MAX_SECTION_RETRIES):
+    """
+    流式生成 QQ 角色 Prompt，逐个产出 (事件, 数据)：
+        ("text", (字段, 本次请求到目前为止的全文))  每收到一段输出；字段为正在接收的部分（JSON 格式为 None）
+        ("section", (字段, 值))   某部分接收完整并通过校验
+        ("retry", [缺失字段])     开始补充请求缺失的部分
+        ("done", 结果)            结果: {"data": {字段: 值}, "missing": [字段], "requests": 请求次数,
+                                         "raw": [各次请求的全文], "errors": [各次请求的错误或 None]}
+    请求中途失败时已完成的部分保留，其余部分算作缺失，在 max_retries 轮内补充请求。
+    """
+    data = {}
+    missing = [field for field, _ in QQ_SECTIONS]
+    result = {"data": data, "missing": missing, "requests": 0, "raw": [], "errors": []}
+    with metrics.span("qq_prompt", format=output_format) as span:
+        for attempt in range(max_retries + 1):
+            if attempt:
+                yield "retry", list(missing)
+            requested = list(missing)
+            prompt = build_qq_prompt(dialogue_text, fields=requested if attempt else None,
+                                     output_format=output_format, done=data if attempt else None)
+            parser = make_parser(output_format)
+            text, error = "", None
+            result["requests"] += 1
+            stream = client.chat([{"role": "user", "content": prompt}], model=model, stream=True,
+                                 label="QQ生成" if not attempt else "QQ补充", json_mode=output_format == "json")
+            if isinstance(stream, str):
+                error = stream
+            else:
+                try:
+                    for chunk in stream:
+                        content = chunk.choices[0].delta.content
+                        if not content:
+                            continue
+                        text += content
+                        for field, value in parser.feed(content):
+                            yield from _accept(data, requested, field, value)
+                        yield "text", (parser.partial()[0], text)
+                    # 只有完整结束的输出，最后一部分才算完成
+                    for field, value in parser.finish():
+                        yield from _accept(data, requested, field, value)
+                except Exception as e:
+                    error = str(e)
+            result["raw"].append(text)
+            result["errors"].append(error)
+            missing[:] = [field for field, _ in QQ_SECTIONS if field not in data]
+            if not missing:
+                break
+        span["requests"] = result["requests"]
+        span["missing"] = len(missing)
+    yield "done", result
+
+
+def _accept(data, requested, field, value):
+    if field not in requested or field in data:
+        return
+    value = validate_section(field, value)
+    if value is not None:
+        data[field] = value
+        yield "section", (field, value)
@@ -1,42 +1,163 @@
 import os
 import shutil
-import chromadb
+import threading
+import time
 import warnings
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
 
 # 忽略 tiktoken 的模型警告
 warnings.filterwarnings("ignore", category=UserWarning, message=".*model not found. Using cl100k_base encoding.*")
 
-from langchain_community.document_loaders import TextLoader, PyPDFLoader, Docx2txtLoader, WebBaseLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.embeddings import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain_core.documents import Document
+# 注意：langchain 的加载器/Embedding（会带入 torch）、chromadb、lxml 等重量级依赖
+# 都在第一次用到时才导入，避免拖慢应用冷启动（例如只想看历史记录时）
+
+import metrics
+from character_dossier import CHARACTER_ASPECTS, DOSSIER_DEPTH, MAX_CHARACTERS, SCAN_CHUNKS, DossierStore, find_main_characters
+from chunk_store import ChunkStore, chunk_hash
+from content_extractor import SITE_TEMPLATES_FILE, ContentExtractor
+from kb_archive import export_collection, iter_archive_batches, read_header
+from crawl_frontier import CRAWL_DIR, CrawlFrontier, extract_links
+from http_cache import HttpCache, content_digest
+from ingest_writer import WRITE_LOCK_FILE, IngestWriter
+from kb_catalog import StatsCatalog
+from kb_maintenance import Maintenance, dir_size
+from txt_loader import load_txt_documents
+from sharded_backend import ShardedBackend
+from vector_backends import create_backend
+
+# 统计目录缺失时分页扫描元数据的页大小
+SUMMARY_SCAN_PAGE_SIZE = 5000
+
+# 默认切分参数；每个知识库可以单独设置，记录在统计目录中
+DEFAULT_CHUNK_SIZE = 800
+DEFAULT_CHUNK_OVERLAP = 100
+CHUNK_SEPARATORS = ["\n\n", "\n", "。", "！", "？", " ", ""]
+
+# 每次建库最多排队等待写入的批次数，写入跟不上时等最早的一批完成再继续 Embedding
+MAX_PENDING_WRITES = 4
+
+# 同一进程内打开同一个向量库目录的引擎（例如多个会话各自初始化）共用存储对象和写入线程
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _open_stores(backend, persist_directory):
+    key = (backend, os.path.realpath(persist_directory))
+    with _stores_lock:
+        stores = _stores.get(key)
+        if stores is None:
+            # 外层的 ShardedBackend 把分片知识库的读写分发到各分片，未分片的知识库原样转发
+            sharded = ShardedBackend(create_backend(backend, persist_directory))
+            data_dir = sharded.data_dir
+            stores = _stores[key] = {
+                "backend": sharded,
+                "writer": IngestWriter(sharded, os.path.join(data_dir, WRITE_LOCK_FILE)),
+                "stats": StatsCatalog(data_dir),
+                "chunk_store": ChunkStore(data_dir),
+                "http_cache": HttpCache(data_dir),
+                "content_extractor": ContentExtractor(os.path.join(data_dir, SITE_TEMPLATES_FILE)),
+                "dossiers": DossierStore(data_dir),
+                "maintenance": Maintenance(data_dir)
+            }
+        return stores
+
+
+def normalize_chunking(chunking=None):
+    """补全并校验切分参数，返回 {"chunk_size", "chunk_overlap"}"""
+    chunking = dict(chunking or {})
+    size = int(chunking.get("chunk_size") or DEFAULT_CHUNK_SIZE)
+    overlap = int(chunking.get("chunk_overlap", DEFAULT_CHUNK_OVERLAP))
+    if size <= 0 or overlap < 0 or overlap >= size:
+        raise ValueError(f"切分参数无效: 片段长度 {size}，重叠 {overlap}（重叠必须小于片段长度）")
+    return {"chunk_size": size, "chunk_overlap": overlap}
+
+
+def make_text_splitter(chunking=None):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    chunking = normalize_chunking(chunking)
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunking["chunk_size"],
+        chunk_overlap=chunking["chunk_overlap"],
+        separators=CHUNK_SEPARATORS
+    )
+
+
+def _merge_results(results, k):
+    """多个知识库的 (正文, metadata, 分数) 按分数全局排序、按内容去重后取前 k 个"""
+    results = sorted(results, key=lambda item: item[2], reverse=True)
+    # 多个知识库可能收录了相同的片段，按内容去重
+    seen_content = set()
+    unique_results = []
+    for text, meta, score in results:
+        if text not in seen_content:
+            seen_content.add(text)
+            unique_results.append((text, meta, score))
+    return unique_results[:k]
+
+
+def _describe_split(result):
+    # 加载函数成功时返回片段列表，失败时返回错误字符串
+    if isinstance(result, list):
+        return {"chunks": len(result), "chars": sum(len(d.page_content) for d in result)}
+    return {"error": result}
 
 class RAGEngine:
-    def __init__(self, persist_directory="./chroma_db", embedding_type="local", model_name="sentence-transformers/all-MiniLM-L6-v2", api_key=None, base_url=None):
+    def __init__(self, persist_directory="./chroma_db", embedding_type="local", model_name="sentence-transformers/all-MiniLM-L6-v2", api_key=None, base_url=None, backend="chroma", local_workers=None, local_threads=None, local_onnx=None, embeddings=None):
+        """
+        local_workers: 本地模式下的 Embedding 工作进程数；None 沿用 HuggingFaceEmbeddings，
+                       0 在当前进程内按长度分桶批量计算，大于 0 启动多进程服务
+        local_threads: 每个工作进程的推理线程数
+        local_onnx: None / "fp32" / "int8"，使用 ONNX（可选 int8 量化）推理
+        embeddings: 直接使用给定的 Embedding 对象（需实现 embed_documents / embed_query），
+                    不再按 embedding_type 创建；model_name 仍用于片段哈希和模型校验（离线基准测试用）
+        """
         self.persist_directory = persist_directory
+        self.embedding_type = embedding_type
         self.embedding_model_name = model_name
-        self.embeddings = None
-        self.client = chromadb.PersistentClient(path=persist_directory)
+        self.base_url = base_url
+        self.embeddings = embeddings
+        stores = _open_stores(backend, persist_directory)
+        # 向量存储后端：chroma (默认) 或 numpy (进程内内存映射，启动快)
+        self.backend = stores["backend"]
+        # 所有写入和删除经由写入线程串行执行，检索直接访问后端
+        self.writer = stores["writer"]
+        self.stats = stores["stats"]
+        # 内容寻址存储：相同片段跨知识库只 Embedding 一次
+        self.chunk_store = stores["chunk_store"]
+        # 网页抓取缓存：重新抓取连载小说时只下载、只入库有变化的章节
+        self.http_cache = stores["http_cache"]
+        self.content_extractor = stores["content_extractor"]
+        self.dossiers = stores["dossiers"]
+        # 后台删除知识库、回收磁盘空间
+        self.maintenance = stores["maintenance"]
+        # 上次退出时没删完的知识库继续删除
+        for name in self.maintenance.untracked():
+            self._schedule_delete(name)
+        self.last_crawl = None
         
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=800,
-            chunk_overlap=100,
-            separators=["\n\n", "\n", "。", "！", "？", " ", ""]
-        )
+        self.text_splitter = make_text_splitter()
         
+        if embeddings is not None:
+            return
+
         print(f"正在初始化 Embedding 模型: {model_name} ({embedding_type}) ...")
         try:
             if embedding_type == "local":
                 # 注意：这会下载模型到本地缓存
-                self.embeddings = HuggingFaceEmbeddings(model_name=model_name)
+                if local_workers is None:
+                    from langchain_huggingface import HuggingFaceEmbeddings
+                    self.embeddings = HuggingFaceEmbeddings(model_name=model_name)
+                else:
+                    from embedding_pool import LocalEmbeddingPool
+                    self.embeddings = LocalEmbeddingPool(
+                        model_name,
+                        num_workers=local_workers,
+                        threads_per_worker=local_threads,
+                        onnx=local_onnx
+                    )
             elif embedding_type == "api":
                 if not api_key or not base_url:
                     raise ValueError("使用 API Embedding 需要提供 API Key 和 Base URL")
+                from langchain_community.embeddings import OpenAIEmbeddings
                 self.embeddings = OpenAIEmbeddings(
                     model=model_name,
                     openai_api_key=api_key,
@@ -58,41 +179,33 @@ class RAGEngine:
             print(f"加载 Embedding 模型失败: {e}")
             raise e
 
-    def load_documents(self, file_paths):
+    @metrics.timed("load_documents", describe=_describe_split)
+    def load_documents(self, file_paths, chunking=None):
         """
         加载并切分文档
+        chunking: {"chunk_size", "chunk_overlap"}，None 使用默认切分参数
+        TXT 按采样判断编码后流式解码、边读边切分（见 txt_loader.py），片段带有在原文件中的字节范围
         """
         documents = []
+        split_docs = []
         for file_path in file_paths:
             ext = os.path.splitext(file_path)[1].lower()
             loader = None
             
             try:
                 if ext == ".txt":
-                    # 针对大文件优化：优先尝试常见编码，避免自动检测超时
-                    success = False
-                    for enc in ["utf-8", "gb18030", "gbk"]:
-                        try:
-                            loader = TextLoader(file_path, encoding=enc)
-                            docs = loader.load()
-                            documents.extend(docs)
-                            success = True
-                            break
-                        except Exception:
-                            continue
-                    
-                    if not success:
-                        # 最后尝试自动检测
-                        loader = TextLoader(file_path, autodetect_encoding=True)
-                        docs = loader.load()
-                        documents.extend(docs)
-                        
+                    docs, encoding = load_txt_documents(file_path, self._splitter(chunking))
+                    print(f"{os.path.basename(file_path)}: 编码 {encoding}，切分为 {len(docs)} 个片段")
+                    split_docs.extend(docs)
                 elif ext == ".pdf":
+                    from langchain_community.document_loaders import PyPDFLoader
+
                     loader = PyPDFLoader(file_path)
                     if loader:
                         docs = loader.load()
                         documents.extend(docs)
                 elif ext in [".docx", ".doc"]:
+                    from langchain_community.document_loaders import Docx2txtLoader
                     loader = Docx2txtLoader(file_path)
                     if loader:
                         docs = loader.load()
@@ -101,227 +214,640 @@ class RAGEngine:
                 print(f"处理文件 {file_path} 时出错: {e}")
                 return f"Error loading {file_path}: {str(e)}"
         
-        if not documents:
+        if not documents and not split_docs:
             return "没有成功加载任何文档。"
 
-        # 切分文档
-        split_docs = self.text_splitter.split_documents(documents)
+        # 切分文档（TXT 已在读取时切分）
+        if documents:
+            split_docs.extend(self._splitter(chunking).split_documents(documents))
         return split_docs
 
-    def load_urls(self, urls, fetch_links=False):
+    @metrics.timed("load_urls", describe=_describe_split)
+    def load_urls(self, urls, fetch_links=False, chunking=None, collection_name=None):
         """
-        加载并切分网页内容
+        加载并切分网页内容。
+        fetch_links: urls 是目录页，按站点规则跟随目录分页、抓取其中的章节链接（见 crawl_frontier.py）；
+                     章节被拆成多页（“下一页”）时，无论是否为目录模式都会顺着抓完。
+        页面经持久化 HTTP 缓存抓取（条件请求，未修改时服务器返回 304）；抓取进度每页写入磁盘，
+        中断后用同样的链接再次抓取会从中断处继续，已完成的页面直接用本地缓存。
+        collection_name: 目标知识库；给定时，正文与上次入库时相同的页面整页跳过，不再提取、切分和 Embedding。
+        章节页只保留正文（导航、广告、评论、推荐列表等由 content_extractor.py 去掉），
+        站点的正文容器可在 crawl_rules.json 中用 content_selector 指定，否则自动判断并按站点学习。
+        本次抓取的下载字节数、复用页数、正文占整页文字的比例等记录在 self.last_crawl。
         """
-        target_urls = []
-        if fetch_links:
-            # 如果是目录页，先抓取链接
-            for url in urls:
+        crawl = {"pages": 0, "new": 0, "modified": 0, "not_modified": 0, "reused": 0, "failed": 0,
+                 "resumed": 0, "toc_pages": 0, "downloaded_bytes": 0,
+                 "extracted": 0, "page_chars": 0, "content_chars": 0, "extract_seconds": 0.0}
+        self.last_crawl = crawl
+        frontier = CrawlFrontier.open(os.path.join(self.backend.data_dir, CRAWL_DIR), urls, kind="toc" if fetch_links else "chapter")
+        if not frontier.size():
+            frontier.close()
+            return "没有找到有效的网页链接。"
+
+        pages = []
+        try:
+            if frontier.resumed:
+                done = frontier.completed()
+                print(f"继续上次中断的抓取: 已完成 {len(done)} 个页面，直接使用本地缓存")
+                for item in done:
+                    page = self.http_cache.cached(item.url)
+                    if page is None:
+                        continue
+                    crawl["resumed"] += 1
+                    doc = self._page_document(page, item, frontier, collection_name)
+                    if doc is not None:
+                        pages.append((item.order, doc))
+
+            print(f"准备抓取，队列中共 {frontier.size()} 个链接...")
+            while True:
+                item = frontier.pop()
+                if item is None:
+                    break
                 try:
-                    print(f"正在分析目录页: {url}")
-                    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-                    response = requests.get(url, headers=headers, timeout=10)
-                    response.encoding = response.apparent_encoding # Fix encoding
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    
-                    # 提取所有链接
-                    links = soup.find_all('a')
-                    chapter_links = []
-                    
-                    base_domain = urlparse(url).netloc
-                    
-                    for link in links:
-                        href = link.get('href')
-                        text = link.get_text().strip()
-                        
-                        if not href or href.startswith('javascript') or href.startswith('#'):
-                            continue
-                            
-                        full_url = urljoin(url, href)
-                        
-                        # 简单的过滤规则：
-                        # 1. 必须是同域名
-                        # 2. 文本长度适中 (章节名通常不会太长)
-                        if urlparse(full_url).netloc == base_domain:
-                            # 关键词过滤 (可选，但为了通用性先不做太死)
-                            if 2 < len(text) < 50: 
-                                chapter_links.append(full_url)
-                    
-                    # 去重
-                    chapter_links = list(set(chapter_links))
-                    print(f"找到 {len(chapter_links)} 个潜在章节链接")
-                    target_urls.extend(chapter_links)
-                    
+                    page = self.http_cache.fetch(item.url)
                 except Exception as e:
-                    print(f"解析目录页 {url} 失败: {e}")
-                    # 如果解析失败，至少把目录页本身加进去
-                    target_urls.append(url)
-        else:
-            target_urls = urls
+                    print(f"抓取 {item.url} 失败: {e}")
+                    crawl["failed"] += 1
+                    frontier.mark_failed(item, e)
+                    continue
+                crawl["pages"] += 1
+                crawl[page.status] += 1
+                crawl["downloaded_bytes"] += page.downloaded
 
-        if not target_urls:
-            return "没有找到有效的网页链接。"
+                # 同一份正文解析过的链接直接复用，未修改的页面不必再解析 HTML
+                parsed = None
+                links = frontier.cached_links(item.url, page.body_hash)
+                if links is None:
+                    parsed = self._extract(page, item, frontier)
+                    links = extract_links(parsed.links, page.url)
+                    frontier.save_links(item.url, page.body_hash, links)
+                found = frontier.add_links(item, links)
+                if item.kind == "toc":
+                    print(f"解析目录页 {item.url}: 新增 {found['chapters']} 个章节链接，{found['toc']} 个目录分页")
+                    # 目录页本身不入库；找不到任何章节链接时把它当作正文（与原先的兜底一致）
+                    if found["matched"]:
+                        crawl["toc_pages"] += 1
+                        frontier.mark_done(item, content=False)
+                        continue
 
-        documents = []
-        try:
-            print(f"准备抓取 {len(target_urls)} 个页面...")
-            # 使用 WebBaseLoader 批量抓取
-            # 注意：如果链接非常多，可能会很慢
-            loader = WebBaseLoader(target_urls)
-            loader.requests_kwargs = {'headers': {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}}
-            loader.requests_per_second = 5 # 限制并发
-            
-            documents = loader.load()
-        except Exception as e:
-            print(f"处理网页时出错: {e}")
-            return f"Error loading URLs: {str(e)}"
-        
-        if not documents:
+                doc = self._page_document(page, item, frontier, collection_name, parsed)
+                if doc is not None:
+                    pages.append((item.order, doc))
+                frontier.mark_done(item)
+            frontier.finish()
+        finally:
+            frontier.close()
+
+        crawl["reused"] = crawl["pages"] + crawl["resumed"] - crawl["toc_pages"] - len(pages)
+        print(f"抓取完成: {crawl['pages']} 个页面，下载 {crawl['downloaded_bytes'] / 1024:.1f} KB，"
+              f"{crawl['not_modified']} 个未修改，{crawl['reused']} 个已入库跳过，{crawl['failed']} 个失败")
+        if crawl["extracted"]:
+            print(f"正文提取: {crawl['extracted']} 个页面，整页 {crawl['page_chars']} 字 -> 正文 {crawl['content_chars']} 字，"
+                  f"平均每页 {crawl['extract_seconds'] / crawl['extracted'] * 1000:.1f} ms")
+        metrics.record("crawl", **crawl)
+
+        if not pages:
+            if crawl["reused"]:
+                # 所有页面都已入库且没有变化，不是错误
+                return []
             return "没有成功加载任何网页内容。"
 
-        # 切分文档
-        split_docs = self.text_splitter.split_documents(documents)
+        # 按目录顺序排列，同一章的分页相邻
+        pages.sort(key=lambda p: p[0])
+        split_docs = self._splitter(chunking).split_documents([doc for _, doc in pages])
         return split_docs
 
-    def build_vector_store(self, documents, collection_name="character_data"):
+    def _extract(self, page, item, frontier):
+        """解析页面：一次解析同时得到链接和正文；目录页不参与站点模板的学习"""
+        start = time.perf_counter()
+        parsed = self.content_extractor.extract(
+            page.text, url=page.url, learn=item.kind == "chapter",
+            selector=frontier.rules.for_url(page.url).get("content_selector")
+        )
+        crawl = self.last_crawl
+        crawl["extracted"] += 1
+        crawl["page_chars"] += parsed.page_chars
+        # 与 page_chars 口径一致，不计段落之间的换行
+        crawl["content_chars"] += len(parsed.text) - parsed.text.count("\n")
+        crawl["extract_seconds"] += time.perf_counter() - start
+        return parsed
+
+    def _page_document(self, page, item, frontier, collection_name=None, parsed=None):
+        """提取页面正文；页面已原样入库到 collection_name 时返回 None"""
+        from langchain_core.documents import Document
+        # 304 且上次提取的文本已入库：连 HTML 解析都省掉
+        if page.not_modified and collection_name and self.http_cache.is_ingested(page.url, collection_name, page.text_hash):
+            return None
+        if parsed is None:
+            parsed = self._extract(page, item, frontier)
+        metadata = {"source": page.url}
+        if parsed.title:
+            metadata["title"] = parsed.title
+        doc = Document(page_content=parsed.text, metadata=metadata)
+        text_hash = content_digest(doc.page_content)
+        if text_hash != page.text_hash:
+            self.http_cache.set_text_hash(page.url, text_hash)
+        # HTML 变了但正文没变（广告、访问计数等），同样不必重新入库
+        if collection_name and self.http_cache.is_ingested(page.url, collection_name, text_hash):
+            return None
+        doc.metadata["page_hash"] = text_hash
+        if item.part:
+            doc.metadata["chapter"] = item.chapter
+            doc.metadata["part"] = item.part
+        return doc
+
+    def _splitter(self, chunking):
+        return self.text_splitter if chunking is None else make_text_splitter(chunking)
+
+    def get_chunking(self, collection_name):
+        """知识库记录的切分参数；新知识库或旧版本建的库返回默认值"""
+        entry = self.stats.get(collection_name)
+        return normalize_chunking(entry.get("chunking") if entry else None)
+
+    def build_vector_store(self, documents, collection_name="character_data", compression=None, chunking=None, shard_chunks=None):
         """
         建立向量数据库 (带速率限制保护)
+        compression: 新建知识库时的向量压缩方式 (float32/float16/int8/pq)，仅 NumPy 后端支持
+        chunking: 这些片段使用的切分参数，记录到知识库的统计目录中
+        shard_chunks: 新建知识库时按来源/分卷分片存储，每个分片最多的片段数；已有知识库沿用创建时的设置
         """
         if not documents:
             return "没有文档可用于构建向量库。"
 
         try:
+            # 同名知识库正在后台删除时，等删除完成再重建
+            self.maintenance.wait(collection_name)
+            if shard_chunks and collection_name not in self.get_available_collections():
+                self.backend.create_sharded(collection_name, shard_chunks)
             import time
             
-            # 初始化 vector_store
-            vector_store = Chroma(
-                embedding_function=self.embeddings,
-                client=self.client,
-                collection_name=collection_name
-            )
-            
-            # 分批处理，避免触发 API 速率限制 (429)
-            batch_size = 10  # 每次处理 10 个片段
+            # API 模式分批处理，避免触发速率限制 (429)；
+            # 本地模式没有速率限制，用大批次交给 Embedding 服务做动态分批
+            is_api = self.embedding_type == "api"
+            batch_size = 10 if is_api else 512
             total_docs = len(documents)
             
             print(f"开始构建向量库，共 {total_docs} 个片段，分批处理中...")
             
+            added_docs = []
+            # 已提交给写入线程、尚未写完的批次；写入与下一批的 Embedding 同时进行
+            pending = []
+            pending_hashes = set()
             for i in range(0, total_docs, batch_size):
                 batch = documents[i : i + batch_size]
                 try:
-                    vector_store.add_documents(batch)
-                    # 简单的速率限制：每批处理完暂停 0.5 秒
-                    # 如果是 API 模式，这个暂停很重要
-                    time.sleep(0.5) 
+                    pending.append(self._add_batch(collection_name, batch, compression, pending_hashes))
+                    # 简单的速率限制：API 模式下每批处理完暂停 0.5 秒
+                    if is_api:
+                        time.sleep(0.5)
                 except Exception as batch_error:
                     print(f"批次 {i} 处理失败: {batch_error}")
                     # 遇到 429 错误时，尝试等待更久后重试一次
                     if "429" in str(batch_error):
                         print("触发速率限制，等待 5 秒后重试...")
                         time.sleep(5)
-                        vector_store.add_documents(batch)
+                        pending.append(self._add_batch(collection_name, batch, compression, pending_hashes))
+                while len(pending) > MAX_PENDING_WRITES:
+                    added_docs.extend(self._finish_batch(collection_name, pending.pop(0)))
+            while pending:
+                added_docs.extend(self._finish_batch(collection_name, pending.pop(0)))
             
+            self.stats.record_ingest(collection_name, added_docs, self.embedding_model_name, normalize_chunking(chunking) if chunking else None)
+            self._finish_pages(collection_name, documents)
+            skipped = total_docs - len(added_docs)
+            if skipped:
+                return f"成功构建知识库 '{collection_name}'，新增 {len(added_docs)} 个片段（{skipped} 个重复片段已跳过）。"
             return f"成功构建知识库 '{collection_name}'，包含 {len(documents)} 个片段。"
         except Exception as e:
             return f"构建向量库失败: {str(e)}"
 
-    def query(self, query_text, k=5, collection_names=None):
+    def _finish_pages(self, collection_name, documents):
         """
-        检索相关文档，支持多知识库
+        网页片段写入后，登记各页面入库时的文本哈希，下次抓取时未变化的页面直接跳过；
+        页面内容更新过的，删除旧版本留下、新版本已不包含的片段。
+        """
+        pages = {}
+        for doc in documents:
+            page_hash = doc.metadata.get("page_hash")
+            if page_hash:
+                hashes = pages.setdefault(doc.metadata["source"], (page_hash, set()))[1]
+                hashes.add(chunk_hash(self.embedding_model_name, doc.page_content))
+        ingested = {}
+        released = False
+        for source, (page_hash, keep) in pages.items():
+            # 有批次写入失败时不登记，下次抓取会重新入库这个页面
+            if self.chunk_store.filter_new(collection_name, list(keep)):
+                continue
+            ingested[source] = page_hash
+            if self.http_cache.ingested_hash(source, collection_name) in (None, page_hash):
+                continue
+            try:
+                removed = self.writer.call(self.backend.delete_source, collection_name, source, keep)
+            except NotImplementedError:
+                print(f"{self.backend.name} 后端不支持删除片段，已更新页面 {source} 的旧片段仍保留在知识库中")
+                continue
+            if removed:
+                self.chunk_store.release(collection_name, removed)
+                released = True
+                # 只删除片段时统计目录不经过 record_batch，这里让角色档案等依赖版本号的缓存失效
+                self.stats.touch(collection_name)
+                print(f"页面已更新: {source}，删除 {len(removed)} 个过期片段")
+        self.http_cache.mark_ingested(collection_name, ingested)
+        # 清理孤立片段要扫描整张表，所有页面处理完后统一执行一次
+        if released:
+            self.chunk_store.purge_orphans()
+
+    def _add_batch(self, collection_name, docs, compression=None, pending_hashes=None):
+        """
+        计算一批片段的向量并提交给写入线程，返回 (Future, 新增的片段, 片段哈希)，由 _finish_batch 等待写入完成。
+        片段以内容哈希为 id：知识库内已有的相同片段（包括 pending_hashes 中尚未写完的）直接跳过，
+        其他知识库算过的向量从内容寻址存储中复用，只对新内容调用 Embedding。
+        """
+        pending_hashes = set() if pending_hashes is None else pending_hashes
+        with metrics.span("ingest_batch", collection=collection_name, size=len(docs)) as span:
+            by_hash = {}
+            for doc in docs:
+                by_hash.setdefault(chunk_hash(self.embedding_model_name, doc.page_content), doc)
+            new_hashes = [h for h in self.chunk_store.filter_new(collection_name, list(by_hash.keys())) if h not in pending_hashes]
+            span["added"] = len(new_hashes)
+            if not new_hashes:
+                return None, [], []
+
+            vectors = self.chunk_store.get_vectors(new_hashes)
+            missing = [h for h in new_hashes if h not in vectors]
+            span["embedded"] = len(missing)
+            if missing:
+                missing_texts = [by_hash[h].page_content for h in missing]
+                with metrics.span("embed_documents", texts=len(missing_texts), chars=sum(len(t) for t in missing_texts)):
+                    embedded = self.embeddings.embed_documents(missing_texts)
+                self.chunk_store.put(missing, missing_texts, embedded)
+                vectors.update(zip(missing, embedded))
+
+            new_docs = [by_hash[h] for h in new_hashes]
+            texts = [doc.page_content for doc in new_docs]
+            # chroma 不接受空 metadata
+            metadatas = [dict(doc.metadata) if doc.metadata else {"source": "unknown"} for doc in new_docs]
+            future = self.writer.submit(collection_name, new_hashes, [vectors[h] for h in new_hashes], texts, metadatas, compression=compression)
+            pending_hashes.update(new_hashes)
+            return future, new_docs, new_hashes
+
+    def _finish_batch(self, collection_name, submitted):
+        """等待一批片段写入完成并登记引用，返回新增的片段；写入失败的批次返回空列表"""
+        future, new_docs, new_hashes = submitted
+        if future is None:
+            return []
+        try:
+            with metrics.span("vector_write", collection=collection_name, size=len(new_docs)):
+                future.result()
+        except Exception as e:
+            print(f"写入 {collection_name} 失败: {e}")
+            return []
+        self.chunk_store.add_refs(collection_name, new_hashes)
+        return new_docs
+
+    def query_with_scores(self, query_text, k=5, collection_names=None):
         """
+        检索相关文档并返回 (Document, score)，支持多知识库。
+        各库使用同一个 Embedding 模型，分数可比，按分数全局排序。
+        """
+        from langchain_core.documents import Document
         if collection_names is None:
             collection_names = ["character_data"]
         
         if isinstance(collection_names, str):
             collection_names = [collection_names]
 
+        with metrics.span("embed_query", chars=len(query_text)):
+            query_vector = self.embeddings.embed_query(query_text)
+        return [(Document(page_content=text, metadata=meta), score)
+                for text, meta, score in self.search_vector(query_vector, k, collection_names)]
+
+    def search_vector(self, query_vector, k, collection_names):
+        """用已经算好的查询向量检索多个知识库，返回全局排序去重后的 [(正文, metadata, 分数)]"""
         all_results = []
-        
         for col_name in collection_names:
-            try:
-                vector_store = Chroma(
-                    client=self.client,
-                    embedding_function=self.embeddings,
-                    collection_name=col_name
-                )
-                # 简单的检索
-                results = vector_store.similarity_search(query_text, k=k)
-                all_results.extend(results)
-            except Exception as e:
-                print(f"检索知识库 {col_name} 失败: {e}")
-                continue
+            all_results.extend(self._search_collection(col_name, query_vector, k))
+        return _merge_results(all_results, k)
 
-        # 如果有多个知识库，结果可能会很多，这里简单去重（基于内容）并截取
-        # 注意：简单的 extend 会导致结果排序混乱（不同库的分数可能不可比），
-        # 但 Chroma 的 similarity_search 返回的是 Document 对象，不带分数。
-        # 如果需要更精确的排序，应该用 similarity_search_with_score
-        
-        # 简单去重
-        seen_content = set()
-        unique_results = []
-        for doc in all_results:
-            if doc.page_content not in seen_content:
-                seen_content.add(doc.page_content)
-                unique_results.append(doc)
-        
-        return unique_results[:k] # 返回前 k 个（这里其实不太准确，因为没有全局排序）
+    def _search_collection(self, col_name, query_vector, k):
+        """单个知识库的检索结果 [(正文, metadata, 分数)]；失败时返回空列表"""
+        try:
+            with metrics.span("query_collection", collection=col_name, k=k) as span:
+                hits = self.backend.search(col_name, query_vector, k)
+                span["hits"] = len(hits)
+            return hits
+        except Exception as e:
+            print(f"检索知识库 {col_name} 失败: {e}")
+            return []
+
+    def retrieve_character(self, char_name, k=15, collection_names=None, extra_req=None):
+        """
+        生成角色提示词时的多路检索：按 CHARACTER_ASPECTS 的几个角度各检索 k 个片段，合并去重后取前 k 个。
+        知识库有该角色的有效档案（版本号与模型一致、保存深度足够）时直接读取档案，结果与实时检索相同；
+        其余知识库照常实时检索。额外要求总是实时检索。
+        返回 (Document 列表, {"dossier": [使用档案的知识库], "live": [实时检索的知识库]})
+        """
+        from langchain_core.documents import Document
+        if collection_names is None:
+            collection_names = ["character_data"]
+        if isinstance(collection_names, str):
+            collection_names = [collection_names]
+
+        with metrics.span("character_retrieval", k=k, collections=len(collection_names)) as span:
+            dossiers = {}
+            for col_name in collection_names:
+                found = self.dossiers.get(col_name, char_name, self.stats.version(col_name), self.embedding_model_name)
+                if found is not None:
+                    aspects, depth = found
+                    # 保存的片段不足 depth 个说明知识库本身就只有这么多，同样可以直接使用
+                    if k <= depth or any(len(hits) < depth for hits in aspects.values()):
+                        dossiers[col_name] = aspects
+            info = {"dossier": [c for c in collection_names if c in dossiers],
+                    "live": [c for c in collection_names if c not in dossiers]}
+            span["dossier"] = len(info["dossier"])
+
+            queries = [(key, template.format(name=char_name)) for key, template in CHARACTER_ASPECTS]
+            if extra_req:
+                queries.append((None, f"{char_name} {extra_req}"))
+
+            all_docs = []
+            seen_contents = set()
+            for key, query in queries:
+                query_vector = None
+                results = []
+                # 按知识库顺序合并，与 query_with_scores 的排序（含同分时的先后）一致
+                for col_name in collection_names:
+                    if key is not None and col_name in dossiers:
+                        results.extend(dossiers[col_name].get(key, [])[:k])
+                        continue
+                    if query_vector is None:
+                        with metrics.span("embed_query", chars=len(query)):
+                            query_vector = self.embeddings.embed_query(query)
+                    results.extend(self._search_collection(col_name, query_vector, k))
+                for text, meta, _ in _merge_results(results, k):
+                    if text not in seen_contents:
+                        seen_contents.add(text)
+                        all_docs.append(Document(page_content=text, metadata=meta))
+
+            # 多路合并后可能超过 k 个，优先保留前面的结果（通常相关性更高）
+            return all_docs[:k], info
+
+    def build_dossiers(self, collection_name, names=None, max_characters=MAX_CHARACTERS, progress=None):
+        """
+        为知识库预先计算角色档案：按出现频率找出主要角色（再加上 names 中指定的角色），
+        每个角色按各检索角度保存前 DOSSIER_DEPTH 个片段。
+        progress: 可选回调 progress(已完成数, 总数, 角色名)
+        返回 (成功与否, 提示信息)
+        """
+        try:
+            version = self.stats.version(collection_name)
+            if version is None:
+                self.stats.set_entry(collection_name, self._scan_collection_stats(collection_name))
+                version = self.stats.version(collection_name)
+
+            with metrics.span("dossier_scan", collection=collection_name) as span:
+                stride = max(1, self.backend.count(collection_name) // SCAN_CHUNKS)
+                sample, seen = [], 0
+                for texts in self.backend.iter_texts(collection_name, page_size=SUMMARY_SCAN_PAGE_SIZE):
+                    # 跨页保持相同的间隔：全局第 0、stride、2*stride... 个片段
+                    sample.extend(texts[-seen % stride::stride])
+                    seen += len(texts)
+                found = find_main_characters(sample, limit=max_characters)
+                span["sampled"] = len(sample)
+                span["characters"] = len(found)
+
+            mentions = dict(found)
+            targets = list(dict.fromkeys([n.strip() for n in (names or []) if n.strip()] + [n for n, _ in found]))
+            if not targets:
+                return False, f"没有在知识库 '{collection_name}' 中找到出现次数足够多的角色，可以手动指定角色名。"
+
+            for done, name in enumerate(targets):
+                if progress:
+                    progress(done, len(targets), name)
+                aspects = {}
+                for key, template in CHARACTER_ASPECTS:
+                    query_vector = self.embeddings.embed_query(template.format(name=name))
+                    aspects[key] = self.backend.search(collection_name, query_vector, DOSSIER_DEPTH)
+                self.dossiers.put(collection_name, name, version, self.embedding_model_name, aspects, mentions.get(name))
+            if progress:
+                progress(len(targets), len(targets), None)
+            return True, f"已为知识库 '{collection_name}' 生成 {len(targets)} 个角色档案: {'、'.join(targets)}"
+        except Exception as e:
+            return False, f"生成角色档案失败: {str(e)}"
+
+    def get_dossier_status(self, collection_name):
+        """[(角色, 出现次数, 是否仍然有效)]"""
+        version = self.stats.version(collection_name)
+        return [(name, mentions, built_version == version) for name, mentions, built_version, _ in self.dossiers.list(collection_name)]
+
+    def query(self, query_text, k=5, collection_names=None):
+        """
+        检索相关文档，支持多知识库
+        """
+        return [doc for doc, _ in self.query_with_scores(query_text, k=k, collection_names=collection_names)]
 
-    def delete_collection(self, collection_name):
+    def delete_collection(self, collection_name, wait=False):
         """
-        删除指定的知识库
+        删除指定的知识库：立即从知识库列表中移除并清理统计和缓存，
+        向量数据和片段引用在写入线程中后台删除（大知识库可能需要几秒）；wait=True 时等待删除完成
         """
         try:
-            self.client.delete_collection(collection_name)
-            return True, f"已删除知识库: {collection_name}"
+            if collection_name not in self.get_available_collections():
+                raise ValueError(f"知识库不存在: {collection_name}")
+            self.maintenance.mark_deleting(collection_name)
+            self.stats.remove(collection_name)
+            self.http_cache.forget_collection(collection_name)
+            self.dossiers.forget_collection(collection_name)
+            future = self._schedule_delete(collection_name)
+            if wait:
+                future.result()
+                return True, f"已删除知识库: {collection_name}"
+            return True, f"已删除知识库: {collection_name}（正在后台释放存储空间）"
         except Exception as e:
             return False, f"删除失败: {str(e)}"
 
+    def _schedule_delete(self, collection_name):
+        future = self.writer.call_async(self._finish_delete, collection_name)
+        self.maintenance.track(collection_name, future)
+        return future
+
+    def _finish_delete(self, collection_name):
+        """
+        在写入线程中执行：删除向量数据、释放片段引用并删除不再被引用的片段；
+        失败的保留在待删除列表中，下次启动时重试。同名知识库重建前会等待这里完成（见 maintenance.wait）
+        """
+        try:
+            with metrics.span("delete_collection", collection=collection_name):
+                if collection_name in self.backend.list_collections():
+                    self.backend.delete_collection(collection_name)
+                self.chunk_store.release_collection(collection_name)
+                self.chunk_store.purge_orphans()
+        except Exception as e:
+            print(f"后台删除知识库 {collection_name} 失败: {e}")
+            raise
+        self.maintenance.finish_delete(collection_name)
+
+    def get_pending_deletes(self):
+        """正在后台删除的知识库"""
+        return self.maintenance.pending()
+
     def clear_database(self):
+        """清空所有知识库：立即从列表中移除，向量数据在后台删除"""
         if os.path.exists(self.persist_directory):
             try:
-                # 关闭 client 连接可能比较麻烦，直接删文件最暴力有效
-                # 但由于 client 保持着连接，可能无法删除。
-                # 尝试使用 client.reset() 如果允许，或者删除所有 collections
-                collections = self.client.list_collections()
-                for col in collections:
-                    self.client.delete_collection(col.name)
+                for name in self.get_available_collections():
+                    success, msg = self.delete_collection(name)
+                    if not success:
+                        print(msg)
+                self.writer.call_async(self.backend.clear_shards)
+                self.stats.clear()
+                self.chunk_store.clear()
+                self.http_cache.clear_ingested()
+                self.dossiers.clear()
                 return True
             except Exception as e:
                 print(f"清理数据库失败: {e}")
                 return False
         return True
 
+    def start_compaction(self):
+        """
+        在后台回收磁盘空间：删除已删除知识库残留的文件、收缩预分配容量、对 SQLite 执行 VACUUM。
+        排在已提交的写入和删除之后执行，立即返回；进度用 get_compaction_status 查询。
+        """
+        compaction = self.maintenance.compaction
+        if compaction is None or compaction.done():
+            self.maintenance.compaction = self.writer.call_async(self._compact)
+        return self.maintenance.compaction
+
+    def get_compaction_status(self):
+        """返回 (状态, 结果)：状态为 None（未执行）/ "running" / "done" / "error"；done 时结果为 _compact 的报告"""
+        compaction = self.maintenance.compaction
+        if compaction is None:
+            return None, None
+        if not compaction.done():
+            return "running", None
+        if compaction.exception() is not None:
+            return "error", str(compaction.exception())
+        return "done", compaction.result()
+
+    def _compact(self):
+        """在写入线程中执行，返回 {"before", "after", "freed", "removed", "errors", "seconds"}（字节数按整个向量库目录统计）"""
+        start = time.perf_counter()
+        with metrics.span("compact") as span:
+            before = dir_size(self.persist_directory)
+            result = self.backend.compact()
+            self.chunk_store.purge_orphans()
+            self.chunk_store.vacuum()
+            after = dir_size(self.persist_directory)
+            span["freed"] = before - after
+        report = dict(result, before=before, after=after, freed=before - after, seconds=time.perf_counter() - start)
+        print(f"磁盘空间回收完成: 释放 {report['freed']} 字节，删除 {len(report['removed'])} 项，{len(report['errors'])} 项失败")
+        return report
+
+    def export_collection(self, collection_name, path, vector_encoding="float16"):
+        """
+        导出知识库为单个 .kbpack 文件（正文、metadata、float16/int8 向量和 Embedding 模型信息，不含 API Key）
+        """
+        try:
+            embedding_info = {
+                "type": self.embedding_type,
+                "model_name": self.embedding_model_name,
+                "base_url": self.base_url,
+                "chunking": self.get_chunking(collection_name)
+            }
+            count = export_collection(self.backend, collection_name, path, embedding_info, vector_encoding=vector_encoding)
+            return True, f"已导出知识库 {collection_name}，共 {count} 个片段。"
+        except Exception as e:
+            return False, f"导出失败: {str(e)}"
+
+    def import_collection(self, path, collection_name=None, compression=None):
+        """
+        从 .kbpack 文件批量导入知识库，直接写入已有向量，不重新计算 Embedding。
+        归档的 Embedding 模型必须与当前引擎一致，否则检索时向量不可比。
+        """
+        try:
+            header = read_header(path)
+            archived_model = header["embedding"].get("model_name")
+            if archived_model != self.embedding_model_name:
+                return False, f"导入失败: 归档使用的 Embedding 模型是 {archived_model}，当前为 {self.embedding_model_name}，请先切换到相同的模型。"
+
+            target = collection_name or header["collection"]
+            self.maintenance.wait(target)
+            imported = 0
+            for ids, vectors, texts, metadatas in iter_archive_batches(path, header):
+                self.writer.write(target, ids, vectors, texts, metadatas, compression=compression)
+                self.stats.record_batch(target, texts, metadatas, self.embedding_model_name, header["embedding"].get("chunking"))
+                imported += len(ids)
+            return True, f"已导入知识库 {target}，共 {imported} 个片段。"
+        except Exception as e:
+            return False, f"导入失败: {str(e)}"
+
     def get_available_collections(self):
         """获取所有可用的知识库名称"""
         try:
-            collections = self.client.list_collections()
-            return [c.name for c in collections]
+            pending = set(self.maintenance.pending())
+            return [name for name in self.backend.list_collections() if name not in pending]
         except:
             return []
 
+    def _scan_collection_stats(self, collection_name):
+        """
+        统计目录缺失时的兜底：分页只读取 metadata，不加载片段正文
+        """
+        sources = {}
+        count = 0
+        for metadatas in self.backend.iter_metadatas(collection_name, page_size=SUMMARY_SCAN_PAGE_SIZE):
+            for meta in metadatas:
+                if meta and "source" in meta:
+                    source = os.path.basename(meta["source"])
+                    sources[source] = sources.get(source, 0) + 1
+            count += len(metadatas)
+        return {
+            "count": count,
+            "sources": sources,
+            "bytes": None, # 只扫描 metadata 时无法得知正文大小
+            "embedding_model": None,
+            "last_ingest": None
+        }
+
+    def get_dedup_stats(self):
+        """片段缓存的去重统计（引用数、缓存的片段数、省下的 Embedding 次数、缓存占用的空间）"""
+        try:
+            return self.chunk_store.dedup_stats()
+        except Exception as e:
+            print(f"获取去重统计失败: {e}")
+            return None
+
     def get_documents_summary(self):
         """
-        获取知识库中的文档摘要（文件名列表和片段数），按知识库分组
+        获取知识库中的文档摘要（文件名列表、片段数、文本大小等），按知识库分组。
+        优先读取统计目录；目录缺失或与实际片段数不一致时才分页扫描 metadata 并回写目录。
         """
         summary = {}
         try:
-            collections = self.client.list_collections()
-            for col in collections:
+            for name in self.get_available_collections():
                 try:
-                    # 获取 metadata
-                    data = col.get()
-                    count = len(data['ids']) if data['ids'] else 0
-                    metadatas = data['metadatas']
-                    files = set()
-                    if metadatas:
-                        for meta in metadatas:
-                            if meta and 'source' in meta:
-                                files.add(os.path.basename(meta['source']))
+                    entry = self.stats.get(name)
+                    # count() 不读取数据，用来校验目录是否过期（例如旧版本建的库）
+                    if entry is None or entry.get("count") != self.backend.count(name):
+                        scanned = self._scan_collection_stats(name)
+                        if entry and entry.get("chunking"):
+                            scanned["chunking"] = entry["chunking"]
+                        entry = scanned
+                        self.stats.set_entry(name, entry)
                     
-                    summary[col.name] = {
-                        "files": list(files),
-                        "count": count
+                    summary[name] = {
+                        "files": sorted(entry["sources"].keys()),
+                        "count": entry["count"],
+                        "bytes": entry.get("bytes"),
+                        "embedding_model": entry.get("embedding_model"),
+                        "last_ingest": entry.get("last_ingest"),
+                        "chunking": entry.get("chunking")
                     }
-                except:
+                    summary[name].update(self.backend.collection_info(name))
+                except Exception as e:
+                    print(f"统计知识库 {name} 失败: {e}")
                     continue
         except Exception as e:
             print(f"获取摘要失败: {e}")
@@ -0,0 +1,273 @@
+"""
+分片知识库：一个逻辑知识库由多个物理集合（分片）组成，界面上只显示逻辑名称。
+
+一整部长篇连载放在单个集合里时，写入越来越慢，Chroma 的 HNSW 索引也会常驻越来越多的内存。
+分片知识库按“来源 + 分卷”把片段分配到分片：同一来源（同一分卷）的片段总在同一个分片中，
+当前分片写满 max_chunks 个片段后新开一个分片。检索时在线程池中并发查询所有分片，再按分数全局合并取前 k 个。
+
+ShardedBackend 包装任意 VectorBackend：未分片的知识库原样转发，RAGEngine 的其他代码不需要区分。
+分片的分配记录保存在 shards.json 中；其他进程更新过该文件时读取前重新加载。
+"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from vector_backends import VectorBackend
+
+SHARDS_FILE = "shards.json"
+SHARD_SEPARATOR = "__shard"
+# 默认每个分片最多的片段数
+DEFAULT_SHARD_CHUNKS = 200000
+# 并发查询分片的线程数
+SEARCH_WORKERS = min(8, (os.cpu_count() or 4))
+# 物理集合名称最长 63 个字符，留出分片后缀
+MAX_LOGICAL_NAME = 63 - len(SHARD_SEPARATOR) - 3
+
+
+def shard_key(metadata):
+    """片段的分片键：来源（本地文件只取文件名，上传的临时目录每次不同）+ 分卷"""
+    source = str((metadata or {}).get("source", ""))
+    if "://" not in source:
+        source = os.path.basename(source)
+    volume = (metadata or {}).get("volume")
+    return f"{source}#{volume}" if volume else source
+
+
+class ShardRegistry:
+    """
+    分片目录：{逻辑名称: {"max_chunks": N, "shards": [{"name": 物理集合, "count": 已分配片段数}], "keys": {分片键: 分片序号}}}
+    """
+
+    def __init__(self, persist_directory):
+        self.path = os.path.join(persist_directory, SHARDS_FILE)
+        self._lock = threading.Lock()
+        self._stat = None
+        self._data = self._load()
+        self._physical = self._index()
+
+    def _file_stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _refresh(self):
+        """调用方持有 _lock"""
+        if self._file_stat() != self._stat:
+            self._data = self._load()
+            self._physical = self._index()
+
+    def _load(self):
+        self._stat = self._file_stat()
+        if self._stat is None:
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"读取分片目录失败: {e}")
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._stat = self._file_stat()
+        self._physical = self._index()
+
+    def _index(self):
+        return {shard["name"]: name for name, entry in self._data.items() for shard in entry["shards"]}
+
+    def create(self, collection_name, max_chunks=DEFAULT_SHARD_CHUNKS):
+        if len(collection_name) > MAX_LOGICAL_NAME:
+            raise ValueError(f"分片知识库名称最长 {MAX_LOGICAL_NAME} 个字符: {collection_name}")
+        with self._lock:
+            self._refresh()
+            if collection_name not in self._data:
+                self._data[collection_name] = {"max_chunks": int(max_chunks), "shards": [], "keys": {}}
+                self._save()
+
+    def is_sharded(self, collection_name):
+        with self._lock:
+            self._refresh()
+            return collection_name in self._data
+
+    def shards(self, collection_name):
+        """逻辑知识库的物理集合列表；未分片的知识库返回 [collection_name]"""
+        with self._lock:
+            self._refresh()
+            entry = self._data.get(collection_name)
+            if entry is None:
+                return [collection_name]
+            return [shard["name"] for shard in entry["shards"]]
+
+    def logical_name(self, physical_name):
+        with self._lock:
+            self._refresh()
+            return self._physical.get(physical_name, physical_name)
+
+    def assign(self, collection_name, metadatas):
+        """
+        为一批片段分配分片，返回 {物理集合: [片段序号]}。
+        已分配过的分片键沿用原来的分片；新键放入最后一个分片，写满后新开一个。
+        """
+        with self._lock:
+            self._refresh()
+            entry = self._data[collection_name]
+            shards, keys = entry["shards"], entry["keys"]
+            groups = {}
+            for i, meta in enumerate(metadatas):
+                key = shard_key(meta)
+                index = keys.get(key)
+                if index is None:
+                    if not shards or shards[-1]["count"] >= entry["max_chunks"]:
+                        shards.append({"name": f"{collection_name}{SHARD_SEPARATOR}{len(shards):03d}", "count": 0})
+                    index = keys[key] = len(shards) - 1
+                shards[index]["count"] += 1
+                groups.setdefault(shards[index]["name"], []).append(i)
+            self._save()
+            return groups
+
+    def remove(self, collection_name):
+        with self._lock:
+            self._refresh()
+            if self._data.pop(collection_name, None) is not None:
+                self._save()
+
+    def clear(self):
+        with self._lock:
+            self._data = {}
+            self._save()
+
+
+def _take(items, indices):
+    return [items[i] for i in indices]
+
+
+class ShardedBackend(VectorBackend):
+    """在任意后端之上提供分片知识库；未分片的知识库直接转发给底层后端"""
+
+    def __init__(self, backend):
+        self.base = backend
+        self.name = backend.name
+        self.supports_compression = backend.supports_compression
+        self.persist_directory = backend.persist_directory
+        self.data_dir = backend.data_dir
+        self.registry = ShardRegistry(self.data_dir)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # 已在底层后端中创建的分片，避免每次检索都列出全部集合
+        self._created = set()
+
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="shard-search")
+            return self._pool
+
+    def create_sharded(self, collection_name, max_chunks=DEFAULT_SHARD_CHUNKS):
+        self.registry.create(collection_name, max_chunks)
+
+    def is_sharded(self, collection_name):
+        return self.registry.is_sharded(collection_name)
+
+    def shard_names(self, collection_name):
+        return self.registry.shards(collection_name)
+
+    def _existing_shards(self, collection_name):
+        shards = self.registry.shards(collection_name)
+        if not self.registry.is_sharded(collection_name):
+            return shards
+        if any(s not in self._created for s in shards):
+            # 分配了但写入失败的分片在底层后端中不存在
+            self._created = set(self.base.list_collections())
+        return [s for s in shards if s in self._created]
+
+    def list_collections(self):
+        names = []
+        for physical in self.base.list_collections():
+            name = self.registry.logical_name(physical)
+            if name not in names:
+                names.append(name)
+        return names
+
+    def count(self, collection_name):
+        if not self.registry.is_sharded(collection_name):
+            return self.base.count(collection_name)
+        shards = self._existing_shards(collection_name)
+        if not shards:
+            raise ValueError(f"知识库不存在: {collection_name}")
+        return sum(self.base.count(s) for s in shards)
+
+    def add(self, collection_name, ids, vectors, texts, metadatas, compression=None):
+        if not self.registry.is_sharded(collection_name):
+            return self.base.add(collection_name, ids, vectors, texts, metadatas, compression=compression)
+        for shard, indices in self.registry.assign(collection_name, metadatas).items():
+            self.base.add(shard, _take(ids, indices), _take(vectors, indices), _take(texts, indices),
+                          _take(metadatas, indices), compression=compression)
+            self._created.add(shard)
+
+    def search(self, collection_name, query_vector, k):
+        if not self.registry.is_sharded(collection_name):
+            return self.base.search(collection_name, query_vector, k)
+        shards = self._existing_shards(collection_name)
+        if not shards:
+            raise ValueError(f"知识库不存在: {collection_name}")
+        if len(shards) == 1:
+            return self.base.search(shards[0], query_vector, k)
+        with metrics.span("shard_fanout", collection=collection_name, shards=len(shards), k=k):
+            # 每个分片各取前 k 个，合并后的前 k 个即为全局前 k 个；按分片顺序合并，同分时结果稳定
+            per_shard = list(self._executor().map(lambda s: self.base.search(s, query_vector, k), shards))
+        results = [hit for hits in per_shard for hit in hits]
+        results.sort(key=lambda hit: hit[2], reverse=True)
+        return results[:k]
+
+    def iter_metadatas(self, collection_name, page_size=5000):
+        for shard in self._existing_shards(collection_name):
+            yield from self.base.iter_metadatas(shard, page_size)
+
+    def iter_texts(self, collection_name, page_size=5000):
+        for shard in self._existing_shards(collection_name):
+            yield from self.base.iter_texts(shard, page_size)
+
+    def iter_batches(self, collection_name, batch_size=5000):
+        for shard in self._existing_shards(collection_name):
+            yield from self.base.iter_batches(shard, batch_size)
+
+    def collection_info(self, collection_name):
+        if not self.registry.is_sharded(collection_name):
+            return self.base.collection_info(collection_name)
+        shards = self._existing_shards(collection_name)
+        info = {"shards": len(shards)}
+        infos = [self.base.collection_info(s) for s in shards]
+        if infos and all("disk_bytes" in i for i in infos):
+            info["disk_bytes"] = sum(i["disk_bytes"] for i in infos)
+            info["compression"] = infos[0].get("compression")
+        return info
+
+    def delete_source(self, collection_name, source, keep_ids=()):
+        if not self.registry.is_sharded(collection_name):
+            return self.base.delete_source(collection_name, source, keep_ids)
+        removed = []
+        for shard in self._existing_shards(collection_name):
+            removed.extend(self.base.delete_source(shard, source, keep_ids))
+        return removed
+
+    def delete_collection(self, collection_name):
+        if not self.registry.is_sharded(collection_name):
+            return self.base.delete_collection(collection_name)
+        for shard in self._existing_shards(collection_name):
+            self.base.delete_collection(shard)
+            self._created.discard(shard)
+        self.registry.remove(collection_name)
+
+    def clear_shards(self):
+        self.registry.clear()
+
+    def compact(self):
+        return self.base.compact()
@@ -0,0 +1,156 @@
+"""
+角色提示词的风格版本：同一组检索结果，按选中的几种风格各自走“生成 → 校验”两个阶段。
+
+多个风格时各版本的两阶段流程在线程池中并发执行（并发数有上限），总耗时接近只生成一个版本；
+各版本共用同一条 system 前缀（原文片段），后续请求仍可命中提供商的上下文缓存。
+工作线程只把流式内容写入队列，界面更新由调用方（Streamlit 脚本线程）在 VariantRun.updates() 中完成。
+"""
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+PROMPT_STYLES = ["详细设定版", "简短对话版", "JSON格式"]
+# 同时进行的版本数上限，避免一次触发太多请求被限流
+MAX_PARALLEL_VARIANTS = 3
+# 界面刷新间隔（秒）：各版本的流式内容在两次刷新之间合并
+UPDATE_INTERVAL = 0.1
+
+STYLE_REQUIREMENTS = {
+    "详细设定版": """1. **Prompt结构**：请使用动态Prompt结构，包含以下模块：
+       - [角色详情]：姓名、年龄、身份等。
+       - [性格特质]：深层性格、行事逻辑、优缺点。
+       - [语言风格]：口癖、语气、常用词、句式特点。
+       - [经历背景]：关键身世、重要剧情节点。
+       - [人际关系]：与关键人物的关系及态度。
+    2. **对话生成**：请生成一段包含 **5个来回** 的对话示例（User与{char_name}的互动）。对话内容需紧扣剧情逻辑，展现角色的语气和性格。
+    3. **行文风格提取**：**必须**在所有输出的最后，单独列出一个章节叫“【提取的原文本行文风格】”，描述原文的描写手法、修辞风格和氛围感。""",
+    "简短对话版": """1. **精简设定**：用不超过 300 字概括{char_name}的身份、性格和说话方式，只保留对话时用得上的信息。
+    2. **对话规则**：列出 3~5 条扮演时必须遵守的语气、口癖和行为规则。
+    3. **对话生成**：请生成一段包含 **5个来回** 的简短对话示例（User与{char_name}的互动），每句回复尽量简短、口语化。
+    4. **行文风格提取**：**必须**在所有输出的最后，单独列出一个章节叫“【提取的原文本行文风格】”，用一两句话描述原文的行文风格。""",
+    "JSON格式": """1. **输出格式**：只输出一个 JSON 对象，不要输出 JSON 以外的任何文字，字段如下：
+       - "name"、"identity"、"personality"、"speech_style"、"background"：字符串
+       - "relationships"：数组，每项为 {{"name": 人物, "attitude": 关系与态度}}
+       - "dialogue_examples"：数组，**5个来回**，每项为 {{"user": 用户的话, "character": {char_name}的回复}}
+       - "writing_style"：原文本的描写手法、修辞风格和氛围感
+    2. **内容要求**：各字段内容需紧扣原文的剧情逻辑，对话示例要展现角色的语气和性格。"""
+}
+
+# 校验时提醒保留各风格的输出格式
+STYLE_KEEP = {
+    "详细设定版": "确保输出的最后依然包含“【提取的原文本行文风格】”。",
+    "简短对话版": "保持精简，确保输出的最后依然包含“【提取的原文本行文风格】”。",
+    "JSON格式": "只输出修正后的完整 JSON 对象，字段与原来相同，不要输出其他文字。"
+}
+
+
+def build_generation_prompt(char_name, style, extra_req=""):
+    """第一阶段（生成）的任务说明；原文片段在共享的 system 前缀中"""
+    return f"""请根据提供的原文片段，为角色【{char_name}】撰写一份高级的角色扮演 System Prompt。
+
+    【任务要求】
+    {STYLE_REQUIREMENTS[style].format(char_name=char_name)}
+
+    【用户额外要求】
+    {extra_req}
+
+    请直接输出结果。
+    """
+
+
+def build_judge_prompt(style):
+    """第二阶段（校验与修正）的任务说明"""
+    return f"""现在请你作为剧情逻辑审核员，评估你上面生成的角色Prompt和对话是否符合原文的剧情逻辑和人设。
+
+    【审核要求】
+    1. **判断标准**：重点判断是否符合“剧情逻辑”和“人设还原度”。**削弱逻辑判断**，不要过分纠结严密的现实逻辑，只要符合故事内部的剧情逻辑即可。
+    2. **输出处理**：
+       - 如果内容合格，请直接输出原内容。
+       - 如果有偏差（如OOC、语气不对、剧情冲突），请修正并输出优化后的完整版本。
+    3. **保留项**：{STYLE_KEEP[style]}
+
+    请输出最终确定的版本。
+    """
+
+
+class VariantRun:
+    """
+    并发生成多个风格版本。用法：
+        run = VariantRun(client, prefix_message, char_name, styles, extra_req, model)
+        for style, stage, text in run.updates():
+            ...  # 刷新该版本的显示，stage 为 "生成" / "校验" / "完成" / "失败"
+        run.results[style]  # {"initial_request", "draft", "final", "usage": [生成, 校验], "error", "seconds"}
+    """
+
+    def __init__(self, client, prefix_message, char_name, styles, extra_req="", model=None, max_workers=MAX_PARALLEL_VARIANTS):
+        self.client = client
+        self.prefix_message = prefix_message
+        self.char_name = char_name
+        self.styles = list(styles)
+        self.extra_req = extra_req
+        self.model = model
+        self.max_workers = max(1, min(max_workers, len(self.styles)))
+        self.results = {}
+        self._queue = queue.Queue()
+
+    def _stream(self, style, stage, messages):
+        """流式调用一个阶段，返回 (全文, 流对象)；出错时抛出 RuntimeError"""
+        stream = self.client.chat(messages, model=self.model, stream=True, label=stage)
+        if isinstance(stream, str):
+            raise RuntimeError(stream)
+        text = ""
+        for chunk in stream:
+            content = chunk.choices[0].delta.content
+            if content:
+                text += content
+                self._queue.put((style, stage, text))
+        return text, stream
+
+    def _run_style(self, style):
+        started = time.perf_counter()
+        initial_request = {"role": "user", "content": build_generation_prompt(self.char_name, style, self.extra_req), "initial": True}
+        result = {"initial_request": initial_request, "draft": "", "final": "", "usage": [None, None], "error": None}
+        try:
+            messages_gen = [self.prefix_message, initial_request]
+            result["draft"], stream_gen = self._stream(style, "生成", messages_gen)
+            result["usage"][0] = stream_gen.usage
+            # 沿用生成阶段的完整消息作为前缀，初稿以 assistant 消息接在后面，不再重复原文片段
+            messages_judge = messages_gen + [
+                {"role": "assistant", "content": result["draft"]},
+                {"role": "user", "content": build_judge_prompt(style)}
+            ]
+            result["final"], stream_judge = self._stream(style, "校验", messages_judge)
+            result["usage"][1] = stream_judge.usage
+            self._queue.put((style, "完成", result["final"]))
+        except Exception as e:
+            result["error"] = str(e)
+            self._queue.put((style, "失败", result["error"]))
+        result["seconds"] = time.perf_counter() - started
+        self.results[style] = result
+
+    def updates(self, interval=UPDATE_INTERVAL):
+        """
+        启动所有版本并逐批产出 (风格, 阶段, 当前全文)，在调用方的线程中执行。
+        同一版本在一个刷新间隔内的多次更新只产出最后一次，“完成 / 失败”总会产出。
+        """
+        with metrics.span("style_variants", styles=len(self.styles), workers=self.max_workers):
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="style-variant") as executor:
+                futures = [executor.submit(self._run_style, style) for style in self.styles]
+                while True:
+                    done = all(f.done() for f in futures)
+                    latest = {}
+                    deadline = time.monotonic() + interval
+                    while True:
+                        timeout = 0 if done else deadline - time.monotonic()
+                        try:
+                            style, stage, text = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if latest.get(style, (None,))[0] not in ("完成", "失败"):
+                            latest[style] = (stage, text)
+                    for style, (stage, text) in latest.items():
+                        yield style, stage, text
+                    if done and self._queue.empty():
+                        break
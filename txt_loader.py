@@ -0,0 +1,368 @@
+"""
+TXT 小说的流式加载：按采样判断编码，内存映射文件后分块增量解码，边解码边切分。
+
+原先的做法是依次用 utf-8 / gb18030 / gbk 把整个文件读成一个字符串，失败再换下一种，
+几百 MB 的 GBK 小说会被完整读取好几次，整本书的字符串、Document 和切分结果同时留在内存中。
+这里只对文件的几段样本试解码来确定编码，正文按块解码、在换行处分段交给切分器，
+任何时候内存中只有一段正文（默认约 100 万字）。
+
+每个片段的 metadata 带有 byte_start / byte_end：片段在原文件中的字节范围，
+可以直接定位回原文（换行统一为 \\n，按原文件的 \\r\\n 计算偏移）。
+行首出现“第X卷 / 第X部”这样的分卷标题时，之后的片段带有 volume（如“第三卷”），分片知识库据此分配分片。
+"""
+import bisect
+import codecs
+import mmap
+import os
+import re
+
+# 每段样本的字节数，以及从文件的几个位置取样（开头、中间、结尾）
+SAMPLE_BYTES = 64 * 1024
+SAMPLE_POSITIONS = (0.0, 0.25, 0.5, 0.75, 1.0)
+# 每次从内存映射中解码的字节数
+BLOCK_BYTES = 4 * 1024 * 1024
+# 缓冲的正文达到多少字后在最后一个换行处切出一段交给切分器
+SEGMENT_CHARS = 1000000
+
+BOMS = [
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+]
+# 没有 BOM 时依次尝试的编码（与原先的顺序一致；gbk 是 gb18030 的子集，不必单独尝试）
+CANDIDATE_ENCODINGS = ["utf-8", "gb18030"]
+
+_NEWLINES = re.compile(r"\r\n?")
+# 行首的分卷标题
+VOLUME_HEADING = re.compile(r"^[ \t\u3000]*(第[0-9０-９零〇一二三四五六七八九十百千两]+[卷部集])", re.M)
+
+
+def _samples(data):
+    """从文件的几个位置各取一段样本；中间的样本从换行之后开始，避免从多字节字符中间截断"""
+    size = len(data)
+    if size <= SAMPLE_BYTES * len(SAMPLE_POSITIONS):
+        return [bytes(data[:size])]
+    samples = []
+    for position in SAMPLE_POSITIONS:
+        start = min(int(size * position), size - SAMPLE_BYTES)
+        if start > 0:
+            # \n 在 UTF-8 和 GB18030 中都不会出现在多字节字符内部
+            newline = data.find(b"\n", start, start + SAMPLE_BYTES)
+            if newline < 0:
+                continue
+            start = newline + 1
+        samples.append(bytes(data[start:start + SAMPLE_BYTES]))
+    return samples
+
+
+def _decodes(samples, encoding):
+    for sample in samples:
+        try:
+            # final=False：样本末尾被截断的多字节字符不算错误
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+        except UnicodeDecodeError:
+            return False
+    return True
+
+
+def _detect(sample):
+    """用 charset_normalizer / chardet（如已安装）猜测编码，都没有时返回 None"""
+    try:
+        from charset_normalizer import from_bytes
+        best = from_bytes(sample).best()
+        return best.encoding if best else None
+    except ImportError:
+        pass
+    try:
+        import chardet
+        return chardet.detect(sample).get("encoding")
+    except ImportError:
+        return None
+
+
+def sniff_encoding(data):
+    """
+    根据文件开头的 BOM 和几段样本判断编码。
+    返回 (候选编码列表, BOM 字节数)；样本都能解码的编码排在前面，整文件解码失败时调用方依次换下一个。
+    """
+    for bom, encoding in BOMS:
+        if data[:len(bom)] == bom:
+            return [encoding], len(bom)
+    samples = _samples(data)
+    matched = [enc for enc in CANDIDATE_ENCODINGS if _decodes(samples, enc)]
+    if not matched:
+        detected = _detect(b"".join(samples))
+        if detected:
+            try:
+                matched.append(codecs.lookup(detected).name)
+            except LookupError:
+                pass
+    return matched + [enc for enc in CANDIDATE_ENCODINGS if enc not in matched], 0
+
+
+class _Segment:
+    """一段解码后的原文及其起始字节偏移；负责把切分出的片段映射回原文位置和字节范围"""
+
+    def __init__(self, raw, byte_start, encoding):
+        self.raw = raw
+        self.encoding = encoding
+        self.removed = None
+        self.all_crlf = False
+        if "\r" in raw:
+            self.text = _NEWLINES.sub("\n", raw)
+            crlf = raw.count("\r\n")
+            # Windows 下保存的文件通常全部是 \r\n：原文位置 = 规范化位置 + 之前的换行数，不必记录每个位置
+            self.all_crlf = crlf == raw.count("\r") == raw.count("\n")
+            if not self.all_crlf:
+                # 被去掉的 \r 在规范化文本中的位置
+                self.removed = [m.start() - i for i, m in enumerate(re.finditer("\r\n", raw))]
+        else:
+            self.text = raw
+        # 上一次定位的 (规范化位置, 原文位置, 字节偏移)；相邻两次定位之间只处理中间的文字
+        self._anchor = (0, 0, byte_start)
+
+    def _raw_index(self, index):
+        anchor, raw_anchor, _ = self._anchor
+        if self.all_crlf:
+            if index >= anchor:
+                return raw_anchor + index - anchor + self.text.count("\n", anchor, index)
+            return raw_anchor - (anchor - index) - self.text.count("\n", index, anchor)
+        if self.removed:
+            return index + bisect.bisect_right(self.removed, index - 1)
+        return index
+
+    def byte_offset(self, index):
+        """
+        规范化文本中第 index 个字符的字节偏移。
+        依次定位片段的起点和终点时，只需编码片段本身和与上一片段重叠的部分。
+        """
+        raw_index = self._raw_index(index)
+        _, raw_anchor, offset = self._anchor
+        if raw_index >= raw_anchor:
+            offset += len(self.raw[raw_anchor:raw_index].encode(self.encoding, errors="replace"))
+        else:
+            offset -= len(self.raw[raw_index:raw_anchor].encode(self.encoding, errors="replace"))
+        self._anchor = (index, raw_index, offset)
+        return offset
+
+    def raw_from(self, index):
+        """从规范化位置 index 开始的原文，以及它的字节偏移"""
+        offset = self.byte_offset(index)
+        return self.raw[self._anchor[1]:], offset
+
+
+def _iter_blocks(data, encoding, bom_length, errors):
+    """
+    从内存映射中按块增量解码，产出 (文本, 是否最后一块)。
+    解码过的页面随即告诉系统不再需要，否则整个文件会逐渐全部计入进程的常驻内存。
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    release = getattr(mmap, "MADV_DONTNEED", None)
+    released = 0
+    position = bom_length
+    size = len(data)
+    while position < size:
+        end = min(position + BLOCK_BYTES, size)
+        text = decoder.decode(data[position:end], final=end == size)
+        position = end
+        if release is not None:
+            aligned = end // mmap.PAGESIZE * mmap.PAGESIZE
+            if aligned > released:
+                data.madvise(release, released, aligned - released)
+                released = aligned
+        yield text, end == size
+
+
+def _locate(text, chunks, overlap):
+    """切分出的片段在原文中的起始位置（与 langchain 的 add_start_index 做法相同）"""
+    positions = []
+    search_from = 0
+    for chunk in chunks:
+        index = text.find(chunk, search_from)
+        if index < 0:
+            index = text.find(chunk, positions[-1] if positions else 0)
+        positions.append(index)
+        # 下一片段最早从本片段末尾减去重叠处开始
+        search_from = max(index + 1, index + len(chunk) - overlap)
+    return positions
+
+
+# 换行类分隔符在原始字节中的写法（\r\n / \r / \n 都算一个换行），用于判断文件中是否出现过
+_RAW_NEWLINE_FORMS = {
+    "\n\n": ["\n\n", "\n\r", "\r\r"],
+    "\n": ["\n", "\r"],
+}
+
+
+def _raw_contains(data, start, forms, encoding):
+    """按块在内存映射中查找，查过的页面随即释放；utf-16 等多字节编码要求匹配位置按字符对齐"""
+    patterns = [form.encode(encoding) for form in forms]
+    width = len("\n".encode(encoding))
+    release = getattr(mmap, "MADV_DONTNEED", None)
+    size = len(data)
+    position = start
+    while position < size:
+        end = min(position + BLOCK_BYTES, size)
+        for pattern in patterns:
+            found = data.find(pattern, position, min(end + len(pattern) - 1, size))
+            while found >= 0 and (found - start) % width:
+                found = data.find(pattern, found + 1, min(end + len(pattern) - 1, size))
+            if found >= 0:
+                return True
+        if release is not None:
+            aligned = end // mmap.PAGESIZE * mmap.PAGESIZE
+            low = position // mmap.PAGESIZE * mmap.PAGESIZE
+            if aligned > low:
+                data.madvise(release, low, aligned - low)
+        position = end
+    return False
+
+
+def _top_separator(splitter, text, data, bom_length, encoding):
+    """
+    整个文件切分时第一层使用的分隔符（切分器按顺序取正文中出现的第一个）。
+    先看已解码的正文，没有时在原始字节中查找换行类分隔符；无法判断时返回 None
+    """
+    for separator in splitter._separators:
+        if separator in text:
+            return separator
+        forms = _RAW_NEWLINE_FORMS.get(separator)
+        if forms is None:
+            return None
+        if _raw_contains(data, bom_length, forms, encoding):
+            return separator
+    return None
+
+
+def _pending_start(splitter, splits):
+    """
+    与 TextSplitter._merge_splits 相同的贪心合并（分隔符保留在各段开头，合并时不另加），
+    返回合并到最后时仍在累积的那个片段由第几段开始：后面接上的正文不同，这个片段也会不同
+    """
+    size, overlap, length = splitter._chunk_size, splitter._chunk_overlap, splitter._length_function
+    start, total = 0, 0
+    for i, split in enumerate(splits):
+        n = length(split)
+        if total + n > size and i > start:
+            while total > overlap or (total + n > size and total > 0):
+                total -= length(splits[start])
+                start += 1
+        total += n
+    return start
+
+
+def _stable_cut(splitter, text, separator):
+    """
+    text 从第一层的一段开头开始。返回 (切分的正文长度, 从哪里开始留给下一段)：
+    在最后一个第一层分隔符处截断，截断前的各段与整文件切分时完全相同；
+    切分结果中只有最后仍在累积的片段会受后文影响，从它的第一段开始留给下一段。
+    正文中还没有完整的一段时返回 (0, 0)
+    """
+    starts = [m.start() for m in re.finditer(re.escape(separator), text)]
+    # 截断处之前至少要出现一次分隔符，切分器才会选用同一个分隔符
+    if len(starts) < 2:
+        return 0, 0
+    cut = starts[-1]
+    bounds = [0] + [p for p in starts if 0 < p < cut] + [cut]
+    splits = [text[a:b] for a, b in zip(bounds, bounds[1:]) if b > a]
+    # 长段会单独递归切分，合并从它之后重新开始
+    last_long = max((i for i, split in enumerate(splits) if splitter._length_function(split) >= splitter._chunk_size), default=-1)
+    run = splits[last_long + 1:]
+    if not run:
+        return cut, cut
+    keep = sum(len(split) for split in splits[:last_long + 1]) + sum(len(split) for split in run[:_pending_start(splitter, run)])
+    return cut, keep
+
+
+def iter_txt_documents(file_path, splitter, encoding=None, errors="strict"):
+    """
+    流式读取 TXT 并切分，逐个产出 Document（metadata: source, byte_start, byte_end）。
+    encoding 为 None 时自动判断（只用第一个候选）；errors="strict" 时遇到无法解码的字节抛出 UnicodeDecodeError。
+    splitter 为 make_text_splitter 创建的 RecursiveCharacterTextSplitter。
+
+    缓冲的正文在切分器第一层分隔符（通常是空行）处切出一段交给切分器。切分器逐段贪心合并，
+    截断只影响最后一个仍在累积的片段：这个片段不输出，从它的第一段开始的正文并入下一段重新切分，
+    合并状态与整文件切分时相同，所以切分结果与把整个文件读成一个字符串再切分完全一致
+    （相同的片段哈希，已入库的内容不会重复 Embedding）。
+    文件中没有换行时只能在块边界处截断，边界附近的片段可能与整文件切分不同。
+    """
+    from langchain_core.documents import Document
+    overlap = getattr(splitter, "_chunk_overlap", 0)
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            candidates, bom_length = sniff_encoding(data)
+            encoding = encoding or candidates[0]
+            buffer, buffer_byte = "", bom_length
+            separator, detected = None, False
+            volume = None
+            for text, final in _iter_blocks(data, encoding, bom_length, errors):
+                buffer += text
+                if len(buffer) < SEGMENT_CHARS and not final:
+                    continue
+                # 只处理到最后一个换行：\r\n 可能被块边界拆开
+                safe = len(buffer) if final else buffer.rfind("\n") + 1
+                segment = _Segment(buffer[:safe] if safe > 0 else buffer, buffer_byte, encoding)
+                rest = buffer[safe:] if safe > 0 else ""
+                if not detected:
+                    separator = _top_separator(splitter, segment.text, data, bom_length, encoding)
+                    detected = True
+                if final:
+                    cut, keep = len(segment.text), None
+                elif separator:
+                    cut, keep = _stable_cut(splitter, segment.text, separator)
+                    if keep == 0:
+                        # 还没有可以截断的位置，继续缓冲
+                        continue
+                else:
+                    # 无法确定第一层分隔符（例如没有换行）：在块边界截断，最后一个片段留给下一段
+                    cut, keep = len(segment.text), None
+                chunks = splitter.split_text(segment.text[:cut])
+                positions = _locate(segment.text, chunks, overlap)
+                if not final and chunks:
+                    if keep is None:
+                        keep = positions[-1]
+                        while keep > 0 and segment.text[keep - 1].isspace():
+                            keep -= 1
+                        chunks, positions = chunks[:-1], positions[:-1]
+                    elif keep < cut and segment.text[keep:cut].strip():
+                        # 最后一个片段仍在累积（只有空白时切分器不输出它）
+                        chunks, positions = chunks[:-1], positions[:-1]
+                for chunk, index in zip(chunks, positions):
+                    start = segment.byte_offset(index)
+                    end = segment.byte_offset(index + len(chunk))
+                    metadata = {"source": file_path, "byte_start": start, "byte_end": end}
+                    # 片段以分卷标题开头时属于新的一卷；片段中间出现的标题从下一个片段开始生效
+                    heading = VOLUME_HEADING.match(chunk)
+                    if heading:
+                        volume = heading.group(1)
+                    if volume:
+                        metadata["volume"] = volume
+                    for heading in VOLUME_HEADING.finditer(chunk):
+                        volume = heading.group(1)
+                    yield Document(page_content=chunk, metadata=metadata)
+                if final:
+                    buffer = ""
+                elif keep is not None:
+                    kept, buffer_byte = segment.raw_from(keep)
+                    buffer = kept + rest
+
+
+def load_txt_documents(file_path, splitter):
+    """
+    加载并切分 TXT，返回 (片段列表, 使用的编码)。
+    采样判断的编码在文件后部解码失败时换下一个候选重新读取；都失败时用第一个候选并替换无法解码的字节。
+    """
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return [], "utf-8"
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            candidates, _ = sniff_encoding(data)
+    for encoding in candidates:
+        try:
+            return list(iter_txt_documents(file_path, splitter, encoding)), encoding
+        except UnicodeDecodeError as e:
+            print(f"{file_path} 按 {encoding} 解码失败（{e.reason}），换下一种编码")
+    return list(iter_txt_documents(file_path, splitter, candidates[0], errors="replace")), candidates[0]
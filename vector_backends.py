@@ -0,0 +1,855 @@
+import json
+import os
+import re
+import shutil
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from vector_quant import COMPRESSION_MODES, PQ_RESCORE_FACTOR, PQ_TRAIN_SAMPLES, create_codec
+
+# 打分时每次处理的行数，控制大库检索时的临时内存
+SEARCH_BLOCK_ROWS = 65536
+# chroma 的段目录以段 id（UUID）命名
+SEGMENT_DIR_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+# chroma 删除集合时分批删除片段的批大小：整个集合一次删除会长时间占住 chroma 的锁，期间所有检索都要等待
+CHROMA_DELETE_PAGE_SIZE = 1000
+
+
+class VectorBackend:
+    """
+    向量存储后端接口。RAGEngine 负责切分和 Embedding，后端只负责存取向量。
+    search 返回 (text, metadata, score) 列表，score 越大越相关。
+    """
+    name = ""
+    supports_compression = False
+
+    def __init__(self, persist_directory):
+        self.persist_directory = persist_directory
+        # 统计目录等附属文件放在这里，不同后端互不干扰
+        self.data_dir = persist_directory
+
+    def list_collections(self):
+        raise NotImplementedError
+
+    def count(self, collection_name):
+        raise NotImplementedError
+
+    def add(self, collection_name, ids, vectors, texts, metadatas, compression=None):
+        """compression 仅对 supports_compression 的后端有效，且只在新建知识库时生效"""
+        raise NotImplementedError
+
+    def search(self, collection_name, query_vector, k):
+        raise NotImplementedError
+
+    def iter_metadatas(self, collection_name, page_size=5000):
+        """逐页返回 metadata 列表，不读取正文"""
+        raise NotImplementedError
+
+    def iter_texts(self, collection_name, page_size=5000):
+        """逐页返回片段正文列表，不读取向量"""
+        raise NotImplementedError
+
+    def collection_info(self, collection_name):
+        """存储相关的附加信息（压缩方式、磁盘占用），未知的项不返回"""
+        return {}
+
+    def iter_batches(self, collection_name, batch_size=5000):
+        """逐批返回 (ids, float32 向量矩阵, texts, metadatas)，用于导出"""
+        raise NotImplementedError
+
+    def delete_source(self, collection_name, source, keep_ids=()):
+        """删除来源为 source、且 id 不在 keep_ids 中的片段，返回被删除的 id 列表"""
+        raise NotImplementedError
+
+    def delete_collection(self, collection_name):
+        raise NotImplementedError
+
+    def compact(self):
+        """
+        回收已删除知识库和中断写入留下的磁盘空间（在写入线程中执行，期间没有写入），
+        返回 {"removed": [删除的目录], "errors": [无法删除的项]}
+        """
+        return {"removed": [], "errors": []}
+
+
+class ChromaBackend(VectorBackend):
+    """基于 chromadb.PersistentClient 的后端（默认）"""
+    name = "chroma"
+
+    def __init__(self, persist_directory):
+        super().__init__(persist_directory)
+        import chromadb
+        self.client = chromadb.PersistentClient(path=persist_directory)
+        # 新版 chromadb 对单次写入条数有限制
+        self.max_batch_size = getattr(self.client, "max_batch_size", None) or 5000
+
+    def _get_collection(self, collection_name, create=False):
+        # embedding_function=None：向量由 RAGEngine 计算后直接写入，不用 chroma 自带模型
+        if create:
+            return self.client.get_or_create_collection(collection_name, embedding_function=None)
+        return self.client.get_collection(collection_name, embedding_function=None)
+
+    def list_collections(self):
+        return [c.name for c in self.client.list_collections()]
+
+    def count(self, collection_name):
+        return self._get_collection(collection_name).count()
+
+    def add(self, collection_name, ids, vectors, texts, metadatas, compression=None):
+        if compression not in (None, "float32"):
+            raise ValueError("Chroma 后端不支持向量压缩，请改用 NumPy 后端")
+        col = self._get_collection(collection_name, create=True)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        for i in range(0, len(ids), self.max_batch_size):
+            j = i + self.max_batch_size
+            col.upsert(
+                ids=list(ids[i:j]),
+                embeddings=vectors[i:j].tolist(),
+                documents=list(texts[i:j]),
+                metadatas=list(metadatas[i:j])
+            )
+
+    def search(self, collection_name, query_vector, k):
+        col = self._get_collection(collection_name)
+        res = col.query(
+            query_embeddings=[np.asarray(query_vector, dtype=np.float32).tolist()],
+            n_results=k,
+            include=["documents", "metadatas", "distances"]
+        )
+        results = []
+        for text, meta, dist in zip(res["documents"][0], res["metadatas"][0], res["distances"][0]):
+            results.append((text, meta or {}, -float(dist)))
+        return results
+
+    def iter_metadatas(self, collection_name, page_size=5000):
+        col = self._get_collection(collection_name)
+        offset = 0
+        while True:
+            data = col.get(include=["metadatas"], limit=page_size, offset=offset)
+            ids = data.get("ids") or []
+            if not ids:
+                break
+            yield data.get("metadatas") or []
+            offset += len(ids)
+            if len(ids) < page_size:
+                break
+
+    def iter_texts(self, collection_name, page_size=5000):
+        col = self._get_collection(collection_name)
+        offset = 0
+        while True:
+            data = col.get(include=["documents"], limit=page_size, offset=offset)
+            ids = data.get("ids") or []
+            if not ids:
+                break
+            yield data.get("documents") or []
+            offset += len(ids)
+            if len(ids) < page_size:
+                break
+
+    def iter_batches(self, collection_name, batch_size=5000):
+        col = self._get_collection(collection_name)
+        offset = 0
+        while True:
+            data = col.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+            ids = data.get("ids") or []
+            if not ids:
+                break
+            yield ids, np.asarray(data["embeddings"], dtype=np.float32), data["documents"], data["metadatas"]
+            offset += len(ids)
+            if len(ids) < batch_size:
+                break
+
+    def delete_source(self, collection_name, source, keep_ids=()):
+        col = self._get_collection(collection_name)
+        keep_ids = set(keep_ids)
+        ids = [i for i in col.get(where={"source": source}, include=[])["ids"] if i not in keep_ids]
+        for i in range(0, len(ids), self.max_batch_size):
+            col.delete(ids=ids[i:i + self.max_batch_size])
+        return ids
+
+    def delete_collection(self, collection_name):
+        col = self._get_collection(collection_name)
+        # 先分批删除片段，每批之间检索可以插进来；总耗时更长，但删除在后台进行
+        while True:
+            ids = col.get(include=[], limit=CHROMA_DELETE_PAGE_SIZE)["ids"]
+            if not ids:
+                break
+            col.delete(ids=ids)
+        self.client.delete_collection(collection_name)
+
+    def compact(self):
+        """
+        删除集合时 chroma 只删除 SQLite 中的记录，HNSW 段目录留在磁盘上：
+        删除不再属于任何段的目录，再对 chroma.sqlite3 执行 VACUUM 收缩空闲页
+        """
+        import sqlite3
+        result = {"removed": [], "errors": []}
+        db_path = os.path.join(self.persist_directory, "chroma.sqlite3")
+        if not os.path.exists(db_path):
+            return result
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            live = {row[0] for row in conn.execute("SELECT id FROM segments")}
+            for name in os.listdir(self.persist_directory):
+                path = os.path.join(self.persist_directory, name)
+                if not SEGMENT_DIR_PATTERN.match(name) or name in live or not os.path.isdir(path):
+                    continue
+                try:
+                    shutil.rmtree(path)
+                    result["removed"].append(name)
+                except OSError as e:
+                    # Windows 下 chroma 可能仍打开着已删除集合的索引文件，下次回收时再试
+                    result["errors"].append(f"{name}: {e}")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        return result
+
+
+class NumpyCollection:
+    """
+    单个 NumPy 知识库：
+      <列>.npy      预分配容量的内存映射矩阵，按容量倍增追加；
+                    具体有哪些列由压缩方式决定（float32/float16 只有 vectors.npy，
+                    int8 另有 scales.npy，pq 另有 codes.npy 并用 float16 的 vectors.npy 精排）
+      pq_codebooks.npy  乘积量化码本（仅 pq）
+      records.jsonl 每行一个片段 {"id", "text", "metadata"}
+      offsets.bin   records.jsonl 中每行的起始字节偏移 (int64)，用于按行号随机读取
+      deleted.bin   已删除的行号 (int64)：删除只做标记，检索和遍历时跳过，compact 时重写去掉
+      meta.json     维度、条数（含已删除的行）、已删除行数、容量、压缩方式
+
+    新片段写在 count 之后的行，检索只读取 count 以内的行：写入数据时不持有 lock，检索不被写入阻塞；
+    只有扩容、重新编码（会替换或改写已有的行）时才等待进行中的检索结束。
+    其他进程（或同一进程内的其他实例）写入后 meta.json 会变化，检索和写入前据此重新加载。
+    """
+
+    def __init__(self, path, compression="float32"):
+        self.path = path
+        self.lock = threading.RLock()
+        # 写入串行执行；检索计数为 0 时 _idle 被通知
+        self._write_lock = threading.Lock()
+        self._idle = threading.Condition(self.lock)
+        self._readers = 0
+        self.meta_path = os.path.join(path, "meta.json")
+        self.records_path = os.path.join(path, "records.jsonl")
+        self.offsets_path = os.path.join(path, "offsets.bin")
+        self.codebooks_path = os.path.join(path, "pq_codebooks.npy")
+        self.deleted_path = os.path.join(path, "deleted.bin")
+        self._arrays = {}
+        self._codec = None
+        self._ids = None
+        self._deleted = None
+        self._meta_stat = None
+
+        if os.path.isdir(path):
+            self._finish_rewrite()
+        if os.path.exists(self.meta_path):
+            self._load_meta()
+        else:
+            if compression not in COMPRESSION_MODES:
+                raise ValueError(f"不支持的压缩方式: {compression}")
+            os.makedirs(path, exist_ok=True)
+            self.meta = {
+                "dim": None,
+                "count": 0,
+                "capacity": 0,
+                "records_bytes": 0,
+                "deleted": 0,
+                "compression": compression,
+                "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+
+    @property
+    def count(self):
+        """有效片段数（不含已删除的行）"""
+        return self.meta["count"] - self.meta["deleted"]
+
+    @property
+    def compression(self):
+        return self.meta["compression"]
+
+    def _stat_meta(self):
+        # meta.json 每次都是替换写入，inode 随之变化
+        try:
+            st = os.stat(self.meta_path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _load_meta(self):
+        self._meta_stat = self._stat_meta()
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        # 兼容未记录压缩方式、删除行数的旧库
+        self.meta.setdefault("compression", self.meta.get("dtype", "float32"))
+        self.meta.setdefault("deleted", 0)
+
+    def _save_meta(self):
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self.meta_path)
+        self._meta_stat = self._stat_meta()
+
+    def refresh(self):
+        """meta.json 被其他写入者更新过时重新加载，丢弃缓存的映射、编码器和 id 集合"""
+        with self.lock:
+            stat = self._stat_meta()
+            if stat is None or stat == self._meta_stat:
+                return
+            self._load_meta()
+            self._arrays = {}
+            self._codec = None
+            self._ids = None
+            self._deleted = None
+
+    def _wait_idle(self):
+        """等待进行中的检索结束（调用方持有 lock）"""
+        while self._readers:
+            self._idle.wait()
+
+    def _column_path(self, column):
+        return os.path.join(self.path, f"{column}.npy")
+
+    def _get_codec(self):
+        if self._codec is None and self.meta["dim"] is not None:
+            codebooks = None
+            if self.compression == "pq" and os.path.exists(self.codebooks_path):
+                codebooks = np.load(self.codebooks_path)
+            self._codec = create_codec(self.compression, self.meta["dim"], codebooks=codebooks)
+        return self._codec
+
+    def _open_arrays(self):
+        if not self._arrays and self.meta["capacity"] > 0:
+            for column in self._get_codec().columns():
+                self._arrays[column] = np.load(self._column_path(column), mmap_mode="r+")
+        return self._arrays
+
+    def _grow(self, needed):
+        """容量不足时按倍增扩容"""
+        capacity = self.meta["capacity"]
+        if needed <= capacity:
+            return
+        self._resize(max(capacity * 2, needed, 1024))
+
+    def _resize(self, new_capacity):
+        """把各列换成容量为 new_capacity 的新文件，已有数据分块拷贝过去（调用方持有 lock）"""
+        # 检索可能还在读旧文件的映射（Windows 下映射中的文件不能被替换）
+        self._wait_idle()
+        old_arrays = self._open_arrays()
+        for column, (dtype, width) in self._get_codec().columns().items():
+            tmp_path = self._column_path(column) + ".tmp"
+            new_array = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.dtype(dtype), shape=(new_capacity, width))
+            if column in old_arrays:
+                for i in range(0, self.meta["count"], SEARCH_BLOCK_ROWS):
+                    j = min(i + SEARCH_BLOCK_ROWS, self.meta["count"])
+                    new_array[i:j] = old_arrays[column][i:j]
+            new_array.flush()
+            del new_array
+        # Windows 下必须先释放旧的映射才能替换文件
+        self._arrays = {}
+        del old_arrays
+        for column in self._get_codec().columns():
+            os.replace(self._column_path(column) + ".tmp", self._column_path(column))
+        self.meta["capacity"] = new_capacity
+
+    def _truncate_uncommitted(self):
+        """丢弃上次写到一半（未更新 meta.json）的记录，保证行号与向量一一对应"""
+        for path, size in [(self.records_path, self.meta["records_bytes"]), (self.offsets_path, self.meta["count"] * 8),
+                           (self.deleted_path, self.meta["deleted"] * 8)]:
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+                self._ids = None
+                self._deleted = None
+
+    def _deleted_mask(self):
+        """长度为 count 的布尔数组，已删除的行为 True；没有删除过时返回 None（调用方持有 lock）"""
+        if not self.meta["deleted"]:
+            return None
+        n = self.meta["count"]
+        if self._deleted is None or len(self._deleted) < n:
+            mask = np.zeros(n, dtype=bool)
+            mask[np.fromfile(self.deleted_path, dtype=np.int64, count=self.meta["deleted"])] = True
+            self._deleted = mask
+        return self._deleted
+
+    def _iter_all_records(self, n):
+        """按行号顺序返回前 n 行的记录，包括已删除的行"""
+        if not os.path.exists(self.records_path):
+            return
+        with open(self.records_path, "r", encoding="utf-8") as f:
+            for row, line in enumerate(f):
+                if row >= n:
+                    break
+                yield json.loads(line)
+
+    def _load_ids(self):
+        if self._ids is None:
+            deleted = self._deleted_mask()
+            self._ids = set()
+            for row, record in enumerate(self._iter_all_records(self.meta["count"])):
+                if deleted is None or not deleted[row]:
+                    self._ids.add(record["id"])
+        return self._ids
+
+    def _train_pq(self, vectors):
+        codec = self._get_codec()
+        trained_on = codec.train(vectors)
+        np.save(self.codebooks_path, codec.codebooks)
+        self.meta["pq_trained_on"] = trained_on
+        print(f"已训练乘积量化码本（样本数 {trained_on}）")
+
+    def _maybe_retrain_pq(self):
+        """
+        码本最初只用第一批数据训练；库增长到训练样本的 4 倍以上时，
+        用已存的 float16 向量重新训练并重新编码，保证召回不随入库退化
+        """
+        trained_on = self.meta.get("pq_trained_on", 0)
+        n = self.meta["count"]
+        if trained_on >= PQ_TRAIN_SAMPLES or n < trained_on * 4:
+            return
+        self._wait_idle()
+        arrays = self._open_arrays()
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(n, size=min(n, PQ_TRAIN_SAMPLES), replace=False))
+        self._train_pq(np.asarray(arrays["vectors"][sample], dtype=np.float32))
+        codec = self._get_codec()
+        for i in range(0, n, SEARCH_BLOCK_ROWS):
+            j = min(i + SEARCH_BLOCK_ROWS, n)
+            arrays["codes"][i:j] = codec.encode(np.asarray(arrays["vectors"][i:j], dtype=np.float32))["codes"]
+        arrays["codes"].flush()
+
+    def append(self, ids, vectors, texts, metadatas):
+        """追加片段；已存在的 id 会被跳过（追加写，不做覆盖）"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._write_lock:
+            with self.lock:
+                self.refresh()
+                keep, vectors, start, end = self._reserve(ids, vectors)
+                if not keep:
+                    return 0
+                arrays = self._open_arrays()
+                codec = self._get_codec()
+            try:
+                # 新行在 count 之后，检索读不到，写入时不持有 lock
+                for column, data in codec.encode(vectors).items():
+                    arrays[column][start:end] = data
+                    arrays[column].flush()
+
+                offsets = []
+                with open(self.records_path, "ab") as f:
+                    for i in keep:
+                        offsets.append(f.tell())
+                        record = {"id": ids[i], "text": texts[i], "metadata": metadatas[i]}
+                        f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+                    records_bytes = f.tell()
+                with open(self.offsets_path, "ab") as f:
+                    f.write(np.asarray(offsets, dtype=np.int64).tobytes())
+            except Exception:
+                # 这批 id 没有提交，下次写入时重新读取 id 集合
+                self._ids = None
+                raise
+
+            with self.lock:
+                # 最后才更新条数，写到一半中断时多出的数据会被忽略
+                self.meta["count"] = end
+                self.meta["records_bytes"] = records_bytes
+                if self.compression == "pq":
+                    self._maybe_retrain_pq()
+                self._save_meta()
+            return len(keep)
+
+    def _reserve(self, ids, vectors):
+        """
+        校验维度、跳过已有 id、预留容量（调用方持有 lock）。
+        返回 (保留的序号, 归一化后的向量, 起始行, 结束行)
+        """
+        if self.meta["dim"] is None:
+            self.meta["dim"] = int(vectors.shape[1])
+        elif vectors.shape[1] != self.meta["dim"]:
+            raise ValueError(f"向量维度不一致: 库中为 {self.meta['dim']}，写入的是 {vectors.shape[1]}")
+
+        self._truncate_uncommitted()
+        existing = self._load_ids()
+        keep = []
+        for i, doc_id in enumerate(ids):
+            if doc_id not in existing:
+                existing.add(doc_id)
+                keep.append(i)
+        if not keep:
+            return keep, vectors, 0, 0
+        vectors = vectors[keep]
+
+        # 归一化后检索时点积即余弦相似度
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+
+        codec = self._get_codec()
+        if self.compression == "pq" and not codec.trained:
+            self._train_pq(vectors)
+
+        start = self.meta["count"]
+        end = start + len(keep)
+        self._grow(end)
+        return keep, vectors, start, end
+
+    def read_records(self, rows):
+        offsets = np.memmap(self.offsets_path, dtype=np.int64, mode="r")
+        records = []
+        with open(self.records_path, "rb") as f:
+            for row in rows:
+                f.seek(int(offsets[row]))
+                records.append(json.loads(f.readline().decode("utf-8")))
+        return records
+
+    def iter_records(self):
+        """按行号顺序返回有效的记录（跳过已删除的行）"""
+        with self.lock:
+            self.refresh()
+            n = self.meta["count"]
+            deleted = self._deleted_mask()
+        for row, record in enumerate(self._iter_all_records(n)):
+            if deleted is None or not deleted[row]:
+                yield record
+
+    def delete_rows(self, source, keep_ids=()):
+        """把来源为 source、且 id 不在 keep_ids 中的行标记为已删除，返回被删除的 id 列表"""
+        keep_ids = set(keep_ids)
+        with self._write_lock, self.lock:
+            self.refresh()
+            self._truncate_uncommitted()
+            deleted = self._deleted_mask()
+            rows, ids = [], []
+            for row, record in enumerate(self._iter_all_records(self.meta["count"])):
+                if deleted is not None and deleted[row]:
+                    continue
+                if record["metadata"].get("source") == source and record["id"] not in keep_ids:
+                    rows.append(row)
+                    ids.append(record["id"])
+            if not rows:
+                return ids
+            with open(self.deleted_path, "ab") as f:
+                f.write(np.asarray(rows, dtype=np.int64).tobytes())
+            # 与追加写入相同，最后才更新 meta.json
+            self.meta["deleted"] += len(rows)
+            self._deleted = None
+            if self._ids is not None:
+                self._ids.difference_update(ids)
+            self._save_meta()
+            return ids
+
+    def search_rows(self, query_vector, k):
+        """
+        分块精确检索：每块用 argpartition 取候选，最后全局合并，返回 (行号, 分数)。
+        带精排列的编码（pq）先取 k * PQ_RESCORE_FACTOR 个粗排候选，再用 float16 原向量重新打分。
+        """
+        with self.lock:
+            self.refresh()
+            n = self.meta["count"]
+            if n == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            arrays = self._open_arrays()
+            codec = self._get_codec()
+            deleted = self._deleted_mask()
+            self._readers += 1
+        try:
+            return self._score(arrays, codec, n, query_vector, k, deleted)
+        finally:
+            with self.lock:
+                self._readers -= 1
+                if not self._readers:
+                    self._idle.notify_all()
+
+    def _score(self, arrays, codec, n, query_vector, k, deleted=None):
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        shortlist = k * PQ_RESCORE_FACTOR if codec.rescore_column else k
+        cand_rows = []
+        cand_scores = []
+        for i in range(0, n, SEARCH_BLOCK_ROWS):
+            j = min(i + SEARCH_BLOCK_ROWS, n)
+            scores = codec.score_block(arrays, i, j, query)
+            if deleted is not None:
+                scores = np.where(deleted[i:j], -np.inf, scores)
+            if len(scores) > shortlist:
+                top = np.argpartition(-scores, shortlist - 1)[:shortlist]
+            else:
+                top = np.arange(len(scores))
+            cand_rows.append(top + i)
+            cand_scores.append(scores[top])
+
+        rows = np.concatenate(cand_rows)
+        scores = np.concatenate(cand_scores)
+        if deleted is not None:
+            # 有效行不足 k 个时候选中会混入已删除的行
+            live = np.isfinite(scores)
+            rows, scores = rows[live], scores[live]
+        if codec.rescore_column:
+            if len(rows) > shortlist:
+                keep = np.argpartition(-scores, shortlist - 1)[:shortlist]
+                rows = rows[keep]
+            # 精排前按行号排序，内存映射读取更连续
+            rows = np.sort(rows)
+            scores = np.asarray(arrays[codec.rescore_column][rows], dtype=np.float32) @ query
+        order = np.argsort(-scores)[:k]
+        return rows[order], scores[order]
+
+    def search(self, query_vector, k):
+        rows, scores = self.search_rows(query_vector, k)
+        records = self.read_records(rows)
+        return [(r["text"], r["metadata"], float(s)) for r, s in zip(records, scores)]
+
+    def iter_batches(self, batch_size=5000):
+        with self.lock:
+            self.refresh()
+            n = self.meta["count"]
+            if n == 0:
+                return
+            arrays = self._open_arrays()
+            codec = self._get_codec()
+            deleted = self._deleted_mask()
+        records = self._iter_all_records(n)
+        for i in range(0, n, batch_size):
+            j = min(i + batch_size, n)
+            batch = [next(records) for _ in range(i, j)]
+            vectors = codec.decode(arrays, i, j)
+            if deleted is not None:
+                live = np.flatnonzero(~deleted[i:j])
+                if not len(live):
+                    continue
+                batch = [batch[r] for r in live]
+                vectors = vectors[live]
+            yield (
+                [r["id"] for r in batch],
+                vectors,
+                [r["text"] for r in batch],
+                [r["metadata"] for r in batch]
+            )
+
+    def disk_size(self):
+        total = 0
+        for name in os.listdir(self.path):
+            total += os.path.getsize(os.path.join(self.path, name))
+        return total
+
+    def compact(self):
+        """
+        重写去掉已删除的行，把预分配的容量收缩到实际条数，丢弃未提交的记录和中断扩容留下的临时文件，
+        返回删除的临时文件
+        """
+        with self._write_lock, self.lock:
+            self.refresh()
+            self._truncate_uncommitted()
+            removed = []
+            for name in os.listdir(self.path):
+                if name.endswith(".tmp"):
+                    os.remove(os.path.join(self.path, name))
+                    removed.append(os.path.join(os.path.basename(self.path), name))
+            if self.meta["deleted"]:
+                self._rewrite_live()
+            elif 0 < self.meta["count"] < self.meta["capacity"]:
+                self._resize(self.meta["count"])
+                self._save_meta()
+            return removed
+
+    def _rewrite_live(self):
+        """
+        只保留有效的行，重写各列、records.jsonl 和 offsets.bin（调用方持有 lock 和写入锁）。
+        新文件先写成 .compacted，最后写 meta.json.compacted 作为提交点，再逐个替换；
+        替换到一半中断时，下次打开知识库由 _finish_rewrite 接着完成
+        """
+        self._wait_idle()
+        n = self.meta["count"]
+        live = np.flatnonzero(~self._deleted_mask()[:n])
+        # 容量为 0 的 .npy 不能内存映射
+        capacity = max(len(live), 1)
+        arrays = self._open_arrays()
+        for column, (dtype, width) in self._get_codec().columns().items():
+            new_array = np.lib.format.open_memmap(self._column_path(column) + ".compacted", mode="w+",
+                                                  dtype=np.dtype(dtype), shape=(capacity, width))
+            for i in range(0, len(live), SEARCH_BLOCK_ROWS):
+                rows = live[i:i + SEARCH_BLOCK_ROWS]
+                new_array[i:i + len(rows)] = arrays[column][rows]
+            new_array.flush()
+            del new_array
+
+        keep = np.zeros(n, dtype=bool)
+        keep[live] = True
+        offsets = []
+        with open(self.records_path, "rb") as src, open(self.records_path + ".compacted", "wb") as dst:
+            for row in range(n):
+                line = src.readline()
+                if keep[row]:
+                    offsets.append(dst.tell())
+                    dst.write(line)
+            records_bytes = dst.tell()
+        with open(self.offsets_path + ".compacted", "wb") as f:
+            f.write(np.asarray(offsets, dtype=np.int64).tobytes())
+
+        meta = dict(self.meta, count=len(live), capacity=capacity, records_bytes=records_bytes, deleted=0)
+        with open(self.meta_path + ".compacted", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        # Windows 下必须先释放旧的映射才能替换文件
+        self._arrays = {}
+        del arrays
+        self._finish_rewrite()
+        self._load_meta()
+        self._ids = None
+        self._deleted = None
+
+    def _finish_rewrite(self):
+        """完成已提交（有 meta.json.compacted）的重写；未提交的半成品直接删除"""
+        committed = os.path.exists(self.meta_path + ".compacted")
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if not name.endswith(".compacted") or path == self.meta_path + ".compacted":
+                continue
+            if committed:
+                os.replace(path, path[:-len(".compacted")])
+            else:
+                os.remove(path)
+        if committed:
+            if os.path.exists(self.deleted_path):
+                os.remove(self.deleted_path)
+            os.replace(self.meta_path + ".compacted", self.meta_path)
+
+    def close(self):
+        self._arrays = {}
+
+
+class NumpyBackend(VectorBackend):
+    """
+    进程内 NumPy 后端：每个知识库是一组内存映射的 .npy 矩阵加元数据文件。
+    打开只需读取 meta.json，无需服务进程；适合中小规模知识库。
+    支持按知识库选择向量压缩方式（float32 / float16 / int8 / pq）。
+    """
+    name = "numpy"
+    DIR_NAME = "numpy_index"
+    supports_compression = True
+
+    def __init__(self, persist_directory):
+        super().__init__(persist_directory)
+        self.data_dir = os.path.join(persist_directory, self.DIR_NAME)
+        os.makedirs(self.data_dir, exist_ok=True)
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def _collection_path(self, collection_name):
+        # 与 chroma 相同的命名规则，保证名称可以直接作为目录名
+        if not re.match(r'^[a-zA-Z0-9][a-zA-Z0-9._-]{1,61}[a-zA-Z0-9]$', collection_name):
+            raise ValueError(f"非法的知识库名称: {collection_name}")
+        return os.path.join(self.data_dir, collection_name)
+
+    def _get_collection(self, collection_name, create=False, compression=None):
+        with self._lock:
+            col = self._collections.get(collection_name)
+            if col is None:
+                path = self._collection_path(collection_name)
+                if not create and not os.path.exists(os.path.join(path, "meta.json")):
+                    raise ValueError(f"知识库不存在: {collection_name}")
+                col = NumpyCollection(path, compression=compression or "float32")
+                self._collections[collection_name] = col
+            return col
+
+    def list_collections(self):
+        names = []
+        for name in sorted(os.listdir(self.data_dir)):
+            if os.path.exists(os.path.join(self.data_dir, name, "meta.json")):
+                names.append(name)
+        return names
+
+    def count(self, collection_name):
+        col = self._get_collection(collection_name)
+        col.refresh()
+        return col.count
+
+    def add(self, collection_name, ids, vectors, texts, metadatas, compression=None):
+        # compression 只在新建知识库时生效，已有知识库沿用创建时的压缩方式
+        self._get_collection(collection_name, create=True, compression=compression).append(ids, vectors, texts, metadatas)
+
+    def search(self, collection_name, query_vector, k):
+        return self._get_collection(collection_name).search(query_vector, k)
+
+    def iter_metadatas(self, collection_name, page_size=5000):
+        page = []
+        for record in self._get_collection(collection_name).iter_records():
+            page.append(record["metadata"])
+            if len(page) >= page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    def iter_texts(self, collection_name, page_size=5000):
+        page = []
+        for record in self._get_collection(collection_name).iter_records():
+            page.append(record["text"])
+            if len(page) >= page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    def iter_batches(self, collection_name, batch_size=5000):
+        return self._get_collection(collection_name).iter_batches(batch_size)
+
+    def collection_info(self, collection_name):
+        col = self._get_collection(collection_name)
+        return {"compression": col.compression, "disk_bytes": col.disk_size()}
+
+    def delete_source(self, collection_name, source, keep_ids=()):
+        # 只做删除标记，磁盘空间在 compact 时回收
+        return self._get_collection(collection_name).delete_rows(source, keep_ids)
+
+    def delete_collection(self, collection_name):
+        path = self._collection_path(collection_name)
+        with self._lock:
+            col = self._collections.pop(collection_name, None)
+            if col:
+                col.close()
+        if not os.path.exists(path):
+            raise ValueError(f"知识库不存在: {collection_name}")
+        # 先删除 meta.json，删到一半失败（例如 Windows 下文件仍被映射）时目录不再被当作知识库，由 compact 清理
+        os.remove(os.path.join(path, "meta.json"))
+        shutil.rmtree(path)
+
+    def compact(self):
+        """删除残留的知识库目录（没有 meta.json），收缩各知识库的预分配容量"""
+        result = {"removed": [], "errors": []}
+        for name in sorted(os.listdir(self.data_dir)):
+            path = os.path.join(self.data_dir, name)
+            if not os.path.isdir(path):
+                continue
+            try:
+                if os.path.exists(os.path.join(path, "meta.json")):
+                    result["removed"].extend(self._get_collection(name).compact())
+                    continue
+                with self._lock:
+                    col = self._collections.pop(name, None)
+                    if col:
+                        col.close()
+                shutil.rmtree(path)
+                result["removed"].append(name)
+            except (OSError, ValueError) as e:
+                result["errors"].append(f"{name}: {e}")
+        return result
+
+
+BACKENDS = {
+    ChromaBackend.name: ChromaBackend,
+    NumpyBackend.name: NumpyBackend,
+}
+
+
+def create_backend(name, persist_directory):
+    if name not in BACKENDS:
+        raise ValueError(f"不支持的向量后端: {name}")
+    return BACKENDS[name](persist_directory)
@@ -0,0 +1,166 @@
+import numpy as np
+
+# 乘积量化每个子空间的聚类中心数（用 uint8 存编码）
+PQ_CENTROIDS = 256
+# 每个子空间的维度
+PQ_SUB_DIM = 8
+# 训练码本最多使用的样本数
+PQ_TRAIN_SAMPLES = 20000
+# 粗排候选数 = k * PQ_RESCORE_FACTOR，再用 float16 原向量精排
+PQ_RESCORE_FACTOR = 20
+
+
+class VectorCodec:
+    """
+    向量压缩编码接口。NumpyCollection 按 columns() 为每种编码开辟内存映射列，
+    入库时 encode()，检索时 score_block() 对一段行打分。
+    """
+    name = ""
+    # 需要精排时，保存全精度（float16）向量的列名
+    rescore_column = None
+
+    def __init__(self, dim):
+        self.dim = dim
+
+    def columns(self):
+        raise NotImplementedError
+
+    def encode(self, vectors):
+        raise NotImplementedError
+
+    def score_block(self, arrays, start, end, query):
+        raise NotImplementedError
+
+    def decode(self, arrays, start, end):
+        """还原一段行的 float32 向量（用于导出）"""
+        raise NotImplementedError
+
+
+class FloatCodec(VectorCodec):
+    """不压缩 (float32) 或半精度 (float16) 直接存储"""
+
+    def __init__(self, dim, dtype):
+        super().__init__(dim)
+        self.name = dtype
+        self.dtype = dtype
+
+    def columns(self):
+        return {"vectors": (self.dtype, self.dim)}
+
+    def encode(self, vectors):
+        return {"vectors": vectors.astype(self.dtype)}
+
+    def score_block(self, arrays, start, end, query):
+        return np.asarray(arrays["vectors"][start:end], dtype=np.float32) @ query
+
+    def decode(self, arrays, start, end):
+        return np.asarray(arrays["vectors"][start:end], dtype=np.float32)
+
+
+class Int8Codec(VectorCodec):
+    """标量量化：每个向量按最大绝对值缩放到 int8，另存一个 float32 缩放系数"""
+    name = "int8"
+
+    def columns(self):
+        return {"vectors": ("int8", self.dim), "scales": ("float32", 1)}
+
+    def encode(self, vectors):
+        scales = np.abs(vectors).max(axis=1, keepdims=True) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales), -127, 127).astype(np.int8)
+        return {"vectors": codes, "scales": scales.astype(np.float32)}
+
+    def score_block(self, arrays, start, end, query):
+        codes = np.asarray(arrays["vectors"][start:end], dtype=np.float32)
+        return (codes @ query) * arrays["scales"][start:end, 0]
+
+    def decode(self, arrays, start, end):
+        return np.asarray(arrays["vectors"][start:end], dtype=np.float32) * arrays["scales"][start:end]
+
+
+def _kmeans(data, k, n_iter=20, seed=0):
+    """简单的 Lloyd k-means，返回 (k, d) 的聚类中心"""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(n_iter):
+        # |x - c|^2 = |x|^2 - 2xc + |c|^2，|x|^2 对 argmin 无影响
+        dists = -2 * data @ centroids.T + (centroids ** 2).sum(axis=1)
+        assign = dists.argmin(axis=1)
+        for c in range(k):
+            members = data[assign == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+            else:
+                # 空簇重新随机取一个样本，避免中心退化
+                centroids[c] = data[rng.integers(len(data))]
+    return centroids
+
+
+class PQCodec(VectorCodec):
+    """
+    乘积量化：向量切成 m 段，每段用 256 个中心之一的编号 (uint8) 表示。
+    粗排用查表 (ADC) 打分，候选再用 float16 原向量精排，兼顾内存和召回。
+    """
+    name = "pq"
+    rescore_column = "vectors"
+
+    def __init__(self, dim, codebooks=None):
+        super().__init__(dim)
+        # 末尾补零到 PQ_SUB_DIM 的整数倍
+        self.m = -(-dim // PQ_SUB_DIM)
+        self.padded_dim = self.m * PQ_SUB_DIM
+        self.codebooks = codebooks  # (m, ks, PQ_SUB_DIM)
+
+    @property
+    def trained(self):
+        return self.codebooks is not None
+
+    def _split(self, vectors):
+        if self.padded_dim != self.dim:
+            vectors = np.pad(vectors, ((0, 0), (0, self.padded_dim - self.dim)))
+        return vectors.reshape(len(vectors), self.m, PQ_SUB_DIM)
+
+    def train(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) > PQ_TRAIN_SAMPLES:
+            rng = np.random.default_rng(0)
+            vectors = vectors[rng.choice(len(vectors), size=PQ_TRAIN_SAMPLES, replace=False)]
+        ks = min(PQ_CENTROIDS, len(vectors))
+        sub = self._split(vectors)
+        self.codebooks = np.stack([_kmeans(sub[:, j, :], ks) for j in range(self.m)]).astype(np.float32)
+        return len(vectors)
+
+    def columns(self):
+        return {"codes": ("uint8", self.m), "vectors": ("float16", self.dim)}
+
+    def encode(self, vectors):
+        sub = self._split(vectors)
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            cb = self.codebooks[j]
+            dists = -2 * sub[:, j, :] @ cb.T + (cb ** 2).sum(axis=1)
+            codes[:, j] = dists.argmin(axis=1)
+        return {"codes": codes, "vectors": vectors.astype(np.float16)}
+
+    def score_block(self, arrays, start, end, query):
+        q_sub = self._split(query[None, :])[0]
+        # table[j, c] = 第 j 段查询向量与第 c 个中心的点积
+        table = np.einsum("jd,jcd->jc", q_sub, self.codebooks)
+        codes = np.asarray(arrays["codes"][start:end])
+        return table[np.arange(self.m), codes].sum(axis=1)
+
+    def decode(self, arrays, start, end):
+        return np.asarray(arrays["vectors"][start:end], dtype=np.float32)
+
+
+COMPRESSION_MODES = ["float32", "float16", "int8", "pq"]
+
+
+def create_codec(compression, dim, codebooks=None):
+    if compression in ("float32", "float16"):
+        return FloatCodec(dim, compression)
+    if compression == "int8":
+        return Int8Codec(dim)
+    if compression == "pq":
+        return PQCodec(dim, codebooks=codebooks)
+    raise ValueError(f"不支持的压缩方式: {compression}")